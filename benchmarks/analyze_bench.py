@@ -0,0 +1,294 @@
+# benchmarks/analyze_bench.py
+"""
+Latency/throughput benchmark for vllm_handler.analyze_content.
+
+Generates synthetic input files (text, PNG, JPEG, PDF in several sizes), then for
+every file type x size x concurrency level runs analyze_content on a thread pool
+and reports p50/p95/p99 latency, throughput and the bytes uploaded to the model.
+
+The default backend is the local fake model (src/fake_backend.py), so the numbers
+measure our own preprocessing and request-building overhead on top of a
+simulated, seeded model latency. Use --backend vertex to hit the configured
+Vertex AI model instead (needs GCP credentials). The response cache is disabled.
+
+Usage (from the repository root):
+    python benchmarks/analyze_bench.py
+    python benchmarks/analyze_bench.py --concurrency 1,8 --file-types png,pdf --sizes large --output benchmarks/results/analyze.json
+    python benchmarks/analyze_bench.py --compare benchmarks/results/analyze_fake_backend.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+# Must be set before config is imported
+os.environ["RESPONSE_CACHE_ENABLED"] = "false" # Every call must reach the model
+os.environ.setdefault("GCP_PROJECT_ID", "analyze-benchmark")
+os.environ.setdefault("GCP_REGION", "europe-west4")
+
+import vllm_handler  # noqa: E402
+import fake_backend  # noqa: E402
+
+FILE_TYPES = ("txt", "png", "jpeg", "pdf")
+# (text kilobytes, image width x height, pdf pages) per size class
+SIZES = {
+    "small": {"text_kb": 2, "image": (800, 600), "pdf_pages": 1},
+    "medium": {"text_kb": 32, "image": (2000, 1500), "pdf_pages": 5},
+    "large": {"text_kb": 256, "image": (4000, 3000), "pdf_pages": 20},
+}
+_LOREM = ("Gradient descent updates the parameters in the direction of the negative gradient. "
+          "The learning rate controls the step size and momentum smooths the updates. ")
+
+
+# --- Input Generation ---
+def _noisy_image(width: int, height: int):
+    """An image with enough detail that encoders cannot shrink it to nothing."""
+    from PIL import Image, ImageDraw
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, height, 40):
+        draw.text((20, y), _LOREM[: width // 8], fill=(0, 0, 0))
+    return image
+
+
+def make_input_file(directory: str, file_type: str, size: str) -> str:
+    """Writes one synthetic input file and returns its path."""
+    spec = SIZES[size]
+    path = os.path.join(directory, f"{size}.{file_type}")
+    if file_type == "txt":
+        repeats = spec["text_kb"] * 1024 // len(_LOREM) + 1
+        with open(path, "w", encoding="utf-8") as f:
+            f.write((_LOREM * repeats)[: spec["text_kb"] * 1024])
+    elif file_type in ("png", "jpeg"):
+        _noisy_image(*spec["image"]).save(path, format=file_type.upper())
+    elif file_type == "pdf":
+        import fitz
+        doc = fitz.open()
+        for page_num in range(spec["pdf_pages"]):
+            page = doc.new_page()
+            if page_num % 2 == 0:
+                page.insert_textbox(fitz.Rect(50, 50, 550, 800), _LOREM * 12)
+            else:
+                # Image-only page, so the PDF exercises rendering as well as text extraction
+                buf = io.BytesIO()
+                _noisy_image(800, 1000).save(buf, format="PNG")
+                page.insert_image(page.rect, stream=buf.getvalue())
+        doc.save(path)
+        doc.close()
+    else:
+        raise ValueError(f"Unknown file type '{file_type}'. Expected one of {FILE_TYPES}.")
+    return path
+
+
+# --- Backends ---
+class MeasuringModel:
+    """Wraps a model and records how long each generate_content call took and how many bytes it sent."""
+
+    def __init__(self, model):
+        self.model = model
+        self._local = threading.local()
+
+    def generate_content(self, contents, **kwargs):
+        self._local.bytes = fake_backend.request_payload_bytes(contents)
+        start = time.perf_counter()
+        try:
+            return self.model.generate_content(contents, **kwargs)
+        finally:
+            self._local.model_s = time.perf_counter() - start
+
+    def take_measurement(self):
+        """Returns and clears (model seconds, bytes sent) for the calling thread's last request."""
+        measurement = (getattr(self._local, "model_s", 0.0), getattr(self._local, "bytes", 0))
+        self._local.model_s, self._local.bytes = 0.0, 0
+        return measurement
+
+
+def install_backend(args) -> MeasuringModel:
+    """Routes every model build through a MeasuringModel around the selected backend."""
+    if args.backend == "fake":
+        model = fake_backend.FakeGenerativeModel(
+            "fake-model",
+            latency_ms=args.latency_ms,
+            latency_distribution=args.latency_distribution,
+            jitter=args.jitter,
+            tokens_per_second=args.tokens_per_second,
+            output_tokens=args.output_tokens,
+            seed=args.seed,
+        )
+    else:
+        if not vllm_handler.initialize_vertex_ai():
+            raise SystemExit("Vertex AI could not be initialized; check GCP_PROJECT_ID/GCP_REGION and credentials.")
+        vllm_handler._load_vertex_sdk()
+        model_name, _ = vllm_handler.resolve_model_name()
+        model = vllm_handler.GenerativeModel(model_name)
+    measuring = MeasuringModel(model)
+    vllm_handler.set_model_factory(lambda model_name: measuring)
+    return measuring
+
+
+# --- Statistics ---
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _distribution(values_s: List[float]) -> Dict[str, float]:
+    values_ms = sorted(v * 1000 for v in values_s)
+    return {
+        "p50": round(percentile(values_ms, 50), 2),
+        "p95": round(percentile(values_ms, 95), 2),
+        "p99": round(percentile(values_ms, 99), 2),
+        "mean": round(sum(values_ms) / len(values_ms), 2) if values_ms else 0.0,
+    }
+
+
+# --- Runner ---
+def run_scenario(file_path: str, concurrency: int, requests: int, prompt: str, measuring: MeasuringModel) -> Dict[str, Any]:
+    """Runs `requests` analyses of file_path with `concurrency` in flight and summarizes them."""
+    def _one(_):
+        start = time.perf_counter()
+        result = vllm_handler.analyze_content(file_path, prompt)
+        total_s = time.perf_counter() - start
+        model_s, sent_bytes = measuring.take_measurement()
+        return total_s, model_s, sent_bytes, result.startswith("Error:") or result.startswith("Info:")
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(_one, range(requests)))
+    wall_s = time.perf_counter() - wall_start
+
+    latencies = [s[0] for s in samples]
+    # Time spent outside the model call: file loading, preprocessing, request building
+    overheads = [s[0] - s[1] for s in samples]
+    uploaded = [s[2] for s in samples]
+    return {
+        "requests": requests,
+        "errors": sum(1 for s in samples if s[3]),
+        "latency_ms": _distribution(latencies),
+        "overhead_ms": _distribution(overheads),
+        "throughput_rps": round(requests / wall_s, 3) if wall_s else 0.0,
+        "bytes_uploaded_total": sum(uploaded),
+        "bytes_uploaded_per_request": round(sum(uploaded) / len(uploaded)) if uploaded else 0,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str):
+    """Prints p50/p95/overhead deltas for the scenarios present in both runs."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["file_type"], r["size"], r["concurrency"])
+    previous = {key(r): r for r in baseline.get("results", [])}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for result in current["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        deltas = []
+        for metric, field in (("p50", "latency_ms"), ("p95", "latency_ms"), ("p50", "overhead_ms")):
+            before, after = old[field][metric], result[field][metric]
+            change = (after - before) / before * 100 if before else 0.0
+            deltas.append(f"{field.split('_')[0]} {metric} {before:.1f} -> {after:.1f} ms ({change:+.1f}%)")
+        print(f"  {result['file_type']:>4} {result['size']:<6} c={result['concurrency']:<3} " + ", ".join(deltas))
+
+
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analyze_content latency and throughput.")
+    parser.add_argument("--backend", choices=("fake", "vertex"), default="fake", help="Model backend (default: fake).")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels (default: 1,8).")
+    parser.add_argument("--file-types", default=",".join(FILE_TYPES), help=f"Comma-separated subset of {','.join(FILE_TYPES)}.")
+    parser.add_argument("--sizes", default="small,large", help=f"Comma-separated subset of {','.join(SIZES)} (default: small,large).")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per scenario (default: 16).")
+    parser.add_argument("--prompt", default="Summarize this document and list the key information with its location.")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Fake backend: mean time to first token (default: 200).")
+    parser.add_argument("--latency-distribution", choices=fake_backend.LATENCY_DISTRIBUTIONS, default="lognormal",
+                        help="Fake backend: latency distribution (default: lognormal).")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Fake backend: distribution spread (default: 0.25).")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="Fake backend: output token rate (default: 2000).")
+    parser.add_argument("--output-tokens", type=int, default=300, help="Fake backend: mean output tokens (default: 300).")
+    parser.add_argument("--seed", type=int, default=1234, help="Fake backend: random seed (default: 1234).")
+    parser.add_argument("--output", default=None, help="Optional JSON file to write the results to.")
+    parser.add_argument("--compare", default=None, help="Optional earlier results JSON to print deltas against.")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING) # Per-request INFO logs would dominate the output
+    file_types = _csv(args.file_types)
+    sizes = _csv(args.sizes)
+    concurrency_levels = [int(c) for c in _csv(args.concurrency)]
+    for value, allowed, label in ((file_types, FILE_TYPES, "file type"), (sizes, SIZES, "size")):
+        unknown = set(value) - set(allowed)
+        if unknown:
+            parser.error(f"Unknown {label}(s): {', '.join(sorted(unknown))}")
+
+    measuring = install_backend(args)
+    summary = {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": [],
+    }
+
+    input_dir = tempfile.mkdtemp(prefix="analyze_bench_")
+    try:
+        for file_type in file_types:
+            for size in sizes:
+                file_path = make_input_file(input_dir, file_type, size)
+                input_bytes = os.path.getsize(file_path)
+                # One untimed call so one-time initialization is not attributed to the first scenario
+                vllm_handler.analyze_content(file_path, args.prompt)
+                measuring.take_measurement()
+                for concurrency in concurrency_levels:
+                    result = run_scenario(file_path, concurrency, args.requests, args.prompt, measuring)
+                    result.update(file_type=file_type, size=size, concurrency=concurrency, input_bytes=input_bytes)
+                    summary["results"].append(result)
+                    print(f"{file_type:>4} {size:<6} c={concurrency:<3} "
+                          f"p50 {result['latency_ms']['p50']:>8.1f} ms  p95 {result['latency_ms']['p95']:>8.1f} ms  "
+                          f"p99 {result['latency_ms']['p99']:>8.1f} ms  overhead p50 {result['overhead_ms']['p50']:>7.1f} ms  "
+                          f"{result['throughput_rps']:>7.2f} req/s  {result['bytes_uploaded_per_request']:>9} B/req"
+                          + (f"  errors {result['errors']}" if result["errors"] else ""))
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+        vllm_handler.set_model_factory(None)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(summary, args.compare)
+
+
+if __name__ == "__main__":
+    main()
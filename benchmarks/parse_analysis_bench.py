@@ -0,0 +1,153 @@
+# benchmarks/parse_analysis_bench.py
+"""
+Microbenchmark for utils.parse_gemini_analysis.
+
+Compares the single-pass section parser with the previous implementation (four
+DOTALL regex scans, copied below as legacy_parse) on every analysis string
+stored in outputs/*.json, plus synthetic outputs with long Key Information
+sections. Reports per-call timings and how often the two parsers agree.
+
+Usage (from the repository root):
+    python benchmarks/parse_analysis_bench.py
+    python benchmarks/parse_analysis_bench.py --repeat 200 --output benchmarks/results/parse_analysis.json
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import statistics
+from typing import Dict, Any, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import utils  # noqa: E402
+
+SECTION_KEYS = ("document_type", "summary", "key_info_localization", "category")
+
+
+def legacy_parse(analysis_text: str) -> Dict[str, Any]:
+    """The parser as it was before the single-pass rewrite (logging removed)."""
+    parsed_data = {key: "N/A" for key in SECTION_KEYS}
+    parsed_data["raw_text"] = analysis_text
+    if not analysis_text or analysis_text.startswith("Error:") or analysis_text.startswith("Info:"):
+        return parsed_data
+    flags = re.MULTILINE | re.IGNORECASE | re.DOTALL
+    doc_type_match = re.search(r"^\s*\**Document Type:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, flags)
+    summary_match = re.search(r"^\s*\**Summary:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, flags)
+    key_info_match = re.search(r"^\s*\**Key Information(?: & Localization)?:?\**\s*\n?(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, flags)
+    category_match = re.search(r"^\s*\**Category:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, flags)
+    for key, match in zip(SECTION_KEYS, (doc_type_match, summary_match, key_info_match, category_match)):
+        if match:
+            parsed_data[key] = match.group(1).strip()
+    return parsed_data
+
+
+def collect_stored_outputs(outputs_dir: str) -> List[str]:
+    """Returns every analysis-looking string found (recursively) in outputs_dir/*.json."""
+    texts = []
+
+    def _walk(node):
+        if isinstance(node, dict):
+            for value in node.values():
+                _walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                _walk(value)
+        elif isinstance(node, str) and re.search(r"document type|summary", node, re.IGNORECASE):
+            texts.append(node)
+
+    for path in sorted(glob.glob(os.path.join(outputs_dir, "*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _walk(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+    return texts
+
+
+def synthetic_output(bullets: int) -> str:
+    """Builds a model-style analysis with a Key Information section of the given size."""
+    lines = [
+        "**Document Type:**", "Typed lecture notes", "",
+        "**Summary:**", "Notes on gradient descent.", "Covers learning rates and convergence.", "",
+        "**Key Information & Localization:**",
+    ]
+    for n in range(bullets):
+        lines += [
+            f"*   Extracted point number {n} about step sizes and momentum terms",
+            f"    *   Location: Page {n // 10 + 1}, paragraph {n % 10 + 1}",
+            "    *   Confidence: High",
+        ]
+    lines += ["", "**Category:**", "Lecture Notes"]
+    return "\n".join(lines)
+
+
+def time_parser(parse_fn, texts: List[str], repeat: int) -> Dict[str, float]:
+    """Times parse_fn over all texts, repeat times; returns per-text-call statistics in microseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            parse_fn(text)
+        samples.append((time.perf_counter() - start) / len(texts) * 1e6)
+    return {"median_us": round(statistics.median(samples), 2), "min_us": round(min(samples), 2)}
+
+
+def compare(texts: List[str]) -> Dict[str, int]:
+    """Counts, per section, how many texts both parsers extract identically."""
+    agreement = {key: 0 for key in SECTION_KEYS}
+    for text in texts:
+        old, new = legacy_parse(text), utils.parse_gemini_analysis(text)
+        for key in SECTION_KEYS:
+            if old[key] == new[key]:
+                agreement[key] += 1
+    return agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_gemini_analysis against the legacy regex parser.")
+    parser.add_argument("--outputs-dir", default=os.path.join(REPO_ROOT, "outputs"), help="Directory with stored *.json outputs.")
+    parser.add_argument("--repeat", type=int, default=100, help="Timing repetitions per corpus (default: 100).")
+    parser.add_argument("--output", default=None, help="Optional JSON file to write the summary to.")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING) # Missing-section warnings would dominate the timings
+
+    corpora = {
+        "stored_outputs": collect_stored_outputs(args.outputs_dir),
+        "synthetic_50_bullets": [synthetic_output(50)],
+        "synthetic_500_bullets": [synthetic_output(500)],
+    }
+    summary = {"python": sys.version.split()[0], "repeat": args.repeat, "corpora": {}}
+    for name, texts in corpora.items():
+        if not texts:
+            print(f"{name}: no texts found, skipped")
+            continue
+        legacy = time_parser(legacy_parse, texts, args.repeat)
+        single_pass = time_parser(utils.parse_gemini_analysis, texts, args.repeat)
+        result = {
+            "texts": len(texts),
+            "legacy": legacy,
+            "single_pass": single_pass,
+            "speedup": round(legacy["median_us"] / single_pass["median_us"], 2),
+            "sections_identical": compare(texts),
+        }
+        summary["corpora"][name] = result
+        print(f"{name} ({len(texts)} texts): legacy {legacy['median_us']} us/text, "
+              f"single-pass {single_pass['median_us']} us/text, speedup x{result['speedup']}")
+        print(f"  sections identical to legacy: {result['sections_identical']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# benchmarks/resilience_bench.py
+"""
+Fault-injection benchmark for the model-call guards in src/resilience.py.
+
+Runs the fake backend (src/fake_backend.py) with injected faults and compares an
+unguarded call path with the guarded one, scenario by scenario:
+
+    transient  random 429/503 errors        no retries   vs  retries with backoff
+    quota      backend quota in calls/s     no limiter   vs  retries  vs  token bucket + retries
+    tail       a few 10x slower calls       no hedging   vs  hedged requests
+    outage     every call fails with 503    retries only vs  retries + circuit breaker
+
+Each scenario reports the success rate, latency percentiles and how many calls
+reached the backend. Backoff delays are scaled down (--backoff-base-ms) so a full run
+takes well under a minute.
+
+Usage (from the repository root):
+    python benchmarks/resilience_bench.py
+    python benchmarks/resilience_bench.py --scenarios tail,outage --output benchmarks/results/resilience.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import resilience  # noqa: E402
+import fake_backend  # noqa: E402
+
+SCENARIOS = ("transient", "quota", "tail", "outage")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _model(args, **faults) -> fake_backend.FakeGenerativeModel:
+    return fake_backend.FakeGenerativeModel(
+        "bench-model", latency_ms=args.latency_ms, latency_distribution="uniform", jitter=0.2,
+        tokens_per_second=0, seed=args.seed, **faults)
+
+
+def _policy(args) -> resilience.RetryPolicy:
+    return resilience.RetryPolicy(
+        max_attempts=args.max_attempts,
+        base_delay_s=args.backoff_base_ms / 1000,
+        max_delay_s=args.backoff_base_ms * 16 / 1000,
+    )
+
+
+def _no_breaker() -> resilience.CircuitBreaker:
+    return resilience.CircuitBreaker(failure_threshold=0)
+
+
+def run_calls(call: Callable[[], Any], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Issues `requests` calls with `concurrency` in flight; summarizes outcomes and latency."""
+    def _one(_):
+        start = time.perf_counter()
+        try:
+            call()
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(_one, range(requests)))
+    wall_s = time.perf_counter() - wall_start
+    latencies_ms = sorted(s[1] * 1000 for s in samples)
+    succeeded = sum(1 for s in samples if s[0])
+    return {
+        "requests": requests,
+        "success_rate": round(succeeded / requests, 4),
+        "latency_ms": {q: round(percentile(latencies_ms, int(q[1:])), 1) for q in ("p50", "p95", "p99")},
+        "mean_ms": round(sum(latencies_ms) / requests, 1),
+        "throughput_rps": round(requests / wall_s, 2),
+    }
+
+
+def run_variant(name: str, model: fake_backend.FakeGenerativeModel, guard: Optional[resilience.ModelCallGuard],
+                requests: int, concurrency: int) -> Dict[str, Any]:
+    call = (lambda: guard.call(lambda: model.generate_content([]))) if guard else (lambda: model.generate_content([]))
+    result = run_calls(call, requests, concurrency)
+    result["variant"] = name
+    result["backend_calls"] = model.stats()["calls"]
+    if guard:
+        result["guard"] = {k: v for k, v in guard.stats().items() if k != "hedge_delay_s"}
+    return result
+
+
+# --- Scenarios ---
+def scenario_transient(args) -> List[Dict[str, Any]]:
+    faults = {"error_rate": 0.2}
+    return [
+        run_variant("no retries", _model(args, **faults), None, args.requests, args.concurrency),
+        run_variant("retries", _model(args, **faults),
+                    resilience.ModelCallGuard("bench", _policy(args), breaker=_no_breaker(), seed=args.seed),
+                    args.requests, args.concurrency),
+    ]
+
+
+def scenario_quota(args) -> List[Dict[str, Any]]:
+    quota = args.quota_per_second
+    faults = {"quota_per_second": quota}
+    return [
+        run_variant("no limiter", _model(args, **faults), None, args.requests, args.concurrency),
+        run_variant("retries", _model(args, **faults),
+                    resilience.ModelCallGuard("bench", _policy(args), breaker=_no_breaker(), seed=args.seed),
+                    args.requests, args.concurrency),
+        run_variant("token bucket + retries", _model(args, **faults),
+                    resilience.ModelCallGuard("bench", _policy(args), rate_per_minute=quota * 60 * 0.9, burst=1,
+                                              breaker=_no_breaker(), seed=args.seed),
+                    args.requests, args.concurrency),
+    ]
+
+
+def scenario_tail(args) -> List[Dict[str, Any]]:
+    faults = {"slow_rate": 0.03, "slow_factor": 10}
+    results = []
+    for name, hedge in (("no hedging", False), ("hedged", True)):
+        model = _model(args, **faults)
+        guard = resilience.ModelCallGuard("bench", _policy(args), hedge_enabled=hedge,
+                                          hedge_min_delay_s=args.latency_ms / 1000, breaker=_no_breaker())
+        # Warm the latency window so hedging has a p95 to work from
+        for _ in range(guard.latency.min_samples):
+            guard.call(lambda: model.generate_content([]))
+        results.append(run_variant(name, model, guard, args.requests, args.concurrency))
+    return results
+
+
+def scenario_outage(args) -> List[Dict[str, Any]]:
+    results = []
+    for name, breaker in (("retries only", _no_breaker()),
+                          ("retries + circuit breaker", resilience.CircuitBreaker(failure_threshold=5, reset_timeout_s=30))):
+        model = _model(args)
+        model.set_outage(503)
+        guard = resilience.ModelCallGuard("bench", _policy(args), breaker=breaker, seed=args.seed)
+        results.append(run_variant(name, model, guard, args.requests // 2, args.concurrency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retry, rate limiting, hedging and circuit breaking against injected faults.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {','.join(SCENARIOS)}.")
+    parser.add_argument("--requests", type=int, default=200, help="Calls per variant (default: 200; outage uses half).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Calls in flight (default: 8).")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Fake backend latency (default: 50).")
+    parser.add_argument("--max-attempts", type=int, default=4, help="Attempts per call for the retrying variants (default: 4).")
+    parser.add_argument("--backoff-base-ms", type=float, default=50, help="First backoff step (default: 50).")
+    parser.add_argument("--quota-per-second", type=float, default=40, help="Backend quota for the quota scenario (default: 40).")
+    parser.add_argument("--seed", type=int, default=1234, help="Random seed (default: 1234).")
+    parser.add_argument("--output", default=None, help="Optional JSON file to write the results to.")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    logging.disable(logging.WARNING) # Every retry logs a warning
+    summary = {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": {},
+    }
+    for scenario in scenarios:
+        results = globals()[f"scenario_{scenario}"](args)
+        summary["results"][scenario] = results
+        print(f"{scenario}:")
+        for r in results:
+            print(f"  {r['variant']:<26} success {r['success_rate'] * 100:>6.1f}%  "
+                  f"p50 {r['latency_ms']['p50']:>7.1f} ms  p95 {r['latency_ms']['p95']:>7.1f} ms  "
+                  f"p99 {r['latency_ms']['p99']:>7.1f} ms  mean {r['mean_ms']:>7.1f} ms  "
+                  f"{r['throughput_rps']:>7.1f} req/s  backend calls {r['backend_calls']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/startup_importtime.py
+"""
+Startup (cold import) benchmark for the API server.
+
+Runs `python -X importtime -c "import src.api"` in fresh subprocesses and
+reports the total import time plus the slowest imports (depth 1-2). This is the
+time gunicorn spends per worker before it can serve its first request.
+
+Usage (from the repository root):
+    python benchmarks/startup_importtime.py
+    python benchmarks/startup_importtime.py --runs 10 --output benchmarks/results/startup_importtime.json
+    python benchmarks/startup_importtime.py --repo-root /path/to/other/checkout   # e.g. compare with an older commit
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, Any, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time: self [us] | cumulative | imported package"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parses -X importtime output into a list of {module, self_us, cumulative_us, depth}."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append({
+                "module": module,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(indent) - 1) // 2,
+            })
+    return entries
+
+
+def run_once(repo_root: str, module: str) -> Dict[str, Any]:
+    """Imports module in a fresh interpreter and returns the wall time and importtime entries."""
+    env = dict(os.environ)
+    # Dummy values so configuration validation cannot fail the import
+    env.setdefault("GCP_PROJECT_ID", "startup-benchmark")
+    env.setdefault("GCP_REGION", "europe-west4")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=repo_root, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    entries = parse_importtime(proc.stderr)
+    return {"wall_ms": wall_ms, "entries": entries}
+
+
+def summarize(runs: List[Dict[str, Any]], module: str, top: int) -> Dict[str, Any]:
+    """Aggregates several runs into medians and the slowest imports below the measured module."""
+    totals_ms = []
+    per_module: Dict[str, List[int]] = {}
+    for run in runs:
+        totals_ms.append(sum(e["cumulative_us"] for e in run["entries"] if e["depth"] == 0) / 1000)
+        # Direct and second-level imports show which dependencies dominate startup
+        for e in run["entries"]:
+            if e["depth"] in (1, 2):
+                per_module.setdefault(e["module"], []).append(e["cumulative_us"])
+    slowest = sorted(
+        ({"module": m, "median_ms": statistics.median(v) / 1000} for m, v in per_module.items()),
+        key=lambda e: e["median_ms"], reverse=True,
+    )[:top]
+    return {
+        "module": module,
+        "runs": len(runs),
+        "python": sys.version.split()[0],
+        "import_total_ms_median": round(statistics.median(totals_ms), 1),
+        "import_total_ms_min": round(min(totals_ms), 1),
+        "process_wall_ms_median": round(statistics.median(r["wall_ms"] for r in runs), 1),
+        "slowest_imports": [{"module": e["module"], "median_ms": round(e["median_ms"], 1)} for e in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the API server.")
+    parser.add_argument("--repo-root", default=REPO_ROOT, help="Checkout to measure (default: this repository).")
+    parser.add_argument("--module", default="src.api", help="Module to import (default: src.api).")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh-interpreter runs (default: 5).")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list (default: 10).")
+    parser.add_argument("--output", default=None, help="Optional JSON file to write the summary to.")
+    args = parser.parse_args()
+
+    runs = [run_once(args.repo_root, args.module) for _ in range(args.runs)]
+    summary = summarize(runs, args.module, args.top)
+
+    print(f"Cold import of {summary['module']} ({summary['runs']} runs, Python {summary['python']}):")
+    print(f"  import time (median): {summary['import_total_ms_median']} ms")
+    print(f"  process wall time (median): {summary['process_wall_ms_median']} ms")
+    print("  slowest imports (depth 1-2):")
+    for e in summary["slowest_imports"]:
+        print(f"    {e['median_ms']:>9.1f} ms  {e['module']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 # src/api.py
 import os
+import json
+import time
+import queue
+import shutil
 import tempfile
 import sys
 import logging # Keep logging for basicConfig
+import threading
 import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor # For concurrent per-file analysis
 # Import Flask components needed
-from flask import Flask, request, jsonify, make_response # Removed 'g' as it wasn't used
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context # Removed 'g' as it wasn't used
 from werkzeug.utils import secure_filename
 from flask_cors import CORS # Import CORS
 
@@ -39,13 +46,49 @@ else:
 # --- Import Project Modules ---
 try:
     # Now imports should work because src_dir is in sys.path
-    from vllm_handler import analyze_content, initialize_vertex_ai
+    from vllm_handler import analyze_content, analyze_content_stream, analyze_content_structured, initialize_vertex_ai, warm_up
+    from vllm_handler import get_model_cache_stats, get_response_cache_stats, get_model_call_stats
+    from vllm_handler import get_answering_model, get_routing_stats, get_context_cache_stats
+    from vllm_handler import DocumentSource
+    from utils import get_image_preprocess_stats
+    import jobs
+    import results_store
     logging.info("Successfully imported from vllm_handler.") # Use root logger
 except ImportError as e:
     logging.error(f"Error importing from vllm_handler: {e}") # Use root logger
     # Define dummy functions if import fails, useful for testing API layer
     def initialize_vertex_ai(): logging.warning("Using dummy initialize_vertex_ai"); return True
+    def warm_up(): logging.warning("Using dummy warm_up"); return {"ready": True, "model": None, "timings_ms": {}}
     def analyze_content(fp, user_prompt, model_id_override=None): logging.warning(f"Using dummy analyze_content for {fp}"); return f"Dummy analysis for {os.path.basename(fp)}"
+    def analyze_content_stream(fp, user_prompt, model_id_override=None):
+        result = analyze_content(fp, user_prompt, model_id_override)
+        yield "chunk", result
+        yield "result", result
+    def analyze_content_structured(fp, user_prompt, model_id_override=None): return analyze_content(fp, user_prompt, model_id_override)
+    def get_model_cache_stats(): return {}
+    def get_response_cache_stats(): return {}
+    def get_model_call_stats(): return {}
+    def get_answering_model(): return None
+    def get_routing_stats(): return {}
+    def get_context_cache_stats(): return {}
+    def get_image_preprocess_stats(): return {}
+    DocumentSource = None # Uploads are always written to disk
+    jobs = results_store = None # /api/jobs and /api/results/search answer 503
+
+try:
+    import config
+    MAX_CONCURRENT_ANALYSES = max(1, getattr(config, 'API_MAX_CONCURRENT_ANALYSES', 4))
+except Exception as e:
+    logging.error(f"Error importing config: {e}. Using default concurrency.")
+    config = None
+    MAX_CONCURRENT_ANALYSES = 4
+
+import telemetry # Stage timing spans (standard library only)
+import logging_config # Queued, request-scoped logging pipeline
+
+# Replace the synchronous basicConfig handler with the queue-backed one before Flask
+# creates app.logger (Flask only adds its own handler if none is configured).
+logging_config.setup_logging_from_config(config)
 
 
 # --- Initialize Flask App and CORS ---
@@ -59,106 +102,91 @@ CORS(app)
 
 
 # --- Initialize Vertex AI ---
-# Use Flask's app.logger once the app object exists
-app.logger.info("Initializing Vertex AI for API server...")
-if not initialize_vertex_ai():
-    app.logger.critical("FATAL: Could not initialize Vertex AI on server startup.")
-else:
-    app.logger.info("Vertex AI initialized successfully.")
+# Vertex AI is no longer initialized at import time: that made every worker pay for the
+# SDK import before it could serve anything. It happens on the first analysis request,
+# or explicitly through the /api/ready warm-up endpoint below.
+
+
+# --- Request Logging Hooks ---
+def _incoming_request_id():
+    """Request id from X-Request-ID, else the trace id of X-Cloud-Trace-Context ("TRACE_ID/SPAN_ID;o=1")."""
+    request_id = request.headers.get('X-Request-ID')
+    if not request_id:
+        trace_context = request.headers.get('X-Cloud-Trace-Context', '')
+        request_id = trace_context.split('/', 1)[0] or None
+    return request_id[:64] if request_id else None
 
 
-# --- Request Logging Hook ---
 @app.before_request
 def log_request_info():
-    """Log details of incoming requests before routing."""
-    log_message = (
-        f"Incoming Request -- "
-        f"Method: {request.method}, "
-        f"Path: {request.path}, "
-        f"Origin: {request.headers.get('Origin', 'N/A')}, "
-        f"Remote Addr: {request.remote_addr}"
-        # Uncomment below to log all headers (can be verbose)
-        # f", Headers: {dict(request.headers)}"
+    """Binds a request id to the request's log records and logs the incoming request."""
+    logging_config.start_request(_incoming_request_id())
+    app.logger.debug(
+        "Incoming Request -- Method: %s, Path: %s, Origin: %s, Remote Addr: %s",
+        request.method, request.path, request.headers.get('Origin', 'N/A'), request.remote_addr,
     )
-    app.logger.info(log_message) # Use app.logger
 
 
-# --- API Endpoint ---
-# Only POST is needed now, as Flask-CORS handles OPTIONS
-@app.route('/api/analyze', methods=['POST'])
-def handle_analyze():
-    """Handles file uploads and analysis requests."""
+@app.after_request
+def add_request_id_header(response):
+    """Echoes the request id so clients can correlate responses with log records."""
+    request_id = logging_config.get_request_id()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
 
-    # POST request handling starts here
-    app.logger.info("Handling POST request to /api/analyze")
 
-    # Check if the 'files' part is present in the request
-    if 'files' not in request.files:
-        app.logger.error("Error: 'files' part not in request.files")
-        return jsonify({"error": "No files part in the request"}), 400
+def _submit_with_context(executor, fn, *args):
+    """executor.submit() that runs fn in a copy of the caller's context (keeps the request id on worker logs)."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
 
-    # Get the list of files and the prompt text
-    files = request.files.getlist('files')
-    prompt_text = request.form.get('prompt', '').strip() # Get prompt and remove leading/trailing whitespace
-    app.logger.info(f"Received {len(files)} file(s). Prompt: '{prompt_text[:100]}...'") # Log snippet
-
-    # Validate prompt presence
-    if not prompt_text:
-        app.logger.error("Error: Prompt text is missing or empty.")
-        return jsonify({"error": "Prompt text is required"}), 400
-
-    # Validate file presence
-    if not files or all(f.filename == '' for f in files):
-         app.logger.error("Error: No files selected or files have no names")
-         return jsonify({"error": "No files selected"}), 400
-
-    results = [] # To store successful analysis results
-    errors = [] # To store errors for specific files
-
-    # Create a temporary directory to store uploaded files securely
-    with tempfile.TemporaryDirectory() as tmpdir:
-        app.logger.info(f"Created temporary directory: {tmpdir}")
-        for file in files:
-            # Skip files with no filename
-            if file.filename == '':
-                app.logger.warning("Skipping file with empty filename.")
-                continue
-
-            # Secure the filename to prevent path traversal issues
-            filename = secure_filename(file.filename)
-            temp_path = os.path.join(tmpdir, filename)
-
-            try:
-                app.logger.info(f"Saving temporary file: {temp_path}")
-                file.save(temp_path) # Save the uploaded file to the temp directory
-                app.logger.info(f"File saved. Analyzing with prompt...")
-
-                # --- Call your backend analysis logic ---
-                analysis_result = analyze_content(temp_path, prompt_text)
-                # ----------------------------------------
 
-                app.logger.info(f"Analysis result snippet for {filename}: {str(analysis_result)[:100]}...")
-
-                # Check if the analysis function returned an error string
-                if isinstance(analysis_result, str) and analysis_result.startswith("Error:"):
-                     app.logger.warning(f"Analysis error for {filename}: {analysis_result}")
-                     errors.append({"filename": filename, "error": analysis_result})
-                else:
-                     # Store successful result associated with the original filename
-                     results.append({
-                         "filename": filename,
-                         "analysis": analysis_result
-                     })
+# --- Per-file Analysis Helper ---
+def _analyze_upload(document, filename: str, prompt_text: str, structured: bool = False):
+    """
+    Runs analyze_content for one upload. Safe to call from worker threads.
 
-            except Exception as e:
-                # Catch unexpected errors during file processing or analysis call
-                app.logger.error(f"Server error processing file {filename}: {e}")
-                traceback.print_exc() # Print full traceback to server logs for debugging
-                errors.append({"filename": filename, "error": f"Server processing error - {type(e).__name__}"})
-            # The temporary file (temp_path) is automatically cleaned up when exiting the 'with' block
+    Args:
+        document: The upload as a DocumentSource (in memory) or the path it was saved to.
+        structured: Return the analysis as a schema-validated object instead of Markdown text.
 
-    app.logger.info(f"Finished processing all files. Results: {len(results)}, Errors: {len(errors)}")
+    Returns:
+        A ("result" | "error", dict) tuple in the shape used by the response.
+    """
+    try:
+        app.logger.debug("Analyzing %s with prompt...", filename)
 
+        # --- Call your backend analysis logic ---
+        if structured:
+            analysis_result = analyze_content_structured(document, prompt_text)
+        else:
+            analysis_result = analyze_content(document, prompt_text)
+        # ----------------------------------------
+
+        app.logger.debug("Analysis result for %s: %d chars", filename, len(str(analysis_result)))
+
+        # Check if the analysis function returned an error string
+        if isinstance(analysis_result, str) and analysis_result.startswith("Error:"):
+            app.logger.warning(f"Analysis error for {filename}: {analysis_result}")
+            return "error", {"filename": filename, "error": analysis_result}
+        if not isinstance(analysis_result, str):
+            analysis_result = analysis_result.to_dict() # StructuredAnalysis
+        # Store successful result associated with the original filename and the model that answered
+        return "result", {"filename": filename, "analysis": analysis_result, "model": get_answering_model()}
+
+    except Exception as e:
+        # Catch unexpected errors during the analysis call
+        app.logger.error(f"Server error processing file {filename}: {e}")
+        traceback.print_exc() # Print full traceback to server logs for debugging
+        return "error", {"filename": filename, "error": f"Server processing error - {type(e).__name__}"}
+
+
+# --- Response Helper ---
+def _build_analysis_response(results: list, errors: list):
+    """
+    Builds the JSON response and status code for a set of per-file outcomes:
+    200 (all succeeded), 207 (partial), 500 (all failed) or 400 (nothing analyzed).
+    """
     # --- Construct Response ---
     response_data = {}
     status_code = 200
@@ -183,6 +211,8 @@ def handle_analyze():
         # If expecting only one file, return analysis directly. Otherwise return list.
         if len(results) == 1:
              response_data = {"analysis": results[0]['analysis']}
+             if results[0].get('model'):
+                 response_data["model"] = results[0]['model']
         else:
              response_data = {"analysis": results} # Keep as list for multiple files
         status_code = 200 # OK
@@ -192,6 +222,575 @@ def handle_analyze():
     return jsonify(response_data), status_code
 
 
+# --- Readiness / Warm-up Endpoint ---
+@app.route('/api/ready', methods=['GET'])
+def handle_ready():
+    """
+    Readiness probe and warm-up hook. Imports the Vertex AI SDK, initializes
+    Vertex AI and builds the default model (only the first call does real work).
+    Returns 200 when the server can analyze documents, 503 otherwise.
+    """
+    status = warm_up()
+    status_code = 200 if status.get("ready") else 503
+    if status_code != 200:
+        app.logger.error(f"Readiness check failed: {status.get('error')}")
+    return jsonify(status), status_code
+
+
+# --- Upload Helpers ---
+def _parse_upload_request():
+    """
+    Validates the multipart upload of the current request.
+
+    Returns:
+        A (files, prompt_text, error_response) tuple. error_response is a
+        (json, status) tuple to return directly if validation failed, else None.
+    """
+    # Check if the 'files' part is present in the request
+    if 'files' not in request.files:
+        app.logger.error("Error: 'files' part not in request.files")
+        return None, None, (jsonify({"error": "No files part in the request"}), 400)
+
+    # Get the list of files and the prompt text
+    files = request.files.getlist('files')
+    prompt_text = request.form.get('prompt', '').strip() # Get prompt and remove leading/trailing whitespace
+    app.logger.info("Received %d file(s). Prompt: %d chars", len(files), len(prompt_text))
+
+    # Validate prompt presence
+    if not prompt_text:
+        app.logger.error("Error: Prompt text is missing or empty.")
+        return None, None, (jsonify({"error": "Prompt text is required"}), 400)
+
+    # Validate file presence
+    if not files or all(f.filename == '' for f in files):
+         app.logger.error("Error: No files selected or files have no names")
+         return None, None, (jsonify({"error": "No files selected"}), 400)
+
+    return files, prompt_text, None
+
+
+def _save_uploads(files, tmpdir: str):
+    """
+    Saves uploads to tmpdir sequentially (the request stream is not thread-safe).
+    Used by /api/jobs, whose workers read the files after the request has ended.
+
+    Returns:
+        A list of (filename, temp_path or None, error dict or None) in upload order.
+    """
+    outcomes = []
+    for index, file in enumerate(files):
+        # Skip files with no filename
+        if file.filename == '':
+            app.logger.warning("Skipping file with empty filename.")
+            continue
+
+        # Secure the filename to prevent path traversal issues
+        filename = secure_filename(file.filename)
+        # One subdirectory per upload so duplicate names don't overwrite each other
+        file_dir = os.path.join(tmpdir, str(index))
+        temp_path = os.path.join(file_dir, filename)
+
+        try:
+            app.logger.debug("Saving temporary file: %s", temp_path)
+            os.makedirs(file_dir, exist_ok=True)
+            file.save(temp_path) # Save the uploaded file to the temp directory
+            outcomes.append((filename, temp_path, None))
+        except Exception as e:
+            app.logger.error(f"Server error saving file {filename}: {e}")
+            traceback.print_exc()
+            outcomes.append((filename, None, {"filename": filename, "error": f"Server processing error - {type(e).__name__}"}))
+    return outcomes
+
+
+def _receive_uploads(files, tmpdir: str):
+    """
+    Reads uploads sequentially (the request stream is not thread-safe). Uploads of up to
+    UPLOAD_SPILL_THRESHOLD_BYTES are kept in memory and analyzed from there; only larger
+    ones are written to tmpdir.
+
+    Returns:
+        A list of (filename, DocumentSource or temp path or None, error dict or None) in upload order.
+    """
+    threshold = getattr(config, 'UPLOAD_SPILL_THRESHOLD_BYTES', 16 * 1024 * 1024)
+    outcomes = []
+    for index, file in enumerate(files):
+        if file.filename == '':
+            app.logger.warning("Skipping file with empty filename.")
+            continue
+
+        filename = secure_filename(file.filename)
+        try:
+            head = file.stream.read(threshold + 1) if DocumentSource is not None else b""
+            if DocumentSource is not None and len(head) <= threshold:
+                outcomes.append((filename, DocumentSource(name=filename, data=head, mime_type=file.mimetype or None), None))
+                continue
+
+            # Too large to keep in memory: write what was read so far plus the rest of the stream
+            file_dir = os.path.join(tmpdir, str(index))
+            temp_path = os.path.join(file_dir, filename)
+            app.logger.debug("Spilling upload to temporary file: %s", temp_path)
+            os.makedirs(file_dir, exist_ok=True)
+            with open(temp_path, "wb") as out:
+                out.write(head)
+                shutil.copyfileobj(file.stream, out)
+            outcomes.append((filename, temp_path, None))
+        except Exception as e:
+            app.logger.error(f"Server error reading file {filename}: {e}")
+            traceback.print_exc()
+            outcomes.append((filename, None, {"filename": filename, "error": f"Server processing error - {type(e).__name__}"}))
+    return outcomes
+
+
+# --- API Endpoint ---
+OUTPUT_FORMATS = ("markdown", "json")
+
+# Only POST is needed now, as Flask-CORS handles OPTIONS
+@app.route('/api/analyze', methods=['POST'])
+def handle_analyze():
+    """
+    Handles file uploads and analysis requests. The optional 'output_format'
+    form field selects "markdown" (analysis text) or "json" (analysis object with
+    document_type, summary, key_info and category).
+    """
+
+    # POST request handling starts here
+    with telemetry.span("handle_analyze") as span:
+        telemetry.stage("parse_upload")
+        files, prompt_text, error_response = _parse_upload_request()
+        if error_response:
+            return error_response
+
+        default_format = "json" if getattr(config, 'STRUCTURED_OUTPUT_ENABLED', False) else "markdown"
+        output_format = request.form.get('output_format', default_format).strip().lower()
+        if output_format not in OUTPUT_FORMATS:
+            app.logger.error(f"Error: Unsupported output_format '{output_format}'")
+            return jsonify({"error": f"output_format must be one of {list(OUTPUT_FORMATS)}"}), 400
+        span.set_attribute("files", len(files))
+
+        results = [] # To store successful analysis results
+        errors = [] # To store errors for specific files
+
+        # Temporary directory for uploads too large to keep in memory
+        with tempfile.TemporaryDirectory() as tmpdir:
+            app.logger.debug("Created temporary directory: %s", tmpdir)
+            telemetry.stage("receive_uploads")
+            # Each outcome slot keeps the upload order so results stay stable.
+            outcomes = _receive_uploads(files, tmpdir)
+
+            # Analyze the uploads concurrently, bounded by MAX_CONCURRENT_ANALYSES
+            telemetry.stage("analyze_files")
+            pending = [(index, filename, document) for index, (filename, document, error) in enumerate(outcomes) if error is None]
+            workers = min(MAX_CONCURRENT_ANALYSES, len(pending)) or 1
+            app.logger.debug("Analyzing %d file(s) with up to %d in flight...", len(pending), workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    index: _submit_with_context(executor, _analyze_upload, document, filename, prompt_text, output_format == "json")
+                    for index, filename, document in pending
+                }
+                # Collect in upload order, not completion order
+                for index, (filename, document, error) in enumerate(outcomes):
+                    if error is None:
+                        kind, entry = futures[index].result()
+                    else:
+                        kind, entry = "error", error
+                    if kind == "error":
+                        errors.append(entry)
+                    else:
+                        results.append(entry)
+            telemetry.stage("cleanup")
+            # The temporary files are automatically cleaned up when exiting the 'with' block
+
+        app.logger.info("Finished processing all files. Results: %d, Errors: %d", len(results), len(errors))
+
+        telemetry.stage("build_response")
+        span.set_attribute("errors", len(errors))
+        return _build_analysis_response(results, errors)
+
+
+# --- Streaming API Endpoint (Server-Sent Events) ---
+def _sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _remove_when_done(futures, path: str):
+    """Removes the directory at path once every future has finished (at once if none is running)."""
+    running = [future for future in futures if not future.done()]
+    if not running:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    lock = threading.Lock()
+    remaining = [len(running)]
+
+    def _on_done(_future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            shutil.rmtree(path, ignore_errors=True)
+
+    for future in running:
+        future.add_done_callback(_on_done) # Runs immediately if the future finished meanwhile
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def handle_analyze_stream():
+    """
+    Same input as /api/analyze, but streams progress as Server-Sent Events:
+    'start' (file list), 'chunk' (model text as it is generated),
+    'file_complete' / 'file_error' (one per file) and a final 'done'.
+    Every per-file event carries the file's upload index and filename.
+    """
+    app.logger.info("Handling POST request to /api/analyze/stream")
+
+    files, prompt_text, error_response = _parse_upload_request()
+    if error_response:
+        return error_response
+
+    # Uploads must be read before the response starts streaming: Flask closes the
+    # request's files when this view returns, before the generator runs
+    tmpdir = tempfile.mkdtemp()
+    try:
+        outcomes = _receive_uploads(files, tmpdir)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    executor, futures, cleaned_up = None, [], False
+
+    def cleanup():
+        """
+        Runs once, when the stream ends or the client disconnects (the generator's finally),
+        or when the response is closed before streaming started. Queued files are cancelled
+        without blocking the worker; in-flight ones still read their temporary files, so
+        the directory goes once they finish.
+        """
+        nonlocal cleaned_up
+        if cleaned_up:
+            return
+        cleaned_up = True
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        _remove_when_done(futures, tmpdir)
+
+    def generate():
+        nonlocal executor
+        events = queue.Queue()
+
+        def stream_file(index: int, filename: str, document):
+            final_text = None
+            try:
+                for kind, text in analyze_content_stream(document, prompt_text):
+                    if kind == "chunk":
+                        events.put(("chunk", {"index": index, "filename": filename, "text": text}))
+                    else:
+                        final_text = text
+            except Exception as e:
+                app.logger.error(f"Server error streaming file {filename}: {e}")
+                traceback.print_exc()
+                final_text = f"Server processing error - {type(e).__name__}"
+                events.put(("file_error", {"index": index, "filename": filename, "error": final_text}))
+                return
+            if final_text is None or final_text.startswith("Error:"):
+                events.put(("file_error", {"index": index, "filename": filename, "error": final_text or "Error: No result produced."}))
+            else:
+                events.put(("file_complete", {"index": index, "filename": filename, "analysis": final_text,
+                                              "model": get_answering_model()}))
+
+        try:
+            yield _sse_event("start", {"files": [filename for filename, _, _ in outcomes]})
+            results_count, errors_count = 0, 0
+            pending = []
+            for index, (filename, document, error) in enumerate(outcomes):
+                if error is None:
+                    pending.append((index, filename, document))
+                else:
+                    errors_count += 1
+                    yield _sse_event("file_error", dict(error, index=index))
+
+            if pending:
+                executor = ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_ANALYSES, len(pending)))
+                for index, filename, document in pending:
+                    futures.append(_submit_with_context(executor, stream_file, index, filename, document))
+
+            remaining = len(pending)
+            while remaining:
+                event, data = events.get()
+                if event == "file_complete":
+                    results_count += 1
+                    remaining -= 1
+                elif event == "file_error":
+                    errors_count += 1
+                    remaining -= 1
+                yield _sse_event(event, data)
+
+            app.logger.info(f"Finished streaming all files. Results: {results_count}, Errors: {errors_count}")
+            yield _sse_event("done", {"results": results_count, "errors": errors_count})
+        finally:
+            # Runs on completion and when the client disconnects mid-stream
+            cleanup()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.call_on_close(cleanup)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Disable proxy buffering so events flush immediately
+    return response
+
+
+# --- Metrics Endpoint ---
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    """
+    Prometheus text-format metrics for this worker process: stage duration
+    histograms from the telemetry spans, plus model registry, model call
+    (retry/hedge/circuit breaker), context cache, response cache and image
+    preprocessing counters. Each gunicorn worker reports its own values.
+    """
+    lines = telemetry.render_stage_histograms()
+
+    model_stats = get_model_cache_stats()
+    if model_stats:
+        lines += telemetry.format_metric("clu_model_registry_lookups_total", "counter",
+                                         "Model registry lookups by result.",
+                                         [({"result": "hit"}, model_stats.get("hits", 0)),
+                                          ({"result": "miss"}, model_stats.get("misses", 0))])
+        lines += telemetry.format_metric("clu_model_registry_models", "gauge", "Models currently cached.",
+                                         [({}, len(model_stats.get("cached_models", [])))])
+
+    call_stats = get_model_call_stats()
+    if call_stats:
+        lines += telemetry.format_metric("clu_model_call_events_total", "counter",
+                                         "Model call attempts, retries, hedged duplicates, hedges that won and calls failed after all retries.",
+                                         [({"model": model, "event": event}, stats[key])
+                                          for model, stats in sorted(call_stats.items())
+                                          for event, key in (("attempt", "attempts"), ("retry", "retries"),
+                                                               ("hedge", "hedges"), ("hedge_win", "hedge_wins"),
+                                                               ("failure", "failures"))])
+        lines += telemetry.format_metric("clu_model_call_rejections_total", "counter",
+                                         "Model calls rejected without being sent, by reason.",
+                                         [({"model": model, "reason": reason}, stats[key])
+                                          for model, stats in sorted(call_stats.items())
+                                          for reason, key in (("circuit_open", "circuit_rejections"),
+                                                              ("rate_limited", "rate_limit_timeouts"))])
+        lines += telemetry.format_metric("clu_model_circuit_open", "gauge",
+                                         "1 while the model's circuit breaker is open or half-open.",
+                                         [({"model": model}, int(stats["circuit_state"] != "closed"))
+                                          for model, stats in sorted(call_stats.items())])
+
+    routing_stats = get_routing_stats()
+    if routing_stats:
+        lines += telemetry.format_metric("clu_model_routing_decisions_total", "counter",
+                                         "Requests routed to the tuned endpoint or the base model, by reason.",
+                                         [({"target": d["source"], "reason": d["reason"]}, d["count"])
+                                          for d in routing_stats["decisions"]])
+        lines += telemetry.format_metric("clu_model_routing_primary_healthy", "gauge",
+                                         "1 while the tuned endpoint is within its error rate and latency limits.",
+                                         [({"model": routing_stats["primary"]}, int(routing_stats["primary_unhealthy_reason"] is None))])
+        targets = sorted(routing_stats["targets"].items())
+        lines += telemetry.format_metric("clu_model_target_error_rate", "gauge",
+                                         "Error rate of each model target over the routing window.",
+                                         [({"model": name}, round(t["error_rate"], 4)) for name, t in targets])
+        lines += telemetry.format_metric("clu_model_target_p95_latency_seconds", "gauge",
+                                         "p95 latency of successful calls to each model target over the routing window.",
+                                         [({"model": name}, round(t["p95_latency_s"], 4)) for name, t in targets
+                                          if t["p95_latency_s"] is not None])
+
+    context_stats = get_context_cache_stats()
+    if context_stats:
+        lines += telemetry.format_metric("clu_context_cache_events_total", "counter",
+                                         "Instruction context cache lookups served, caches created, reused from another worker, renewed, invalidated and failed to create.",
+                                         [({"event": event}, context_stats.get(key, 0))
+                                          for event, key in (("hit", "hits"), ("create", "created"), ("reuse", "reused"),
+                                                             ("renew", "renewed"), ("invalidate", "invalidated"),
+                                                             ("failure", "failures"))])
+        lines += telemetry.format_metric("clu_context_cache_active", "gauge", "Instruction context caches in use by this worker.",
+                                         [({}, context_stats.get("active", 0))])
+
+    cache_stats = get_response_cache_stats()
+    if cache_stats:
+        lines += telemetry.format_metric("clu_response_cache_lookups_total", "counter",
+                                         "Response cache lookups by result.",
+                                         [({"result": "hit"}, cache_stats.get("hits", 0)),
+                                          ({"result": "miss"}, cache_stats.get("misses", 0))])
+        lines += telemetry.format_metric("clu_response_cache_removals_total", "counter",
+                                         "Response cache entries removed, by reason.",
+                                         [({"reason": "evicted"}, cache_stats.get("evictions", 0)),
+                                          ({"reason": "expired"}, cache_stats.get("expirations", 0))])
+        lines += telemetry.format_metric("clu_response_cache_entries", "gauge", "Entries in the response cache.",
+                                         [({}, cache_stats.get("entries", 0))])
+        lines += telemetry.format_metric("clu_response_cache_bytes", "gauge", "Size of the cached responses in bytes.",
+                                         [({}, cache_stats.get("bytes", 0))])
+
+    image_stats = get_image_preprocess_stats()
+    if image_stats:
+        lines += telemetry.format_metric("clu_image_preprocess_images_total", "counter",
+                                         "Uploaded images preprocessed, and how many of them were downscaled.",
+                                         [({"result": "processed"}, image_stats.get("images", 0)),
+                                          ({"result": "resized"}, image_stats.get("resized", 0))])
+        lines += telemetry.format_metric("clu_image_preprocess_bytes_total", "counter",
+                                         "Uploaded image bytes before and after preprocessing.",
+                                         [({"stage": "before"}, image_stats.get("bytes_before", 0)),
+                                          ({"stage": "after"}, image_stats.get("bytes_after", 0))])
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+# --- Asynchronous Job API ---
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+def _unavailable(feature: str):
+    """503 response for an API whose backing module could not be imported."""
+    app.logger.error(f"{feature} is unavailable: its modules failed to import (see startup logs).")
+    return jsonify({"error": f"{feature} is unavailable on this server"}), 503
+
+def _get_job_manager():
+    """
+    Returns this process's JobManager, creating it on first use, or None if the
+    jobs module could not be imported. Workers are started lazily so they are
+    created after gunicorn forks, not before.
+    """
+    global _job_manager
+    if jobs is None:
+        return None
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                backend = jobs.create_backend(
+                    getattr(config, 'JOBS_BACKEND', "memory"),
+                    getattr(config, 'JOBS_DB_PATH', None),
+                )
+                _job_manager = jobs.JobManager(
+                    backend,
+                    analyze_fn=analyze_content,
+                    upload_dir=getattr(config, 'JOBS_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), "clu_jobs")),
+                    workers=getattr(config, 'JOBS_WORKERS', 4),
+                    model_fn=get_answering_model,
+                )
+                _job_manager.start()
+    return _job_manager
+
+@app.route('/api/jobs', methods=['POST'])
+def handle_create_job():
+    """
+    Accepts the same multipart input as /api/analyze, queues the files for
+    background analysis and returns a job id immediately (202 Accepted).
+    """
+    app.logger.info("Handling POST request to /api/jobs")
+    manager = _get_job_manager()
+    if manager is None:
+        return _unavailable("The job API")
+
+    files, prompt_text, error_response = _parse_upload_request()
+    if error_response:
+        return error_response
+
+    job_id, job_dir = manager.new_job_dir()
+    outcomes = _save_uploads(files, job_dir)
+    saved = [(filename, temp_path) for filename, temp_path, error in outcomes if error is None]
+    if not saved:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({"error": "Could not save any uploaded files", "details": [e for _, _, e in outcomes if e]}), 500
+
+    manager.submit(job_id, prompt_text, saved)
+    response_data = {
+        "job_id": job_id,
+        "status": "queued",
+        "total": len(saved),
+        "status_url": f"/api/jobs/{job_id}",
+        "results_url": f"/api/jobs/{job_id}/results",
+    }
+    save_errors = [error for _, _, error in outcomes if error]
+    if save_errors:
+        response_data["errors"] = save_errors
+    return jsonify(response_data), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def handle_get_job(job_id):
+    """Returns job progress, including the results of files that have already finished."""
+    manager = _get_job_manager()
+    if manager is None:
+        return _unavailable("The job API")
+    job = manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def handle_get_job_results(job_id):
+    """
+    Returns the final output of a completed job in the same shape and with the
+    same status codes as /api/analyze. Responds 202 with progress while running.
+    """
+    manager = _get_job_manager()
+    if manager is None:
+        return _unavailable("The job API")
+    job = manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    if job["status"] != "completed":
+        return jsonify({"job_id": job_id, "status": job["status"], "completed": job["completed"], "total": job["total"]}), 202
+
+    results = [{"filename": f["filename"], "analysis": f["analysis"], "model": f["model"]}
+               for f in job["files"] if f["status"] == "success"]
+    errors = [{"filename": f["filename"], "error": f["error"]} for f in job["files"] if f["status"] == "error"]
+    return _build_analysis_response(results, errors)
+
+
+# --- Results Search API ---
+_results_store = None
+_results_store_lock = threading.Lock()
+
+def _get_results_store():
+    """Opens the results store (filled by batch and watch runs) on first use."""
+    global _results_store
+    if _results_store is None:
+        with _results_store_lock:
+            if _results_store is None:
+                _results_store = results_store.ResultsStore(
+                    getattr(config, 'RESULTS_STORE_PATH', os.path.join("outputs", "results_store.sqlite3")),
+                    rank_max_matches=getattr(config, 'RESULTS_SEARCH_RANK_MAX_MATCHES', 20000),
+                )
+    return _results_store
+
+@app.route('/api/results/search', methods=['GET'])
+def handle_results_search():
+    """
+    Searches the analyzed documents. Query parameters (all optional):
+    q (words that must appear in the summary or key information), category,
+    document_type, limit (default 20) and offset. Results are ordered by relevance,
+    or newest first without q or when q matches too many documents to rank
+    (RESULTS_SEARCH_RANK_MAX_MATCHES); "order" in the response says which.
+    """
+    if results_store is None:
+        return _unavailable("Results search")
+    text = request.args.get('q', '').strip() or None
+    category = request.args.get('category', '').strip() or None
+    document_type = request.args.get('document_type', '').strip() or None
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    max_limit = getattr(config, 'RESULTS_SEARCH_MAX_LIMIT', 100)
+    if not 1 <= limit <= max_limit or offset < 0:
+        return jsonify({"error": f"limit must be between 1 and {max_limit}, offset must not be negative"}), 400
+
+    start = time.perf_counter()
+    try:
+        found = _get_results_store().search(text, category=category, document_type=document_type,
+                                            limit=limit, offset=offset)
+    except Exception as e:
+        app.logger.error(f"Results search failed: {e}", exc_info=True)
+        return jsonify({"error": "Results search failed"}), 500
+    return jsonify({
+        "query": {"q": text, "category": category, "document_type": document_type},
+        "limit": limit,
+        "offset": offset,
+        "order": found["order"],
+        "count": len(found["results"]),
+        "took_ms": round((time.perf_counter() - start) * 1000, 2),
+        "results": found["results"],
+    }), 200
+
+
 # --- Main Execution (Only for running locally, not used by Gunicorn/Cloud Run) ---
 if __name__ == '__main__':
     # This block allows running the Flask development server directly
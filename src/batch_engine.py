@@ -0,0 +1,310 @@
+# src/batch_engine.py
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- File Fingerprinting ---
+def file_fingerprint(file_path: str) -> Tuple[str, int, int]:
+    """
+    Returns the (absolute path, size, mtime_ns) triple used to decide whether
+    a file has already been analyzed in a previous run.
+
+    Args:
+        file_path: Path to the input file.
+
+    Returns:
+        The fingerprint tuple. Raises OSError if the file cannot be stat'ed.
+    """
+    st = os.stat(file_path)
+    return os.path.abspath(file_path), st.st_size, st.st_mtime_ns
+
+
+# --- Checkpoint Handling ---
+def _ends_with_newline(file_path: str) -> bool:
+    with open(file_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class CheckpointWriter:
+    """
+    Append-only JSONL checkpoint. One line is written (and flushed to disk) per
+    completed file, so a crash loses at most the files that were in flight.
+    Safe to call from multiple worker threads.
+    """
+
+    def __init__(self, checkpoint_path: str):
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+        checkpoint_dir = os.path.dirname(checkpoint_path)
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        self._file = open(checkpoint_path, 'a', encoding='utf-8')
+        if self._file.tell() and not _ends_with_newline(checkpoint_path):
+            # A crash mid-write left a truncated last line; end it so the next record starts cleanly
+            self._file.write("\n")
+            self._file.flush()
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_checkpoint(checkpoint_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the records of a JSONL checkpoint one at a time, in the order they were
+    written. A truncated last line (from a crash mid-write) is skipped with a warning.
+
+    Args:
+        checkpoint_path: Path to the checkpoint file.
+    """
+    if not os.path.exists(checkpoint_path):
+        return
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping corrupt checkpoint line {line_num} in {checkpoint_path}")
+
+
+def read_checkpoint(checkpoint_path: str) -> List[Dict[str, Any]]:
+    """
+    Reads all records from a JSONL checkpoint (see iter_checkpoint).
+
+    Args:
+        checkpoint_path: Path to the checkpoint file.
+
+    Returns:
+        The list of records in the order they were written.
+    """
+    return list(iter_checkpoint(checkpoint_path))
+
+
+def completed_fingerprints(records: Iterable[Dict[str, Any]]) -> set:
+    """Returns the fingerprints of files whose latest checkpoint record is a success."""
+    latest = {} # path -> (size, mtime_ns, succeeded); the analyses themselves are not kept
+    for record in records:
+        latest[record.get("path")] = (record.get("size"), record.get("mtime_ns"),
+                                      record.get("result", {}).get("status") == "success")
+    return {(path, size, mtime_ns) for path, (size, mtime_ns, succeeded) in latest.items() if succeeded}
+
+
+def iter_latest_records(checkpoint_path: str, order: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the latest checkpoint record of every file, without holding the records in
+    memory: a first pass notes where each file's latest record starts, a second one
+    reads just those lines.
+
+    Args:
+        checkpoint_path: Path to the checkpoint file.
+        order: Optional list of relative paths giving the output order.
+               Files not in the list follow in checkpoint order.
+    """
+    if not os.path.exists(checkpoint_path):
+        return
+    offsets: Dict[str, int] = {} # relative path -> offset of its latest record
+    with open(checkpoint_path, 'rb') as f:
+        offset = 0
+        for line_num, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    offsets[json.loads(line)["file"]] = offset
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                    logging.warning(f"Skipping corrupt checkpoint line {line_num} in {checkpoint_path}")
+            offset += len(line)
+
+        def _read_at(position: int) -> Dict[str, Any]:
+            f.seek(position)
+            return json.loads(f.readline())
+
+        for key in order or []:
+            if key in offsets:
+                yield _read_at(offsets.pop(key))
+        for position in list(offsets.values()):
+            yield _read_at(position)
+
+
+def compact_checkpoint(checkpoint_path: str, order: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Collapses the checkpoint into the results.json layout
+    ({relative_path: {"status": ..., "analysis"|"message": ...}}).
+    The latest record for each file wins. For large checkpoints prefer
+    iter_latest_records() (or results_sink.export_results), which streams.
+
+    Args:
+        checkpoint_path: Path to the checkpoint file.
+        order: Optional list of relative paths giving the output order.
+               Files not in the list follow in checkpoint order.
+
+    Returns:
+        The compacted results dictionary.
+    """
+    return {record["file"]: record["result"] for record in iter_latest_records(checkpoint_path, order=order)}
+
+
+# --- Batch Runner ---
+def make_record(file_path: str, fingerprint: Tuple[str, int, int], analysis_result_str: str, base_dir: str,
+                on_success: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
+    """
+    Builds the checkpoint record for one analyzed file, logging the outcome and
+    running on_success for successful analyses.
+
+    Args:
+        file_path: Absolute path of the analyzed file.
+        fingerprint: The file's fingerprint when it was picked up (see file_fingerprint).
+        analysis_result_str: The analysis string, or an "Error: ..." string.
+        base_dir: Directory that the record's "file" key is made relative to.
+        on_success: Optional callback(relative_path, analysis) for successful analyses.
+
+    Returns:
+        The record ({"file", "path", "size", "mtime_ns", "result"}).
+    """
+    relative_file_path = os.path.relpath(file_path, base_dir)
+    if analysis_result_str.startswith("Error:"):
+        result = {"status": "error", "message": analysis_result_str}
+        logging.error(f"Analysis failed for {relative_file_path}: {analysis_result_str}")
+    else:
+        result = {"status": "success", "analysis": analysis_result_str}
+        logging.info(f"Analysis successful for {relative_file_path}.")
+        if on_success:
+            try:
+                on_success(relative_file_path, analysis_result_str)
+            except Exception as e:
+                logging.error(f"on_success callback failed for {relative_file_path}: {e}", exc_info=True)
+
+    path, size, mtime_ns = fingerprint
+    return {"file": relative_file_path, "path": path, "size": size, "mtime_ns": mtime_ns, "result": result}
+
+
+def run_batch(
+    input_files: List[str],
+    analyze_fn: Callable[[str], str],
+    checkpoint_path: str,
+    base_dir: str,
+    max_workers: int = 8,
+    resume: bool = True,
+    on_success: Optional[Callable[[str, str], None]] = None,
+    plan_packs_fn: Optional[Callable[[List[str]], List[List[str]]]] = None,
+    analyze_pack_fn: Optional[Callable[[List[str]], Dict[str, str]]] = None,
+) -> Dict[str, int]:
+    """
+    Analyzes input_files on a bounded worker pool, checkpointing each result as
+    it completes. The results themselves stay in the checkpoint: read them with
+    compact_checkpoint(), iter_latest_records() or results_sink.export_results().
+
+    Args:
+        input_files: Absolute paths of the files to analyze.
+        analyze_fn: Callable taking a file path and returning the analysis string
+                    (or an "Error: ..." string).
+        checkpoint_path: Path of the JSONL checkpoint file.
+        base_dir: Directory that result keys are made relative to.
+        max_workers: Maximum number of files analyzed concurrently.
+        resume: If True, files with a successful checkpoint record and an
+                unchanged path/size/mtime are skipped. If False, the checkpoint
+                is truncated first.
+        on_success: Optional callback(relative_path, analysis) run for each
+                    successful analysis.
+        plan_packs_fn: Optional callable grouping the files to analyze into packs
+                       (see packing.plan_packs). Requires analyze_pack_fn.
+        analyze_pack_fn: Callable taking a pack of file paths and returning
+                         {file_path: analysis string}; used for packs of more than one file.
+
+    Returns:
+        The counts {"found", "skipped", "succeeded", "failed"} of this run.
+    """
+    if not resume and os.path.exists(checkpoint_path):
+        logging.info(f"Resume disabled, discarding checkpoint: {checkpoint_path}")
+        os.remove(checkpoint_path)
+
+    done = completed_fingerprints(iter_checkpoint(checkpoint_path)) if resume else set()
+
+    todo = []
+    for file_path in input_files:
+        try:
+            fingerprint = file_fingerprint(file_path)
+        except OSError as e:
+            logging.error(f"Could not stat {file_path}, skipping: {e}")
+            continue
+        if fingerprint in done:
+            logging.debug(f"Already analyzed (checkpoint hit): {file_path}")
+            continue
+        todo.append((file_path, fingerprint))
+
+    logging.info(f"Batch: {len(input_files)} files found, {len(input_files) - len(todo)} already done, "
+                 f"{len(todo)} to analyze with {max_workers} workers.")
+
+    def _process(file_path: str, fingerprint: Tuple[str, int, int]) -> Dict[str, Any]:
+        relative_file_path = os.path.relpath(file_path, base_dir)
+        logging.info(f"--- Processing file: {relative_file_path} ---")
+        try:
+            analysis_result_str = analyze_fn(file_path)
+        except Exception as e:
+            logging.error(f"Unexpected error analyzing {relative_file_path}: {e}", exc_info=True)
+            analysis_result_str = f"Error: Unexpected error during batch analysis: {e}"
+        return _record(file_path, fingerprint, analysis_result_str)
+
+    def _process_pack(items: List[Tuple[str, Tuple[str, int, int]]]) -> List[Dict[str, Any]]:
+        if len(items) == 1:
+            return [_process(*items[0])]
+        paths = [file_path for file_path, _ in items]
+        logging.info(f"--- Processing pack of {len(items)} files: "
+                     f"{', '.join(os.path.relpath(p, base_dir) for p in paths)} ---")
+        try:
+            analyses = analyze_pack_fn(paths)
+        except Exception as e:
+            logging.error(f"Unexpected error analyzing pack of {len(items)} files: {e}", exc_info=True)
+            analyses = {}
+        return [
+            _record(file_path, fingerprint,
+                    analyses.get(file_path, "Error: Unexpected error during batch analysis: missing from pack result."))
+            for file_path, fingerprint in items
+        ]
+
+    def _record(file_path: str, fingerprint: Tuple[str, int, int], analysis_result_str: str) -> Dict[str, Any]:
+        return make_record(file_path, fingerprint, analysis_result_str, base_dir, on_success)
+
+    if plan_packs_fn and analyze_pack_fn:
+        fingerprints = dict(todo)
+        packs = [[(file_path, fingerprints[file_path]) for file_path in pack]
+                 for pack in plan_packs_fn([file_path for file_path, _ in todo])]
+        logging.info(f"Batch: {len(todo)} files packed into {len(packs)} requests.")
+    else:
+        packs = [[item] for item in todo]
+
+    completed = succeeded = 0
+    with CheckpointWriter(checkpoint_path) as checkpoint:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(_process_pack, pack) for pack in packs]
+            for future in as_completed(futures):
+                for record in future.result():
+                    checkpoint.write(record)
+                    completed += 1
+                    succeeded += record["result"]["status"] == "success"
+                    logging.info(f"Finished processing {record['file']} ({completed}/{len(todo)}).")
+
+    return {"found": len(input_files), "skipped": len(input_files) - len(todo),
+            "succeeded": succeeded, "failed": completed - succeeded}
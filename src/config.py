@@ -1,5 +1,6 @@
 # src/config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 import logging
 
@@ -33,39 +34,216 @@ BASE_MODEL_ID = "gemini-2.0-flash-lite-001"
 # IMPORTANT: Replace YOUR_PROJECT_NUMBER with your actual Google Cloud project number (e.g., 123456789012)
 TUNED_MODEL_ID = "projects/248124319532/locations/europe-west4/endpoints/6177691842566422528"
 
+# "vertex" calls Vertex AI; "fake" answers locally with simulated latency (src/fake_backend.py),
+# for load tests and frontend work without GCP credentials.
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "vertex").lower()
+FAKE_MODEL_LATENCY_MS = float(os.getenv("FAKE_MODEL_LATENCY_MS", "800")) # Mean time to first token
+FAKE_MODEL_TOKENS_PER_SECOND = float(os.getenv("FAKE_MODEL_TOKENS_PER_SECOND", "150")) # Output rate (0 = instant)
+FAKE_MODEL_ERROR_RATE = float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")) # Fraction of calls failing with 429/503
+FAKE_MODEL_SLOW_RATE = float(os.getenv("FAKE_MODEL_SLOW_RATE", "0")) # Fraction of calls 10x slower than usual
+
+# --- Model Call Resilience (src/resilience.py) ---
+# Retries on 429/5xx/connection errors, with exponential backoff and full jitter
+MODEL_CALL_MAX_ATTEMPTS = int(os.getenv("MODEL_CALL_MAX_ATTEMPTS", "4")) # 1 = no retries
+MODEL_CALL_BACKOFF_BASE_MS = float(os.getenv("MODEL_CALL_BACKOFF_BASE_MS", "500"))
+MODEL_CALL_BACKOFF_MAX_MS = float(os.getenv("MODEL_CALL_BACKOFF_MAX_MS", "20000"))
+# Per-model token bucket (0 = unlimited). Callers wait up to MODEL_RATE_LIMIT_MAX_WAIT_SECONDS for a token.
+MODEL_RATE_LIMIT_PER_MINUTE = float(os.getenv("MODEL_RATE_LIMIT_PER_MINUTE", "0"))
+MODEL_RATE_LIMIT_BURST = int(os.getenv("MODEL_RATE_LIMIT_BURST", "5"))
+MODEL_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("MODEL_RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+# Hedged requests: send a duplicate call once the first exceeds the observed latency percentile
+MODEL_HEDGE_ENABLED = os.getenv("MODEL_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "95"))
+MODEL_HEDGE_MIN_DELAY_MS = float(os.getenv("MODEL_HEDGE_MIN_DELAY_MS", "2000")) # Never hedge earlier than this
+MODEL_HEDGE_MAX_WORKERS = int(os.getenv("MODEL_HEDGE_MAX_WORKERS", "16")) # Threads running hedged calls
+# Fail fast after this many consecutive failures (0 = disabled), probing again after the reset timeout
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+
+# --- Model Routing (src/model_router.py) ---
+# Opt-in: default requests go to TUNED_MODEL_ID while it is healthy and to BASE_MODEL_ID while its
+# rolling error rate or p95 latency is over the limits below (e.g. during an endpoint cold start).
+# Results name the model that answered ("model" in /api/analyze and /api/jobs results).
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "false").lower() in ("1", "true", "yes")
+MODEL_ROUTING_LATENCY_SLO_MS = float(os.getenv("MODEL_ROUTING_LATENCY_SLO_MS", "20000")) # p95 of the tuned endpoint
+MODEL_ROUTING_ERROR_RATE_THRESHOLD = float(os.getenv("MODEL_ROUTING_ERROR_RATE_THRESHOLD", "0.2"))
+MODEL_ROUTING_MIN_SAMPLES = int(os.getenv("MODEL_ROUTING_MIN_SAMPLES", "10")) # Calls in the window before judging
+MODEL_ROUTING_WINDOW_SECONDS = float(os.getenv("MODEL_ROUTING_WINDOW_SECONDS", "300"))
+MODEL_ROUTING_PROBE_FRACTION = float(os.getenv("MODEL_ROUTING_PROBE_FRACTION", "0.05")) # Still sent to an unhealthy tuned endpoint
+# Opt-in: resend a request to the base model when the tuned endpoint fails to load or answer (after retries)
+MODEL_FALLBACK_ENABLED = os.getenv("MODEL_FALLBACK_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# --- Context Caching (src/context_cache.py) ---
+# Stores the system instructions once per model as cached content instead of sending them
+# with every request. Vertex AI only caches content above a minimum size, which the default
+# instructions are far below: this only pays off with larger static context. Smaller
+# instructions, and models that cannot get a cache, keep sending them inline.
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_RENEW_BEFORE_SECONDS = float(os.getenv("CONTEXT_CACHE_RENEW_BEFORE_SECONDS", "300")) # Renew when expiring sooner
+CONTEXT_CACHE_RETRY_SECONDS = float(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "600")) # Wait after a failed create
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096")) # Service minimum; smaller instructions are not cached
+
 # --- Input/Output Configuration ---
 # Define relative paths for input and output directories based on this file's location
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Project root directory
 INPUT_DIR = os.path.join(BASE_DIR, "inputs")
 OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
 OUTPUT_FILENAME = "results.json" # Name for the output JSON file
+# Result files written after each batch run (src/results_sink.py), comma-separated:
+# json (OUTPUT_FILENAME), jsonl, parquet, arrow (both need pyarrow), sqlite (results.<ext> in OUTPUT_DIR)
+RESULTS_FORMATS = [f.strip().lower() for f in os.getenv("RESULTS_FORMATS", "json").split(",") if f.strip()]
+# Searchable store of parsed analyses (src/results_store.py, GET /api/results/search), filled by batch and watch runs
+RESULTS_STORE_ENABLED = os.getenv("RESULTS_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULTS_STORE_PATH = os.getenv("RESULTS_STORE_PATH", os.path.join(OUTPUT_DIR, "results_store.sqlite3"))
+RESULTS_SEARCH_MAX_LIMIT = int(os.getenv("RESULTS_SEARCH_MAX_LIMIT", "100")) # Most results per search request
+RESULTS_SEARCH_RANK_MAX_MATCHES = int(os.getenv("RESULTS_SEARCH_RANK_MAX_MATCHES", "20000")) # Broader searches: newest first, not by relevance
+
+# --- Concurrency Configuration ---
+# Maximum number of files analyzed in parallel for a single /api/analyze request.
+# Set to 1 to restore the old one-file-at-a-time behaviour.
+API_MAX_CONCURRENT_ANALYSES = int(os.getenv("API_MAX_CONCURRENT_ANALYSES", "4"))
+# Uploads up to this size are analyzed straight from memory; larger ones are written to a
+# temporary file first. On Cloud Run /tmp is in-memory too, so this mainly bounds heap use.
+UPLOAD_SPILL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPILL_THRESHOLD_BYTES", str(16 * 1024 * 1024)))
+
+# --- Batch Configuration (python -m src.main) ---
+# Number of files analyzed in parallel by the batch pipeline.
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+# Append-only JSONL checkpoint written as each file completes (lives in OUTPUT_DIR).
+BATCH_CHECKPOINT_FILENAME = "results.checkpoint.jsonl"
+# Prompt used for batch runs, where there is no user typing one in.
+BATCH_DEFAULT_PROMPT = os.getenv(
+    "BATCH_DEFAULT_PROMPT",
+    "Analyze this document and extract the key information with its location."
+)
+
+# --- Incremental Input Scanning (src/file_index.py) ---
+# With the file index, a batch run only analyzes files that are new or changed (by content
+# hash) since their last successful analysis, instead of every file under INPUT_DIR.
+FILE_INDEX_ENABLED = os.getenv("FILE_INDEX_ENABLED", "false").lower() in ("1", "true", "yes") # Or: python -m src.main --incremental
+FILE_INDEX_DB_PATH = os.getenv("FILE_INDEX_DB_PATH", os.path.join(OUTPUT_DIR, "file_index.sqlite3"))
+FILE_WATCH_POLL_SECONDS = float(os.getenv("FILE_WATCH_POLL_SECONDS", "30")) # Rescan interval when inotify is unavailable
+
+# --- Watch Mode (python -m src.main --watch, src/watch_daemon.py) ---
+# Runs until SIGINT/SIGTERM, analyzing files as they appear in INPUT_DIR (uses the file index above).
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2")) # A file must stop changing this long before it is analyzed
+WATCH_MAX_QUEUED = int(os.getenv("WATCH_MAX_QUEUED", "16")) # Files waiting for a worker (workers: BATCH_MAX_WORKERS)
+WATCH_EXPORT_INTERVAL_SECONDS = float(os.getenv("WATCH_EXPORT_INTERVAL_SECONDS", "300")) # Rewrite the result files this often (0 = at shutdown only)
+
+# --- Request Packing Configuration (src/packing.py) ---
+# Sends several small text/image files with the same prompt in one model request
+# (prompt and system instructions are sent once per pack). Markdown output only.
+PACKING_ENABLED = os.getenv("PACKING_ENABLED", "false").lower() in ("1", "true", "yes")
+PACK_MAX_DOCUMENTS = int(os.getenv("PACK_MAX_DOCUMENTS", "6")) # Files per request
+PACK_MAX_TOKENS = int(os.getenv("PACK_MAX_TOKENS", "24000")) # Estimated input tokens per request
+PACK_MAX_BYTES = int(os.getenv("PACK_MAX_BYTES", str(8 * 1024 * 1024))) # Upload size per request
+PACK_MAX_FILE_BYTES = int(os.getenv("PACK_MAX_FILE_BYTES", str(2 * 1024 * 1024))) # Larger files are sent alone
+PACK_MAX_OUTPUT_TOKENS = int(os.getenv("PACK_MAX_OUTPUT_TOKENS", "8192")) # Output budget shared by the pack
+
+# --- Asynchronous Job Configuration (/api/jobs) ---
+# "sqlite" shares jobs between all worker processes on a host and survives restarts; "memory" is per-process.
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "sqlite").lower()
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(OUTPUT_DIR, "jobs.sqlite3"))
+JOBS_UPLOAD_DIR = os.getenv("JOBS_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "clu_jobs")) # Uploads wait here until analyzed
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2")) # Background analysis threads per process
+
+# --- PDF Rendering Configuration ---
+PDF_MAX_PAGES_TO_SEND = int(os.getenv("PDF_MAX_PAGES_TO_SEND", "1")) # Pages rendered and sent per PDF
+PDF_RENDER_ZOOM = float(os.getenv("PDF_RENDER_ZOOM", "2")) # Zoom factor (ignored if PDF_RENDER_DPI is set)
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "0")) or None # e.g. 150; 0 means use PDF_RENDER_ZOOM
+PDF_IMAGE_FORMAT = os.getenv("PDF_IMAGE_FORMAT", "png").lower() # png, jpeg or webp
+PDF_IMAGE_QUALITY = int(os.getenv("PDF_IMAGE_QUALITY", "85")) # JPEG/WebP quality (1-100)
+PDF_RENDER_PROCESSES = int(os.getenv("PDF_RENDER_PROCESSES", "0")) # >1 renders multi-page PDFs in a process pool
+# Opt-in text-layer fast path: "off" always rasterizes (the tuned model was trained on page images),
+# "auto" sends extracted text for text-only pages, "mixed" also sends text + image for pages with
+# both text and figures.
+PDF_TEXT_LAYER_MODE = os.getenv("PDF_TEXT_LAYER_MODE", "off").lower()
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "200")) # Minimum extracted characters to trust a page's text layer
+
+# --- Long PDF Configuration ---
+# PDFs with more than PDF_CHUNK_PAGES pages are split into page groups that are analyzed
+# concurrently and merged into one analysis (src/long_document.py). When disabled, only the
+# first PDF_MAX_PAGES_TO_SEND pages of a PDF are analyzed.
+PDF_LONG_DOCUMENT_ENABLED = os.getenv("PDF_LONG_DOCUMENT_ENABLED", "false").lower() in ("1", "true", "yes")
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", "4")) # Pages per chunk request
+PDF_CHUNK_CONCURRENCY = int(os.getenv("PDF_CHUNK_CONCURRENCY", "4")) # Chunks analyzed (and held in memory) at once
+PDF_LONG_DOCUMENT_MAX_PAGES = int(os.getenv("PDF_LONG_DOCUMENT_MAX_PAGES", "200")) # Pages analyzed per PDF (0 = no limit)
+PDF_REDUCE_MODE = os.getenv("PDF_REDUCE_MODE", "local").lower() # "local" merges chunk results, "model" adds a summarizing call
+
+# --- Image Preprocessing Configuration ---
+# Opt-in: uploaded images are auto-rotated, stripped of metadata, downscaled and re-encoded before
+# upload (PNG losslessly). Images that need no change and would not shrink are sent as they are.
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "false").lower() in ("1", "true", "yes")
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048")) # Longest side in pixels (0 = no limit)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "4000000")) # Total pixel budget (0 = no limit)
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "webp").lower() # webp, jpeg or png
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "85")) # Lossy JPEG/WebP quality (1-100)
+
+# --- Response Cache Configuration ---
+# Opt-in persistent cache of model responses keyed by file content, prompt, model and settings.
+# Cached answers are served for up to RESPONSE_CACHE_TTL_SECONDS.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(OUTPUT_DIR, "response_cache.sqlite3"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))) # 7 days
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))) # 256MB
+
+# --- Structured Output Configuration ---
+# Ask the model for JSON matching structured_output.ANALYSIS_RESPONSE_SCHEMA instead of Markdown.
+# Used by batch runs and as the /api/analyze default when the request has no output_format field.
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# --- Telemetry Configuration ---
+# Per-stage timing spans around analysis and request handling (src/telemetry.py).
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() in ("1", "true", "yes")
+# Comma-separated: "histogram" (served at /metrics), "log" (one JSON log line per span), "otel" (OpenTelemetry API)
+TELEMETRY_SINKS = [s.strip().lower() for s in os.getenv("TELEMETRY_SINKS", "histogram").split(",") if s.strip()]
+
+# --- Logging Configuration ---
+# Records are queued and written by a background thread (src/logging_config.py).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line, parsed by Cloud Logging) or "text". Defaults to json on Cloud Run.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json" if os.getenv("K_SERVICE") else "text").lower()
+# Fraction of requests (0-1) whose per-request debug channel output is logged
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0"))
 
 # --- Validation ---
-# Check if essential configuration variables are set
-if not GCP_PROJECT_ID:
-    logging.error("FATAL ERROR: GCP_PROJECT_ID environment variable not set.")
-    raise ValueError("GCP_PROJECT_ID must be set in the .env file or environment variables.")
-
-if not GCP_REGION:
-    logging.error("FATAL ERROR: GCP_REGION environment variable not set.")
-    raise ValueError("GCP_REGION must be set in the .env file or environment variables.")
-
-# Check if the placeholder in TUNED_MODEL_ID has been replaced
-if "YOUR_PROJECT_NUMBER" in TUNED_MODEL_ID:
-     logging.warning("WARNING: TUNED_MODEL_ID in config.py still contains 'YOUR_PROJECT_NUMBER'. Please replace it with your actual project number.")
-     # Optionally, you could raise an error here if you want to force the user to change it:
-     # raise ValueError("TUNED_MODEL_ID must be updated with your actual project number.")
-
-# Log the loaded configuration (optional, good for debugging)
-logging.info(f"GCP Project ID: {GCP_PROJECT_ID}")
-logging.info(f"GCP Region: {GCP_REGION}")
-logging.info(f"Base Model ID: {BASE_MODEL_ID}")
-logging.info(f"Tuned Model ID: {TUNED_MODEL_ID}")
-logging.info(f"Input Directory: {INPUT_DIR}")
-logging.info(f"Output Directory: {OUTPUT_DIR}")
-
-# Create output directory if it doesn't exist
-if not os.path.exists(OUTPUT_DIR):
-    logging.info(f"Creating output directory: {OUTPUT_DIR}")
-    os.makedirs(OUTPUT_DIR)
+_validated = False
+
+def validate():
+    """
+    Checks that the essential configuration variables are set and logs the
+    loaded configuration. Called lazily (by initialize_vertex_ai and the batch
+    entry point) rather than at import time, so importing config stays cheap.
+
+    Raises:
+        ValueError: If GCP_PROJECT_ID or GCP_REGION is missing.
+    """
+    global _validated
+    if _validated:
+        return
+
+    # Check if essential configuration variables are set
+    if not GCP_PROJECT_ID:
+        logging.error("FATAL ERROR: GCP_PROJECT_ID environment variable not set.")
+        raise ValueError("GCP_PROJECT_ID must be set in the .env file or environment variables.")
+
+    if not GCP_REGION:
+        logging.error("FATAL ERROR: GCP_REGION environment variable not set.")
+        raise ValueError("GCP_REGION must be set in the .env file or environment variables.")
+
+    # Check if the placeholder in TUNED_MODEL_ID has been replaced
+    if "YOUR_PROJECT_NUMBER" in TUNED_MODEL_ID:
+         logging.warning("WARNING: TUNED_MODEL_ID in config.py still contains 'YOUR_PROJECT_NUMBER'. Please replace it with your actual project number.")
+
+    # Log the loaded configuration (optional, good for debugging)
+    logging.info(f"GCP Project ID: {GCP_PROJECT_ID}")
+    logging.info(f"GCP Region: {GCP_REGION}")
+    logging.info(f"Base Model ID: {BASE_MODEL_ID}")
+    logging.info(f"Tuned Model ID: {TUNED_MODEL_ID}")
+    logging.info(f"Input Directory: {INPUT_DIR}")
+    logging.info(f"Output Directory: {OUTPUT_DIR}")
+    _validated = True
 
+# Note: OUTPUT_DIR is created on demand by the code that writes into it
+# (results saving, checkpoints, caches), not at import time.
@@ -0,0 +1,239 @@
+# src/context_cache.py
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Import project modules
+try:
+    from . import config
+except ImportError:
+    try:
+        import config
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Context caching for the static system instructions. Instead of sending (and paying
+# for) the same instructions as input tokens on every call, they are stored once per
+# model as a Vertex AI CachedContent and requests go to a model bound to that cache,
+# so the user prompt and the document are the only per-call payload.
+#
+# Caches are keyed by model and a hash of the instruction text. Changed instructions
+# therefore get a new cache; the old one is no longer renewed and expires on its own.
+# A cache is renewed when it gets close to its expiry time. If a cache cannot be
+# created (unsupported model, quota), that model is sent inline instructions until
+# CONTEXT_CACHE_RETRY_SECONDS have passed.
+#
+# Vertex AI only caches content above a minimum size (CONTEXT_CACHE_MIN_TOKENS; a few
+# thousand tokens depending on the model). The default analysis instructions are far
+# smaller, so caching only pays off with larger static context such as long custom
+# instructions; smaller instructions are sent inline without trying to create a cache.
+
+DISPLAY_NAME_PREFIX = "clu-instructions"
+_CHARS_PER_TOKEN = 4 # Rough average for English text
+
+
+def instructions_hash(system_instructions: str) -> str:
+    """Short, stable hash of the instruction text (part of the cache key and display name)."""
+    return hashlib.sha256(system_instructions.encode("utf-8")).hexdigest()[:16]
+
+
+def display_name_for(model_name: str, system_instructions: str) -> str:
+    """Display name of the cache for model_name and these instructions (shared by all processes)."""
+    model_id = model_name.rstrip("/").rsplit("/", 1)[-1]
+    return f"{DISPLAY_NAME_PREFIX}-{model_id}-{instructions_hash(system_instructions)}"
+
+
+class VertexCacheService:
+    """Creates, renews and binds Vertex AI CachedContent resources (vertexai.preview.caching)."""
+
+    def __init__(self):
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel
+        self._caching = caching
+        self._model_class = GenerativeModel
+
+    def find(self, display_name: str) -> Optional[Any]:
+        """Returns an unexpired cache with this display name (e.g. created by another worker), or None."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for cached in self._caching.CachedContent.list():
+            if cached.display_name == display_name and cached.expire_time > now:
+                return cached
+        return None
+
+    def create(self, model_name: str, system_instructions: str, ttl_s: float, display_name: str) -> Any:
+        return self._caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instructions,
+            ttl=datetime.timedelta(seconds=ttl_s),
+            display_name=display_name,
+        )
+
+    def renew(self, handle: Any, ttl_s: float) -> Any:
+        handle.update(ttl=datetime.timedelta(seconds=ttl_s))
+        handle.refresh()
+        return handle
+
+    def delete(self, handle: Any):
+        handle.delete()
+
+    def expire_time(self, handle: Any) -> float:
+        """Expiry of the cache as a Unix timestamp."""
+        return handle.expire_time.timestamp()
+
+    def bind(self, handle: Any) -> Any:
+        """Returns a model whose requests use the cached instructions."""
+        return self._model_class.from_cached_content(cached_content=handle)
+
+
+class _CacheEntry(NamedTuple):
+    handle: Any
+    model: Any # Model bound to the cache
+    expires_at: float # Unix timestamp
+
+
+class ContextCacheManager:
+    """
+    Keeps one cached-content handle per (model, instruction text) for this process.
+
+    Args:
+        service: Backend creating the caches (VertexCacheService, or a stand-in with the
+                 same find/create/renew/delete/expire_time/bind methods).
+        ttl_s: Lifetime given to a cache when it is created or renewed.
+        renew_before_s: A cache expiring sooner than this is renewed before it is used.
+        retry_after_failure_s: How long a model that failed to get a cache is sent inline
+                               instructions before creation is tried again.
+        min_tokens: Estimated size below which instructions are never cached (the
+                    service's minimum cached-content size; 0 = no minimum).
+        clock: Returns the current Unix time (replaceable for testing).
+    """
+
+    def __init__(self, service: Any, ttl_s: float = 3600, renew_before_s: float = 300,
+                 retry_after_failure_s: float = 600, min_tokens: int = 0, clock: Callable[[], float] = time.time):
+        self.service = service
+        self.ttl_s = ttl_s
+        self.renew_before_s = min(renew_before_s, ttl_s / 2)
+        self.retry_after_failure_s = retry_after_failure_s
+        self.min_tokens = min_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        self._failed_until: Dict[Tuple[str, str], float] = {}
+        self._too_small = set() # Keys whose instructions are below min_tokens
+        self.counters = {"hits": 0, "created": 0, "reused": 0, "renewed": 0, "invalidated": 0, "failures": 0}
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def get_model(self, model_name: str, system_instructions: str) -> Optional[Any]:
+        """
+        Returns a model bound to a cache holding system_instructions, creating or renewing
+        the cache as needed.
+
+        Args:
+            model_name: Model the request is sent to.
+            system_instructions: Instruction text to cache.
+
+        Returns:
+            The bound model, or None if the instructions have to be sent inline.
+        """
+        key = (model_name, instructions_hash(system_instructions))
+        if self.min_tokens and len(system_instructions) // _CHARS_PER_TOKEN < self.min_tokens:
+            with self._lock:
+                first_time = key not in self._too_small
+                self._too_small.add(key)
+            if first_time:
+                logging.warning(f"Context caching skipped for model '{model_name}': the instructions are about "
+                                f"{len(system_instructions) // _CHARS_PER_TOKEN} tokens, below the minimum cache size "
+                                f"of {self.min_tokens} (CONTEXT_CACHE_MIN_TOKENS). Sending them inline.")
+            return None
+        with self._lock:
+            if self._failed_until.get(key, 0) > self._clock():
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One thread per key creates or renews; the others wait and reuse its result
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            now = self._clock()
+            if entry is not None and entry.expires_at - now > self.renew_before_s:
+                self._count("hits")
+                return entry.model
+            try:
+                if entry is not None and entry.expires_at > now:
+                    handle = self.service.renew(entry.handle, self.ttl_s)
+                    self._count("renewed")
+                    logging.info(f"Renewed context cache for model '{model_name}'.")
+                else:
+                    handle = self._find_or_create(model_name, system_instructions)
+                entry = _CacheEntry(handle, self.service.bind(handle), self.service.expire_time(handle))
+            except Exception as e:
+                self._count("failures")
+                logging.warning(f"Context cache unavailable for model '{model_name}', sending instructions inline "
+                                f"for the next {self.retry_after_failure_s:.0f}s: {e}")
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._failed_until[key] = self._clock() + self.retry_after_failure_s
+                return None
+            with self._lock:
+                self._entries[key] = entry
+            return entry.model
+
+    def _find_or_create(self, model_name: str, system_instructions: str) -> Any:
+        display_name = display_name_for(model_name, system_instructions)
+        handle = self.service.find(display_name)
+        if handle is not None and self.service.expire_time(handle) - self._clock() > self.renew_before_s:
+            self._count("reused")
+            logging.info(f"Reusing context cache '{display_name}' for model '{model_name}'.")
+            return handle
+        handle = self.service.create(model_name, system_instructions, self.ttl_s, display_name)
+        self._count("created")
+        logging.info(f"Created context cache '{display_name}' for model '{model_name}' (TTL {self.ttl_s:.0f}s).")
+        return handle
+
+    def invalidate(self, model_name: str, system_instructions: Optional[str] = None, delete: bool = False):
+        """
+        Forgets the cache(s) of model_name (only the one for system_instructions if given),
+        e.g. after the service reported it missing. The next request creates a new one.
+
+        Args:
+            model_name: Model whose caches are dropped.
+            system_instructions: Optional instruction text selecting a single cache.
+            delete: Also delete the cache resources (best effort).
+        """
+        wanted = instructions_hash(system_instructions) if system_instructions is not None else None
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == model_name and wanted in (None, k[1])]
+            entries = [self._entries.pop(k) for k in keys]
+            self.counters["invalidated"] += len(entries)
+        for entry in entries:
+            logging.info(f"Invalidated context cache for model '{model_name}'.")
+            if delete:
+                try:
+                    self.service.delete(entry.handle)
+                except Exception as e:
+                    logging.warning(f"Could not delete context cache for model '{model_name}': {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, active=len(self._entries), too_small=len(self._too_small))
+
+
+def manager_from_config(service: Any) -> ContextCacheManager:
+    """Builds a manager with the CONTEXT_CACHE_* settings."""
+    return ContextCacheManager(
+        service,
+        ttl_s=getattr(config, 'CONTEXT_CACHE_TTL_SECONDS', 3600),
+        renew_before_s=getattr(config, 'CONTEXT_CACHE_RENEW_BEFORE_SECONDS', 300),
+        retry_after_failure_s=getattr(config, 'CONTEXT_CACHE_RETRY_SECONDS', 600),
+        min_tokens=getattr(config, 'CONTEXT_CACHE_MIN_TOKENS', 0),
+    )
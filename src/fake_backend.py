@@ -0,0 +1,346 @@
+# src/fake_backend.py
+import json
+import math
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+# Import project modules
+try:
+    from . import packing
+except ImportError:
+    try:
+        import packing
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        packing = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Stand-in for a Vertex AI GenerativeModel, for benchmarks and local development without
+# GCP credentials. Select it with MODEL_BACKEND=fake or vllm_handler.set_model_factory().
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+_CHARS_PER_TOKEN = 4 # Rough average for English text
+
+
+def request_payload_bytes(contents: List[Any]) -> int:
+    """
+    Returns the serialized size of the request parts, i.e. the bytes that would be
+    uploaded to the model (excluding transport framing).
+
+    Args:
+        contents: The list of vertexai Part objects passed to generate_content.
+    """
+    total = 0
+    for part in contents:
+        raw = getattr(part, "_raw_part", None)
+        if raw is not None:
+            total += len(type(raw).serialize(raw))
+        elif isinstance(part, (str, bytes)):
+            total += len(part.encode("utf-8") if isinstance(part, str) else part)
+    return total
+
+
+def request_text_parts(contents: List[Any]) -> List[str]:
+    """Returns the text of the request's text parts (image/data parts are skipped)."""
+    texts = []
+    for part in contents:
+        raw = getattr(part, "_raw_part", None)
+        if raw is not None and getattr(raw, "text", ""):
+            texts.append(raw.text)
+        elif isinstance(part, str):
+            texts.append(part)
+    return texts
+
+
+class FakeAPIError(Exception):
+    """
+    Injected failure. Like google.api_core.exceptions.GoogleAPICallError it carries
+    the HTTP status in .code, so retry logic treats both the same way.
+    """
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+
+_FAULT_MESSAGES = {
+    429: "Resource exhausted (injected fault)",
+    500: "Internal error (injected fault)",
+    503: "Service unavailable (injected fault)",
+}
+
+
+class FakeResponse:
+    """Minimal GenerationResponse: the analysis code only reads .text on success."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates = []
+        self.prompt_feedback = None
+
+
+class FakeGenerativeModel:
+    """
+    Answers generate_content() after a simulated delay: a time-to-first-token
+    drawn from a latency distribution, then output tokens at tokens_per_second.
+    Responses follow the Markdown layout (or the JSON schema in structured mode), with
+    one delimited section per document for packed requests (see packing.py).
+
+    Args:
+        model_name: Name reported in logs and responses.
+        latency_ms: Mean time to first token.
+        latency_distribution: "fixed", "uniform" (latency_ms +/- jitter) or
+                              "lognormal" (mean latency_ms, sigma jitter).
+        jitter: Spread of the distribution (fraction of latency_ms for uniform, sigma for lognormal).
+        tokens_per_second: Output generation rate (0 = instant).
+        output_tokens: Mean number of output tokens per response.
+        seed: Seed for the random generator, for reproducible runs.
+        error_rate: Fraction of calls failing with one of error_codes (after the simulated latency).
+        error_codes: HTTP status codes used for injected failures.
+        slow_rate: Fraction of calls whose latency is multiplied by slow_factor (tail latency).
+        slow_factor: Latency multiplier for slow calls.
+        quota_per_second: Calls accepted per rolling second; more fail with 429 (0 = no quota).
+    """
+
+    def __init__(self, model_name: str = "fake-model", latency_ms: float = 800, latency_distribution: str = "lognormal",
+                 jitter: float = 0.25, tokens_per_second: float = 150, output_tokens: int = 300,
+                 seed: Optional[int] = None, error_rate: float = 0.0, error_codes: Tuple[int, ...] = (429, 503),
+                 slow_rate: float = 0.0, slow_factor: float = 10.0, quota_per_second: float = 0):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_distribution}'. Expected one of {LATENCY_DISTRIBUTIONS}.")
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self._fail_next: List[int] = [] # Status codes of the next calls to fail, in order
+        self._outage_code: Optional[int] = None
+        self.quota_per_second = quota_per_second
+        self._recent_calls = deque() # Monotonic times of accepted calls in the last second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.bytes_received = 0
+        self.faults = 0
+
+    def _sample_latency_s(self) -> float:
+        with self._lock:
+            if self.latency_distribution == "fixed":
+                latency_ms = self.latency_ms
+            elif self.latency_distribution == "uniform":
+                latency_ms = self._random.uniform(self.latency_ms * (1 - self.jitter), self.latency_ms * (1 + self.jitter))
+            else:
+                # mu chosen so the distribution's mean is latency_ms
+                mu = math.log(max(self.latency_ms, 1e-3)) - self.jitter ** 2 / 2
+                latency_ms = self._random.lognormvariate(mu, self.jitter)
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                latency_ms *= self.slow_factor
+        return max(latency_ms, 0) / 1000
+
+    # --- Fault Injection ---
+    def fail_next(self, count: int = 1, code: int = 503):
+        """Makes the next count calls fail with the given status code."""
+        with self._lock:
+            self._fail_next.extend([code] * count)
+
+    def set_outage(self, code: Optional[int] = 503):
+        """Fails every call with code until set_outage(None) is called."""
+        with self._lock:
+            self._outage_code = code
+
+    def _pick_fault(self) -> Optional[int]:
+        with self._lock:
+            if self._fail_next:
+                return self._fail_next.pop(0)
+            if self._outage_code is not None:
+                return self._outage_code
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice(self.error_codes)
+            if self.quota_per_second:
+                now = time.monotonic()
+                while self._recent_calls and now - self._recent_calls[0] >= 1.0:
+                    self._recent_calls.popleft()
+                if len(self._recent_calls) >= self.quota_per_second:
+                    return 429
+                self._recent_calls.append(now)
+            return None
+
+    def _sample_output_tokens(self) -> int:
+        with self._lock:
+            return max(1, int(self._random.uniform(0.5, 1.5) * self.output_tokens))
+
+    def _response_text(self, tokens: int, structured: bool) -> str:
+        bullets = max(1, tokens // 30)
+        if structured:
+            return json.dumps({
+                "document_type": "General Text",
+                "summary": f"Synthetic response from {self.model_name}.",
+                "key_info": [
+                    {"info": f"Synthetic key point {n}", "location": f"Paragraph {n + 1}", "confidence": "High"}
+                    for n in range(bullets)
+                ],
+                "category": "Other",
+            })
+        lines = [
+            "**Document Type:**", "General Text", "",
+            "**Summary:**", f"Synthetic response from {self.model_name}.", "",
+            "**Key Information & Localization:**",
+        ]
+        for n in range(bullets):
+            lines += [f"* Synthetic key point {n}", f"    * Location: Paragraph {n + 1}", "    * Confidence: High"]
+        lines += ["", "**Category:**", "Other"]
+        text = "\n".join(lines)
+        # Pad to roughly the sampled token count
+        return text + " " * max(0, tokens * _CHARS_PER_TOKEN - len(text))
+
+    def generate_content(self, contents, generation_config: Optional[Dict[str, Any]] = None,
+                         safety_settings=None, stream: bool = False, **kwargs):
+        payload_bytes = request_payload_bytes(contents)
+        with self._lock:
+            self.calls += 1
+            self.bytes_received += payload_bytes
+        structured = bool(generation_config and generation_config.get("response_schema"))
+        tokens = self._sample_output_tokens()
+        text = self._response_text(tokens, structured)
+        documents = packing.count_packed_documents(request_text_parts(contents)) if packing else 0
+        if documents and not structured: # Packed request: one delimited section per document
+            text = "\n\n".join(f"{packing.section_delimiter(n)}\n{self._response_text(tokens, False).rstrip()}"
+                                for n in range(1, documents + 1))
+            tokens *= documents
+        fault = self._pick_fault()
+        time.sleep(self._sample_latency_s())
+        if fault is not None:
+            with self._lock:
+                self.faults += 1
+            raise FakeAPIError(fault, _FAULT_MESSAGES.get(fault, "Injected fault"))
+        if stream:
+            return self._stream(text, tokens)
+        if self.tokens_per_second:
+            time.sleep(tokens / self.tokens_per_second)
+        return FakeResponse(text)
+
+    def _stream(self, text: str, tokens: int):
+        chunk_count = max(1, min(tokens // 20, 20))
+        chunk_size = -(-len(text) // chunk_count)
+        for start in range(0, len(text), chunk_size):
+            if self.tokens_per_second:
+                time.sleep(tokens / chunk_count / self.tokens_per_second)
+            yield FakeResponse(text[start:start + chunk_size])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "bytes_received": self.bytes_received, "faults": self.faults}
+
+
+
+# --- Context Caching Stand-in ---
+class FakeCachedContent:
+    """A cached-content resource held by FakeCacheService."""
+
+    def __init__(self, name: str, model_name: str, display_name: str, system_instruction: str, expire_time: float):
+        self.name = name
+        self.model_name = model_name
+        self.display_name = display_name
+        self.system_instruction = system_instruction
+        self.expire_time = expire_time # Unix timestamp
+
+
+class FakeCacheService:
+    """
+    In-process stand-in for the Vertex AI cached-content service, with the interface
+    context_cache.ContextCacheManager expects (find/create/renew/delete/expire_time/bind).
+
+    Args:
+        model_factory: Returns the model a cache is bound to, from its model name.
+        min_tokens: Instructions shorter than this (chars/4) are rejected with a 400,
+                    like the real service's minimum cache size (0 = no minimum).
+        clock: Returns the current Unix time.
+    """
+
+    def __init__(self, model_factory, min_tokens: int = 0, clock=time.time):
+        self.model_factory = model_factory
+        self.min_tokens = min_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._caches: Dict[str, FakeCachedContent] = {}
+        self._next_id = 0
+        self.calls = {"find": 0, "create": 0, "renew": 0, "delete": 0}
+
+    def _live(self, name: str) -> Optional[FakeCachedContent]:
+        cached = self._caches.get(name)
+        return cached if cached is not None and cached.expire_time > self._clock() else None
+
+    def find(self, display_name: str) -> Optional[FakeCachedContent]:
+        with self._lock:
+            self.calls["find"] += 1
+            return next((c for c in self._caches.values()
+                         if c.display_name == display_name and self._live(c.name)), None)
+
+    def create(self, model_name: str, system_instructions: str, ttl_s: float, display_name: str) -> FakeCachedContent:
+        with self._lock:
+            self.calls["create"] += 1
+            if self.min_tokens and len(system_instructions) // _CHARS_PER_TOKEN < self.min_tokens:
+                raise FakeAPIError(400, f"Cached content is too small (minimum {self.min_tokens} tokens)")
+            self._next_id += 1
+            cached = FakeCachedContent(f"cachedContents/{self._next_id}", model_name, display_name,
+                                       system_instructions, self._clock() + ttl_s)
+            self._caches[cached.name] = cached
+            return cached
+
+    def renew(self, handle: FakeCachedContent, ttl_s: float) -> FakeCachedContent:
+        with self._lock:
+            self.calls["renew"] += 1
+            if self._live(handle.name) is None:
+                raise FakeAPIError(404, f"Cached content {handle.name} not found")
+            handle.expire_time = self._clock() + ttl_s
+            return handle
+
+    def delete(self, handle: FakeCachedContent):
+        with self._lock:
+            self.calls["delete"] += 1
+            self._caches.pop(handle.name, None)
+
+    def expire_time(self, handle: FakeCachedContent) -> float:
+        return handle.expire_time
+
+    def bind(self, handle: FakeCachedContent) -> "FakeCachedModel":
+        return FakeCachedModel(self, handle, self.model_factory(handle.model_name))
+
+    def is_live(self, name: str) -> bool:
+        with self._lock:
+            return self._live(name) is not None
+
+    def drop(self, name: Optional[str] = None):
+        """Makes one cache (or all) disappear server-side, as if it had expired."""
+        with self._lock:
+            if name is None:
+                self._caches.clear()
+            else:
+                self._caches.pop(name, None)
+
+
+class FakeCachedModel:
+    """Model bound to a FakeCachedContent: fails with 404 once the cache is gone."""
+
+    def __init__(self, service: FakeCacheService, handle: FakeCachedContent, model: FakeGenerativeModel):
+        self.service = service
+        self.handle = handle
+        self.model = model
+        self.model_name = model.model_name
+
+    def generate_content(self, contents, **kwargs):
+        if not self.service.is_live(self.handle.name):
+            raise FakeAPIError(404, f"Cached content {self.handle.name} not found")
+        return self.model.generate_content(contents, **kwargs)
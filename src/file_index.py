@@ -0,0 +1,398 @@
+# src/file_index.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Generator, Iterable, List, NamedTuple, Optional, Tuple
+
+# Import project modules
+try:
+    from . import config
+    from . import utils
+    from . import response_cache
+except ImportError:
+    try:
+        import config
+        import utils
+        import response_cache
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+        utils = None
+        response_cache = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Persistent index of the input tree, so a batch run only analyzes what changed since
+# the last one. Every supported file has a row with its size, mtime and content hash,
+# plus the hash of the content that was last analyzed successfully ("processed").
+# A file is pending while the two hashes differ.
+#
+# scan_changes() walks the tree with os.scandir, one directory at a time, and only
+# hashes files whose size or mtime differ from the index. Unchanged files cost one
+# stat and no database write. Touching a file without changing it therefore does not
+# make it pending again. Rows of files that disappeared are dropped during the scan.
+# watch_changes() adds an inotify mode (optional inotify_simple package) that reacts
+# to events instead of rescanning, and falls back to periodic scans without it.
+
+_INOTIFY_MASK_NAMES = ("CLOSE_WRITE", "MOVED_TO", "CREATE", "DELETE", "MOVED_FROM", "DELETE_SELF")
+
+
+class IndexedFile(NamedTuple):
+    """A file reported by the index. content_hash is the hash to pass to mark_processed()."""
+    path: str # Absolute path
+    size: int
+    mtime_ns: int
+    content_hash: str
+
+
+def is_indexed_name(filename: str, pdf_supported: bool = True) -> bool:
+    """True for the files get_input_files() would return: supported extension, not hidden."""
+    if filename.startswith('.'):
+        return False
+    extension = utils.input_file_extension(filename)
+    if extension in utils.SUPPORTED_PDF_EXTENSIONS:
+        return pdf_supported
+    return extension in utils.ALL_SUPPORTED_EXTENSIONS
+
+
+class FileIndex:
+    """
+    SQLite index of input files (path, size, mtime, content hash, processed hash).
+    Safe to share between threads; processes pointing at the same database file
+    should not scan the same tree at the same time.
+
+    Args:
+        db_path: Path of the SQLite database (created if missing).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " dir TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " processed_hash TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir)")
+
+    # --- Scanning ---
+    def scan_changes(self, root: str, include_pending: bool = True) -> Generator[IndexedFile, None, None]:
+        """
+        Walks root and yields every supported file that is new, changed or still
+        pending from an earlier run. The index is updated as the scan goes, one
+        directory per transaction, so an interrupted scan keeps what it has seen.
+
+        Args:
+            root: Input directory to scan (recursively).
+            include_pending: Also yield unchanged files that were never analyzed
+                             successfully. Watchers rescanning the same tree pass False
+                             so files already handed out are not reported again.
+
+        Yields:
+            IndexedFile for each file that needs to be analyzed.
+        """
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            logging.error(f"Input directory not found or is not a directory: {root}")
+            return
+
+        pdf_supported = utils.pdf_support_available()
+        started = time.monotonic()
+        counts = {"files": 0, "hashed": 0, "pending": 0, "removed": 0}
+        visited_dirs = set()
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            visited_dirs.add(directory)
+            entries = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif is_indexed_name(entry.name, pdf_supported) and entry.is_file():
+                                st = entry.stat()
+                                entries.append((entry.path, st.st_size, st.st_mtime_ns))
+                        except OSError as e:
+                            logging.warning(f"Could not stat {entry.path}, skipping: {e}")
+            except OSError as e:
+                logging.error(f"Could not list {directory}: {e}")
+                continue
+            counts["files"] += len(entries)
+            for indexed in self._sync_directory(directory, entries, counts, include_pending):
+                counts["pending"] += 1
+                yield indexed
+
+        counts["removed"] += self._drop_unvisited_dirs(root, visited_dirs)
+        logging.info(f"File index: scanned {counts['files']} files under {root} in "
+                     f"{time.monotonic() - started:.2f}s ({counts['hashed']} hashed, "
+                     f"{counts['pending']} to analyze, {counts['removed']} removed).")
+
+    def _sync_directory(self, directory: str, entries: List[Tuple[str, int, int]],
+                        counts: Dict[str, int], include_pending: bool = True) -> List[IndexedFile]:
+        """Reconciles one directory's listing with the index. Returns its pending files."""
+        with self._lock:
+            known = {
+                row[0]: row[1:]
+                for row in self._conn.execute(
+                    "SELECT path, size, mtime_ns, content_hash, processed_hash FROM files WHERE dir = ?",
+                    (directory,))
+            }
+        pending, updates = [], []
+        for path, size, mtime_ns in entries:
+            self._reconcile(directory, path, size, mtime_ns, known.pop(path, None), counts, pending, updates,
+                            include_pending)
+        if updates or known:
+            with self._lock:
+                self._conn.execute("BEGIN")
+                self._write_locked(updates)
+                # Whatever is left in `known` is no longer in the directory
+                self._conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in known])
+                self._conn.execute("COMMIT")
+            counts["removed"] += len(known)
+        return pending
+
+    def _reconcile(self, directory: str, path: str, size: int, mtime_ns: int, row: Optional[tuple],
+                   counts: Dict[str, int], pending: List[IndexedFile], updates: List[tuple],
+                   include_pending: bool = True):
+        """
+        Compares a file on disk with its index row (size, mtime_ns, content_hash, processed_hash)
+        and collects the row to write (if the file is new or its size/mtime changed) and the
+        IndexedFile (if it needs to be analyzed).
+        """
+        if row is not None and row[0] == size and row[1] == mtime_ns:
+            if not include_pending:
+                return
+            content_hash, processed_hash = row[2], row[3]
+        else:
+            try:
+                content_hash = response_cache.hash_file(path)
+            except OSError as e:
+                logging.warning(f"Could not hash {path}, skipping: {e}")
+                return
+            counts["hashed"] += 1
+            processed_hash = row[3] if row is not None else None
+            updates.append((path, directory, size, mtime_ns, content_hash, processed_hash, time.time()))
+        if content_hash != processed_hash:
+            pending.append(IndexedFile(path, size, mtime_ns, content_hash))
+
+    def _write_locked(self, updates: List[tuple]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, content_hash, processed_hash, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)", updates)
+
+    def _drop_unvisited_dirs(self, root: str, visited_dirs: set) -> int:
+        """Deletes the rows of directories under root that no longer exist."""
+        prefix = root.rstrip(os.sep) + os.sep
+        with self._lock:
+            stale = [
+                d for (d,) in self._conn.execute("SELECT DISTINCT dir FROM files")
+                if (d == root or d.startswith(prefix)) and d not in visited_dirs
+            ]
+            if not stale:
+                return 0
+            self._conn.execute("BEGIN")
+            removed = sum(self._conn.execute("DELETE FROM files WHERE dir = ?", (d,)).rowcount for d in stale)
+            self._conn.execute("COMMIT")
+        return removed
+
+    def check_file(self, path: str) -> Optional[IndexedFile]:
+        """
+        Updates the index for a single file (e.g. after a watch event) and returns it
+        if it needs to be analyzed. A file that no longer exists is removed.
+
+        Args:
+            path: Path of the file.
+
+        Returns:
+            The IndexedFile if it is new, changed or pending, else None.
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.remove(path)
+            return None
+        except OSError as e:
+            logging.warning(f"Could not stat {path}, skipping: {e}")
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, content_hash, processed_hash FROM files WHERE path = ?", (path,)).fetchone()
+        pending, updates = [], []
+        self._reconcile(os.path.dirname(path), path, st.st_size, st.st_mtime_ns, row, {"hashed": 0}, pending, updates)
+        if updates:
+            with self._lock:
+                self._write_locked(updates)
+        return pending[0] if pending else None
+
+    # --- Bookkeeping ---
+    def mark_processed(self, files: Iterable[Tuple[str, str]]):
+        """
+        Records that these files were analyzed successfully.
+
+        Args:
+            files: (path, content_hash) pairs, with the hash reported when the file was
+                   picked up. A file that changed since then stays pending.
+        """
+        rows = [(content_hash, os.path.abspath(path)) for path, content_hash in files]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE files SET processed_hash = ? WHERE path = ?", rows)
+            self._conn.execute("COMMIT")
+
+    def remove(self, path: str) -> bool:
+        """Drops a file, or every file under a directory, from the index. True if anything was removed."""
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+        return cursor.rowcount > 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total, pending = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(processed_hash IS NULL OR processed_hash != content_hash), 0) FROM files"
+            ).fetchone()
+        return {"files": total, "pending": pending}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Watch Mode ---
+def inotify_available() -> bool:
+    """True if event-driven watching is possible (Linux with the inotify_simple package)."""
+    try:
+        import inotify_simple # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def watch_changes(index: FileIndex, root: str, poll_interval_s: float = 30.0,
+                  stop_event: Optional[threading.Event] = None,
+                  use_inotify: Optional[bool] = None) -> Generator[IndexedFile, None, None]:
+    """
+    Yields files that need to be analyzed as they appear or change under root, until
+    stop_event is set. Starts with a full scan_changes() to catch up on what changed
+    while nothing was watching.
+
+    With inotify, files are reported when they are closed after writing or moved into
+    the tree, so files that are still being written are not picked up. Without it,
+    the tree is rescanned every poll_interval_s seconds.
+
+    Args:
+        index: The file index to keep up to date.
+        root: Input directory to watch (recursively).
+        poll_interval_s: Rescan interval in polling mode.
+        stop_event: Set it to end the generator.
+        use_inotify: Force (True) or disable (False) inotify; None picks it if available.
+
+    Yields:
+        IndexedFile for each new, changed or pending file.
+    """
+    stop_event = stop_event or threading.Event()
+    if use_inotify is None:
+        use_inotify = inotify_available()
+    if use_inotify:
+        yield from _watch_inotify(index, root, poll_interval_s, stop_event)
+        return
+
+    logging.info(f"File index: watching {root} by polling every {poll_interval_s:.0f}s.")
+    include_pending = True # The first scan catches up; later ones only report changes
+    while not stop_event.is_set():
+        for indexed in index.scan_changes(root, include_pending=include_pending):
+            yield indexed
+            if stop_event.is_set():
+                return
+        include_pending = False
+        stop_event.wait(poll_interval_s)
+
+
+def _watch_inotify(index: FileIndex, root: str, poll_interval_s: float,
+                   stop_event: threading.Event) -> Generator[IndexedFile, None, None]:
+    from inotify_simple import INotify, flags
+
+    root = os.path.abspath(root)
+    mask = 0
+    for name in _INOTIFY_MASK_NAMES:
+        mask |= getattr(flags, name)
+    inotify = INotify()
+    watched: Dict[int, str] = {}
+
+    def _add_tree(directory: str):
+        """Watches directory and its subdirectories."""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                watched[inotify.add_watch(current, mask)] = current
+                with os.scandir(current) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except OSError as e:
+                logging.warning(f"Could not watch {current}: {e}")
+
+    pdf_supported = utils.pdf_support_available()
+    try:
+        # Watches go in before the catch-up scan, so nothing written during it is missed
+        _add_tree(root)
+        logging.info(f"File index: watching {root} with inotify ({len(watched)} directories).")
+        yield from index.scan_changes(root)
+        while not stop_event.is_set():
+            rescan_roots = []
+            # Wake up at least once a second to notice stop_event
+            for event in inotify.read(timeout=int(min(poll_interval_s, 1.0) * 1000)):
+                if event.mask & flags.Q_OVERFLOW:
+                    rescan_roots = [root]
+                    continue
+                directory = watched.get(event.wd)
+                if event.mask & flags.IGNORED:
+                    watched.pop(event.wd, None)
+                    continue
+                if directory is None or not event.name:
+                    continue
+                path = os.path.join(directory, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        _add_tree(path)
+                        rescan_roots.append(path) # Files may have landed in it before the watch existed
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        index.remove(path)
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    index.remove(path)
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO) and is_indexed_name(event.name, pdf_supported):
+                    indexed = index.check_file(path)
+                    if indexed is not None:
+                        yield indexed
+            for rescan_root in ([root] if root in rescan_roots else rescan_roots):
+                if stop_event.is_set():
+                    break
+                logging.info(f"File index: rescanning {rescan_root} after a new directory or an event queue overflow.")
+                yield from index.scan_changes(rescan_root, include_pending=False)
+    finally:
+        inotify.close()
+
+
+def index_from_config() -> FileIndex:
+    """Opens the index at FILE_INDEX_DB_PATH."""
+    return FileIndex(config.FILE_INDEX_DB_PATH)
@@ -0,0 +1,340 @@
+# src/jobs.py
+import os
+import time
+import uuid
+import queue
+import shutil
+import json
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A task is one file of a job: (job_id, index, filename, path, prompt)
+Task = Tuple[str, int, str, str, str]
+
+FINAL_FILE_STATUSES = ("success", "error")
+
+
+def _summarize_job(job_id: str, prompt: str, created_at: float, files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Builds the job status dictionary shared by every backend."""
+    total = len(files)
+    succeeded = sum(1 for f in files if f["status"] == "success")
+    failed = sum(1 for f in files if f["status"] == "error")
+    queued = sum(1 for f in files if f["status"] == "queued")
+    if succeeded + failed == total:
+        status = "completed"
+    elif queued == total:
+        status = "queued"
+    else:
+        status = "running"
+    return {
+        "job_id": job_id,
+        "status": status,
+        "prompt": prompt,
+        "created_at": created_at,
+        "total": total,
+        "completed": succeeded + failed,
+        "succeeded": succeeded,
+        "failed": failed,
+        "files": files,
+    }
+
+
+def _file_entry(index: int, filename: str, status: str, result: Optional[str],
+                model: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    entry = {"index": index, "filename": filename, "status": status}
+    if status == "success":
+        entry["analysis"] = result
+        entry["model"] = model # The model that answered, as in /api/analyze results
+    elif status == "error":
+        entry["error"] = result
+    return entry
+
+
+# --- Backends ---
+class InMemoryJobBackend:
+    """
+    Job backend held in process memory. Simple and fast, but jobs are only
+    visible to the process that created them and are lost on restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: "queue.Queue[Task]" = queue.Queue()
+
+    def create_job(self, job_id: str, prompt: str, files: List[Tuple[str, str]]):
+        with self._lock:
+            self._jobs[job_id] = {
+                "prompt": prompt,
+                "created_at": time.time(),
+                "files": [{"filename": name, "path": path, "status": "queued", "result": None, "model": None}
+                          for name, path in files],
+            }
+        for index, (filename, path) in enumerate(files):
+            self._tasks.put((job_id, index, filename, path, prompt))
+
+    def claim_next_task(self, timeout: float = 1.0) -> Optional[Task]:
+        try:
+            task = self._tasks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs.get(task[0])
+            if job is None:
+                return None
+            job["files"][task[1]]["status"] = "running"
+        return task
+
+    def complete_task(self, job_id: str, index: int, status: str, result: str, model: Optional[Dict[str, str]] = None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["files"][index].update(status=status, result=result, model=model)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            files = [_file_entry(i, f["filename"], f["status"], f["result"], f["model"]) for i, f in enumerate(job["files"])]
+            return _summarize_job(job_id, job["prompt"], job["created_at"], files)
+
+    def requeue_stale(self, older_than_seconds: float) -> int:
+        return 0 # In-memory tasks cannot outlive the process that runs them
+
+
+class SQLiteJobBackend:
+    """
+    Job backend stored in a local SQLite database. Jobs survive restarts and
+    are shared by every process on the host (e.g. all gunicorn workers), which
+    claim queued files atomically.
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 0.5):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, prompt TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            " job_id TEXT NOT NULL, idx INTEGER NOT NULL, filename TEXT NOT NULL, path TEXT NOT NULL,"
+            " status TEXT NOT NULL, result TEXT, claimed_at REAL, model TEXT,"
+            " PRIMARY KEY (job_id, idx))"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(job_files)")}
+        if "model" not in columns: # Databases created before results recorded the answering model
+            conn.execute("ALTER TABLE job_files ADD COLUMN model TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_files_status ON job_files(status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def create_job(self, job_id: str, prompt: str, files: List[Tuple[str, str]]):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO jobs (id, prompt, created_at) VALUES (?, ?, ?)", (job_id, prompt, time.time()))
+            conn.executemany(
+                "INSERT INTO job_files (job_id, idx, filename, path, status) VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, index, name, path) for index, (name, path) in enumerate(files)],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim_next_task(self, timeout: float = 1.0) -> Optional[Task]:
+        deadline = time.monotonic() + timeout
+        conn = self._conn()
+        while True:
+            conn.execute("BEGIN IMMEDIATE") # Write lock makes the claim atomic across processes
+            try:
+                row = conn.execute(
+                    "SELECT f.job_id, f.idx, f.filename, f.path, j.prompt FROM job_files f"
+                    " JOIN jobs j ON j.id = f.job_id WHERE f.status = 'queued'"
+                    " ORDER BY j.created_at, f.idx LIMIT 1"
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE job_files SET status = 'running', claimed_at = ? WHERE job_id = ? AND idx = ?",
+                        (time.time(), row[0], row[1]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if row:
+                return tuple(row)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def complete_task(self, job_id: str, index: int, status: str, result: str, model: Optional[Dict[str, str]] = None):
+        self._conn().execute(
+            "UPDATE job_files SET status = ?, result = ?, model = ? WHERE job_id = ? AND idx = ?",
+            (status, result, json.dumps(model) if model else None, job_id, index),
+        )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        job = conn.execute("SELECT prompt, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        rows = conn.execute(
+            "SELECT idx, filename, status, result, model FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,)
+        ).fetchall()
+        files = [_file_entry(idx, filename, status, result, json.loads(model) if model else None)
+                 for idx, filename, status, result, model in rows]
+        return _summarize_job(job_id, job[0], job[1], files)
+
+    def requeue_stale(self, older_than_seconds: float) -> int:
+        """Puts files claimed by a worker that died (e.g. a killed process) back in the queue."""
+        cur = self._conn().execute(
+            "UPDATE job_files SET status = 'queued', claimed_at = NULL WHERE status = 'running' AND claimed_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+        return max(cur.rowcount, 0)
+
+
+def create_backend(kind: str, db_path: Optional[str] = None):
+    """
+    Returns a job backend by name.
+
+    Args:
+        kind: "sqlite" or "memory".
+        db_path: Database file for the SQLite backend.
+    """
+    if kind == "memory":
+        return InMemoryJobBackend()
+    if kind == "sqlite":
+        if not db_path:
+            raise ValueError("db_path is required for the sqlite job backend.")
+        return SQLiteJobBackend(db_path)
+    raise ValueError(f"Unknown job backend '{kind}'. Expected 'sqlite' or 'memory'.")
+
+
+# --- Worker Pool ---
+class JobManager:
+    """
+    Submits jobs to a backend and runs them on a pool of background worker
+    threads, each of which claims one file at a time and analyzes it.
+    model_fn, if given, is called on the worker thread right after analyze_fn and
+    returns the model that answered, which is stored with the file's result.
+    """
+
+    def __init__(self, backend, analyze_fn: Callable[[str, str], str], upload_dir: str,
+                 workers: int = 4, stale_after_seconds: float = 900,
+                 model_fn: Optional[Callable[[], Optional[Dict[str, str]]]] = None):
+        self.backend = backend
+        self.analyze_fn = analyze_fn
+        self.model_fn = model_fn
+        self.upload_dir = upload_dir
+        self.workers = max(1, workers)
+        self.stale_after_seconds = stale_after_seconds
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker threads (idempotent)."""
+        with self._start_lock:
+            if self._threads:
+                return
+            requeued = self.backend.requeue_stale(self.stale_after_seconds)
+            if requeued:
+                logging.warning(f"Requeued {requeued} stale job file(s) left running by a previous worker.")
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logging.info(f"Started {self.workers} job worker thread(s).")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Signals the workers to exit once their current file is finished."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def new_job_dir(self) -> Tuple[str, str]:
+        """Allocates a job id and the directory its uploads should be saved in."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.upload_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        return job_id, job_dir
+
+    def submit(self, job_id: str, prompt: str, files: List[Tuple[str, str]]) -> str:
+        """
+        Queues a job whose files have already been saved.
+
+        Args:
+            job_id: Id returned by new_job_dir().
+            prompt: User prompt applied to every file.
+            files: (filename, saved_path) pairs in upload order.
+
+        Returns:
+            The job id.
+        """
+        self.start()
+        self.backend.create_job(job_id, prompt, files)
+        logging.info(f"Queued job {job_id} with {len(files)} file(s).")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.backend.get_job(job_id)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                task = self.backend.claim_next_task(timeout=1.0)
+            except Exception as e:
+                logging.error(f"Job worker could not claim a task: {e}", exc_info=True)
+                time.sleep(1.0)
+                continue
+            if task is None:
+                continue
+            job_id, index, filename, path, prompt = task
+            model = None
+            try:
+                analysis_result = self.analyze_fn(path, prompt)
+                model = self.model_fn() if self.model_fn else None
+                if isinstance(analysis_result, str) and analysis_result.startswith("Error:"):
+                    status = "error"
+                else:
+                    status = "success"
+            except Exception as e:
+                logging.error(f"Job {job_id}: unexpected error analyzing {filename}: {e}", exc_info=True)
+                status, analysis_result = "error", f"Server processing error - {type(e).__name__}"
+            self.backend.complete_task(job_id, index, status, analysis_result, model)
+            logging.info(f"Job {job_id}: {filename} finished with status '{status}'.")
+            self._cleanup_upload(job_id, path)
+
+    def _cleanup_upload(self, job_id: str, path: str):
+        """Deletes an analyzed upload, and the job directory once the job is complete."""
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+            job = self.backend.get_job(job_id)
+            if job and job["status"] == "completed":
+                shutil.rmtree(os.path.join(self.upload_dir, job_id), ignore_errors=True)
+        except Exception as e:
+            logging.warning(f"Could not clean up upload {path} for job {job_id}: {e}")
@@ -0,0 +1,185 @@
+# src/logging_config.py
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import logging.handlers
+from typing import Optional
+
+# Process-wide logging pipeline:
+#   - callers only enqueue records (QueueHandler); a background QueueListener thread
+#     formats them and does the stdout I/O, so request threads never block on it
+#   - records carry the current request id and can be rendered as one JSON object
+#     per line (the structured format Cloud Logging parses)
+#   - per-request debug output (the old print("DEBUG: ...") lines) goes through
+#     debug(), which is sampled per request and formatted lazily
+
+DEBUG_LOGGER_NAME = "clu.debug"
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("log_request_id", default=None)
+_debug_sampled: contextvars.ContextVar = contextvars.ContextVar("log_debug_sampled", default=False)
+
+_debug_logger = logging.getLogger(DEBUG_LOGGER_NAME)
+_debug_sample_rate = 0.0
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+# --- Request Context ---
+def start_request(request_id: Optional[str] = None) -> str:
+    """
+    Binds a request id to the current context and decides whether this request's
+    debug output is sampled.
+
+    Args:
+        request_id: Incoming id (e.g. from an X-Request-ID header); generated if None.
+
+    Returns:
+        The request id in effect.
+    """
+    request_id = request_id or uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    _debug_sampled.set(_debug_sample_rate >= 1.0 or (_debug_sample_rate > 0 and random.random() < _debug_sample_rate))
+    return request_id
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def debug(msg: str, *args):
+    """
+    Debug channel for per-request diagnostics. Emitted at DEBUG level on the
+    'clu.debug' logger only when the current request was sampled (LOG_DEBUG_SAMPLE_RATE)
+    and the logger is enabled. Use %-style args: they are only formatted if emitted.
+    """
+    if _debug_sampled.get() and _debug_logger.isEnabledFor(logging.DEBUG):
+        _debug_logger.debug(msg, *args)
+
+
+# --- Handlers and Formatters ---
+class RequestIdFilter(logging.Filter):
+    """Adds record.request_id from the current context (runs in the calling thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+class _DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record untouched. The stock handler formats the
+    message in the calling thread; here formatting happens on the listener thread.
+    The queue never leaves the process, so records need not be pickled.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with severity, message, logger, request id and any extra fields."""
+
+    converter = time.gmtime # Timestamps are UTC
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "timestamp": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_ATTRIBUTES and key not in payload and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class _TextFormatter(logging.Formatter):
+    """The existing text layout, with the request id appended when there is one."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{text} [request_id={request_id}]" if request_id else text
+
+
+# --- Setup ---
+def setup_logging(level: str = "INFO", log_format: str = "text", debug_sample_rate: float = 0.0,
+                  stream=None) -> logging.handlers.QueueListener:
+    """
+    Routes the root logger through a queue to a background writer thread.
+    Replaces any handlers installed earlier (e.g. by logging.basicConfig). Idempotent:
+    later calls only update the level, format and sample rate.
+
+    Args:
+        level: Root log level name, e.g. "INFO".
+        log_format: "json" for one JSON object per line, "text" for the classic layout.
+        debug_sample_rate: Fraction (0-1) of requests whose debug() output is emitted.
+        stream: Output stream (default: stdout).
+
+    Returns:
+        The running QueueListener.
+    """
+    global _listener, _debug_sample_rate
+    with _setup_lock:
+        _debug_sample_rate = max(0.0, min(1.0, debug_sample_rate))
+        if log_format == "json":
+            formatter = JsonFormatter()
+        else:
+            formatter = _TextFormatter('%(asctime)s - %(levelname)s - %(message)s')
+
+        root = logging.getLogger()
+        root.setLevel(getattr(logging, level.upper(), logging.INFO))
+        # The debug channel is gated by sampling, so it may log below the root level
+        _debug_logger.setLevel(logging.DEBUG if _debug_sample_rate > 0 else logging.INFO)
+
+        if _listener is not None:
+            for handler in _listener.handlers:
+                handler.setFormatter(formatter)
+            return _listener
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(formatter)
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        queue_handler = _DeferredFormatQueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def setup_logging_from_config(config_module) -> logging.handlers.QueueListener:
+    """Calls setup_logging() with LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE from config."""
+    return setup_logging(
+        level=getattr(config_module, 'LOG_LEVEL', "INFO"),
+        log_format=getattr(config_module, 'LOG_FORMAT', "text"),
+        debug_sample_rate=getattr(config_module, 'LOG_DEBUG_SAMPLE_RATE', 0.0),
+    )
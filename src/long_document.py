@@ -0,0 +1,172 @@
+# src/long_document.py
+import re
+import json
+import logging
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# Import project modules
+try:
+    from . import structured_output
+except ImportError:
+    try:
+        import structured_output
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        structured_output = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Long PDFs are analyzed map-reduce style instead of sending only their first pages:
+# the pages are split into chunks of PDF_CHUNK_PAGES, each chunk is analyzed as its own
+# request (vllm_handler renders a chunk only when a worker is free for it), and the
+# chunk analyses are merged into one analysis of the whole document. The merge is
+# local (merge_chunk_analyses) or, with PDF_REDUCE_MODE=model, one more model call over
+# the chunk analyses (reduce_request_text), falling back to the local merge if that
+# call fails.
+#
+# Each chunk request tells the model which pages it holds, and every Key Information
+# location that still has no page number afterwards gets the chunk's page range, so
+# merged items can always be traced back to their pages.
+
+_PAGE_REFERENCE_RE = re.compile(r"\bp(?:age|ages|p?\.)\s*\d+", re.IGNORECASE)
+_NOT_AVAILABLE = ("", "n/a", "parsing error")
+
+
+class ChunkAnalysis:
+    """
+    The analysis of one page group.
+
+    Args:
+        first_page: First page of the chunk (1-based).
+        last_page: Last page of the chunk (1-based, inclusive).
+        text: The model response for the chunk, or an "Error: ..." string.
+    """
+
+    def __init__(self, first_page: int, last_page: int, text: str):
+        self.first_page = first_page
+        self.last_page = last_page
+        self.text = text
+
+    @property
+    def ok(self) -> bool:
+        return not (self.text.startswith("Error:") or self.text.startswith("Info:"))
+
+    @property
+    def pages(self) -> str:
+        return page_label(self.first_page, self.last_page)
+
+
+def page_label(first_page: int, last_page: int) -> str:
+    """ "Page 3" or "Pages 3-6" (1-based page numbers)."""
+    return f"Page {first_page}" if first_page == last_page else f"Pages {first_page}-{last_page}"
+
+
+def chunk_header(first_page: int, last_page: int, page_count: int) -> str:
+    """Text part placed before the pages of a chunk request."""
+    return (f"The content below is {page_label(first_page, last_page).lower()} of a {page_count}-page PDF document; "
+            f"the other pages are analyzed separately. Analyze only these pages, and start every "
+            f"Location with the page number it refers to (e.g. 'Page {first_page}, top-left').")
+
+
+def with_page_reference(location: Optional[str], first_page: int, last_page: int) -> str:
+    """Prefixes location with the chunk's page range unless it already names a page."""
+    location = (location or "").strip()
+    if _PAGE_REFERENCE_RE.search(location):
+        return location
+    label = page_label(first_page, last_page)
+    return f"{label}, {location}" if location else label
+
+
+def _vote(values: List[str], avoid: Tuple[str, ...] = ()) -> str:
+    """Most frequent usable value (earliest on ties), preferring values not in avoid."""
+    usable = [value for value in values if value and value.strip().lower() not in _NOT_AVAILABLE]
+    preferred = [value for value in usable if value not in avoid] or usable
+    if not preferred:
+        return "N/A"
+    counts = Counter(preferred)
+    return max(preferred, key=lambda value: (counts[value], -preferred.index(value)))
+
+
+def merge_chunk_analyses(chunks: List[ChunkAnalysis], structured: bool = False) -> "structured_output.StructuredAnalysis":
+    """
+    Merges the chunk analyses of a document locally.
+
+    Document type and category are the most frequent answers across chunks (a
+    specific category wins over "Other"), the summary lists each chunk's summary
+    under its page range (and names the pages that could not be analyzed), and Key
+    Information keeps every item in page order with a page number in its location;
+    an item found on several chunks is kept once, with all of its locations.
+
+    Args:
+        chunks: Analyses in page order; failed chunks are skipped.
+        structured: Whether the chunk responses are JSON (structured mode) or Markdown.
+
+    Returns:
+        The merged analysis (source "merged").
+    """
+    parse = structured_output.parse_structured_analysis if structured else structured_output.from_markdown
+    parsed = [(chunk, parse(chunk.text)) for chunk in chunks if chunk.ok]
+
+    summaries, key_info, positions = [], [], {} # positions: normalized info -> index in key_info
+    for chunk, analysis in parsed:
+        if analysis.summary and analysis.summary.strip().lower() not in _NOT_AVAILABLE:
+            summaries.append(f"{chunk.pages}: {analysis.summary}")
+        for item in analysis.key_info:
+            location = with_page_reference(item.location, chunk.first_page, chunk.last_page)
+            identity = " ".join(item.info.lower().split())
+            if identity in positions:
+                first = key_info[positions[identity]]
+                key_info[positions[identity]] = first._replace(location=f"{first.location}; {location}")
+                continue
+            positions[identity] = len(key_info)
+            key_info.append(structured_output.KeyInfoItem(item.info, location, item.confidence))
+
+    failed = [chunk.pages for chunk in chunks if not chunk.ok]
+    if failed:
+        summaries.append(f"({', '.join(failed)} could not be analyzed.)")
+
+    return structured_output.StructuredAnalysis(
+        document_type=_vote([analysis.document_type for _, analysis in parsed]),
+        summary=" ".join(summaries) or "N/A",
+        key_info=key_info,
+        category=_vote([analysis.category for _, analysis in parsed], avoid=("Other",)),
+        source="merged",
+        raw_text="",
+    )
+
+
+def render_analysis(analysis: "structured_output.StructuredAnalysis", structured: bool = False) -> str:
+    """
+    Writes a merged analysis in the layout a single request returns: the Markdown
+    headings of vllm_handler.SYSTEM_INSTRUCTIONS, or the response schema's JSON in
+    structured mode. Both parse back with the existing parsers.
+    """
+    if structured:
+        data = analysis.to_dict()
+        data.pop("source")
+        for item in data["key_info"]:
+            item["confidence"] = item["confidence"] or "Low" # Required by the schema; missing only after a Markdown fallback
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    lines = ["**Document Type:**", analysis.document_type, "", "**Summary:**", analysis.summary, "",
+             "**Key Information & Localization:**"]
+    for item in analysis.key_info:
+        lines.append(f"* {item.info}")
+        lines.append(f"    * Location: {item.location or 'N/A'}")
+        if item.confidence:
+            lines.append(f"    * Confidence: {item.confidence}")
+    lines += ["", "**Category:**", analysis.category]
+    return "\n".join(lines)
+
+
+def reduce_request_text(chunks: List[ChunkAnalysis], page_count: int) -> str:
+    """
+    Text part for a model-side reduce: the successful chunk analyses, each under its
+    page range, with instructions to combine them into one analysis of the document.
+    """
+    sections = [f"<<< {chunk.pages} >>>\n{chunk.text.strip()}" for chunk in chunks if chunk.ok]
+    return (f"The analyses below each cover a different part of one {page_count}-page PDF document. "
+            f"Combine them into a single analysis of the whole document: one document type, one summary "
+            f"of the entire document, one category, and all Key Information without duplicates. Keep the "
+            f"page numbers in every Location.\n\n" + "\n\n".join(sections))
@@ -1,12 +1,23 @@
 import os
+import signal
 import logging
-from typing import Dict, Any
+import argparse
+import threading
+from typing import Dict, Any, List, Tuple
 
 # Import project modules using relative paths
 try:
     from . import config
     from . import utils
     from . import vllm_handler
+    from . import batch_engine
+    from . import structured_output
+    from . import logging_config
+    from . import packing
+    from . import file_index
+    from . import watch_daemon
+    from . import results_sink
+    from . import results_store
     # We might create a new file for parsing later, or keep it in utils
     # from . import edtech_processor
 except ImportError:
@@ -14,11 +25,37 @@ except ImportError:
     import config
     import utils
     import vllm_handler
+    import batch_engine
+    import structured_output
+    import logging_config
+    import packing
+    import file_index
+    import watch_daemon
+    import results_sink
+    import results_store
     # import edtech_processor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- Results Store (searchable parsed analyses) ---
+_results_store = None
+_results_store_lock = threading.Lock()
+
+def _get_results_store():
+    """Opens the results store on first use; None if it is disabled or cannot be opened."""
+    global _results_store
+    if _results_store is None and config.RESULTS_STORE_ENABLED:
+        with _results_store_lock:
+            if _results_store is None:
+                try:
+                    _results_store = results_store.store_from_config()
+                except Exception as e:
+                    logging.error(f"Could not open results store at {config.RESULTS_STORE_PATH}, "
+                                  f"analyses will not be searchable: {e}")
+                    config.RESULTS_STORE_ENABLED = False
+    return _results_store
+
 # --- Placeholder function for MVP logic ---
 def process_edtech_analysis(file_key: str, analysis_text: str):
     """
@@ -30,73 +67,229 @@ def process_edtech_analysis(file_key: str, analysis_text: str):
         analysis_text: The successful analysis string returned by Gemini.
     """
     logging.info(f"Processing successful analysis for EdTech MVP: {file_key}")
-    # TODO: Add logic here later to parse analysis_text.
-    # Example: Use regex or string splitting to find sections like
-    # "Summary:", "Key Information & Localization:", etc., based on the
-    # expected structure from the prompt in vllm_handler.py.
-    # For now, just log that we received it.
-    logging.debug(f"Analysis Text Received:\n{analysis_text[:500]}...") # Log first 500 chars
-    pass
+    # JSON-mode responses are validated against the schema; Markdown goes through the section parser
+    if config.STRUCTURED_OUTPUT_ENABLED:
+        analysis = structured_output.parse_structured_analysis(analysis_text)
+    else:
+        analysis = structured_output.from_markdown(analysis_text)
+    logging.info(f"{file_key}: {analysis.document_type} / {analysis.category}, "
+                 f"{len(analysis.key_info)} key information item(s) (parsed from {analysis.source}).")
+    # Make the parsed fields searchable (python -m src.results_store search, GET /api/results/search)
+    store = _get_results_store()
+    if store is not None:
+        store.upsert(file_key, analysis)
 
 # --- Main Analysis Function ---
-def run_analysis() -> Dict[str, Any]:
+def _analyze_file(file_path: str) -> str:
+    """Analyzes one batch input under its own log request id."""
+    logging_config.start_request()
+    return vllm_handler.analyze_content(
+        file_path, config.BATCH_DEFAULT_PROMPT, structured=config.STRUCTURED_OUTPUT_ENABLED
+    )
+
+def _analyze_pack(file_paths: List[str]) -> Dict[str, str]:
+    """Analyzes a pack of small files with one model request, under one log request id."""
+    logging_config.start_request()
+    return vllm_handler.analyze_content_packed(file_paths, config.BATCH_DEFAULT_PROMPT)
+
+def _plan_packs(file_paths: List[str]) -> List[List[str]]:
+    return packing.plan_packs(
+        file_paths,
+        max_documents=config.PACK_MAX_DOCUMENTS,
+        max_tokens=config.PACK_MAX_TOKENS,
+        max_bytes=config.PACK_MAX_BYTES,
+        max_file_bytes=config.PACK_MAX_FILE_BYTES,
+    )
+
+def run_analysis(max_workers: int = None, resume: bool = True, incremental: bool = None) -> Dict[str, Any]:
     """
     Orchestrates the process of finding input files, analyzing them,
-    and collecting the results in a structured format. Calls EdTech
-    processing function for successful analyses.
+    and writing the results in the configured formats (RESULTS_FORMATS).
+    Calls EdTech processing function for successful analyses.
+
+    Args:
+        max_workers: Number of files analyzed in parallel (defaults to config.BATCH_MAX_WORKERS).
+        resume: Skip files already analyzed successfully in a previous run.
+        incremental: Only analyze files that are new or changed since their last
+                     successful analysis (defaults to config.FILE_INDEX_ENABLED).
 
     Returns:
         A dictionary containing the analysis results, mapping input filenames
-        (relative to the project root) to a dictionary containing status and data/error.
+        (relative to the project root) to a dictionary containing status and
+        analysis/message. Files skipped on resume are included with their
+        checkpointed result. Use run_analysis_summary() for large runs: it does
+        not hold the results in memory.
+    """
+    summary, order = _run_batch_analysis(max_workers, resume, incremental)
+    if not summary:
+        return {}
+    checkpoint_path = os.path.join(config.OUTPUT_DIR, config.BATCH_CHECKPOINT_FILENAME)
+    wanted = set(order)
+    return {
+        record["file"]: record["result"]
+        for record in batch_engine.iter_latest_records(checkpoint_path, order=order)
+        if record["file"] in wanted
+    }
+
+def run_analysis_summary(max_workers: int = None, resume: bool = True, incremental: bool = None) -> Dict[str, Any]:
+    """
+    Same as run_analysis(), but returns the run's counts instead of the results.
+
+    Files are analyzed on a worker pool and each result is appended to a JSONL
+    checkpoint as soon as it completes, so an interrupted run can be resumed.
+    At the end, the latest result of every file in the checkpoint is streamed
+    into the result files.
+
+    Args:
+        max_workers: Number of files analyzed in parallel (defaults to config.BATCH_MAX_WORKERS).
+        resume: Skip files already analyzed successfully in a previous run
+                (same path, size and modification time).
+        incremental: Only analyze files that are new or changed since their last
+                     successful analysis, according to the file index
+                     (defaults to config.FILE_INDEX_ENABLED).
+
+    Returns:
+        The run's counts ({"found", "skipped", "succeeded", "failed"}) and the result
+        files written ("outputs": {format: path}); empty if there was nothing to analyze.
     """
+    return _run_batch_analysis(max_workers, resume, incremental)[0]
+
+def _run_batch_analysis(max_workers: int, resume: bool, incremental: bool) -> Tuple[Dict[str, Any], List[str]]:
+    """Runs the batch; returns the summary and the run's files relative to BASE_DIR."""
     logging.info("Starting analysis process...")
-    all_results = {}
+    summary = {}
 
-    # 1. Get list of input files
-    input_files = utils.get_input_files(config.INPUT_DIR)
+    # 1. Get list of input files (only the new and changed ones with the file index)
+    if incremental is None:
+        incremental = config.FILE_INDEX_ENABLED
+    index = file_index.index_from_config() if incremental else None
+    if index is not None:
+        changed = list(index.scan_changes(config.INPUT_DIR))
+        input_files = [indexed.path for indexed in changed]
+    else:
+        input_files = utils.get_input_files(config.INPUT_DIR)
 
     if not input_files:
-        logging.warning(f"No supported input files found in {config.INPUT_DIR}. Exiting.")
-        return all_results
-
-    # 2. Loop through each file and analyze
-    for file_path in input_files:
-        relative_file_path = os.path.relpath(file_path, config.BASE_DIR)
-        logging.info(f"--- Processing file: {relative_file_path} ---")
-
-        analysis_result_str = vllm_handler.analyze_content(file_path)
-
-        if analysis_result_str.startswith("Error:"):
-            all_results[relative_file_path] = {
-                "status": "error",
-                "message": analysis_result_str
-            }
-            logging.error(f"Analysis failed for {relative_file_path}: {analysis_result_str}")
+        if index is not None:
+            logging.info(f"No new or changed input files in {config.INPUT_DIR}. Exiting.")
+            index.close()
         else:
-            all_results[relative_file_path] = {
-                "status": "success",
-                "analysis": analysis_result_str
-            }
-            logging.info(f"Analysis successful for {relative_file_path}.")
-            # --- Call EdTech MVP Processing Logic ---
-            process_edtech_analysis(relative_file_path, analysis_result_str)
-            # -----------------------------------------
+            logging.warning(f"No supported input files found in {config.INPUT_DIR}. Exiting.")
+        return summary, []
 
-        logging.info(f"Finished processing {relative_file_path}.")
+    # 2. Analyze files in parallel, checkpointing as each one completes
+    checkpoint_path = os.path.join(config.OUTPUT_DIR, config.BATCH_CHECKPOINT_FILENAME)
+    # Packing sends several small files per request; it only applies to Markdown output
+    packing_enabled = config.PACKING_ENABLED and not config.STRUCTURED_OUTPUT_ENABLED
+    summary = batch_engine.run_batch(
+        input_files,
+        analyze_fn=_analyze_file,
+        checkpoint_path=checkpoint_path,
+        base_dir=config.BASE_DIR,
+        max_workers=max_workers or config.BATCH_MAX_WORKERS,
+        resume=resume,
+        # --- Call EdTech MVP Processing Logic ---
+        on_success=process_edtech_analysis,
+        plan_packs_fn=_plan_packs if packing_enabled else None,
+        analyze_pack_fn=_analyze_pack if packing_enabled else None,
+    )
+
+    # 3. Remember what was analyzed successfully; failed files stay pending for the next run
+    if index is not None:
+        done = batch_engine.completed_fingerprints(batch_engine.iter_checkpoint(checkpoint_path))
+        index.mark_processed(
+            (indexed.path, indexed.content_hash) for indexed in changed
+            if (indexed.path, indexed.size, indexed.mtime_ns) in done
+        )
+        index.close()
 
+    # 4. Write the result files
     logging.info("Finished processing all input files.")
-    return all_results
+    order = [os.path.relpath(f, config.BASE_DIR) for f in input_files]
+    summary["outputs"] = _export_results(order=order)
+    return summary, order
+
+def _export_results(order: List[str] = None) -> Dict[str, str]:
+    """Writes the RESULTS_FORMATS files from the checkpoint (all files analyzed so far)."""
+    checkpoint_path = os.path.join(config.OUTPUT_DIR, config.BATCH_CHECKPOINT_FILENAME)
+    try:
+        return results_sink.export_results(checkpoint_path, config.RESULTS_FORMATS, config.OUTPUT_DIR, order=order)
+    except Exception as e:
+        logging.error(f"Failed to write result files (previous ones are unchanged): {e}", exc_info=True)
+        return {}
+
+def run_watch(max_workers: int = None):
+    """
+    Runs as a daemon: analyzes new and changed files in the inputs directory as they
+    appear, until SIGINT or SIGTERM. In-flight analyses are finished before exiting.
+    Results go to the same checkpoint as batch runs, and the result files
+    (RESULTS_FORMATS) are rewritten every WATCH_EXPORT_INTERVAL_SECONDS and at shutdown.
+
+    Args:
+        max_workers: Number of files analyzed in parallel (defaults to config.BATCH_MAX_WORKERS).
+    """
+    # Pay for SDK imports and Vertex AI initialization once, before the first file arrives
+    warm_up = vllm_handler.warm_up()
+    if not warm_up.get("ready"):
+        logging.error(f"Warm-up failed, not starting watch mode: {warm_up.get('error')}")
+        return
+
+    index = file_index.index_from_config()
+    daemon = watch_daemon.WatchDaemon(
+        config.INPUT_DIR,
+        index,
+        analyze_fn=_analyze_file,
+        checkpoint_path=os.path.join(config.OUTPUT_DIR, config.BATCH_CHECKPOINT_FILENAME),
+        base_dir=config.BASE_DIR,
+        max_workers=max_workers or config.BATCH_MAX_WORKERS,
+        max_queued=config.WATCH_MAX_QUEUED,
+        debounce_s=config.WATCH_DEBOUNCE_SECONDS,
+        poll_interval_s=config.FILE_WATCH_POLL_SECONDS,
+        on_success=process_edtech_analysis,
+        on_export=_export_results,
+        export_interval_s=config.WATCH_EXPORT_INTERVAL_SECONDS,
+    )
+
+    def _handle_signal(signum, frame):
+        logging.info(f"Received {signal.Signals(signum).name}, shutting down watch mode...")
+        daemon.stop()
+
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    try:
+        daemon.run()
+    finally:
+        index.close()
 
 # --- Main execution block ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze all supported files in the inputs directory.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"Number of files analyzed in parallel (default: {config.BATCH_MAX_WORKERS}).")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore the existing checkpoint and re-analyze every file.")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="Only analyze files that are new or changed since their last successful analysis "
+                             "(file index at FILE_INDEX_DB_PATH; also enabled by FILE_INDEX_ENABLED).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and analyze files as they appear in the inputs directory "
+                             "(stop with Ctrl+C or SIGTERM).")
+    args = parser.parse_args()
+    if (args.incremental or args.watch) and args.no_resume:
+        parser.error("--incremental and --watch cannot be combined with --no-resume.")
+
+    logging_config.setup_logging_from_config(config)
     logging.info("Script started.")
-    final_results = run_analysis()
-    if final_results:
-        utils.save_results_to_json(
-            results_data=final_results,
-            output_dir=config.OUTPUT_DIR,
-            filename=config.OUTPUT_FILENAME
-        )
+    config.validate() # Fail fast on missing GCP configuration
+    if args.watch:
+        run_watch(max_workers=args.workers)
+        logging.info("Script finished.")
+        raise SystemExit(0)
+    summary = run_analysis_summary(max_workers=args.workers, resume=not args.no_resume,
+                                   incremental=False if args.no_resume else args.incremental)
+    if summary:
+        logging.info(f"{summary['succeeded']} succeeded, {summary['failed']} failed, {summary['skipped']} already done. "
+                     f"Results: {', '.join(summary['outputs'].values()) or 'not written'}")
     else:
         logging.info("No results generated to save.")
     logging.info("Script finished.")
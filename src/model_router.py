@@ -0,0 +1,188 @@
+# src/model_router.py
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+# Import project modules
+try:
+    from . import config
+except ImportError:
+    try:
+        import config
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Routing between the dedicated tuned endpoint (primary) and the shared base model
+# (fallback). Every model call reports its latency and outcome; while the primary's
+# rolling error rate or p95 latency is over its limits (e.g. during an endpoint cold
+# start) or its circuit breaker is open, new requests go to the fallback. A small
+# fraction of requests still probes the primary so the router notices when it recovers.
+
+ROUTE_REASONS = ("primary", "probe", "error_rate", "latency_slo", "circuit_open")
+
+
+class RouteDecision(NamedTuple):
+    """Where a request is sent. source is "tuned" or "base"; reason is one of ROUTE_REASONS."""
+    model_name: str
+    source: str
+    reason: str
+
+
+class TargetStats:
+    """Rolling latency/error window for one model target (bounded by age and count)."""
+
+    def __init__(self, window_s: float = 300.0, max_samples: int = 500, clock: Callable[[], float] = time.monotonic):
+        self.window_s = window_s
+        self._clock = clock
+        self._samples = deque(maxlen=max_samples) # (time, latency_s, ok)
+        self._lock = threading.Lock()
+
+    def record(self, latency_s: float, ok: bool):
+        with self._lock:
+            self._samples.append((self._clock(), latency_s, ok))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns {"samples", "error_rate", "p95_latency_s"} over the current window."""
+        with self._lock:
+            cutoff = self._clock() - self.window_s
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+        if not samples:
+            return {"samples": 0, "error_rate": 0.0, "p95_latency_s": None}
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        return {
+            "samples": len(samples),
+            "error_rate": sum(1 for _, _, ok in samples if not ok) / len(samples),
+            "p95_latency_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        }
+
+
+class ModelRouter:
+    """
+    Chooses between a primary and a fallback model per request.
+
+    Args:
+        primary: Primary model name (the tuned endpoint).
+        fallback: Fallback model name (the base model); None disables fallback.
+        latency_slo_s: p95 latency of the primary above which traffic falls back.
+        error_rate_threshold: Primary error rate above which traffic falls back.
+        min_samples: Calls needed in the window before the primary can be judged unhealthy.
+        window_s: Age of the oldest call taken into account.
+        probe_fraction: Share of requests still sent to an unhealthy primary.
+        circuit_state: Optional callable returning the primary's circuit breaker state.
+        seed: Seed for the probe sampling.
+    """
+
+    def __init__(self, primary: str, fallback: Optional[str], latency_slo_s: float = 20.0,
+                 error_rate_threshold: float = 0.2, min_samples: int = 10, window_s: float = 300.0,
+                 probe_fraction: float = 0.05, circuit_state: Optional[Callable[[str], str]] = None,
+                 seed: Optional[int] = None):
+        self.primary = primary
+        self.fallback = fallback if fallback != primary else None
+        self.latency_slo_s = latency_slo_s
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.window_s = window_s
+        self.probe_fraction = probe_fraction
+        self.circuit_state = circuit_state
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._targets: Dict[str, TargetStats] = {}
+        self.decisions: Dict[tuple, int] = {} # (source, reason) -> count
+        self._last_unhealthy_reason: Optional[str] = None
+
+    def _target(self, model_name: str) -> TargetStats:
+        with self._lock:
+            stats = self._targets.get(model_name)
+            if stats is None:
+                stats = self._targets[model_name] = TargetStats(self.window_s)
+            return stats
+
+    def record(self, model_name: str, latency_s: float, ok: bool):
+        """Records the outcome of one call to model_name (latency including retries)."""
+        self._target(model_name).record(latency_s, ok)
+
+    def primary_health(self) -> Optional[str]:
+        """None if the primary looks healthy, otherwise the reason it does not."""
+        if self.circuit_state is not None and self.circuit_state(self.primary) == "open":
+            return "circuit_open"
+        stats = self._target(self.primary).snapshot()
+        if stats["samples"] < self.min_samples:
+            return None
+        if stats["error_rate"] > self.error_rate_threshold:
+            return "error_rate"
+        if stats["p95_latency_s"] is not None and stats["p95_latency_s"] > self.latency_slo_s:
+            return "latency_slo"
+        return None
+
+    def choose(self, count: bool = True) -> RouteDecision:
+        """
+        Picks the target for a new request. count=False leaves the decision out of the
+        decision counts (e.g. a response cache lookup); count() adds it once the
+        request is actually sent.
+        """
+        reason = self.primary_health() if self.fallback else None
+        if reason is None:
+            decision = RouteDecision(self.primary, "tuned", "primary")
+        else:
+            with self._lock:
+                probe = self._random.random() < self.probe_fraction
+            if probe and reason != "circuit_open": # The breaker does its own probing
+                decision = RouteDecision(self.primary, "tuned", "probe")
+            else:
+                decision = RouteDecision(self.fallback, "base", reason)
+        self._log_transition(reason)
+        if count:
+            self.count(decision)
+        return decision
+
+    def count(self, decision: RouteDecision):
+        """Adds a decision to the decision counts."""
+        with self._lock:
+            key = (decision.source, decision.reason)
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+
+    def _log_transition(self, reason: Optional[str]):
+        with self._lock:
+            if reason == self._last_unhealthy_reason:
+                return
+            previous, self._last_unhealthy_reason = self._last_unhealthy_reason, reason
+        if reason is None:
+            logging.info(f"Model router: primary '{self.primary}' healthy again (was: {previous}); routing to it.")
+        else:
+            logging.warning(f"Model router: primary '{self.primary}' unhealthy ({reason}); routing to fallback '{self.fallback}'.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = [{"source": source, "reason": reason, "count": count}
+                         for (source, reason), count in sorted(self.decisions.items())]
+            names = list(self._targets)
+        return {
+            "primary": self.primary,
+            "fallback": self.fallback,
+            "primary_unhealthy_reason": self.primary_health(),
+            "decisions": decisions,
+            "targets": {name: self._target(name).snapshot() for name in names},
+        }
+
+
+def router_from_config(primary: str, fallback: Optional[str],
+                       circuit_state: Optional[Callable[[str], str]] = None) -> ModelRouter:
+    """Builds a router with the MODEL_ROUTING_* settings."""
+    return ModelRouter(
+        primary, fallback,
+        latency_slo_s=getattr(config, 'MODEL_ROUTING_LATENCY_SLO_MS', 20000) / 1000,
+        error_rate_threshold=getattr(config, 'MODEL_ROUTING_ERROR_RATE_THRESHOLD', 0.2),
+        min_samples=getattr(config, 'MODEL_ROUTING_MIN_SAMPLES', 10),
+        window_s=getattr(config, 'MODEL_ROUTING_WINDOW_SECONDS', 300),
+        probe_fraction=getattr(config, 'MODEL_ROUTING_PROBE_FRACTION', 0.05),
+        circuit_state=circuit_state,
+    )
@@ -0,0 +1,180 @@
+# src/packing.py
+import os
+import re
+import math
+import logging
+from typing import Dict, List, Optional
+
+# Import project modules
+try:
+    from . import config
+    from . import utils
+except ImportError:
+    try:
+        import config
+        import utils
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+        utils = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Request packing: several small documents analyzed with the same prompt share one
+# generate_content call, so the prompt and the system instructions are sent once per
+# pack instead of once per file. Each document is wrapped in numbered markers and the
+# model is asked to answer in one numbered section per document; split_packed_response()
+# maps the sections back to the files. Documents whose section is missing are analyzed
+# again on their own by the caller.
+
+_CHARS_PER_TOKEN = 4 # Rough average for English text
+_IMAGE_TILE_TOKENS = 258 # Gemini bills images per 768x768 tile (one tile if both sides <= 384 px)
+_IMAGE_TILE_EDGE = 768
+
+_SECTION_PATTERN = re.compile(r"^[ \t*#>]*@@@\s*DOCUMENT\s+(\d+)\s*@@@[ \t*]*$", re.MULTILINE | re.IGNORECASE)
+
+
+def document_header(index: int, file_name: str) -> str:
+    """Text part placed before document `index` (1-based) in a packed request."""
+    return f"<<< DOCUMENT {index}: {file_name} >>>"
+
+
+def document_footer(index: int) -> str:
+    """Text part placed after document `index` in a packed request."""
+    return f"<<< END OF DOCUMENT {index} >>>"
+
+
+def section_delimiter(index: int) -> str:
+    """Line the model writes before its analysis of document `index`."""
+    return f"@@@ DOCUMENT {index} @@@"
+
+
+def pack_preamble(count: int) -> str:
+    """Text placed after the user prompt, before the first document."""
+    return (f"The request below contains {count} separate documents, each between "
+            f"'<<< DOCUMENT n: name >>>' and '<<< END OF DOCUMENT n >>>' markers. "
+            f"Apply the request to each document independently.")
+
+
+def pack_output_instructions(count: int) -> str:
+    """Appended to the system instructions of a packed request."""
+    return f"""
+**Multiple Documents:**
+This request contains {count} documents. Analyze each one on its own, as if it were the only document.
+For each document n from 1 to {count}, in order, write the line `@@@ DOCUMENT n @@@` on its own and follow it with the complete analysis of document n in the format above.
+Write exactly {count} sections, never combine documents, and write nothing before the first section.
+"""
+
+
+def packable_kind(file_path: str) -> Optional[str]:
+    """
+    Returns "text" or "image" if the file can share a request with other files, else None.
+    PDFs are not packed: they are rendered page by page and are rarely small.
+    """
+    ext = os.path.splitext(file_path.lower())[1]
+    if ext in getattr(utils, 'SUPPORTED_TEXT_EXTENSIONS', {".txt"}):
+        return "text"
+    if ext in getattr(utils, 'SUPPORTED_IMAGE_EXTENSIONS', {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}):
+        return "image"
+    return None
+
+
+def _image_tokens(file_path: str) -> int:
+    """Estimates the input tokens of an image after preprocessing (reads the header only)."""
+    PILImage, _ = utils._get_pil() if utils else (None, None)
+    if PILImage is None:
+        return _IMAGE_TILE_TOKENS * 4
+    try:
+        with PILImage.open(file_path) as image:
+            width, height = image.size
+    except Exception:
+        return _IMAGE_TILE_TOKENS * 4
+    max_edge = getattr(config, 'IMAGE_MAX_EDGE', 0) if getattr(config, 'IMAGE_PREPROCESS_ENABLED', False) else 0
+    if max_edge and max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+        width, height = width * scale, height * scale
+    if width <= _IMAGE_TILE_EDGE / 2 and height <= _IMAGE_TILE_EDGE / 2:
+        return _IMAGE_TILE_TOKENS
+    return _IMAGE_TILE_TOKENS * math.ceil(width / _IMAGE_TILE_EDGE) * math.ceil(height / _IMAGE_TILE_EDGE)
+
+
+def estimate_tokens(file_path: str) -> int:
+    """Rough input-token estimate for a packable file (text: chars/4, image: 258 per tile)."""
+    kind = packable_kind(file_path)
+    if kind == "image":
+        return _image_tokens(file_path)
+    return max(1, os.path.getsize(file_path) // _CHARS_PER_TOKEN)
+
+
+def plan_packs(file_paths: List[str], max_documents: int, max_tokens: int, max_bytes: int,
+               max_file_bytes: int) -> List[List[str]]:
+    """
+    Groups files into packs, keeping the input order. A pack is closed when adding the
+    next file would exceed max_documents, max_tokens (estimated input tokens) or
+    max_bytes (file sizes). PDFs, unreadable files and files larger than max_file_bytes
+    become single-file packs.
+
+    Args:
+        file_paths: Files to analyze, in order.
+        max_documents: Most files per pack (<= 1 disables packing).
+        max_tokens: Input token budget per pack.
+        max_bytes: Upload budget per pack, in bytes.
+        max_file_bytes: Files larger than this are never packed.
+
+    Returns:
+        A list of packs; each pack is a list of file paths.
+    """
+    if max_documents <= 1:
+        return [[path] for path in file_paths]
+
+    packs: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = current_bytes = 0
+    for path in file_paths:
+        try:
+            size = os.path.getsize(path)
+            tokens = estimate_tokens(path) if packable_kind(path) and size <= max_file_bytes else None
+        except OSError:
+            tokens = None
+        if tokens is None or tokens > max_tokens:
+            packs.append([path])
+            continue
+        if current and (len(current) >= max_documents or current_tokens + tokens > max_tokens
+                        or current_bytes + size > max_bytes):
+            packs.append(current)
+            current, current_tokens, current_bytes = [], 0, 0
+        current.append(path)
+        current_tokens += tokens
+        current_bytes += size
+    if current:
+        packs.append(current)
+    return packs
+
+
+def split_packed_response(text: str, count: int) -> Dict[int, str]:
+    """
+    Splits a packed response into per-document analyses.
+
+    Args:
+        text: The model's response to a packed request.
+        count: Number of documents in the pack.
+
+    Returns:
+        {document index (1-based): analysis text} for every section that is present and
+        non-empty. Out-of-range and repeated section numbers are ignored (first one wins).
+    """
+    matches = list(_SECTION_PATTERN.finditer(text or ""))
+    sections: Dict[int, str] = {}
+    for position, match in enumerate(matches):
+        index = int(match.group(1))
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(text)
+        body = text[match.end():end].strip()
+        if 1 <= index <= count and index not in sections and body:
+            sections[index] = body
+    return sections
+
+
+def count_packed_documents(texts: List[str]) -> int:
+    """Number of documents in a packed request, from its text parts (0 if not packed)."""
+    return sum(1 for text in texts if text.startswith("<<< END OF DOCUMENT "))
@@ -0,0 +1,421 @@
+# src/resilience.py
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+# Import project modules
+try:
+    from . import config
+except ImportError:
+    try:
+        import config
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Guards for model calls, one per model/endpoint name:
+#   - retries with exponential backoff and full jitter on 429/5xx/connection errors
+#   - a token bucket so batch runs stay under the endpoint's request quota
+#   - optional hedging: if a call is slower than the observed p95, a duplicate is sent
+#     and whichever answers first wins
+#   - a circuit breaker that fails fast after repeated failures instead of queueing
+#     more requests against an endpoint that is down
+
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+CIRCUIT_STATES = ("closed", "half_open", "open")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the model while the endpoint's circuit breaker is open."""
+
+    def __init__(self, model_name: str, retry_after_s: float):
+        super().__init__(f"Circuit breaker open for '{model_name}'; retry in {retry_after_s:.1f}s.")
+        self.model_name = model_name
+        self.retry_after_s = retry_after_s
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when no request token became available within the configured wait."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    True for transient failures: google.api_core errors with a retryable HTTP
+    status (their .code), and connection/timeout errors.
+    """
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+class RetryPolicy(NamedTuple):
+    """Exponential backoff with full jitter: attempt n waits uniform(0, min(max_delay, base * multiplier**(n-1)))."""
+    max_attempts: int = 4
+    base_delay_s: float = 0.5
+    max_delay_s: float = 20.0
+    multiplier: float = 2.0
+
+    def delay(self, attempt: int, rng: random.Random) -> float:
+        return rng.uniform(0, min(self.max_delay_s, self.base_delay_s * self.multiplier ** (attempt - 1)))
+
+
+# --- Building Blocks ---
+class TokenBucket:
+    """
+    Allows rate_per_s requests per second on average with bursts of up to burst.
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate_per_s: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate_per_s = rate_per_s
+        self.capacity = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Takes a token if one is available; returns 0, else the seconds until the next one."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_s)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate_per_s
+
+    def try_acquire(self) -> bool:
+        return self.rate_per_s <= 0 or self._take() == 0.0
+
+    def acquire(self, timeout_s: Optional[float] = None) -> bool:
+        """Blocks until a token is available; False if that would take longer than timeout_s."""
+        if self.rate_per_s <= 0:
+            return True
+        deadline = None if timeout_s is None else self._clock() + timeout_s
+        while True:
+            wait_s = self._take()
+            if wait_s == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                wait_s = min(wait_s, remaining)
+            time.sleep(wait_s)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. While open, calls are
+    rejected; after reset_timeout_s one probe call is let through (half-open) and
+    its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def retry_after_s(self) -> float:
+        with self._lock:
+            return max(0.0, self._opened_at + self.reset_timeout_s - self._clock())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._state == "open":
+                if self._clock() - self._opened_at < self.reset_timeout_s:
+                    return False
+                self._state = "half_open"
+                self._probe_in_flight = False
+            if self._state == "half_open":
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """
+        Gives back the half-open probe slot taken by allow() when the probe call was
+        never sent (e.g. no rate limit token), so the next call can probe instead.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        """The endpoint answered (including non-retryable client errors)."""
+        with self._lock:
+            if self._state != "closed":
+                logging.info("Circuit breaker closed after a successful probe.")
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """The call failed with a retryable (transient or server-side) error."""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or (self._state == "closed" and 0 < self.failure_threshold <= self._failures):
+                self._state = "open"
+                self._opened_at = self._clock()
+                self.times_opened += 1
+                logging.warning(f"Circuit breaker opened after {self._failures} consecutive failure(s).")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """The given percentile of the window, or None until min_samples calls were recorded."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+# --- Model Call Guard ---
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=getattr(config, 'MODEL_HEDGE_MAX_WORKERS', 16), thread_name_prefix="model-hedge")
+    return _hedge_executor
+
+
+class ModelCallGuard:
+    """
+    Retry, rate limiting, hedging and circuit breaking around the calls to one model.
+
+    Args:
+        model_name: Model or endpoint name (for logs and stats).
+        policy: Retry/backoff settings.
+        rate_per_minute: Request quota for the token bucket (0 = unlimited).
+        burst: Token bucket capacity.
+        rate_limit_wait_s: Longest wait for a token before giving up with RateLimitTimeout.
+        hedge_enabled: Send a duplicate call when the first is slower than the hedge delay.
+        hedge_percentile: Latency percentile used as the hedge delay.
+        hedge_min_delay_s: Lower bound of the hedge delay.
+        breaker: Circuit breaker for the endpoint.
+        seed: Seed for the backoff jitter.
+    """
+
+    def __init__(self, model_name: str, policy: RetryPolicy = RetryPolicy(), rate_per_minute: float = 0,
+                 burst: int = 1, rate_limit_wait_s: float = 60.0, hedge_enabled: bool = False,
+                 hedge_percentile: float = 95, hedge_min_delay_s: float = 2.0,
+                 breaker: Optional[CircuitBreaker] = None, seed: Optional[int] = None):
+        self.model_name = model_name
+        self.policy = policy
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.rate_limit_wait_s = rate_limit_wait_s
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_s = hedge_min_delay_s
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+                         "hedges": 0, "hedge_wins": 0, "circuit_rejections": 0, "rate_limit_timeouts": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def hedge_delay_s(self) -> Optional[float]:
+        """Current hedge delay, or None if hedging is off or there are too few latency samples."""
+        if not self.hedge_enabled:
+            return None
+        observed = self.latency.percentile(self.hedge_percentile)
+        return None if observed is None else max(self.hedge_min_delay_s, observed)
+
+    def call(self, fn: Callable[[], Any], streaming: bool = False) -> Any:
+        """
+        Calls fn() (one model request) with retries, rate limiting, hedging and
+        circuit breaking.
+
+        Args:
+            fn: Sends the request and returns its result.
+            streaming: fn opens a response stream (and waits for its first chunk). Such
+                       calls are never hedged, since a duplicate stream cannot be merged,
+                       and their time to first chunk is kept out of the latency percentiles.
+
+        Returns:
+            fn's result. Raises the last error once retries are exhausted or the
+            error is not retryable, CircuitOpenError while the circuit is open and
+            RateLimitTimeout if no request token became available in time.
+        """
+        self._count("calls")
+        for attempt in range(1, self.policy.max_attempts + 1):
+            if not self.breaker.allow():
+                self._count("circuit_rejections")
+                raise CircuitOpenError(self.model_name, self.breaker.retry_after_s())
+            if not self.bucket.acquire(self.rate_limit_wait_s):
+                self.breaker.release_probe() # Nothing was sent, so this was not the probe
+                self._count("rate_limit_timeouts")
+                raise RateLimitTimeout(f"No request token for '{self.model_name}' within {self.rate_limit_wait_s:.0f}s.")
+            self._count("attempts")
+            try:
+                result, elapsed = self._call_once(fn, hedge=not streaming)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success() # The endpoint is up; the request itself was rejected
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.policy.max_attempts:
+                    self._count("failures")
+                    raise
+                delay = self.policy.delay(attempt, self._random)
+                self._count("retries")
+                logging.warning(f"Model call to '{self.model_name}' failed ({type(e).__name__}: {e}); "
+                                f"retry {attempt}/{self.policy.max_attempts - 1} in {delay:.2f}s.")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            if not streaming:
+                self.latency.record(elapsed)
+            return result
+
+    def _call_once(self, fn: Callable[[], Any], hedge: bool = True):
+        """One attempt, hedged if a hedge delay is known. Returns (result, latency of the winning call)."""
+        hedge_delay = self.hedge_delay_s() if hedge else None
+        if hedge_delay is None:
+            start = time.perf_counter()
+            result = fn()
+            return result, time.perf_counter() - start
+
+        executor = _get_hedge_executor()
+        starts = {} # future -> (label, start time)
+
+        def submit(label):
+            future = executor.submit(contextvars.copy_context().run, fn)
+            starts[future] = (label, time.perf_counter())
+            return future
+
+        primary = submit("primary")
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done or self.breaker.state != "closed" or not self.bucket.try_acquire():
+            return primary.result(), time.perf_counter() - starts[primary][1]
+
+        self._count("hedges")
+        logging.info(f"Hedging slow call to '{self.model_name}' after {hedge_delay * 1000:.0f} ms.")
+        pending = {primary, submit("hedge")}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                label, start = starts[future]
+                if future.exception() is None:
+                    if label == "hedge":
+                        self._count("hedge_wins")
+                    # The losing call keeps running in the pool; its result is discarded
+                    return future.result(), time.perf_counter() - start
+                if first_error is None or label == "primary":
+                    first_error = future.exception()
+        raise first_error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["circuit_state"] = self.breaker.state
+        stats["circuit_opened"] = self.breaker.times_opened
+        stats["hedge_delay_s"] = self.hedge_delay_s()
+        return stats
+
+
+# --- Per-model Guards ---
+_guards: Dict[str, ModelCallGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def guard_from_config(model_name: str) -> ModelCallGuard:
+    """Builds a guard with the MODEL_CALL_*, MODEL_RATE_LIMIT_*, MODEL_HEDGE_* and CIRCUIT_BREAKER_* settings."""
+    return ModelCallGuard(
+        model_name,
+        policy=RetryPolicy(
+            max_attempts=max(1, getattr(config, 'MODEL_CALL_MAX_ATTEMPTS', 4)),
+            base_delay_s=getattr(config, 'MODEL_CALL_BACKOFF_BASE_MS', 500) / 1000,
+            max_delay_s=getattr(config, 'MODEL_CALL_BACKOFF_MAX_MS', 20000) / 1000,
+        ),
+        rate_per_minute=getattr(config, 'MODEL_RATE_LIMIT_PER_MINUTE', 0),
+        burst=getattr(config, 'MODEL_RATE_LIMIT_BURST', 5),
+        rate_limit_wait_s=getattr(config, 'MODEL_RATE_LIMIT_MAX_WAIT_SECONDS', 60),
+        hedge_enabled=getattr(config, 'MODEL_HEDGE_ENABLED', False),
+        hedge_percentile=getattr(config, 'MODEL_HEDGE_PERCENTILE', 95),
+        hedge_min_delay_s=getattr(config, 'MODEL_HEDGE_MIN_DELAY_MS', 2000) / 1000,
+        breaker=CircuitBreaker(
+            failure_threshold=getattr(config, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
+            reset_timeout_s=getattr(config, 'CIRCUIT_BREAKER_RESET_SECONDS', 30),
+        ),
+    )
+
+
+def get_guard(model_name: str) -> ModelCallGuard:
+    """Returns the process-wide guard for model_name, creating it from config on first use."""
+    with _guards_lock:
+        guard = _guards.get(model_name)
+        if guard is None:
+            guard = _guards[model_name] = guard_from_config(model_name)
+        return guard
+
+
+def set_guard(model_name: str, guard: Optional[ModelCallGuard]):
+    """Installs a custom guard for model_name (None drops it so the next call rebuilds it from config)."""
+    with _guards_lock:
+        if guard is None:
+            _guards.pop(model_name, None)
+        else:
+            _guards[model_name] = guard
+
+
+def reset_guards():
+    """Drops every guard (their state and counters)."""
+    with _guards_lock:
+        _guards.clear()
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns {model name: guard stats} for every model called so far."""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.model_name: guard.stats() for guard in guards}
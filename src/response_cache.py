@@ -0,0 +1,188 @@
+# src/response_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_HASH_CHUNK_SIZE = 1024 * 1024 # Read files in 1MB chunks when hashing
+_EVICT_TO_FRACTION = 0.9 # LRU eviction frees space down to this fraction of max_bytes
+_EVICT_BATCH_SIZE = 64 # Least-recently-used entries read per eviction query
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+
+    Args:
+        file_path: Path to the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """Returns the SHA-256 hex digest of in-memory content (same digest hash_file() gives for a file)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(content_hash: str, user_prompt: str, model_name: str,
+                   system_instructions: str, generation_config: Dict[str, Any]) -> str:
+    """
+    Builds the cache key for one analysis request. Any change to the document
+    bytes, prompt, model, system instructions or generation config yields a
+    different key.
+
+    Returns:
+        A SHA-256 hex digest identifying the request.
+    """
+    key_material = json.dumps(
+        {
+            "content": content_hash,
+            "prompt": user_prompt,
+            "model": model_name,
+            "system": system_instructions,
+            "generation_config": generation_config,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite-backed cache of analysis results with TTL expiry and
+    size-based LRU eviction. Shared safely between threads, and between
+    processes that point at the same database file.
+
+    The total size is kept as a running count, so a put does not scan the table.
+    Only when that count passes max_bytes is it re-read from the database (which
+    also picks up entries written by other processes); least-recently-used entries
+    are then evicted down to 90% of max_bytes, so the next rescan is some puts away.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = 7 * 24 * 3600, max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses(created_at)")
+        self._total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached analysis for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, size, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, size, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        """
+        Stores an analysis result. Error results are never cached.
+
+        Args:
+            key: Cache key from make_cache_key().
+            value: The analysis string returned by the model.
+        """
+        if not value or value.startswith("Error:"):
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total_bytes += size - (replaced[0] if replaced else 0)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """Drops expired entries, then least-recently-used entries until under max_bytes."""
+        if self.ttl_seconds:
+            cutoff = time.time() - self.ttl_seconds
+            expired, expired_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (cutoff,)).fetchone()
+            if expired:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+                self.expirations += expired
+                self._total_bytes -= expired_bytes
+        if not self.max_bytes or self._total_bytes <= self.max_bytes:
+            return
+        self._total_bytes = self._stored_bytes() # Include entries written by other processes
+        target = int(self.max_bytes * _EVICT_TO_FRACTION)
+        while self._total_bytes > target:
+            batch = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC LIMIT ?",
+                                       (_EVICT_BATCH_SIZE,)).fetchall()
+            if not batch:
+                break
+            for key, size in batch:
+                if self._total_bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every cached entry."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss/eviction counters and the current entry count and size."""
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": entries,
+                "bytes": total,
+            }
@@ -0,0 +1,411 @@
+# src/results_sink.py
+import os
+import json
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Import project modules
+try:
+    from . import config
+    from . import batch_engine
+except ImportError:
+    try:
+        import config
+        import batch_engine
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+        batch_engine = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Result files written one record at a time. Runs append every result to the JSONL
+# checkpoint as it completes; at the end of a run (and periodically in watch mode)
+# export_results() streams the latest record of each file from the checkpoint into one
+# sink per configured format. No format needs all results in memory. A sink writes to a
+# temporary file next to its target, and finalize() moves it into place with
+# os.replace(), so readers only ever see a complete previous or complete new file.
+#
+# Formats: "json" (the results.json layout: {relative_path: {"status", "analysis"|"message"}}),
+# "jsonl" (one checkpoint record per line), "parquet" and "arrow" (columnar, written in
+# record batches; need pyarrow) and "sqlite" (a `results` table keyed by file).
+
+_ARROW_BATCH_SIZE = 1000 # Records buffered per Parquet row group / Arrow record batch
+_SQLITE_COMMIT_EVERY = 1000
+
+_COLUMNS = ("file", "path", "size", "mtime_ns", "status", "analysis", "message")
+
+pa = None # Set by _get_pyarrow() once pyarrow has been imported
+
+
+def _get_pyarrow():
+    """Imports pyarrow on first use. Raises ImportError with an install hint if it is missing."""
+    global pa
+    if pa is None:
+        try:
+            import pyarrow as _pa
+        except ImportError as e:
+            raise ImportError("The parquet and arrow result formats need pyarrow: pip install pyarrow") from e
+        pa = _pa
+    return pa
+
+
+def _arrow_schema():
+    pa = _get_pyarrow()
+    return pa.schema([
+        ("file", pa.string()), ("path", pa.string()), ("size", pa.int64()), ("mtime_ns", pa.int64()),
+        ("status", pa.string()), ("analysis", pa.string()), ("message", pa.string()),
+    ])
+
+
+def record_to_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Flattens a checkpoint record into the columns of the tabular formats."""
+    result = record.get("result", {})
+    return {
+        "file": record.get("file"),
+        "path": record.get("path"),
+        "size": record.get("size"),
+        "mtime_ns": record.get("mtime_ns"),
+        "status": result.get("status"),
+        "analysis": result.get("analysis"),
+        "message": result.get("message"),
+    }
+
+
+def row_to_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of record_to_row()."""
+    result = {"status": row.get("status")}
+    if row.get("analysis") is not None:
+        result["analysis"] = row["analysis"]
+    if row.get("message") is not None:
+        result["message"] = row["message"]
+    return {"file": row.get("file"), "path": row.get("path"), "size": row.get("size"),
+            "mtime_ns": row.get("mtime_ns"), "result": result}
+
+
+# --- Sinks ---
+class ResultsSink:
+    """
+    Base class of the result writers. Records are written to a temporary file in the
+    target's directory; finalize() publishes it atomically, abort() discards it.
+    Used as a context manager, the sink is finalized on success and aborted on error.
+
+    Args:
+        path: Final path of the results file.
+    """
+
+    format_name = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.tmp_path = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path) # Left over from a crashed run
+        self._open()
+
+    def write(self, record: Dict[str, Any]):
+        """Writes one checkpoint record ({"file", "path", "size", "mtime_ns", "result"})."""
+        self._write(record)
+        self.count += 1
+
+    def finalize(self):
+        """Closes the temporary file, flushes it to disk and moves it over the target."""
+        self._close()
+        fd = os.open(self.tmp_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(self.tmp_path, self.path)
+        logging.info(f"Wrote {self.count} results to {self.path} ({self.format_name}).")
+
+    def abort(self):
+        """Closes and deletes the temporary file; the target is left untouched."""
+        try:
+            self._close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.abort()
+
+    # Implemented by subclasses
+    def _open(self):
+        raise NotImplementedError
+
+    def _write(self, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class JsonResultsSink(ResultsSink):
+    """The results.json layout, written entry by entry (same text json.dump(indent=4) gives)."""
+
+    format_name = "json"
+
+    def _open(self):
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        self._file.write("{")
+
+    def _write(self, record: Dict[str, Any]):
+        value = json.dumps(record["result"], indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        self._file.write(f"{',' if self.count else ''}\n    {json.dumps(record['file'], ensure_ascii=False)}: {value}")
+
+    def _close(self):
+        if not self._file.closed:
+            self._file.write("\n}" if self.count else "}")
+            self._file.close()
+
+
+class JsonlResultsSink(ResultsSink):
+    """One checkpoint record per line (readable with batch_engine.read_checkpoint)."""
+
+    format_name = "jsonl"
+
+    def _open(self):
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def _write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class ArrowResultsSink(ResultsSink):
+    """
+    Columnar results (columns: file, path, size, mtime_ns, status, analysis, message),
+    written in batches of _ARROW_BATCH_SIZE records.
+
+    Args:
+        path: Final path of the results file.
+        file_format: "parquet" or "arrow" (Arrow IPC file, a.k.a. Feather v2).
+    """
+
+    def __init__(self, path: str, file_format: str = "parquet"):
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"Unsupported columnar format: {file_format}")
+        self.format_name = file_format
+        super().__init__(path)
+
+    def _open(self):
+        pa = _get_pyarrow()
+        self._schema = _arrow_schema()
+        self._rows: List[Dict[str, Any]] = []
+        if self.format_name == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.tmp_path, self._schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(self.tmp_path, self._schema)
+        self._closed = False
+
+    def _write(self, record: Dict[str, Any]):
+        self._rows.append(record_to_row(record))
+        if len(self._rows) >= _ARROW_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._flush()
+            finally:
+                self._writer.close()
+
+
+class SqliteResultsSink(ResultsSink):
+    """A `results` table with one row per file (the columns of the tabular formats)."""
+
+    format_name = "sqlite"
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.tmp_path)
+        self._conn.execute(
+            "CREATE TABLE results ("
+            " file TEXT PRIMARY KEY,"
+            " path TEXT,"
+            " size INTEGER,"
+            " mtime_ns INTEGER,"
+            " status TEXT NOT NULL,"
+            " analysis TEXT,"
+            " message TEXT)"
+        )
+        self._conn.execute("CREATE INDEX idx_results_status ON results(status)")
+        self._closed = False
+
+    def _write(self, record: Dict[str, Any]):
+        row = record_to_row(record)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO results ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            tuple(row[column] for column in _COLUMNS))
+        if (self.count + 1) % _SQLITE_COMMIT_EVERY == 0:
+            self._conn.commit()
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            self._conn.commit()
+            self._conn.close()
+
+
+SINK_EXTENSIONS = {"json": ".json", "jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow", "sqlite": ".sqlite3"}
+_FORMATS_BY_EXTENSION = {".json": "json", ".jsonl": "jsonl", ".parquet": "parquet", ".arrow": "arrow",
+                         ".feather": "arrow", ".sqlite3": "sqlite", ".sqlite": "sqlite", ".db": "sqlite"}
+
+
+def format_for_path(path: str) -> str:
+    """Result format implied by a file extension (raises ValueError for unknown ones)."""
+    extension = os.path.splitext(path.lower())[1]
+    if extension not in _FORMATS_BY_EXTENSION:
+        raise ValueError(f"Unknown results file extension '{extension}' (expected one of "
+                         f"{', '.join(sorted(_FORMATS_BY_EXTENSION))}).")
+    return _FORMATS_BY_EXTENSION[extension]
+
+
+def default_path(file_format: str, output_dir: str) -> str:
+    """Where a format is written by default: OUTPUT_FILENAME for json, results.<ext> otherwise."""
+    if file_format == "json":
+        return os.path.join(output_dir, getattr(config, 'OUTPUT_FILENAME', "results.json"))
+    return os.path.join(output_dir, "results" + SINK_EXTENSIONS[file_format])
+
+
+def open_sink(file_format: str, path: str) -> ResultsSink:
+    """Creates the sink for file_format ("json", "jsonl", "parquet", "arrow" or "sqlite") writing to path."""
+    if file_format == "json":
+        return JsonResultsSink(path)
+    if file_format == "jsonl":
+        return JsonlResultsSink(path)
+    if file_format in ("parquet", "arrow"):
+        return ArrowResultsSink(path, file_format)
+    if file_format == "sqlite":
+        return SqliteResultsSink(path)
+    raise ValueError(f"Unknown results format: {file_format} (expected one of {', '.join(SINK_EXTENSIONS)}).")
+
+
+# --- Reading and Exporting ---
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads records back from a checkpoint or any results file (format from the extension).
+    A results.json file only has the "file" and "result" fields.
+    """
+    file_format = format_for_path(path)
+    if file_format == "jsonl":
+        yield from batch_engine.iter_checkpoint(path)
+    elif file_format == "json":
+        with open(path, 'r', encoding='utf-8') as f:
+            for key, result in json.load(f).items():
+                yield {"file": key, "result": result}
+    elif file_format == "parquet":
+        _get_pyarrow()
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=_ARROW_BATCH_SIZE):
+            for row in batch.to_pylist():
+                yield row_to_record(row)
+    elif file_format == "arrow":
+        pa = _get_pyarrow()
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                for row in reader.get_batch(i).to_pylist():
+                    yield row_to_record(row)
+    else:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM results ORDER BY rowid"):
+                yield row_to_record(dict(row))
+        finally:
+            conn.close()
+
+
+def write_records(records: Iterable[Dict[str, Any]], paths: Dict[str, str]) -> int:
+    """
+    Writes records to one sink per format in a single pass, finalizing them all at the end.
+    If anything fails, every sink is aborted and the existing files are left as they were.
+
+    Args:
+        records: Checkpoint records, at most one per file.
+        paths: {format: target path}.
+
+    Returns:
+        Number of records written.
+    """
+    sinks = []
+    count = 0
+    try:
+        for file_format, path in paths.items():
+            sinks.append(open_sink(file_format, path))
+        for record in records:
+            for sink in sinks:
+                sink.write(record)
+            count += 1
+    except BaseException:
+        for sink in sinks:
+            try:
+                sink.abort()
+            except Exception as e:
+                logging.warning(f"Could not discard temporary results file {sink.tmp_path}: {e}")
+        raise
+    for sink in sinks:
+        sink.finalize()
+    return count
+
+
+def export_results(checkpoint_path: str, formats: List[str], output_dir: str,
+                   order: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Writes the latest result of every file in the checkpoint to the configured formats.
+
+    Args:
+        checkpoint_path: Path of the JSONL checkpoint.
+        formats: Formats to write (see open_sink).
+        output_dir: Directory the files are written to (see default_path).
+        order: Optional relative paths giving the output order (others follow in checkpoint order).
+
+    Returns:
+        {format: path} of the files written.
+    """
+    paths = {file_format: default_path(file_format, output_dir) for file_format in dict.fromkeys(formats)}
+    if paths:
+        write_records(batch_engine.iter_latest_records(checkpoint_path, order=order), paths)
+    return paths
+
+
+# --- Command Line ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a results checkpoint or results file into another results format, "
+                    "e.g. rebuild results.json from the checkpoint.")
+    parser.add_argument("source", help="Checkpoint (.jsonl) or results file (.json, .parquet, .arrow, .sqlite3).")
+    parser.add_argument("destination", help="Output file; the format follows from its extension.")
+    args = parser.parse_args()
+
+    # A checkpoint may hold several records per file; only the latest one is kept
+    if format_for_path(args.source) == "jsonl":
+        source_records = batch_engine.iter_latest_records(args.source)
+    else:
+        source_records = iter_records(args.source)
+    written = write_records(source_records, {format_for_path(args.destination): args.destination})
+    print(f"Wrote {written} results to {args.destination}.")
@@ -0,0 +1,322 @@
+# src/results_store.py
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Import project modules
+try:
+    from . import config
+    from . import structured_output
+except ImportError:
+    try:
+        import config
+        import structured_output
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+        structured_output = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Queryable store of analyzed documents, so questions like "all Lecture Notes mentioning
+# decision trees" do not mean loading and scanning results.json. Each successfully
+# analyzed file has one row with the parsed fields (document type, summary, key
+# information, category). Category and document type have B-tree indexes; summary and
+# key information are in an FTS5 full-text index (porter stemming, so "trees" matches
+# "tree"), kept in sync with the table by triggers.
+#
+# Ranking by relevance (bm25) has to score every matching document, which is what
+# makes very broad queries slow (roughly 2 ms per thousand matches). Searches whose
+# words match more than rank_max_matches documents therefore return the newest
+# matches first instead; the response says which order was used. Snippets are only
+# built for the page of results that is returned.
+#
+# Batch and watch runs add each analysis as it completes (main.process_edtech_analysis);
+# `python -m src.results_store index` (re)builds the store from a checkpoint or results
+# file. The store holds the latest successful analysis of each file.
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents ("
+    " id INTEGER PRIMARY KEY,"
+    " file TEXT NOT NULL UNIQUE,"
+    " document_type TEXT COLLATE NOCASE,"
+    " category TEXT COLLATE NOCASE,"
+    " summary TEXT,"
+    " key_info TEXT," # Key information items as searchable text, one per line
+    " key_info_json TEXT,"
+    " source TEXT,"
+    " updated_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_category ON documents(category, document_type)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_document_type ON documents(document_type)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+    " summary, key_info, content='documents', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN"
+    " INSERT INTO documents_fts(rowid, summary, key_info) VALUES (new.id, new.summary, new.key_info); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN"
+    " INSERT INTO documents_fts(documents_fts, rowid, summary, key_info)"
+    " VALUES ('delete', old.id, old.summary, old.key_info); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN"
+    " INSERT INTO documents_fts(documents_fts, rowid, summary, key_info)"
+    " VALUES ('delete', old.id, old.summary, old.key_info);"
+    " INSERT INTO documents_fts(rowid, summary, key_info) VALUES (new.id, new.summary, new.key_info); END",
+)
+
+_UPSERT = (
+    "INSERT INTO documents (file, document_type, category, summary, key_info, key_info_json, source, updated_at)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT(file) DO UPDATE SET document_type = excluded.document_type, category = excluded.category,"
+    " summary = excluded.summary, key_info = excluded.key_info, key_info_json = excluded.key_info_json,"
+    " source = excluded.source, updated_at = excluded.updated_at"
+)
+
+_BULK_COMMIT_EVERY = 1000
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turns free text into an FTS5 query matching documents that contain every word
+    (so user input never hits FTS5 query syntax). A trailing "*" on a word makes it
+    a prefix search. Returns None if the text has no words.
+    """
+    terms = []
+    for word in text.split():
+        tokens = [f'"{token}"' for token in _TOKEN_RE.findall(word)]
+        if tokens and word.endswith("*"):
+            tokens[-1] += "*"
+        terms += tokens
+    return " ".join(terms) or None
+
+
+def _row_values(file_key: str, analysis: Any) -> Tuple:
+    key_info = [item._asdict() for item in analysis.key_info]
+    key_info_text = "\n".join(
+        f"{item['info']} (Location: {item['location']})" if item.get("location") else item["info"]
+        for item in key_info
+    )
+    return (file_key, analysis.document_type, analysis.category, analysis.summary, key_info_text,
+            json.dumps(key_info, ensure_ascii=False), analysis.source, time.time())
+
+
+class ResultsStore:
+    """
+    SQLite store of parsed analyses with category/document type indexes and a
+    full-text index over summaries and key information. Safe to share between threads.
+
+    Args:
+        db_path: Path of the SQLite database (created if missing).
+        rank_max_matches: Full-text searches matching more documents than this are
+                          ordered newest first instead of by relevance.
+    """
+
+    def __init__(self, db_path: str, rank_max_matches: int = 20000):
+        self.db_path = db_path
+        self.rank_max_matches = rank_max_matches
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    # --- Writing ---
+    def upsert(self, file_key: str, analysis: Any):
+        """
+        Adds or replaces the analysis of one file.
+
+        Args:
+            file_key: The file's results key (path relative to the project root).
+            analysis: A structured_output.StructuredAnalysis.
+        """
+        with self._lock:
+            self._conn.execute(_UPSERT, _row_values(file_key, analysis))
+
+    def upsert_many(self, items: Iterable[Tuple[str, Any]]) -> int:
+        """Adds or replaces many analyses, committing every _BULK_COMMIT_EVERY rows. Returns the count."""
+        count = 0
+        batch = []
+        for file_key, analysis in items:
+            batch.append(_row_values(file_key, analysis))
+            if len(batch) >= _BULK_COMMIT_EVERY:
+                count += self._write_batch(batch)
+                batch = []
+        return count + self._write_batch(batch)
+
+    def _write_batch(self, rows: List[Tuple]) -> int:
+        if rows:
+            with self._lock:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(_UPSERT, rows)
+                self._conn.execute("COMMIT")
+        return len(rows)
+
+    def delete(self, file_key: str) -> bool:
+        """Removes a file from the store. True if it was there."""
+        with self._lock:
+            return self._conn.execute("DELETE FROM documents WHERE file = ?", (file_key,)).rowcount > 0
+
+    def optimize(self):
+        """Merges the full-text index segments (worth doing after a large rebuild)."""
+        with self._lock:
+            self._conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('optimize')")
+
+    # --- Querying ---
+    def search(self, text: Optional[str] = None, category: Optional[str] = None,
+               document_type: Optional[str] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        Finds documents by full text and/or category and document type (both matched
+        case-insensitively).
+
+        Args:
+            text: Words that must all appear in the summary or key information.
+                  None lists documents by filter only.
+            category: Optional category filter (e.g. "Lecture Notes").
+            document_type: Optional document type filter.
+            limit: Maximum number of results.
+            offset: Number of results to skip (for paging).
+
+        Returns:
+            {"order": "relevance" (best matches first) or "newest", "results": [...]}; each
+            result has "file", "document_type", "category", "summary" and "key_info",
+            plus "snippet" and "score" (bm25, lower is better) for full-text searches.
+        """
+        filters, filter_params = "", []
+        if category:
+            filters += " AND d.category = ?"
+            filter_params.append(category)
+        if document_type:
+            filters += " AND d.document_type = ?"
+            filter_params.append(document_type)
+        page = [max(0, int(limit)), max(0, int(offset))]
+
+        match = fts_query(text) if text else None
+        if text and match is None:
+            return {"order": "relevance", "results": []}
+
+        # The page of ids is chosen first: snippet() and bm25() in the same query would be
+        # computed for every match before the sort, not just for the rows returned
+        with self._lock:
+            if match:
+                # Counting matches only walks the index; ranking them all is the expensive part
+                (matches,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM documents_fts WHERE documents_fts MATCH ?", (match,)).fetchone()
+                order = "relevance" if matches <= self.rank_max_matches else "newest"
+                join = " JOIN documents d ON d.id = documents_fts.rowid" if filters else ""
+                ids = [row[0] for row in self._conn.execute(
+                    f"SELECT documents_fts.rowid FROM documents_fts{join} WHERE documents_fts MATCH ?{filters}"
+                    f" ORDER BY {'documents_fts.rank' if order == 'relevance' else 'documents_fts.rowid DESC'}"
+                    f" LIMIT ? OFFSET ?", [match] + filter_params + page)]
+                rows = self._conn.execute(
+                    "SELECT d.id, d.file, d.document_type, d.category, d.summary, d.key_info_json,"
+                    " snippet(documents_fts, -1, '[', ']', '...', 16) AS snippet, bm25(documents_fts) AS score"
+                    " FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid"
+                    f" WHERE documents_fts MATCH ? AND documents_fts.rowid IN ({', '.join('?' * len(ids))})",
+                    [match] + ids).fetchall() if ids else []
+                position = {row_id: i for i, row_id in enumerate(ids)}
+                rows.sort(key=lambda row: position[row["id"]])
+            else:
+                order = "newest"
+                rows = self._conn.execute(
+                    "SELECT d.id, d.file, d.document_type, d.category, d.summary, d.key_info_json"
+                    f" FROM documents d WHERE 1 = 1{filters} ORDER BY d.id DESC LIMIT ? OFFSET ?",
+                    filter_params + page).fetchall()
+
+        results = []
+        for row in rows:
+            result = {
+                "file": row["file"],
+                "document_type": row["document_type"],
+                "category": row["category"],
+                "summary": row["summary"],
+                "key_info": json.loads(row["key_info_json"] or "[]"),
+            }
+            if match:
+                result["snippet"] = " ".join(row["snippet"].split())
+                result["score"] = round(row["score"], 4)
+            results.append(result)
+        return {"order": order, "results": results}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (documents,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return {"documents": documents}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def store_from_config() -> ResultsStore:
+    """Opens the store at RESULTS_STORE_PATH."""
+    return ResultsStore(config.RESULTS_STORE_PATH,
+                        rank_max_matches=getattr(config, 'RESULTS_SEARCH_RANK_MAX_MATCHES', 20000))
+
+
+def index_records(store: ResultsStore, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Adds the successful analyses among checkpoint/results records to the store.
+    Each analysis is parsed as JSON or Markdown depending on the mode it was
+    written in. Returns the number added.
+    """
+    def _parsed():
+        for record in records:
+            result = record.get("result", {})
+            if result.get("status") == "success" and result.get("analysis"):
+                yield record["file"], structured_output.parse_analysis(result["analysis"])
+    return store.upsert_many(_parsed())
+
+
+# --- Command Line ---
+if __name__ == "__main__":
+    try:
+        from . import results_sink, batch_engine
+    except ImportError:
+        import results_sink
+        import batch_engine
+
+    parser = argparse.ArgumentParser(description="Build and query the searchable results store.")
+    parser.add_argument("--db", default=None, help="Store database (default: RESULTS_STORE_PATH).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="Add the analyses of a checkpoint or results file to the store.")
+    index_parser.add_argument("source", nargs="?", default=None,
+                              help="Checkpoint (.jsonl) or results file (default: the batch checkpoint).")
+    search_parser = commands.add_parser("search", help="Search the store.")
+    search_parser.add_argument("text", nargs="*", help="Words to search for in summaries and key information.")
+    search_parser.add_argument("--category", default=None)
+    search_parser.add_argument("--type", dest="document_type", default=None)
+    search_parser.add_argument("--limit", type=int, default=20)
+    search_parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    results_store = ResultsStore(args.db or config.RESULTS_STORE_PATH,
+                                 rank_max_matches=config.RESULTS_SEARCH_RANK_MAX_MATCHES)
+    if args.command == "index":
+        source = args.source or os.path.join(config.OUTPUT_DIR, config.BATCH_CHECKPOINT_FILENAME)
+        if results_sink.format_for_path(source) == "jsonl":
+            source_records = batch_engine.iter_latest_records(source)
+        else:
+            source_records = results_sink.iter_records(source)
+        added = index_records(results_store, source_records)
+        results_store.optimize()
+        print(f"Indexed {added} analyses from {source} ({results_store.stats()['documents']} documents in the store).")
+    else:
+        started = time.perf_counter()
+        found = results_store.search(" ".join(args.text) or None, category=args.category,
+                                     document_type=args.document_type, limit=args.limit, offset=args.offset)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for hit in found["results"]:
+            print(f"{hit['file']}  [{hit['category']} / {hit['document_type']}]")
+            print(f"    {hit.get('snippet') or hit['summary']}")
+        print(f"{len(found['results'])} result(s), {found['order']} first, in {elapsed_ms:.1f} ms.")
+    results_store.close()
@@ -0,0 +1,194 @@
+# src/structured_output.py
+import re
+import json
+import logging
+from typing import Dict, Any, List, NamedTuple, Optional
+
+# Import project modules
+try:
+    from . import utils
+except ImportError:
+    import utils
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Schema ---
+# Same fields and allowed values as the Markdown layout in vllm_handler.SYSTEM_INSTRUCTIONS.
+CATEGORIES = (
+    "Lecture Notes", "Essay Draft", "Research Paper", "Assignment Submission",
+    "Admin Form", "Data Visualization", "Other",
+)
+CONFIDENCE_LEVELS = ("High", "Medium", "Low")
+
+# Vertex AI response_schema (OpenAPI subset). Sent with response_mime_type="application/json"
+# so the model is constrained to produce an object of exactly this shape.
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "document_type": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "key_info": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "info": {"type": "STRING"},
+                    "location": {"type": "STRING"},
+                    "confidence": {"type": "STRING", "enum": list(CONFIDENCE_LEVELS)},
+                },
+                "required": ["info", "location", "confidence"],
+                "property_ordering": ["info", "location", "confidence"],
+            },
+        },
+        "category": {"type": "STRING", "enum": list(CATEGORIES)},
+    },
+    "required": ["document_type", "summary", "key_info", "category"],
+    "property_ordering": ["document_type", "summary", "key_info", "category"],
+}
+
+_CONFIDENCE_BY_LOWER = {level.lower(): level for level in CONFIDENCE_LEVELS}
+_CATEGORY_BY_LOWER = {category.lower(): category for category in CATEGORIES}
+# Models occasionally wrap JSON in a ```json fence even in JSON mode
+_CODE_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL | re.IGNORECASE)
+
+
+class SchemaValidationError(ValueError):
+    """Raised when a structured response does not match ANALYSIS_RESPONSE_SCHEMA."""
+
+
+# --- Typed Results ---
+class KeyInfoItem(NamedTuple):
+    """One extracted piece of information and where it was found."""
+    info: str
+    location: Optional[str]
+    confidence: Optional[str] # "High", "Medium" or "Low"
+
+
+class StructuredAnalysis(NamedTuple):
+    """A parsed analysis, from a JSON-mode response or the Markdown fallback."""
+    document_type: str
+    summary: str
+    key_info: List[KeyInfoItem]
+    category: str
+    source: str # "json" or "markdown" (fallback parser was used)
+    raw_text: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns a JSON-serializable dictionary (raw_text excluded)."""
+        return {
+            "document_type": self.document_type,
+            "summary": self.summary,
+            "key_info": [item._asdict() for item in self.key_info],
+            "category": self.category,
+            "source": self.source,
+        }
+
+
+# --- Validation ---
+def _require_string(data: Dict[str, Any], field: str, path: str) -> str:
+    value = data.get(field)
+    if not isinstance(value, str):
+        raise SchemaValidationError(f"{path}{field}: expected a string, got {type(value).__name__}")
+    return value.strip()
+
+
+def validate_analysis(data: Any, raw_text: str = "") -> StructuredAnalysis:
+    """
+    Checks a decoded JSON response against ANALYSIS_RESPONSE_SCHEMA and converts it
+    to a StructuredAnalysis. Enum values are matched case-insensitively.
+
+    Args:
+        data: The decoded JSON value.
+        raw_text: The original response text, kept on the result.
+
+    Returns:
+        The typed analysis. Raises SchemaValidationError on the first mismatch.
+    """
+    if not isinstance(data, dict):
+        raise SchemaValidationError(f"expected an object, got {type(data).__name__}")
+
+    document_type = _require_string(data, "document_type", "")
+    summary = _require_string(data, "summary", "")
+    category = _CATEGORY_BY_LOWER.get(_require_string(data, "category", "").lower())
+    if category is None:
+        raise SchemaValidationError(f"category: '{data['category']}' is not one of {list(CATEGORIES)}")
+
+    raw_items = data.get("key_info")
+    if not isinstance(raw_items, list):
+        raise SchemaValidationError(f"key_info: expected an array, got {type(raw_items).__name__}")
+    key_info = []
+    for index, item in enumerate(raw_items):
+        path = f"key_info[{index}]."
+        if not isinstance(item, dict):
+            raise SchemaValidationError(f"key_info[{index}]: expected an object, got {type(item).__name__}")
+        confidence = _CONFIDENCE_BY_LOWER.get(_require_string(item, "confidence", path).lower())
+        if confidence is None:
+            raise SchemaValidationError(f"{path}confidence: '{item['confidence']}' is not one of {list(CONFIDENCE_LEVELS)}")
+        key_info.append(KeyInfoItem(_require_string(item, "info", path), _require_string(item, "location", path), confidence))
+
+    return StructuredAnalysis(document_type, summary, key_info, category, "json", raw_text)
+
+
+# --- Parsing ---
+def from_markdown(analysis_text: str) -> StructuredAnalysis:
+    """
+    Builds a StructuredAnalysis from a Markdown response with utils.parse_gemini_analysis.
+    Missing sections are "N/A", as in the parser.
+    """
+    parsed = utils.parse_gemini_analysis(analysis_text)
+    key_info = [KeyInfoItem(item["info"], item["location"], item["confidence"]) for item in parsed["key_info_items"]]
+    return StructuredAnalysis(
+        parsed["document_type"], parsed["summary"], key_info, parsed["category"], "markdown", analysis_text,
+    )
+
+
+def parse_json_analysis(analysis_text: str) -> StructuredAnalysis:
+    """
+    Parses a JSON-mode response (optionally wrapped in a ```json fence) and validates it.
+
+    Returns:
+        The typed analysis. Raises SchemaValidationError if the text is not valid JSON
+        or does not match the schema.
+    """
+    fenced = _CODE_FENCE_RE.match(analysis_text)
+    json_text = fenced.group(1) if fenced else analysis_text
+    try:
+        data = json.loads(json_text)
+    except json.JSONDecodeError as e:
+        raise SchemaValidationError(f"not valid JSON ({e})") from e
+    return validate_analysis(data, raw_text=analysis_text)
+
+
+def is_json_output(analysis_text: str) -> bool:
+    """
+    Whether a stored analysis came from a JSON-mode request (an object, possibly in a
+    ```json fence) rather than the Markdown layout. Results files do not record the
+    output mode, and a structured run can hold Markdown results (see parse_structured_analysis).
+    """
+    text = analysis_text.lstrip()
+    return text.startswith("{") or bool(_CODE_FENCE_RE.match(text))
+
+
+def parse_analysis(analysis_text: str) -> StructuredAnalysis:
+    """Parses a stored analysis of either mode with the parser for the mode it was written in."""
+    return parse_structured_analysis(analysis_text) if is_json_output(analysis_text) else from_markdown(analysis_text)
+
+
+def parse_structured_analysis(analysis_text: str) -> StructuredAnalysis:
+    """
+    Parses the result of a structured analyze_content() call. That is JSON, unless the
+    JSON response failed validation and the request was answered again in Markdown
+    mode; such results go through the Markdown parser.
+
+    Args:
+        analysis_text: The response text from a structured analyze_content() call.
+
+    Returns:
+        The typed analysis; its source field records which parser produced it.
+    """
+    try:
+        return parse_json_analysis(analysis_text)
+    except SchemaValidationError as e:
+        logging.info(f"Structured result is not schema-valid JSON ({e}). Parsing it as Markdown.")
+    return from_markdown(analysis_text)
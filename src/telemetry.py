@@ -0,0 +1,314 @@
+# src/telemetry.py
+import json
+import time
+import logging
+import threading
+import contextvars
+from typing import Dict, Any, List, Optional, Tuple
+
+# Import project modules
+try:
+    from . import config
+except ImportError:
+    try:
+        import config
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        config = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Stage timing spans. A span times a block of code:
+#
+#     with telemetry.span("prepare_request"):
+#         telemetry.stage("mime_detection")   # ends at the next stage() or when the span exits
+#         ...
+#         telemetry.stage("pdf_render")
+#         ...
+#
+# and stages split the current span into consecutive phases without re-indenting the code.
+# Finished spans and stages are handed to every configured sink. When telemetry is
+# disabled span() returns a shared no-op object and stage() returns immediately.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # Seconds
+SINK_NAMES = ("histogram", "log", "otel")
+
+# Offset that turns perf_counter() readings into Unix time (for exporters that need timestamps)
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+# --- Sinks ---
+class HistogramSink:
+    """Keeps a cumulative latency histogram per span/stage name (rendered for /metrics)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[Any]] = {} # name -> [bucket counts, sum, count]
+
+    def record(self, name: str, start: float, duration: float, attributes: Dict[str, Any]):
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += duration
+            series[2] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Returns {name: {"buckets": [(le, cumulative count)], "sum": s, "count": n}}."""
+        with self._lock:
+            result = {}
+            for name, (counts, total, count) in self._series.items():
+                cumulative, running = [], 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    running += bucket_count
+                    cumulative.append((bound, running))
+                result[name] = {"buckets": cumulative, "sum": total, "count": count}
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class LogSink:
+    """Writes one JSON log record per finished span or stage."""
+
+    def __init__(self, logger_name: str = "telemetry", level: int = logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def record(self, name: str, start: float, duration: float, attributes: Dict[str, Any]):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        payload = {"span": name, "duration_ms": round(duration * 1000, 3)}
+        payload.update(attributes)
+        self.logger.log(self.level, json.dumps(payload, default=str))
+
+
+class OpenTelemetrySink:
+    """
+    Exports spans through the OpenTelemetry API (opentelemetry-api/sdk must be
+    installed and a tracer provider configured by the application). Spans are
+    exported when they finish, with their original start and end times.
+    """
+
+    def __init__(self, tracer_name: str = "clu-backend"):
+        from opentelemetry import trace # Optional dependency
+        self.tracer = trace.get_tracer(tracer_name)
+
+    def record(self, name: str, start: float, duration: float, attributes: Dict[str, Any]):
+        start_ns = int((start + _EPOCH_OFFSET) * 1e9)
+        otel_attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in attributes.items()
+        }
+        otel_span = self.tracer.start_span(name, start_time=start_ns, attributes=otel_attributes)
+        otel_span.end(end_time=start_ns + int(duration * 1e9))
+
+
+# --- Spans ---
+_enabled = False
+_sinks: list = []
+_histogram: Optional[HistogramSink] = None
+_current_span: contextvars.ContextVar = contextvars.ContextVar("telemetry_current_span", default=None)
+
+
+class Span:
+    """A timed block; use through span(). Stages are recorded as '<span name>.<stage name>'."""
+
+    __slots__ = ("name", "attributes", "start", "_stage_name", "_stage_start", "_token")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self._stage_name = None
+        self._stage_start = 0.0
+        self._token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self._end_stage(end)
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _emit(self.name, self.start, end - self.start, self.attributes)
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def stage(self, name: str):
+        now = time.perf_counter()
+        self._end_stage(now)
+        self._stage_name = f"{self.name}.{name}"
+        self._stage_start = now
+
+    def _end_stage(self, now: float):
+        if self._stage_name is not None:
+            _emit(self._stage_name, self._stage_start, now - self._stage_start, {})
+            self._stage_name = None
+
+
+class _NoopSpan:
+    """Returned by span() when telemetry is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def stage(self, name: str):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """
+    Returns a context manager timing the enclosed block as a span called name.
+
+    Args:
+        name: Span name (used as the stage label in /metrics).
+        **attributes: Extra fields for the log and OpenTelemetry sinks.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def stage(name: str):
+    """Starts a new stage of the current span (ending the previous stage, if any)."""
+    if not _enabled:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.stage(name)
+
+
+def end_stage():
+    """Ends the current stage without starting another one."""
+    if not _enabled:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current._end_stage(time.perf_counter())
+
+
+def _emit(name: str, start: float, duration: float, attributes: Dict[str, Any]):
+    for sink in _sinks:
+        try:
+            sink.record(name, start, duration, attributes)
+        except Exception as e:
+            logging.warning(f"Telemetry sink {type(sink).__name__} failed: {e}")
+
+
+# --- Configuration ---
+def configure(enabled: bool, sink_names: Optional[List[str]] = None, extra_sinks: Optional[list] = None):
+    """
+    Enables or disables span recording and selects the sinks.
+
+    Args:
+        enabled: False turns span() and stage() into no-ops.
+        sink_names: Any of "histogram" (needed for /metrics), "log" and "otel".
+        extra_sinks: Additional sink objects with a record(name, start, duration, attributes) method.
+    """
+    global _enabled, _sinks, _histogram
+    sinks, histogram = [], None
+    for sink_name in sink_names or []:
+        if sink_name == "histogram":
+            histogram = HistogramSink()
+            sinks.append(histogram)
+        elif sink_name == "log":
+            sinks.append(LogSink())
+        elif sink_name == "otel":
+            try:
+                sinks.append(OpenTelemetrySink())
+            except ImportError:
+                logging.warning("TELEMETRY_SINKS includes 'otel' but opentelemetry is not installed; skipping it.")
+        else:
+            logging.warning(f"Unknown telemetry sink '{sink_name}'. Expected one of {SINK_NAMES}.")
+    sinks.extend(extra_sinks or [])
+    _sinks, _histogram = sinks, histogram
+    _enabled = bool(enabled and sinks)
+
+
+def get_histogram_sink() -> Optional[HistogramSink]:
+    """Returns the histogram sink backing /metrics, or None if it is not configured."""
+    return _histogram
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+# --- Prometheus Text Format ---
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_metric(name: str, metric_type: str, help_text: str,
+                  samples: List[Tuple[Dict[str, Any], float]]) -> List[str]:
+    """
+    Formats one metric family in the Prometheus text exposition format.
+
+    Args:
+        name: Metric name.
+        metric_type: "counter" or "gauge".
+        help_text: HELP line text.
+        samples: (labels, value) pairs.
+
+    Returns:
+        The lines of the metric family.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    return lines
+
+
+def render_stage_histograms(metric_name: str = "clu_stage_duration_seconds") -> List[str]:
+    """Renders the histogram sink as a Prometheus histogram with one series per stage."""
+    if _histogram is None:
+        return []
+    lines = [
+        f"# HELP {metric_name} Duration of analysis stages and request handling spans.",
+        f"# TYPE {metric_name} histogram",
+    ]
+    for stage_name, series in sorted(_histogram.snapshot().items()):
+        for bound, count in series["buckets"]:
+            lines.append(f"{metric_name}_bucket{_format_labels({'stage': stage_name, 'le': bound})} {count}")
+        lines.append(f"{metric_name}_bucket{_format_labels({'stage': stage_name, 'le': '+Inf'})} {series['count']}")
+        lines.append(f"{metric_name}_sum{_format_labels({'stage': stage_name})} {series['sum']:.6f}")
+        lines.append(f"{metric_name}_count{_format_labels({'stage': stage_name})} {series['count']}")
+    return lines
+
+
+configure(
+    getattr(config, 'TELEMETRY_ENABLED', False),
+    getattr(config, 'TELEMETRY_SINKS', ["histogram"]),
+)
@@ -1,18 +1,55 @@
 # src/utils.py
 import os
 import logging
+import importlib.util # To check for optional dependencies without importing them
 import json
 import re # Import regular expressions for parsing
 from typing import List, Dict, Any, Optional, Tuple, Generator
 import io # For handling image bytes
-
-# Try importing fitz (PyMuPDF) and handle potential ImportError
-try:
-    import fitz # PyMuPDF
-except ImportError:
-    logging.warning("PyMuPDF library not found. PDF processing will be disabled. "
-                    "Install it using: pip install PyMuPDF")
-    fitz = None # Set fitz to None if not installed
+import threading # Guards the image preprocessing counters
+from collections import deque # Pages being rendered ahead of the consumer
+import multiprocessing # Spawn context for the rendering pool
+from concurrent.futures import ProcessPoolExecutor # For page-parallel PDF rendering
+
+# PyMuPDF (fitz) and Pillow are imported on first use rather than at module import,
+# so processes that never touch a PDF or image (and cold starts) don't pay for them.
+fitz = None # Set by _get_fitz() once PyMuPDF has been imported
+_fitz_import_attempted = False
+PILImage = None # Set by _get_pil() once Pillow has been imported
+ImageOps = None
+
+def _get_fitz():
+    """Imports PyMuPDF on first use. Returns the module, or None if it is not installed."""
+    global fitz, _fitz_import_attempted
+    if not _fitz_import_attempted:
+        try:
+            import fitz as _fitz # PyMuPDF
+            fitz = _fitz
+        except ImportError:
+            logging.warning("PyMuPDF library not found. PDF processing will be disabled. "
+                            "Install it using: pip install PyMuPDF")
+        _fitz_import_attempted = True
+    return fitz
+
+def pdf_support_available() -> bool:
+    """Returns True if PyMuPDF is installed, without importing it."""
+    return fitz is not None or (not _fitz_import_attempted and importlib.util.find_spec("fitz") is not None)
+
+def _get_pil():
+    """Imports Pillow on first use. Returns (Image, ImageOps), or (None, None) if it is not installed."""
+    global PILImage, ImageOps
+    if PILImage is None:
+        try:
+            from PIL import Image as _Image, ImageOps as _ImageOps
+            PILImage, ImageOps = _Image, _ImageOps
+        except ImportError:
+            return None, None
+    return PILImage, ImageOps
+
+def preload_optional_dependencies():
+    """Imports PyMuPDF and Pillow now (used by warm-up so the first request doesn't pay for it)."""
+    _get_fitz()
+    _get_pil()
 
 # Import configuration variables (Input/Output Dirs)
 # This assumes config.py is in the same src directory
@@ -32,6 +69,11 @@ SUPPORTED_PDF_EXTENSIONS = {".pdf"}
 # Combine all supported extensions for easier checking
 ALL_SUPPORTED_EXTENSIONS = SUPPORTED_TEXT_EXTENSIONS | SUPPORTED_IMAGE_EXTENSIONS | SUPPORTED_PDF_EXTENSIONS
 
+def input_file_extension(filename: str) -> str:
+    """Lower-cased extension of filename including the dot ("" if it has none)."""
+    dot = filename.rfind('.')
+    return filename[dot:].lower() if dot > 0 else ""
+
 # --- UPDATED FUNCTION: Recursively find input files ---
 def get_input_files(input_dir: str) -> List[str]:
     """
@@ -50,6 +92,7 @@ def get_input_files(input_dir: str) -> List[str]:
         return supported_files # Return empty list
 
     logging.info(f"Recursively scanning for supported files in: {input_dir}")
+    pdf_supported = pdf_support_available()
     try:
         # os.walk yields (directory_path, subdirectories, filenames) for each directory
         for dirpath, dirnames, filenames in os.walk(input_dir):
@@ -62,10 +105,10 @@ def get_input_files(input_dir: str) -> List[str]:
                     continue
 
                 # Check if the file extension is supported
-                _, file_extension = os.path.splitext(filename.lower())
+                file_extension = input_file_extension(filename)
                 if file_extension in ALL_SUPPORTED_EXTENSIONS:
                     # Special check for PDF if PyMuPDF is not installed
-                    if file_extension in SUPPORTED_PDF_EXTENSIONS and not fitz:
+                    if file_extension in SUPPORTED_PDF_EXTENSIONS and not pdf_supported:
                         logging.warning(f"Skipping PDF file due to missing PyMuPDF: {filename}")
                         continue
 
@@ -84,7 +127,8 @@ def get_input_files(input_dir: str) -> List[str]:
 
 def save_results_to_json(results_data: Dict[str, Any], output_dir: str, filename: str):
     """
-    Saves the analysis results dictionary to a JSON file.
+    Saves the analysis results dictionary to a JSON file (atomically). Batch runs
+    stream their results through results_sink instead of building this dictionary.
 
     Args:
         results_data: A dictionary where keys are filenames and values are analysis results.
@@ -100,9 +144,19 @@ def save_results_to_json(results_data: Dict[str, Any], output_dir: str, filename
             logging.warning(f"Output directory did not exist. Creating: {output_dir}")
             os.makedirs(output_dir)
 
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            # Use ensure_ascii=False to handle potential non-ASCII characters in analysis
-            json.dump(results_data, f, indent=4, ensure_ascii=False)
+        # Write to a temporary file and move it into place, so an interrupted save
+        # never leaves a truncated results file behind
+        tmp_filepath = f"{output_filepath}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_filepath, 'w', encoding='utf-8') as f:
+                # Use ensure_ascii=False to handle potential non-ASCII characters in analysis
+                json.dump(results_data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filepath, output_filepath)
+        finally:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
         logging.info("Results saved successfully.")
 
     except TypeError as e:
@@ -113,23 +167,85 @@ def save_results_to_json(results_data: Dict[str, Any], output_dir: str, filename
         logging.error(f"An unexpected error occurred while saving results: {e}", exc_info=True)
 
 
-# --- UPDATED FUNCTION: Parse Gemini Analysis Text (with Category) ---
+# --- Analysis Parsing (single pass over the lines of the model output) ---
+# Maps each heading the system prompt asks for to its key in the parsed result.
+_SECTION_KEYS = {
+    "document type": "document_type",
+    "summary": "summary",
+    "key information": "key_info_localization",
+    "category": "category",
+}
+_SECTION_LABELS = {
+    "document_type": "Document Type",
+    "summary": "Summary",
+    "key_info_localization": "Key Information & Localization",
+    "category": "Category",
+}
+# A line can only be a heading if, after indentation, it starts with one of these
+# (markdown '#', bold '**', rule '---', or the first letter of a known heading).
+# Everything else - bullets and body text - is skipped without running a regex.
+_HEADING_FIRST_CHARS = frozenset("#*-dDsSkKcC")
+# Known heading: "**Document Type:**", "## Summary", "Category: Notes". Text after the heading
+# on the same line is captured as 'rest' and starts the section content.
+_SECTION_HEADING_RE = re.compile(
+    r"(?P<hashes>#{1,6}[ \t]*)?(?P<stars>\*{1,2})?"
+    r"(?P<name>document[ \t]+type|summary|key[ \t]+information(?:[ \t]*(?:&|and)[ \t]*localization)?|category)"
+    r"(?=[ \t]*[:*]|[ \t]*$)[ \t]*(?P<colon>:?)[ \t]*\**[ \t]*:?[ \t]*(?P<rest>.*)",
+    re.IGNORECASE,
+)
+# Any other markdown heading, bold-only line or horizontal rule closes the current section.
+_OTHER_HEADING_RE = re.compile(r"#{1,6}[ \t]+\S.*|\*\*[^*]+\*\*[ \t]*:?[ \t]*$|-{3,}[ \t]*$")
+# Nested Key Information fields ("* Location: ..." / "* Confidence: ..." under an item bullet).
+_KEY_INFO_FIELDS = ("location", "confidence")
+
+
+def _parse_key_info_items(key_info_text: str) -> List[Dict[str, Optional[str]]]:
+    """
+    Splits the Key Information & Localization section into structured items.
+
+    Returns:
+        A list of {"info", "location", "confidence"} dictionaries. location and
+        confidence are None when the model did not provide them as nested bullets.
+    """
+    items = []
+    current = None
+    for line in key_info_text.splitlines():
+        stripped = line.lstrip()
+        if stripped[:1] not in ("*", "-", "\u2022") or stripped[1:2] not in (" ", "\t"):
+            continue # Not a bullet
+        text = stripped[1:].strip()
+        if current is not None:
+            label, sep, value = text.partition(":")
+            field = label.strip("* \t").lower() if sep else ""
+            if field in _KEY_INFO_FIELDS:
+                current[field] = value.strip("* \t")
+                continue
+        current = {"info": text, "location": None, "confidence": None}
+        items.append(current)
+    return items
+
+
 def parse_gemini_analysis(analysis_text: str) -> Dict[str, Any]:
     """
     Parses the structured text output expected from the Gemini model based on the prompt.
 
+    The text is scanned once, line by line: a known heading starts a section and
+    the next heading of any kind (or the end of the text) closes it.
+
     Args:
         analysis_text: The string output from the Gemini model.
 
     Returns:
         A dictionary containing parsed sections (Document Type, Summary,
-        Key Information & Localization, Category), or a default structure if parsing fails.
+        Key Information & Localization, Category), the Key Information bullets
+        as structured items, or a default structure if parsing fails.
     """
     # Default structure to return, including the raw text and new category field
     parsed_data = {
         "document_type": "N/A",
         "summary": "N/A",
         "key_info_localization": "N/A",
+        "key_info_items": [],
         "category": "N/A", # Added category field
         "raw_text": analysis_text # Always include the original text
     }
@@ -141,37 +257,35 @@ def parse_gemini_analysis(analysis_text: str) -> Dict[str, Any]:
         return parsed_data # Return default structure
 
     try:
-        # Use regex to find sections based on headings like "**Document Type:**"
-        # Regex looks for heading, captures content until next potential heading or end of string.
-        # Made regex slightly more robust to variations in spacing and optional colons
-        doc_type_match = re.search(r"^\s*\**Document Type:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
-        summary_match = re.search(r"^\s*\**Summary:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
-        # Allow "Key Information & Localization" or just "Key Information"
-        key_info_match = re.search(r"^\s*\**Key Information(?: & Localization)?:?\**\s*\n?(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
-        category_match = re.search(r"^\s*\**Category:?\**\s*(.*?)(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)", analysis_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
-
-
-        if doc_type_match:
-            parsed_data["document_type"] = doc_type_match.group(1).strip()
-        else:
-            logging.warning("Could not parse 'Document Type' section.")
-
-        if summary_match:
-            parsed_data["summary"] = summary_match.group(1).strip()
-        else:
-             logging.warning("Could not parse 'Summary' section.")
-
-        if key_info_match:
-            parsed_data["key_info_localization"] = key_info_match.group(1).strip()
-        else:
-             logging.warning("Could not parse 'Key Information & Localization' section.")
+        sections: Dict[str, List[str]] = {}
+        current_lines = None # Lines of the section being collected, or None outside a known section
+        for line in analysis_text.splitlines():
+            stripped = line.lstrip()
+            first = stripped[:1]
+            if first in _HEADING_FIRST_CHARS and not (first in "*-" and stripped[1:2] in (" ", "\t")): # Bullets are never headings
+                heading = _SECTION_HEADING_RE.match(stripped)
+                if heading and (heading.group("stars") or heading.group("hashes") or heading.group("colon")):
+                    name = " ".join(heading.group("name").lower().split())
+                    key = _SECTION_KEYS["key information" if name.startswith("key information") else name]
+                    if key in sections:
+                        current_lines = None # Keep the first occurrence, like the previous regex parser
+                        continue
+                    current_lines = sections[key] = [heading.group("rest")]
+                    continue
+                if _OTHER_HEADING_RE.match(stripped):
+                    current_lines = None
+                    continue
+            if current_lines is not None:
+                current_lines.append(line)
 
-        # Extract the category
-        if category_match:
-            parsed_data["category"] = category_match.group(1).strip()
-        else:
-             logging.warning("Could not parse 'Category' section.")
+        for key, label in _SECTION_LABELS.items():
+            if key in sections:
+                parsed_data[key] = "\n".join(sections[key]).strip()
+            else:
+                logging.warning(f"Could not parse '{label}' section.")
 
+        if "key_info_localization" in sections:
+            parsed_data["key_info_items"] = _parse_key_info_items(parsed_data["key_info_localization"])
 
     except Exception as e:
         logging.error(f"Error parsing analysis text: {e}", exc_info=True)
@@ -179,15 +293,276 @@ def parse_gemini_analysis(analysis_text: str) -> Dict[str, Any]:
         parsed_data["document_type"] = "Parsing Error"
         parsed_data["summary"] = "Parsing Error"
         parsed_data["key_info_localization"] = "Parsing Error"
+        parsed_data["key_info_items"] = []
         parsed_data["category"] = "Parsing Error" # Indicate error here too
 
     return parsed_data
 
 
-# --- UPDATED FUNCTION: Render PDF Page to Image Bytes ---
+# --- PDF Rendering ---
+PDF_IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def _encode_pixmap(pix, image_format: str = "png", quality: int = 85) -> bytes:
+    """
+    Encodes a PyMuPDF pixmap as PNG, JPEG or WebP bytes.
+
+    Args:
+        pix: The rendered fitz.Pixmap.
+        image_format: "png", "jpeg" (or "jpg") or "webp".
+        quality: Encoder quality (1-100) for JPEG/WebP.
+
+    Returns:
+        The encoded image bytes.
+    """
+    image_format = image_format.lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format == "png":
+        return pix.tobytes(output="png")
+    if image_format not in PDF_IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported PDF page image format: {image_format}")
+    PILImage, _ = _get_pil()
+    if PILImage is None:
+        raise ImportError("Pillow is required to encode PDF pages as JPEG/WebP. Install it using: pip install Pillow")
+    mode = "RGBA" if pix.alpha else "RGB"
+    img = PILImage.frombytes(mode, (pix.width, pix.height), pix.samples)
+    if mode == "RGBA" and image_format == "jpeg":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+def _render_page(page, zoom: float = 2, dpi: Optional[int] = None, image_format: str = "png", quality: int = 85) -> bytes:
+    """Renders an already-loaded PDF page to encoded image bytes."""
+    if dpi:
+        zoom = dpi / 72.0 # PDF user space is 72 points per inch
+    pix = page.get_pixmap(matrix=_get_fitz().Matrix(zoom, zoom))
+    return _encode_pixmap(pix, image_format, quality)
+
+# Per-process state for the rendering pool: each worker opens the PDF once.
+_worker_doc = None
+_worker_render_args = None
+
+def _open_pdf(pdf_path: str, pdf_data: Optional[bytes] = None):
+    """Opens a PDF from disk, or from memory if pdf_data is given (pdf_path is then only a name)."""
+    if pdf_data is not None:
+        return _get_fitz().open(stream=pdf_data, filetype="pdf")
+    return _get_fitz().open(pdf_path)
+
+def pdf_page_count(pdf_path: str, pdf_data: Optional[bytes] = None) -> int:
+    """Returns the number of pages of a PDF (opening it does not parse the pages)."""
+    with _open_pdf(pdf_path, pdf_data) as doc:
+        return len(doc)
+
+def _init_render_worker(pdf_path: str, render_args: Dict[str, Any], pdf_data: Optional[bytes] = None):
+    global _worker_doc, _worker_render_args
+    _worker_doc = _open_pdf(pdf_path, pdf_data)
+    _worker_render_args = render_args
+
+def _render_page_in_worker(page_num: int) -> bytes:
+    return _render_page(_worker_doc.load_page(page_num), **_worker_render_args)
+
+def iter_pdf_page_images(
+    pdf_path: str,
+    max_pages: Optional[int] = None,
+    zoom: float = 2,
+    dpi: Optional[int] = None,
+    image_format: str = "png",
+    quality: int = 85,
+    processes: int = 0,
+    pdf_data: Optional[bytes] = None,
+) -> Generator[Tuple[int, bytes, str], None, None]:
+    """
+    Opens a PDF once and yields its pages rendered as images, in page order.
+
+    Args:
+        pdf_path: Path to the PDF file.
+        max_pages: Maximum number of pages to render (None renders all pages).
+        zoom: Zoom factor to apply (ignored if dpi is given). Default is 2.
+        dpi: Optional target resolution in dots per inch.
+        image_format: Output format: "png", "jpeg" or "webp".
+        quality: Encoder quality for JPEG/WebP (1-100).
+        processes: If greater than 1 and more than one page is rendered, pages are
+                   rasterized in a process pool of this size.
+        pdf_data: Optional PDF content already in memory; pdf_path is then only used in logs.
+
+    Yields:
+        (page_num, image_bytes, mime_type) tuples. Pages that fail to render are
+        logged and skipped.
+    """
+    fitz = _get_fitz()
+    if not fitz:
+        logging.error("PyMuPDF (fitz) is not installed. Cannot render PDF.")
+        return
+
+    image_format = "jpeg" if image_format.lower() == "jpg" else image_format.lower()
+    mime_type = PDF_IMAGE_MIME_TYPES.get(image_format, "image/png")
+    render_args = {"zoom": zoom, "dpi": dpi, "image_format": image_format, "quality": quality}
+
+    with _open_pdf(pdf_path, pdf_data) as doc:
+        num_pages = len(doc)
+        pages_to_render = num_pages if max_pages is None else min(num_pages, max_pages)
+        logging.info(f"Rendering {pages_to_render} of {num_pages} pages from {os.path.basename(pdf_path)}.")
+        for page_num, img_bytes in _iter_rendered_pages(doc, pdf_path, list(range(pages_to_render)), render_args,
+                                                        processes, pdf_data):
+            yield page_num, img_bytes, mime_type
+
+
+def _iter_rendered_pages(doc, pdf_path: str, page_numbers: List[int], render_args: Dict[str, Any],
+                         processes: int = 0, pdf_data: Optional[bytes] = None) -> Generator[Tuple[int, bytes], None, None]:
+    """
+    Renders the given pages of an open document, in the order given, either
+    in-process or in a process pool. Pages that fail to render are logged and skipped.
+    The pool renders at most two pages per worker ahead of the consumer, so long
+    documents are never held in memory all at once. Its workers are spawned rather
+    than forked: this runs inside multithreaded API and batch workers, and a forked
+    child can inherit locks held by other threads (logging, gRPC) and deadlock.
+    """
+    if processes and processes > 1 and len(page_numbers) > 1:
+        workers = min(processes, len(page_numbers))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_render_worker,
+                                 initargs=(pdf_path, render_args, pdf_data)) as executor:
+            pending = deque()
+            remaining = iter(page_numbers)
+            for page_num in remaining:
+                pending.append((page_num, executor.submit(_render_page_in_worker, page_num)))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                page_num, future = pending.popleft()
+                try:
+                    img_bytes = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to render page {page_num} of PDF {pdf_path}: {e}", exc_info=True)
+                    img_bytes = None
+                next_page = next(remaining, None)
+                if next_page is not None:
+                    pending.append((next_page, executor.submit(_render_page_in_worker, next_page)))
+                if img_bytes is not None:
+                    yield page_num, img_bytes
+        return
+
+    for page_num in page_numbers:
+        try:
+            img_bytes = _render_page(doc.load_page(page_num), **render_args)
+        except Exception as e:
+            logging.error(f"Failed to render page {page_num} of PDF {pdf_path}: {e}", exc_info=True)
+            continue
+        logging.debug(f"Successfully rendered page {page_num} of {pdf_path} to image bytes.")
+        yield page_num, img_bytes
+
+
+# --- PDF Text-Layer Triage ---
+PDF_TEXT_MODES = {"off", "auto", "mixed"}
+
+def classify_pdf_page(page, min_text_chars: int = 200, min_drawings: int = 10) -> Tuple[str, str]:
+    """
+    Decides how a PDF page should be sent to the model, based on its text layer.
+
+    Args:
+        page: A loaded fitz.Page.
+        min_text_chars: Minimum number of extracted characters for the text
+                        layer to be considered usable.
+        min_drawings: Number of vector drawing operations above which the page
+                      is considered to contain a figure (charts, diagrams).
+
+    Returns:
+        A (decision, text) tuple. decision is "text" (usable text layer, no
+        figures), "mixed" (usable text layer plus embedded images or vector
+        figures) or "image" (no usable text layer, e.g. scanned pages).
+    """
+    text = page.get_text("text").strip()
+    if len(text) < min_text_chars:
+        return "image", text
+    has_figures = bool(page.get_images(full=False)) or len(page.get_drawings()) >= min_drawings
+    return ("mixed" if has_figures else "text"), text
+
+
+def iter_pdf_page_parts(
+    pdf_path: str,
+    max_pages: Optional[int] = None,
+    text_mode: str = "off",
+    min_text_chars: int = 200,
+    zoom: float = 2,
+    dpi: Optional[int] = None,
+    image_format: str = "png",
+    quality: int = 85,
+    processes: int = 0,
+    pdf_data: Optional[bytes] = None,
+) -> Generator[Tuple[int, str, Any, str], None, None]:
+    """
+    Opens a PDF once and yields the content to send for each page, using the
+    extracted text layer instead of a rendered image where that is sufficient.
+
+    Args:
+        pdf_path: Path to the PDF file.
+        max_pages: Maximum number of pages to process (None processes all pages).
+        text_mode: "off" renders every page as an image (default).
+                   "auto" sends text for text-only pages and an image otherwise.
+                   "mixed" additionally sends both the text and the image for
+                   pages that have a text layer and figures.
+        min_text_chars: Minimum extracted characters for a page's text layer to be used.
+        zoom, dpi, image_format, quality, processes: Rendering options, see iter_pdf_page_images().
+        pdf_data: Optional PDF content already in memory; pdf_path is then only used in logs.
+
+    Yields:
+        (page_num, kind, data, mime_type) tuples in page order. kind is "text"
+        (data is a str) or "image" (data is bytes). A mixed page yields its text
+        first, then its image.
+    """
+    fitz = _get_fitz()
+    if not fitz:
+        logging.error("PyMuPDF (fitz) is not installed. Cannot process PDF.")
+        return
+    if text_mode not in PDF_TEXT_MODES:
+        raise ValueError(f"Unknown PDF text mode '{text_mode}'. Expected one of: {sorted(PDF_TEXT_MODES)}")
+
+    image_format = "jpeg" if image_format.lower() == "jpg" else image_format.lower()
+    mime_type = PDF_IMAGE_MIME_TYPES.get(image_format, "image/png")
+    render_args = {"zoom": zoom, "dpi": dpi, "image_format": image_format, "quality": quality}
+
+    with _open_pdf(pdf_path, pdf_data) as doc:
+        num_pages = len(doc)
+        pages_to_send = num_pages if max_pages is None else min(num_pages, max_pages)
+
+        # Triage every page first (text extraction is cheap compared to rasterizing)
+        plan = [] # List of (page_num, send_text, send_image, text)
+        for page_num in range(pages_to_send):
+            if text_mode == "off":
+                plan.append((page_num, False, True, ""))
+                continue
+            try:
+                decision, text = classify_pdf_page(doc.load_page(page_num), min_text_chars)
+            except Exception as e:
+                logging.warning(f"Text extraction failed for page {page_num} of {pdf_path}, rendering instead: {e}")
+                decision, text = "image", ""
+            if decision == "mixed" and text_mode == "auto":
+                decision = "image"
+            plan.append((page_num, decision in ("text", "mixed"), decision in ("image", "mixed"), text))
+
+        image_pages = [page_num for page_num, _, send_image, _ in plan if send_image]
+        logging.info(f"PDF triage for {os.path.basename(pdf_path)}: {pages_to_send} of {num_pages} pages, "
+                     f"{pages_to_send - len(image_pages)} text-only, {len(image_pages)} rendered.")
+
+        rendered = _iter_rendered_pages(doc, pdf_path, image_pages, render_args, processes, pdf_data)
+        next_image = next(rendered, None)
+        for page_num, send_text, send_image, text in plan:
+            if send_text:
+                yield page_num, "text", f"[PDF page {page_num + 1} text layer]\n{text}", "text/plain"
+            if send_image:
+                # Rendered pages come back in page order; a page that failed to render is absent
+                while next_image is not None and next_image[0] < page_num:
+                    next_image = next(rendered, None)
+                if next_image is not None and next_image[0] == page_num:
+                    yield page_num, "image", next_image[1], mime_type
+                    next_image = next(rendered, None)
+
+
 def render_pdf_page_to_image_bytes(pdf_path: str, page_num: int, zoom: int = 2) -> Optional[bytes]:
     """
     Renders a specific page of a PDF file into PNG image bytes using PyMuPDF.
+    Prefer iter_pdf_page_images() when rendering more than one page of the same file.
 
     Args:
         pdf_path: Path to the PDF file.
@@ -197,43 +572,128 @@ def render_pdf_page_to_image_bytes(pdf_path: str, page_num: int, zoom: int = 2)
     Returns:
         PNG image data as bytes, or None if an error occurs or PyMuPDF is not installed.
     """
+    fitz = _get_fitz()
     if not fitz:
         logging.error("PyMuPDF (fitz) is not installed. Cannot render PDF.")
         return None
 
-    doc = None # Initialize doc to None
     try:
-        doc = fitz.open(pdf_path)
-        if page_num < 0 or page_num >= len(doc):
-            logging.error(f"Invalid page number {page_num} for PDF {pdf_path} with {len(doc)} pages.")
-            # Ensure doc is closed before returning None
-            if doc: doc.close()
-            return None
-
-        page = doc.load_page(page_num)
-
-        # Configure the matrix for zooming
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
-
-        # Use tobytes() instead of save() for in-memory bytes
-        img_bytes = pix.tobytes(output="png") # Get bytes directly
-
-        doc.close() # Close the PDF document
+        with fitz.open(pdf_path) as doc:
+            if page_num < 0 or page_num >= len(doc):
+                logging.error(f"Invalid page number {page_num} for PDF {pdf_path} with {len(doc)} pages.")
+                return None
+            img_bytes = _render_page(doc.load_page(page_num), zoom=zoom)
         logging.debug(f"Successfully rendered page {page_num} of {pdf_path} to image bytes.")
         return img_bytes
 
     except Exception as e:
         logging.error(f"Failed to render page {page_num} of PDF {pdf_path}: {e}", exc_info=True)
-        # Ensure doc is closed even if error occurs during rendering
-        if doc:
-            try:
-                doc.close()
-            except Exception as close_err:
-                logging.error(f"Error closing PDF document after rendering error: {close_err}")
         return None
 
 
+# --- Image Preprocessing (downscale + re-encode before upload) ---
+IMAGE_OUTPUT_MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+_EXIF_ORIENTATION_TAG = 0x0112
+_image_stats_lock = threading.Lock()
+_image_stats = {"images": 0, "resized": 0, "bytes_before": 0, "bytes_after": 0}
+
+def preprocess_image_bytes(
+    image_bytes: bytes,
+    max_edge: int = 2048,
+    max_pixels: int = 4_000_000,
+    output_format: str = "webp",
+    quality: int = 85,
+) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Prepares an image for upload: applies EXIF orientation, drops all metadata,
+    downscales it to fit within max_edge / max_pixels and re-encodes it.
+
+    PNG input (scans, line art) is re-encoded losslessly: WebP lossless, or PNG when
+    output_format is "jpeg". If the image needed neither resizing nor rotation and
+    re-encoding would not make it smaller, the original bytes are returned unchanged.
+
+    Args:
+        image_bytes: The original encoded image.
+        max_edge: Maximum length in pixels of the longest side (0 disables the limit).
+        max_pixels: Maximum total pixel count (0 disables the limit).
+        output_format: "webp", "jpeg" or "png".
+        quality: Encoder quality for lossy JPEG/WebP (1-100).
+
+    Returns:
+        An (image_bytes, mime_type, metrics) tuple. metrics contains the original
+        and final sizes in bytes and pixels, and whether the original was kept.
+    """
+    PILImage, ImageOps = _get_pil()
+    if PILImage is None:
+        raise ImportError("Pillow is required for image preprocessing. Install it using: pip install Pillow")
+    output_format = "jpeg" if output_format.lower() == "jpg" else output_format.lower()
+    if output_format not in IMAGE_OUTPUT_MIME_TYPES:
+        raise ValueError(f"Unsupported image output format: {output_format}")
+
+    with PILImage.open(io.BytesIO(image_bytes)) as img:
+        original_size = img.size
+        original_mime_type = PILImage.MIME.get(img.format or "")
+        lossless = img.format == "PNG"
+        if lossless and output_format == "jpeg":
+            output_format = "png"
+        rotated = img.getexif().get(_EXIF_ORIENTATION_TAG, 1) != 1
+        img = ImageOps.exif_transpose(img) # Auto-rotate phone photos from EXIF orientation
+
+        width, height = img.size
+        scale = 1.0
+        if max_edge and max(width, height) > max_edge:
+            scale = min(scale, max_edge / max(width, height))
+        if max_pixels and width * height > max_pixels:
+            scale = min(scale, (max_pixels / (width * height)) ** 0.5)
+        if scale < 1.0:
+            new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            img = img.resize(new_size, PILImage.LANCZOS)
+
+        # JPEG has no alpha channel; palette/other modes are normalized for every encoder
+        if output_format == "jpeg" or img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")
+
+        buffer = io.BytesIO()
+        # Saving without exif/icc arguments strips the original metadata
+        if output_format == "png":
+            save_kwargs = {"optimize": True}
+        elif output_format == "webp" and lossless:
+            save_kwargs = {"lossless": True}
+        else:
+            save_kwargs = {"quality": quality}
+        img.save(buffer, format=output_format.upper(), **save_kwargs)
+        output_bytes = buffer.getvalue()
+        final_size = img.size
+
+    mime_type = IMAGE_OUTPUT_MIME_TYPES[output_format]
+    kept_original = (final_size == original_size and not rotated and original_mime_type is not None
+                     and len(output_bytes) >= len(image_bytes))
+    if kept_original: # Re-encoding would only make the upload bigger
+        output_bytes, mime_type = image_bytes, original_mime_type
+    metrics = {
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(output_bytes),
+        "pixels_before": original_size,
+        "pixels_after": final_size,
+        "kept_original": kept_original,
+    }
+    with _image_stats_lock:
+        _image_stats["images"] += 1
+        _image_stats["resized"] += int(final_size != original_size)
+        _image_stats["bytes_before"] += len(image_bytes)
+        _image_stats["bytes_after"] += len(output_bytes)
+    logging.info(f"Preprocessed image {original_size[0]}x{original_size[1]} -> {final_size[0]}x{final_size[1]}, "
+                 f"{len(image_bytes)} -> {len(output_bytes)} bytes ({mime_type}{', original kept' if kept_original else ''}).")
+    return output_bytes, mime_type, metrics
+
+
+def get_image_preprocess_stats() -> Dict[str, int]:
+    """Returns cumulative image preprocessing counters (images, resized, bytes_before, bytes_after)."""
+    with _image_stats_lock:
+        return dict(_image_stats)
+
+
 # --- Example Usage (for testing this script directly) ---
 if __name__ == '__main__':
     # This block runs only when the script is executed directly from the root folder using:
@@ -1,32 +1,84 @@
 # src/vllm_handler.py
 import logging
 import os
-from PIL import Image # Keep import for potential use elsewhere or future checks
 import mimetypes # To determine file type
 import io
+import time
+import threading # For the per-process model registry lock
+import contextvars
+import itertools # Re-attaches the first chunk of a response stream
+from concurrent.futures import ThreadPoolExecutor # Concurrent page-group requests for long PDFs
+from typing import BinaryIO, Callable, Dict, Any, Iterator, List, Optional, NamedTuple, Generator, Tuple, Union
 
-# Import Google Cloud Vertex AI libraries
-import vertexai
-from vertexai.generative_models import (
-    GenerativeModel,
-    Part,
-    FinishReason,
-    Image as VertexImage # Renamed to avoid conflict with PIL.Image
-)
-import vertexai.preview.generative_models as generative_models
+# Google Cloud Vertex AI libraries are imported on first use (see _load_vertex_sdk).
+# Importing them costs ~2s, which would otherwise be paid by every process at startup.
+vertexai = None
+GenerativeModel = None
+Part = None
+FinishReason = None
+VertexImage = None # vertexai.generative_models.Image, renamed to avoid conflict with PIL.Image
+generative_models = None
+_vertex_sdk_lock = threading.Lock()
+
+def _load_vertex_sdk():
+    """Imports the Vertex AI SDK into this module's globals (idempotent, thread-safe)."""
+    global vertexai, GenerativeModel, Part, FinishReason, VertexImage, generative_models
+    if GenerativeModel is not None:
+        return
+    with _vertex_sdk_lock:
+        if GenerativeModel is not None:
+            return
+        import vertexai as _vertexai
+        from vertexai.generative_models import (
+            Part as _Part,
+            FinishReason as _FinishReason,
+            Image as _VertexImage,
+        )
+        import vertexai.preview.generative_models as _generative_models
+        from vertexai.generative_models import GenerativeModel as _GenerativeModel
+        vertexai, Part, FinishReason, VertexImage = _vertexai, _Part, _FinishReason, _VertexImage
+        generative_models = _generative_models
+        GenerativeModel = _GenerativeModel # Assigned last: it is the "loaded" flag
 
 # Import project modules
 try:
     from . import config
     from . import utils
+    from . import response_cache
+    from . import structured_output
+    from . import telemetry
+    from . import logging_config
+    from . import resilience
+    from . import model_router
+    from . import packing
+    from . import context_cache
+    from . import long_document
 except ImportError:
     try:
         import config
         import utils
+        import response_cache
+        import structured_output
+        import telemetry
+        import logging_config
+        import resilience
+        import model_router
+        import packing
+        import context_cache
+        import long_document
     except ImportError as e:
         logging.error(f"Fallback import failed: {e}")
         config = None
         utils = None
+        response_cache = None
+        structured_output = None
+        telemetry = None
+        logging_config = None
+        resilience = None
+        model_router = None
+        packing = None
+        context_cache = None
+        long_document = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -47,6 +99,12 @@ def initialize_vertex_ai():
          logging.error("Config module failed to load. Cannot initialize Vertex AI.")
          return False
 
+    try:
+        config.validate()
+    except ValueError as e:
+        logging.error(f"Invalid configuration, cannot initialize Vertex AI: {e}")
+        return False
+
     gcp_project_id = getattr(config, 'GCP_PROJECT_ID', None)
     gcp_region = getattr(config, 'GCP_REGION', None)
 
@@ -55,6 +113,7 @@ def initialize_vertex_ai():
          return False
 
     try:
+        _load_vertex_sdk()
         logging.info(f"Initializing Vertex AI for project '{gcp_project_id}' in region '{gcp_region}'")
         vertexai.init(project=gcp_project_id, location=gcp_region)
         _vertex_ai_initialized = True
@@ -64,30 +123,1227 @@ def initialize_vertex_ai():
         logging.error(f"FATAL ERROR: Failed to initialize Vertex AI: {e}", exc_info=True)
         return False
 
-# --- MODIFIED FUNCTION SIGNATURE ---
-def analyze_content(file_path: str, user_prompt: str, model_id_override: str = None) -> str:
+# --- Model Registry (per-process cache of GenerativeModel instances) ---
+class ModelRegistry:
+    """
+    Thread-safe, per-process cache of GenerativeModel instances keyed by the
+    resolved model name or endpoint resource name. Each model is built lazily
+    on first use and reused by every later call in the same process.
+    """
+
+    def __init__(self, factory: Optional[Callable[[str], Any]] = None):
+        self._models: Dict[str, "GenerativeModel"] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self.factory = factory # Builds a model from its name; None means the configured backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_name: str) -> "GenerativeModel":
+        """
+        Returns the cached model for model_name, building it on first use.
+
+        Args:
+            model_name: Model ID or endpoint resource name.
+
+        Returns:
+            The GenerativeModel instance. Exceptions raised while building the
+            model are propagated to the caller and nothing is cached.
+        """
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is not None:
+                self.hits += 1
+                return model
+            build_lock = self._build_locks.setdefault(model_name, threading.Lock())
+
+        # Only one thread builds a given model; others wait and then reuse it.
+        with build_lock:
+            with self._lock:
+                model = self._models.get(model_name)
+                if model is not None:
+                    self.hits += 1
+                    return model
+                self.misses += 1
+            logging.info(f"Model registry miss, building model '{model_name}'")
+            model = (self.factory or _default_model_factory)(model_name)
+            with self._lock:
+                self._models[model_name] = model
+            return model
+
+    def invalidate(self, model_name: Optional[str] = None):
+        """
+        Drops a cached model (or all models if model_name is None) so that the
+        next call rebuilds it.
+        """
+        with self._lock:
+            if model_name is None:
+                self._models.clear()
+                logging.info("Model registry cleared.")
+            elif self._models.pop(model_name, None) is not None:
+                logging.info(f"Model registry invalidated: {model_name}")
+
+    def reload(self, model_name: str) -> "GenerativeModel":
+        """Invalidates and immediately rebuilds the model for model_name."""
+        self.invalidate(model_name)
+        return self.get(model_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and the names of the cached models."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached_models": sorted(self._models.keys()),
+            }
+
+def _default_model_factory(model_name: str):
+    """Builds a model for the backend selected by config.MODEL_BACKEND."""
+    if getattr(config, 'MODEL_BACKEND', "vertex") == "fake":
+        try:
+            from . import fake_backend
+        except ImportError:
+            import fake_backend
+        return fake_backend.FakeGenerativeModel(
+            model_name,
+            latency_ms=config.FAKE_MODEL_LATENCY_MS,
+            tokens_per_second=config.FAKE_MODEL_TOKENS_PER_SECOND,
+            error_rate=config.FAKE_MODEL_ERROR_RATE,
+            slow_rate=config.FAKE_MODEL_SLOW_RATE,
+        )
+    _load_vertex_sdk()
+    return GenerativeModel(model_name)
+
+_model_registry = ModelRegistry()
+
+def get_model(model_name: str) -> "GenerativeModel":
+    """Returns the process-wide cached GenerativeModel for model_name."""
+    return _model_registry.get(model_name)
+
+def invalidate_model_cache(model_name: Optional[str] = None):
+    """Invalidates one cached model, or every cached model if model_name is None."""
+    _model_registry.invalidate(model_name)
+
+def reload_model(model_name: str) -> "GenerativeModel":
+    """Forces a rebuild of the cached model for model_name."""
+    return _model_registry.reload(model_name)
+
+def get_model_cache_stats() -> Dict[str, Any]:
+    """Returns hit/miss counters for the model registry."""
+    return _model_registry.stats()
+
+def get_model_call_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns retry/hedge/circuit breaker stats per model (see resilience.py)."""
+    return resilience.get_stats() if resilience else {}
+
+def set_model_factory(factory: Optional[Callable[[str], Any]] = None):
+    """
+    Replaces how models are built (e.g. with a fake backend for benchmarks) and
+    drops every cached model. Pass None to go back to the configured backend.
+
+    Args:
+        factory: Callable taking a model name and returning an object with a
+                 GenerativeModel-compatible generate_content() method.
+    """
+    _model_registry.factory = factory
+    _model_registry.invalidate()
+
+# --- Define System Instructions/Structure Prompt ---
+# This prompt tells the model HOW to structure its response.
+SYSTEM_INSTRUCTIONS = """
+        Your task is to act as an expert document analyst. Analyze the provided document content meticulously based *only* on the user's request.
+
+        Follow these steps precisely and structure your output exactly as requested by the user, or if the user asks for specific information (like summary, key points, data extraction), structure your output clearly using Markdown headings based on their request.
+
+        If the user asks a general question or requests analysis without specifying format, structure your output using the following default Markdown headings:
+
+        **Document Type:**
+        [Identify the type: e.g., Handwritten Notes, Typed Essay, Scientific Paper, Form, Receipt, General Text, PDF Page Image, Bar Chart, Line Graph, Diagram. Note if handwriting is present.]
+
+        **Summary:**
+        [Provide a concise 1-2 sentence summary of the main topic or purpose. For charts/graphs, describe what it represents.]
+
+        **Key Information & Localization:**
+        [Identify and extract crucial pieces of information relevant to the user's query (main points, arguments, data points from charts/graphs, axis labels, legends, titles, definitions, form fields/values). For EACH piece of information, describe its precise location (Text files: line/paragraph; Images/PDF pages: visual location like 'top-left', 'bar corresponding to 'Category A'', 'X-axis label', 'legend entry for Series 1'). Use bullet points for clarity.]
+        * [Extracted Info 1]
+            * Location: [Precise location description]
+            * Confidence: [High, Medium, or Low]
+        * [Extracted Info 2]
+            * Location: [Precise location description]
+            * Confidence: [High, Medium, or Low]
+        * ... (continue for all key pieces relevant to the user's request)
+
+        **Category:**
+        [Assign ONE category based on the content from this list: Lecture Notes, Essay Draft, Research Paper, Assignment Submission, Admin Form, Data Visualization, Other. If unsure, state 'Other'.]
+
+        ---
+        Respond *only* based on the user's request applied to the provided document content. Do not add information not present in the document.
+        """
+
+# Used instead of SYSTEM_INSTRUCTIONS in structured (JSON) mode. The layout itself is
+# enforced by the response schema, so this only describes what goes in each field.
+STRUCTURED_SYSTEM_INSTRUCTIONS = """
+        Your task is to act as an expert document analyst. Analyze the provided document content meticulously based *only* on the user's request.
+
+        Respond with a single JSON object with these fields:
+        - document_type: the type of document, e.g. Handwritten Notes, Typed Essay, Scientific Paper, Form, Receipt, General Text, PDF Page Image, Bar Chart, Line Graph, Diagram. Note if handwriting is present.
+        - summary: a concise 1-2 sentence summary of the main topic or purpose. For charts/graphs, describe what it represents.
+        - key_info: the crucial pieces of information relevant to the user's request (main points, arguments, data points, axis labels, legends, titles, definitions, form fields/values). For EACH entry give info, its precise location (Text files: line/paragraph; Images/PDF pages: visual location like 'top-left' or 'X-axis label') and confidence (High, Medium or Low).
+        - category: ONE of Lecture Notes, Essay Draft, Research Paper, Assignment Submission, Admin Form, Data Visualization, Other. If unsure, use Other.
+
+        Do not add information not present in the document.
+        """
+
+# --- Generation Config ---
+GENERATION_CONFIG = {
+    "max_output_tokens": 2048,
+    "temperature": 0.3, # Lower temperature for more factual/structured output
+    "top_p": 0.95,
+    "top_k": 40,
+}
+
+def get_output_settings(structured: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns the (system instructions, generation config) pair for an output mode.
+
+    Args:
+        structured: True for schema-constrained JSON output, False for the Markdown layout.
+    """
+    if not structured:
+        return SYSTEM_INSTRUCTIONS, GENERATION_CONFIG
+    generation_config = dict(
+        GENERATION_CONFIG,
+        response_mime_type="application/json",
+        response_schema=structured_output.ANALYSIS_RESPONSE_SCHEMA,
+    )
+    return STRUCTURED_SYSTEM_INSTRUCTIONS, generation_config
+
+# --- Safety Settings ---
+def get_safety_settings() -> Dict[Any, Any]:
+    """Returns the safety settings sent with every request (requires the Vertex SDK)."""
+    _load_vertex_sdk()
+    return {
+        generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+        generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+        generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+        generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    }
+
+class AnalysisRequest(NamedTuple):
+    """A fully prepared model request for one file."""
+    model: Any # GenerativeModel
+    model_name: str
+    model_source: str # "override", "tuned" or "base"
+    contents: list # User prompt part, file content parts, system instructions part
+    cached_instructions: Optional[str] = None # Set when the instructions are in a context cache instead of contents
+
+class DocumentSource(NamedTuple):
+    """
+    An input document: a file on disk, or content already in memory (e.g. an upload
+    that was never written to disk). Every analyze_* function accepts either a path
+    or a DocumentSource.
+    """
+    name: str # File name, used for MIME type detection and logs
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+    mime_type: Optional[str] = None # Hint used when the name has no known extension
+
+    def exists(self) -> bool:
+        return self.data is not None or (self.path is not None and os.path.isfile(self.path))
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def read_text(self) -> str:
+        """Content decoded as UTF-8, with newlines translated like open(path, 'r')."""
+        if self.data is None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return f.read()
+        return io.TextIOWrapper(io.BytesIO(self.data), encoding='utf-8').read()
+
+def as_document(file_path: Union[str, DocumentSource]) -> DocumentSource:
+    """Wraps a file path in a DocumentSource (DocumentSources are returned unchanged)."""
+    if isinstance(file_path, DocumentSource):
+        return file_path
+    return DocumentSource(name=os.path.basename(file_path), path=file_path)
+
+def document_from_bytes(data: Union[bytes, BinaryIO], filename: str, mime_type: Optional[str] = None) -> DocumentSource:
+    """
+    Builds an in-memory DocumentSource.
+
+    Args:
+        data: The file content, or a binary file-like object to read it from.
+        filename: Original file name (its extension selects how the content is processed).
+        mime_type: Optional MIME type, used when the extension is not recognized.
+    """
+    if not isinstance(data, (bytes, bytearray)):
+        data = data.read()
+    return DocumentSource(name=os.path.basename(filename), data=bytes(data), mime_type=mime_type)
+
+def resolve_model_name(model_id_override: Optional[str] = None):
+    """
+    Resolves which model or endpoint a request should be sent to.
+
+    Args:
+        model_id_override: Optional model ID or endpoint name to override defaults.
+
+    Returns:
+        A (model_name, source) tuple where source is "override", "tuned" or "base".
+    """
+    if model_id_override:
+        return model_id_override, "override"
+
+    # Get IDs from config (ensure config.py is updated and loaded)
+    tuned_model_name = getattr(config, 'TUNED_MODEL_ID', None)
+    base_model_name = getattr(config, 'BASE_MODEL_ID', "gemini-2.0-flash-lite-001") # Ensure a default base model
+
+    if tuned_model_name and "endpoints/" in tuned_model_name:
+        return tuned_model_name, "tuned"
+
+    if not tuned_model_name:
+        logging.info(f"Tuned model ID not configured, using DEFAULT (base) model: {base_model_name}")
+    else: # Tuned model ID was set but wasn't an endpoint format
+        logging.warning(f"Configured TUNED_MODEL_ID '{tuned_model_name}' is not an endpoint format. Using DEFAULT (base) model: {base_model_name}")
+    return base_model_name, "base"
+
+# --- Model Routing (tuned endpoint with base model fallback) ---
+_model_router = None
+_model_router_lock = threading.Lock()
+# (model_name, source) of the model that produced the current context's last analysis
+_answering_model: contextvars.ContextVar = contextvars.ContextVar("answering_model", default=None)
+# Routing decision made for a response cache lookup; counted once the request is sent (_count_route)
+_uncounted_route: contextvars.ContextVar = contextvars.ContextVar("uncounted_route", default=None)
+# Set when the current context's last analysis covers only part of the document (some
+# page groups of a long PDF failed); such results are returned but not cached
+_partial_analysis: contextvars.ContextVar = contextvars.ContextVar("partial_analysis", default=False)
+
+def get_model_router():
+    """Returns the process-wide ModelRouter, or None if routing is disabled or no tuned endpoint is configured."""
+    global _model_router
+    if model_router is None or not getattr(config, 'MODEL_ROUTING_ENABLED', False):
+        return None
+    if _model_router is None:
+        with _model_router_lock:
+            if _model_router is None:
+                primary, source = resolve_model_name()
+                if source != "tuned":
+                    return None
+                _model_router = model_router.router_from_config(
+                    primary, getattr(config, 'BASE_MODEL_ID', None),
+                    circuit_state=lambda name: resilience.get_guard(name).breaker.state,
+                )
+    return _model_router
+
+def choose_model(model_id_override: Optional[str] = None, count: bool = True):
+    """
+    Like resolve_model_name(), but default requests go through the model router:
+    the tuned endpoint while it is healthy, the base model while it is not.
+
+    Args:
+        model_id_override: Optional model ID or endpoint name to override defaults.
+        count: False for a choice made to look up the response cache; the routing
+               decision is then counted by _count_route() only if the request is sent.
+
+    Returns:
+        A (model_name, source) tuple where source is "override", "tuned" or "base".
+    """
+    if not count:
+        _uncounted_route.set(None)
+    resolved = resolve_model_name(model_id_override)
+    router = get_model_router() if resolved[1] == "tuned" else None
+    if router is None:
+        return resolved
+    decision = router.choose(count=count)
+    if not count:
+        _uncounted_route.set(decision)
+    logging_config.debug("Routed to %s model (%s): %s", decision.source, decision.reason, decision.model_name)
+    return decision.model_name, decision.source
+
+def _count_route():
+    """Counts the routing decision of a response cache lookup that missed."""
+    decision = _uncounted_route.get()
+    router = get_model_router()
+    if decision is not None and router is not None:
+        router.count(decision)
+    _uncounted_route.set(None)
+
+def _fallback_for(model_source: str):
+    """The (model_name, "base") fallback for a failed tuned-endpoint request, or None."""
+    base_model_name = getattr(config, 'BASE_MODEL_ID', None)
+    if model_source != "tuned" or not base_model_name or not getattr(config, 'MODEL_FALLBACK_ENABLED', False):
+        return None
+    return base_model_name, "base"
+
+def record_model_outcome(model_name: str, latency_s: float, ok: bool):
+    """Feeds one model call's latency and outcome to the router's rolling stats."""
+    router = get_model_router()
+    if router is not None:
+        router.record(model_name, latency_s, ok)
+
+def get_answering_model() -> Optional[Dict[str, str]]:
+    """
+    Returns {"model": name, "source": "override" | "tuned" | "base"} for the model
+    that produced the last analysis in the current context (thread or copied
+    context), or None if no model answered.
+    """
+    answered = _answering_model.get()
+    return {"model": answered[0], "source": answered[1]} if answered else None
+
+def get_routing_stats() -> Dict[str, Any]:
+    """Returns the router's decisions and per-target rolling stats (empty if routing is disabled)."""
+    router = get_model_router()
+    return router.stats() if router else {}
+
+# --- Warm-up ---
+def warm_up() -> Dict[str, Any]:
+    """
+    Performs the expensive one-time initialization explicitly: imports the
+    Vertex AI SDK, initializes Vertex AI, builds the default model and, with
+    context caching enabled, creates or finds its instruction cache. Intended
+    for readiness probes so the first user request does not pay for it.
+
+    Returns:
+        A dictionary with "ready" (bool), the default model name and per-step timings in ms.
+    """
+    timings = {}
+    status = {"ready": False, "model": None, "timings_ms": timings}
+
+    start = time.perf_counter()
+    initialized = initialize_vertex_ai()
+    timings["vertex_init"] = round((time.perf_counter() - start) * 1000, 1)
+    if not initialized:
+        status["error"] = "Vertex AI could not be initialized. Check configuration and logs."
+        return status
+
+    model_name, _ = resolve_model_name()
+    status["model"] = model_name
+    start = time.perf_counter()
+    try:
+        get_model(model_name)
+    except Exception as e:
+        logging.error(f"Warm-up could not build model '{model_name}': {e}", exc_info=True)
+        status["error"] = f"Could not load model '{model_name}': {e}"
+        return status
+    timings["model_build"] = round((time.perf_counter() - start) * 1000, 1)
+
+    manager = get_context_cache()
+    if manager is not None:
+        start = time.perf_counter()
+        manager.get_model(model_name, get_output_settings(getattr(config, 'STRUCTURED_OUTPUT_ENABLED', False))[0])
+        timings["context_cache"] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    utils.preload_optional_dependencies()
+    timings["optional_dependencies"] = round((time.perf_counter() - start) * 1000, 1)
+
+    status["ready"] = True
+    return status
+
+# --- Response Cache ---
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache, or None if caching is disabled."""
+    global _response_cache
+    if response_cache is None or not getattr(config, 'RESPONSE_CACHE_ENABLED', False):
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                try:
+                    _response_cache = response_cache.ResponseCache(
+                        config.RESPONSE_CACHE_PATH,
+                        ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+                        max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+                    )
+                except Exception as e:
+                    logging.error(f"Could not open response cache at {config.RESPONSE_CACHE_PATH}: {e}. Caching disabled.")
+                    return None
+    return _response_cache
+
+# --- Context Cache (system instructions) ---
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+def get_context_cache():
+    """
+    Returns the process-wide ContextCacheManager, or None if context caching is disabled.
+    The fake backend gets an in-process stand-in for the cache service.
+    """
+    global _context_cache
+    if _context_cache is None and getattr(config, 'CONTEXT_CACHE_ENABLED', False) and context_cache:
+        with _context_cache_lock:
+            if _context_cache is None:
+                try:
+                    if getattr(config, 'MODEL_BACKEND', "vertex") == "fake":
+                        try:
+                            from . import fake_backend
+                        except ImportError:
+                            import fake_backend
+                        service = fake_backend.FakeCacheService(get_model, min_tokens=getattr(config, 'CONTEXT_CACHE_MIN_TOKENS', 0))
+                    else:
+                        _load_vertex_sdk()
+                        service = context_cache.VertexCacheService()
+                    _context_cache = context_cache.manager_from_config(service)
+                except Exception as e:
+                    logging.warning(f"Context caching disabled, could not set up the cache service: {e}")
+                    config.CONTEXT_CACHE_ENABLED = False
+    return _context_cache
+
+def set_context_cache(manager=None):
+    """Replaces the context cache manager (e.g. with a stand-in service for tests); None resets it."""
+    global _context_cache
+    with _context_cache_lock:
+        _context_cache = manager
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    """Returns create/renew/hit counters for the context cache (empty if disabled)."""
+    manager = get_context_cache()
+    return manager.stats() if manager else {}
+
+def _with_inline_instructions(prepared: AnalysisRequest) -> AnalysisRequest:
+    """Returns prepared with the system instructions back in its contents and the plain model."""
+    if prepared.cached_instructions is None:
+        return prepared
+    return prepared._replace(
+        model=get_model(prepared.model_name),
+        contents=prepared.contents + [Part.from_text(prepared.cached_instructions)],
+        cached_instructions=None,
+    )
+
+def _is_cache_error(error: Exception) -> bool:
+    """Errors a request bound to a context cache gets when the cache is gone or unusable."""
+    return getattr(error, "code", None) in (400, 404)
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Returns hit/miss/eviction stats for the response cache (empty if disabled)."""
+    cache = get_response_cache()
+    return cache.stats() if cache else {}
+
+def analyze_content(file_path: Union[str, DocumentSource], user_prompt: str, model_id_override: str = None, structured: bool = False) -> str:
     """
     Analyzes content using a specified Vertex AI Gemini model, incorporating a user prompt.
+    Results are served from the persistent response cache when the same file
+    content has already been analyzed with the same prompt, model and settings.
+
+    Args:
+        file_path: Absolute path to the input file, or a DocumentSource for content in memory.
+        user_prompt: The specific question or instruction from the user.
+        model_id_override: Optional model ID or endpoint name to override defaults.
+        structured: If True, the model is asked for JSON matching
+                    structured_output.ANALYSIS_RESPONSE_SCHEMA instead of Markdown.
+
+    Returns:
+        A string containing the analysis result or an error message. In structured mode,
+        a JSON response that fails schema validation is not cached; the request is sent
+        again in Markdown mode and that (Markdown) result is returned instead.
+    """
+    source = as_document(file_path)
+    _answering_model.set(None)
+    _partial_analysis.set(False)
+    with telemetry.span("analyze_content", file=source.name, structured=structured) as span:
+        cache = get_response_cache()
+        if cache is None or not source.exists():
+            span.set_attribute("cache", "disabled")
+            analysis_result = _analyze_content_uncached(source, user_prompt, model_id_override, structured=structured)
+            if _fails_schema(analysis_result, structured, source.name):
+                return _resend_as_markdown(source, user_prompt, model_id_override)
+            return analysis_result
+
+        telemetry.stage("cache_lookup")
+        resolved_model = choose_model(model_id_override, count=False)
+        try:
+            cache_key = _response_cache_key(source, user_prompt, resolved_model[0], structured)
+            cached = cache.get(cache_key)
+        except Exception as e:
+            logging.warning(f"Response cache lookup failed for {source.name}: {e}")
+            telemetry.end_stage()
+            _count_route()
+            analysis_result = _analyze_content_uncached(source, user_prompt, model_id_override, resolved_model, structured)
+            if _fails_schema(analysis_result, structured, source.name):
+                return _resend_as_markdown(source, user_prompt, model_id_override)
+            return analysis_result
+        telemetry.end_stage()
+
+        if cached is not None:
+            logging.info(f"Response cache hit for {source.name}.")
+            span.set_attribute("cache", "hit")
+            _answering_model.set(resolved_model)
+            return cached
+
+        span.set_attribute("cache", "miss")
+        _count_route()
+        analysis_result = _analyze_content_uncached(source, user_prompt, model_id_override, resolved_model, structured)
+        if _fails_schema(analysis_result, structured, source.name):
+            return _resend_as_markdown(source, user_prompt, model_id_override) # The invalid response is not cached
+        telemetry.stage("cache_store")
+        answered = _answering_model.get()
+        if answered and answered[0] != resolved_model[0]: # Answered by the fallback model
+            cache_key = _response_cache_key(source, user_prompt, answered[0], structured)
+        if not _partial_analysis.get():
+            _store_in_response_cache(cache, cache_key, analysis_result, source.name)
+        return analysis_result
+
+def _fails_schema(analysis_result: str, structured: bool, file_path: str) -> bool:
+    """Whether a structured-mode response is neither an error/info message nor schema-valid JSON."""
+    if not structured or analysis_result.startswith("Error:") or analysis_result.startswith("Info:"):
+        return False
+    try:
+        structured_output.parse_json_analysis(analysis_result)
+        return False
+    except structured_output.SchemaValidationError as e:
+        logging.warning(f"Structured response for {file_path} failed validation ({e}). Sending the request again in Markdown mode.")
+        return True
+
+def _resend_as_markdown(source: DocumentSource, user_prompt: str, model_id_override: str = None) -> str:
+    """Answers a request whose JSON response failed validation with a Markdown-mode analysis."""
+    return analyze_content(source, user_prompt, model_id_override, structured=False)
+
+def analyze_content_structured(file_path: Union[str, DocumentSource], user_prompt: str,
+                               model_id_override: str = None) -> Union["structured_output.StructuredAnalysis", str]:
+    """
+    Structured variant of analyze_content(): requests schema-constrained JSON and
+    returns it validated as a StructuredAnalysis. If the JSON fails validation, the
+    request is answered again in Markdown mode and parsed with the Markdown parser
+    (the result's source says which).
+
+    Args:
+        file_path: Absolute path to the input file, or a DocumentSource for content in memory.
+        user_prompt: The specific question or instruction from the user.
+        model_id_override: Optional model ID or endpoint name to override defaults.
+
+    Returns:
+        A StructuredAnalysis, or an "Error: ..." / "Info: ..." string.
+    """
+    analysis_result = analyze_content(file_path, user_prompt, model_id_override, structured=True)
+    if analysis_result.startswith("Error:") or analysis_result.startswith("Info:"):
+        return analysis_result
+    return structured_output.parse_structured_analysis(analysis_result)
+
+def analyze_content_packed(file_paths: List[str], user_prompt: str, model_id_override: str = None) -> Dict[str, str]:
+    """
+    Analyzes several small text/image files with one model request (see packing.py).
+    Each file keeps its own response cache entry for packed sections, separate from its
+    single-file entry (see _response_cache_key). Files whose section is missing from the
+    packed response, or all files if the packed call fails, are analyzed again one by
+    one with analyze_content(). Markdown output only.
+
+    Args:
+        file_paths: Absolute paths of the files, usually one pack from packing.plan_packs().
+        user_prompt: The specific question or instruction from the user, shared by all files.
+        model_id_override: Optional model ID or endpoint name to override defaults.
+
+    Returns:
+        {file_path: analysis result or error message}, in the order of file_paths.
+    """
+    if len(file_paths) <= 1:
+        return {path: analyze_content(path, user_prompt, model_id_override) for path in file_paths}
+
+    _answering_model.set(None)
+    results: Dict[str, str] = {}
+    with telemetry.span("analyze_pack", files=len(file_paths)) as span:
+        if not initialize_vertex_ai():
+            return {path: "Error: Vertex AI could not be initialized. Check configuration and logs." for path in file_paths}
+        cache = get_response_cache()
+        resolved_model = choose_model(model_id_override, count=cache is None)
+
+        # --- Cache lookup and content loading, per document ---
+        documents = [] # (file_path, content parts) still to be analyzed
+        for path in file_paths:
+            cached = None
+            if cache is not None and os.path.isfile(path):
+                try:
+                    cached = cache.get(_response_cache_key(path, user_prompt, resolved_model[0], packed=True))
+                except Exception as e:
+                    logging.warning(f"Response cache lookup failed for {path}: {e}")
+            if cached is not None:
+                logging.info(f"Response cache hit for {os.path.basename(path)}.")
+                results[path] = cached
+                continue
+            parts = _load_content_parts(path)
+            if isinstance(parts, str):
+                results[path] = parts # Error/Info message from loading
+            else:
+                documents.append((path, parts))
+        span.set_attribute("cache_hits", len(file_paths) - len(documents))
+
+        sections: Dict[int, str] = {}
+        packed = False
+        if len(documents) > 1:
+            _count_route() # Single leftovers are routed again by analyze_content
+            try:
+                sections, answered = _generate_packed(documents, user_prompt, resolved_model)
+                packed = True
+            except Exception as e:
+                logging.warning(f"Packed request for {len(documents)} files failed, analyzing them one by one: {e}")
+            else:
+                for index, (path, _) in enumerate(documents, start=1):
+                    if index in sections:
+                        results[path] = sections[index]
+                        if cache is not None:
+                            _store_in_response_cache(cache, _response_cache_key(path, user_prompt, answered[0], packed=True),
+                                                     sections[index], path)
+                _answering_model.set(answered)
+
+        # --- Per-file fallback for anything the packed response did not cover ---
+        missing = [path for index, (path, _) in enumerate(documents, start=1) if index not in sections]
+        if missing and packed:
+            logging.warning(f"Packed response covered {len(sections)}/{len(documents)} files; "
+                            f"analyzing {len(missing)} file(s) one by one.")
+        span.set_attribute("fallback_files", len(missing))
+        for path in missing:
+            results[path] = analyze_content(path, user_prompt, model_id_override)
+    return {path: results[path] for path in file_paths}
+
+def _generate_packed(documents: List[Tuple[str, list]], user_prompt: str, resolved_model):
+    """
+    Sends one packed request for documents and splits the response.
+
+    Returns:
+        A ({document index: analysis}, (model_name, source) that answered) tuple.
+        Raises if the model could not be loaded or did not answer.
+    """
+    count = len(documents)
+    with telemetry.span("prepare_request", files=count):
+        model_name, model_source = resolved_model
+        contents = [Part.from_text(user_prompt), Part.from_text(packing.pack_preamble(count))]
+        for index, (path, parts) in enumerate(documents, start=1):
+            contents.append(Part.from_text(packing.document_header(index, os.path.basename(path))))
+            contents.extend(parts)
+            contents.append(Part.from_text(packing.document_footer(index)))
+        contents.append(Part.from_text(SYSTEM_INSTRUCTIONS + packing.pack_output_instructions(count)))
+        prepared = AnalysisRequest(get_model(model_name), model_name, model_source, contents)
+    generation_config = dict(
+        GENERATION_CONFIG,
+        max_output_tokens=min(getattr(config, 'PACK_MAX_OUTPUT_TOKENS', 8192), GENERATION_CONFIG["max_output_tokens"] * count),
+    )
+
+    label = f"pack of {count} files"
+    logging.info(f"Sending packed request to model ({model_name}) for {count} files...")
+    with telemetry.span("model_call", model=model_name, files=count) as call_span:
+        responses, answered = _generate_with_fallback(prepared, generation_config, label)
+        if answered is not prepared:
+            call_span.set_attribute("fallback_model", answered.model_name)
+    with telemetry.span("response_parse"):
+        text = _response_to_text(responses, label)
+        if text.startswith("Error:"):
+            raise RuntimeError(text)
+        sections = packing.split_packed_response(text, count)
+    logging.info(f"Packed response from {answered.model_name} covered {len(sections)}/{count} files.")
+    return sections, (answered.model_name, answered.model_source)
+
+def _response_cache_key(file_path: Union[str, DocumentSource], user_prompt: str, model_name: str, structured: bool = False,
+                        packed: bool = False) -> str:
+    """
+    Builds the response cache key for a file/prompt/model/output mode combination.
+    packed selects the key of a file's section of a packed response: those requests have
+    the pack instructions and a shared output budget, so their sections are cached apart
+    from single-file analyses.
+    """
+    source = as_document(file_path)
+    system_instructions, generation_config = get_output_settings(structured)
+    if packed:
+        system_instructions += "\n[packed request section]"
+        generation_config = dict(generation_config, pack_max_output_tokens=getattr(config, 'PACK_MAX_OUTPUT_TOKENS', 8192))
+    if _long_pdf_page_count(source):
+        # Page-group analyses differ from first-pages analyses of the same file
+        system_instructions += (f"\n[long document: {config.PDF_CHUNK_PAGES} pages per group, "
+                                f"{config.PDF_LONG_DOCUMENT_MAX_PAGES} max, {config.PDF_REDUCE_MODE} merge]")
+    content_hash = response_cache.hash_bytes(source.data) if source.data is not None else response_cache.hash_file(source.path)
+    return response_cache.make_cache_key(
+        content_hash, user_prompt, model_name,
+        system_instructions, generation_config,
+    )
+
+def _store_in_response_cache(cache, cache_key: str, analysis_result: str, file_path: str):
+    try:
+        cache.put(cache_key, analysis_result) # Error results are skipped by the cache
+    except Exception as e:
+        logging.warning(f"Could not store response in cache for {file_path}: {e}")
+
+def _analyze_content_uncached(file_path: Union[str, DocumentSource], user_prompt: str, model_id_override: str = None, resolved_model=None,
+                              structured: bool = False) -> str:
+    """
+    Analyzes content using a specified Vertex AI Gemini model, bypassing the response cache.
 
     Args:
-        file_path: Absolute path to the input file.
+        file_path: Absolute path to the input file, or a DocumentSource for content in memory.
         user_prompt: The specific question or instruction from the user.
         model_id_override: Optional model ID or endpoint name to override defaults.
+        resolved_model: Optional (model_name, source) tuple already returned by resolve_model_name().
+        structured: Request JSON output (see analyze_content).
 
     Returns:
         A string containing the analysis result or an error message.
     """
+    source = as_document(file_path)
+    page_count = _long_pdf_page_count(source)
+    if page_count:
+        return _analyze_long_pdf(source, user_prompt, page_count, model_id_override, resolved_model, structured)
+
+    system_instructions, generation_config = get_output_settings(structured)
+    with telemetry.span("prepare_request"):
+        prepared = prepare_analysis_request(source, user_prompt, model_id_override, resolved_model, system_instructions)
+    if isinstance(prepared, str):
+        return prepared # Error/Info message from request preparation
+    return _run_prepared_request(prepared, generation_config, source.name)
+
+def _run_prepared_request(prepared: AnalysisRequest, generation_config: Dict[str, Any], name: str) -> str:
+    """
+    Sends a prepared request (with model fallback) and returns the response text, or an
+    "Error: ..." string describing why no model answered. name labels the request in logs.
+    """
+    try:
+        # --- API Call ---
+        logging.info(f"Sending request to Vertex AI Gemini model ({prepared.model_name}) for file: {name}...")
+        logging_config.debug("Sending request with model: %s", prepared.model_name)
+        with telemetry.span("model_call", model=prepared.model_name) as call_span:
+            responses, answered = _generate_with_fallback(prepared, generation_config, name)
+            if answered is not prepared:
+                call_span.set_attribute("fallback_model", answered.model_name)
+        _answering_model.set((answered.model_name, answered.model_source))
+        logging.info(f"Received response from model ({answered.model_name}) for file: {name}.")
+        logging_config.debug("Received response for %s", name)
+        with telemetry.span("response_parse"):
+            return _response_to_text(responses, name)
+
+    except Exception as e:
+        return _model_error_message(e, name)
+
+def _model_error_message(error: Exception, name: str) -> str:
+    """Logs a model call that no model answered and returns the "Error: ..." result for it."""
+    if isinstance(error, resilience.CircuitOpenError):
+        logging.error(f"Skipping model call for {name}: {error}")
+        return f"Error: Model endpoint is temporarily unavailable (circuit open). Retry in {error.retry_after_s:.0f}s."
+    if isinstance(error, resilience.RateLimitTimeout):
+        logging.error(f"Rate limited model call for {name}: {error}")
+        return "Error: Model request quota exhausted. Try again later."
+    if resilience.is_retryable(error):
+        logging.error(f"Model call for {name} still failing after retries: {error}")
+        return f"Error: The model is unavailable or overloaded after {config.MODEL_CALL_MAX_ATTEMPTS} attempt(s) ({error}). Try again later."
+    logging.error(f"Outer unexpected error for {name}: {error}", exc_info=True)
+    return f"Error: An unexpected error occurred during analysis for {name}: {error}"
+
+# --- Long PDFs (page-group map-reduce, see long_document.py) ---
+def _long_pdf_page_count(source: DocumentSource) -> Optional[int]:
+    """Returns the page count of source if it is a PDF to analyze in page groups, else None."""
+    if not getattr(config, 'PDF_LONG_DOCUMENT_ENABLED', False) or long_document is None:
+        return None
+    if os.path.splitext(source.name.lower())[1] != ".pdf" or not source.exists() or not utils.pdf_support_available():
+        return None
+    try:
+        page_count = utils.pdf_page_count(source.path or source.name, source.data)
+    except Exception as e:
+        logging.warning(f"Could not count the pages of {source.name}: {e}")
+        return None # The regular path reports the error
+    return page_count if page_count > max(1, config.PDF_CHUNK_PAGES) else None
+
+def _iter_pdf_chunks(source: DocumentSource, pages: int, page_count: int,
+                     chunk_pages: int) -> Generator[Tuple[int, int, list], None, None]:
+    """
+    Yields (first_page, last_page, content parts) for each group of chunk_pages pages
+    (1-based page numbers), reading and rendering each group only when it is requested.
+    """
+    parts, chunk_index = [], None
+
+    def chunk():
+        first_page = chunk_index * chunk_pages + 1
+        last_page = min((chunk_index + 1) * chunk_pages, pages)
+        return first_page, last_page, [Part.from_text(long_document.chunk_header(first_page, last_page, page_count))] + parts
+
+    for page_num, part_kind, part_data, part_mime_type in utils.iter_pdf_page_parts(
+        source.path or source.name,
+        max_pages=pages,
+        text_mode=getattr(config, 'PDF_TEXT_LAYER_MODE', "off"),
+        min_text_chars=getattr(config, 'PDF_TEXT_MIN_CHARS', 200),
+        zoom=getattr(config, 'PDF_RENDER_ZOOM', 2),
+        dpi=getattr(config, 'PDF_RENDER_DPI', None),
+        image_format=getattr(config, 'PDF_IMAGE_FORMAT', "png"),
+        quality=getattr(config, 'PDF_IMAGE_QUALITY', 85),
+        processes=getattr(config, 'PDF_RENDER_PROCESSES', 0),
+        pdf_data=source.data,
+    ):
+        if page_num // chunk_pages != chunk_index:
+            if parts:
+                yield chunk()
+            parts, chunk_index = [], page_num // chunk_pages
+        if part_kind == "text":
+            parts.append(Part.from_text(part_data))
+        else:
+            parts.append(Part.from_data(data=part_data, mime_type=part_mime_type))
+    if parts:
+        yield chunk()
+
+def _analyze_pdf_chunk(source: DocumentSource, user_prompt: str, model_id_override: Optional[str], resolved_model,
+                       system_instructions: str, generation_config: Dict[str, Any], first_page: int, last_page: int,
+                       parts: list) -> Tuple[str, Optional[Tuple[str, str]]]:
+    """Analyzes one page group. Returns (response text or error, (model_name, source) that answered)."""
+    name = f"{source.name} ({long_document.page_label(first_page, last_page).lower()})"
+    with telemetry.span("analyze_pdf_chunk", file=source.name, first_page=first_page, last_page=last_page):
+        prepared = prepare_analysis_request(source, user_prompt, model_id_override, resolved_model,
+                                            system_instructions, content_parts=parts)
+        if isinstance(prepared, str):
+            return prepared, None
+        return _run_prepared_request(prepared, generation_config, name), _answering_model.get()
+
+def _analyze_long_pdf(source: DocumentSource, user_prompt: str, page_count: int, model_id_override: str = None,
+                      resolved_model=None, structured: bool = False) -> str:
+    """
+    Analyzes a long PDF in groups of PDF_CHUNK_PAGES pages, PDF_CHUNK_CONCURRENCY groups at
+    a time, and merges the group analyses (PDF_REDUCE_MODE). A group is only rendered once
+    a worker is free for it, so at most PDF_CHUNK_CONCURRENCY groups of rendered pages
+    are held in memory.
+
+    Returns:
+        The merged analysis in the same layout as a single-request analysis, or an
+        "Error: ..." string if no page group could be analyzed.
+    """
+    if not initialize_vertex_ai():
+        return "Error: Vertex AI could not be initialized. Check configuration and logs."
+    system_instructions, generation_config = get_output_settings(structured)
+    chunk_pages = max(1, config.PDF_CHUNK_PAGES)
+    concurrency = max(1, config.PDF_CHUNK_CONCURRENCY)
+    max_pages = config.PDF_LONG_DOCUMENT_MAX_PAGES
+    pages = min(page_count, max_pages) if max_pages > 0 else page_count
+    if pages < page_count:
+        logging.warning(f"{source.name} has {page_count} pages; analyzing the first {pages} (PDF_LONG_DOCUMENT_MAX_PAGES).")
+    resolved_model = resolved_model or choose_model(model_id_override)
+    logging.info(f"Analyzing {pages} pages of {source.name} in groups of {chunk_pages} ({concurrency} at a time).")
+
+    with telemetry.span("analyze_long_pdf", file=source.name, pages=pages) as span:
+        slots = threading.Semaphore(concurrency)
+        submitted = [] # (first_page, last_page, future) in page order
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pdf-chunk") as executor:
+            try:
+                pdf_chunks = _iter_pdf_chunks(source, pages, page_count, chunk_pages)
+                while True:
+                    slots.acquire() # Wait for a free worker before rendering the next group
+                    pdf_chunk = next(pdf_chunks, None)
+                    if pdf_chunk is None:
+                        slots.release()
+                        break
+                    first_page, last_page, parts = pdf_chunk
+                    future = executor.submit(contextvars.copy_context().run, _analyze_pdf_chunk, source, user_prompt,
+                                             model_id_override, resolved_model, system_instructions, generation_config,
+                                             first_page, last_page, parts)
+                    future.add_done_callback(lambda _: slots.release())
+                    submitted.append((first_page, last_page, future))
+                    pdf_chunk = parts = None # Only the worker holds the rendered pages now
+            except Exception as e:
+                logging.error(f"Failed to read PDF file {source.path or source.name}: {e}", exc_info=True)
+                if not submitted:
+                    return f"Error: Could not process PDF file {source.name}."
+                unread = (submitted[-1][1] + 1, pages, f"Error: Could not read pages of PDF file {source.name}: {e}")
+            else:
+                unread = None
+
+        chunks, answered = [], None
+        for first_page, last_page, future in submitted:
+            try:
+                text, chunk_answered = future.result()
+            except Exception as e:
+                logging.error(f"Unexpected error analyzing pages {first_page}-{last_page} of {source.name}: {e}", exc_info=True)
+                text, chunk_answered = f"Error: Unexpected error during analysis: {e}", None
+            chunks.append(long_document.ChunkAnalysis(first_page, last_page, text))
+            answered = answered or chunk_answered
+        if unread and unread[0] <= unread[1]:
+            chunks.append(long_document.ChunkAnalysis(*unread))
+        failed = [chunk for chunk in chunks if not chunk.ok]
+        span.set_attribute("chunks", len(chunks))
+        span.set_attribute("failed_chunks", len(failed))
+        if not chunks:
+            return f"Error: Could not render any pages from PDF {source.name}."
+        if len(failed) == len(chunks):
+            return failed[0].text
+        if failed:
+            logging.warning(f"{len(failed)} of {len(chunks)} page groups of {source.name} failed; "
+                            f"the analysis covers the other pages and is not cached.")
+            _partial_analysis.set(True)
+        _answering_model.set(answered)
+
+        if getattr(config, 'PDF_REDUCE_MODE', "local") == "model" and len(chunks) - len(failed) > 1:
+            with telemetry.span("reduce", file=source.name):
+                reduce_parts = [Part.from_text(long_document.reduce_request_text(chunks, page_count))]
+                prepared = prepare_analysis_request(source, user_prompt, model_id_override, resolved_model,
+                                                    system_instructions, content_parts=reduce_parts)
+                reduced = prepared if isinstance(prepared, str) else \
+                    _run_prepared_request(prepared, generation_config, f"{source.name} (merge)")
+            if not reduced.startswith("Error:") and not reduced.startswith("Info:"):
+                return reduced
+            logging.warning(f"Model merge of {source.name} failed ({reduced}); merging the page groups locally.")
+            _answering_model.set(answered)
+        return long_document.render_analysis(long_document.merge_chunk_analyses(chunks, structured), structured)
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """Errors that say the endpoint (rather than the request) is at fault, so another model may succeed."""
+    if isinstance(error, (resilience.CircuitOpenError, resilience.RateLimitTimeout)):
+        return True
+    return resilience.is_retryable(error) or getattr(error, "code", None) in (403, 404)
+
+def _open_stream(responses) -> Iterator[Any]:
+    """Waits for the first chunk of a response stream, so failures to start surface here."""
+    chunks = iter(responses)
+    first = next(chunks, None)
+    return iter(()) if first is None else itertools.chain([first], chunks)
+
+def _generate_with_fallback(prepared: AnalysisRequest, generation_config: Dict[str, Any], file_path: str,
+                            stream: bool = False):
+    """
+    Sends the prepared request through the model's guard (retries, rate limiting,
+    hedging, circuit breaking; see resilience.py). If a tuned endpoint still fails
+    with an endpoint error, the same request is sent once to the base model.
+    Outcomes are reported to the model router.
+
+    With stream=True the request is streamed: everything above applies until the first
+    chunk has arrived, and the caller reports the outcome once the stream is consumed.
+
+    Returns:
+        A (response, AnalysisRequest actually sent) tuple; the response is an iterator
+        over the chunks when streaming. Raises the last error if no model answered.
+    """
+    while True:
+        def call(request=prepared):
+            responses = request.model.generate_content(
+                request.contents,
+                generation_config=dict(generation_config),
+                safety_settings=get_safety_settings(),
+                stream=stream,
+            )
+            return _open_stream(responses) if stream else responses
+        start = time.perf_counter()
+        try:
+            responses = resilience.get_guard(prepared.model_name).call(call, streaming=stream)
+        except Exception as e:
+            if prepared.cached_instructions is not None and _is_cache_error(e):
+                # The context cache expired or was deleted; resend once with the instructions inline
+                logging.warning(f"Request using the context cache of '{prepared.model_name}' failed ({e}); "
+                                f"resending with inline instructions.")
+                get_context_cache().invalidate(prepared.model_name, prepared.cached_instructions)
+                prepared = _with_inline_instructions(prepared)
+                continue
+            if not _is_endpoint_failure(e):
+                raise
+            record_model_outcome(prepared.model_name, time.perf_counter() - start, ok=False)
+            fallback = _fallback_for(prepared.model_source)
+            if fallback is None:
+                raise
+            logging.warning(f"Model call to '{prepared.model_name}' failed for {os.path.basename(file_path)} ({e}); "
+                            f"falling back to base model '{fallback[0]}'.")
+            prepared = _with_inline_instructions(prepared)._replace(
+                model=get_model(fallback[0]), model_name=fallback[0], model_source=fallback[1])
+            continue
+        if not stream:
+            record_model_outcome(prepared.model_name, time.perf_counter() - start, ok=True)
+        return responses, prepared
+
+def analyze_content_stream(file_path: Union[str, DocumentSource], user_prompt: str, model_id_override: str = None) -> Generator[Tuple[str, str], None, None]:
+    """
+    Streaming variant of analyze_content(). Uses generate_content(stream=True)
+    and yields text as the model produces it.
+
+    Args:
+        file_path: Absolute path to the input file, or a DocumentSource for content in memory.
+        user_prompt: The specific question or instruction from the user.
+        model_id_override: Optional model ID or endpoint name to override defaults.
+
+    Yields:
+        ("chunk", text) events while the model is generating, followed by exactly
+        one ("result", full_text) event. full_text is the same string
+        analyze_content() would return, including "Error: ..." messages.
+    """
+    source = as_document(file_path)
+    if _long_pdf_page_count(source):
+        # Page groups are analyzed concurrently and merged, so there is no single stream to forward
+        analysis_result = analyze_content(source, user_prompt, model_id_override)
+        yield "chunk", analysis_result
+        yield "result", analysis_result
+        return
+    _answering_model.set(None)
+    cache = get_response_cache() if source.exists() else None
+    resolved_model = choose_model(model_id_override, count=cache is None)
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = _response_cache_key(source, user_prompt, resolved_model[0])
+            cached = cache.get(cache_key)
+        except Exception as e:
+            logging.warning(f"Response cache lookup failed for {source.name}: {e}")
+            cached = None
+        if cached is not None:
+            logging.info(f"Response cache hit for {source.name}.")
+            _answering_model.set(resolved_model)
+            yield "chunk", cached
+            yield "result", cached
+            return
+        _count_route()
+
+    with telemetry.span("prepare_request"):
+        prepared = prepare_analysis_request(source, user_prompt, model_id_override, resolved_model)
+    if isinstance(prepared, str):
+        yield "result", prepared
+        return
+
+    text_chunks = []
+    start = time.perf_counter()
+    try:
+        # Retries, rate limiting, the circuit breaker and the base-model fallback apply until the first chunk
+        logging.info(f"Streaming request to Vertex AI Gemini model ({prepared.model_name}) for file: {source.name}...")
+        responses, prepared = _generate_with_fallback(prepared, GENERATION_CONFIG, source.name, stream=True)
+    except Exception as e:
+        yield "result", _model_error_message(e, source.name)
+        return
+
+    try:
+        for response_chunk in responses:
+            try:
+                chunk_text = response_chunk.text
+            except ValueError:
+                # Blocked or empty chunk: reuse the non-streaming diagnostics
+                chunk_text = _response_to_text(response_chunk, source.name)
+                if chunk_text.startswith("Error:"):
+                    yield "result", chunk_text
+                    return
+            if chunk_text:
+                text_chunks.append(chunk_text)
+                yield "chunk", chunk_text
+    except Exception as e:
+        # Chunks were already sent to the client, so the request cannot be retried
+        logging.error(f"Streaming error for {source.name}: {e}", exc_info=True)
+        if prepared.cached_instructions is not None and _is_cache_error(e):
+            get_context_cache().invalidate(prepared.model_name, prepared.cached_instructions)
+        if _is_endpoint_failure(e):
+            record_model_outcome(prepared.model_name, time.perf_counter() - start, ok=False)
+        yield "result", f"Error: An unexpected error occurred during analysis for {source.name}: {e}"
+        return
+
+    record_model_outcome(prepared.model_name, time.perf_counter() - start, ok=True)
+    _answering_model.set((prepared.model_name, prepared.model_source))
+    analysis_result = "".join(text_chunks)
+    if not analysis_result.strip():
+        analysis_result = "Error: Model response parts contained empty text."
+    logging.info(f"Streaming analysis complete for file: {source.name}.")
+    if cache_key is not None and prepared.model_name != resolved_model[0]: # Loaded the fallback model instead
+        cache_key = _response_cache_key(source, user_prompt, prepared.model_name)
+    if cache is not None and cache_key is not None:
+        _store_in_response_cache(cache, cache_key, analysis_result, source.name)
+    yield "result", analysis_result
+
+# --- MODIFIED FUNCTION SIGNATURE ---
+def prepare_analysis_request(file_path: Union[str, DocumentSource], user_prompt: str, model_id_override: str = None,
+                             resolved_model=None, system_instructions: str = None,
+                             content_parts: Optional[list] = None) -> Union[AnalysisRequest, str]:
+    """
+    Loads the file content, selects the model and builds the request contents.
+
+    Args:
+        file_path: Absolute path to the input file, or a DocumentSource for content in memory.
+        user_prompt: The specific question or instruction from the user.
+        model_id_override: Optional model ID or endpoint name to override defaults.
+        resolved_model: Optional (model_name, source) tuple already returned by resolve_model_name().
+        system_instructions: Instructions appended after the file content (defaults to SYSTEM_INSTRUCTIONS).
+        content_parts: Content to send instead of the file's own content (e.g. one page group of a long PDF).
+
+    Returns:
+        An AnalysisRequest ready for generate_content, or an "Error: ..."/"Info: ..."
+        string if the request could not be prepared.
+    """
+    source = as_document(file_path)
+    telemetry.stage("vertex_init")
     if not initialize_vertex_ai():
          return "Error: Vertex AI could not be initialized. Check configuration and logs."
 
     # --- Log the received user prompt ---
-    logging.info(f"Analyzing file: {file_path} with user prompt: '{user_prompt[:100]}...'")
-    print(f"DEBUG: analyze_content called for: {file_path}")
-    print(f"DEBUG: User Prompt Received: '{user_prompt}'")
+    logging.info(f"Analyzing file: {source.path or source.name}")
+    logging_config.debug("analyze_content called for: %s (prompt: %d chars)", source.name, len(user_prompt))
+
+    request_contents_list = content_parts if content_parts is not None else _load_content_parts(source)
+    if isinstance(request_contents_list, str):
+        return request_contents_list
+
+    try:
+        # --- Model Selection Logic ---
+        telemetry.stage("model_instantiation")
+        model = None
+        model_name_to_use, model_source = resolved_model or choose_model(model_id_override)
+        while True:
+            source_label = {"override": "OVERRIDDEN", "tuned": "DEFAULT (tuned endpoint)", "base": "DEFAULT (base)"}[model_source]
+            logging.info(f"Using {source_label} model: {model_name_to_use}")
+            try:
+                logging_config.debug("Getting model '%s' from registry...", model_name_to_use)
+                model = get_model(model_name_to_use) # Reuse cached instance if available
+                logging.info(f"Successfully loaded {source_label} model: {model_name_to_use}")
+                logging_config.debug("Loaded %s model successfully.", source_label)
+                break
+            except Exception as load_err:
+                logging.error(f"Failed to load {source_label} model '{model_name_to_use}': {load_err}", exc_info=True)
+                record_model_outcome(model_name_to_use, 0.0, ok=False)
+                fallback = _fallback_for(model_source)
+                if fallback:
+                    logging.warning(f"Falling back to base model '{fallback[0]}' for {source.name}.")
+                    model_name_to_use, model_source = fallback
+                    continue
+                if model_source == "override":
+                    error_prefix = "endpoint" if "endpoints/" in model_name_to_use else "model"
+                elif model_source == "tuned":
+                    error_prefix = "fine-tuned endpoint"
+                else:
+                    error_prefix = "base model"
+                if "not found" in str(load_err).lower() or "404" in str(load_err):
+                    return f"Error: Could not load {error_prefix} '{model_name_to_use}' (Not Found or No Access)."
+                else:
+                    return f"Error: Could not load {error_prefix} '{model_name_to_use}' (Load Error: {load_err})."
+
+        if not model:
+             logging.error("Model object could not be instantiated.")
+             return "Error: Model object could not be instantiated (check previous errors)."
+
+        # --- Construct the final request content list ---
+        # Order: User Prompt -> File Content -> System Instructions
+        # (the instructions are left out when they are held in a context cache)
+        telemetry.stage("request_build")
+        system_instructions = system_instructions or SYSTEM_INSTRUCTIONS
+        cached_instructions = None
+        manager = get_context_cache()
+        if manager is not None:
+            cached_model = manager.get_model(model_name_to_use, system_instructions)
+            if cached_model is not None:
+                model, cached_instructions = cached_model, system_instructions
+        request_contents = [Part.from_text(user_prompt)] + request_contents_list
+        if cached_instructions is None:
+            request_contents.append(Part.from_text(system_instructions))
+        logging_config.debug("Final request_contents length: %d", len(request_contents))
+
+        # Ensure the model object is valid before it is used for generate_content
+        if not callable(getattr(model, "generate_content", None)):
+             logging.error("Model object is not a valid GenerativeModel instance before API call.")
+             return "Error: Invalid model object before API call."
+
+        return AnalysisRequest(model, model_name_to_use, model_source, request_contents, cached_instructions)
+
+    except Exception as e:
+        logging.error(f"Unexpected error preparing request for {source.name}: {e}", exc_info=True)
+        return f"Error: An unexpected error occurred during analysis for {source.name}: {e}"
+
+
+def _load_content_parts(source: Union[str, DocumentSource]) -> Union[list, str]:
+    """
+    Loads a file into request content parts (image, text or rendered PDF pages).
+
+    Args:
+        source: Absolute path to the input file, or a DocumentSource.
 
-    if not os.path.exists(file_path):
+    Returns:
+        The list of Parts for the file, or an "Error: ..."/"Info: ..." string if it
+        could not be loaded.
+    """
+    source = as_document(source)
+    file_path = source.path or source.name # Used in logs and messages
+    if not source.exists():
         logging.error(f"File not found: {file_path}")
-        print(f"DEBUG: File does not exist: {file_path}")
         return f"Error: File not found at path '{file_path}'."
 
     if utils is None:
@@ -96,60 +1352,79 @@ def analyze_content(file_path: str, user_prompt: str, model_id_override: str = N
 
     supported_text_extensions = getattr(utils, 'SUPPORTED_TEXT_EXTENSIONS', {".txt"})
     supported_image_extensions = getattr(utils, 'SUPPORTED_IMAGE_EXTENSIONS', {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"})
-    fitz_available = hasattr(utils, 'fitz') and utils.fitz is not None
+    fitz_available = utils.pdf_support_available()
 
     try:
-        mime_type, _ = mimetypes.guess_type(file_path)
+        telemetry.stage("mime_detection")
+        mime_type, _ = mimetypes.guess_type(source.name)
         if mime_type is None:
-            _, ext = os.path.splitext(file_path.lower())
+            _, ext = os.path.splitext(source.name.lower())
             if ext == ".pdf": mime_type = "application/pdf"
             elif ext in supported_text_extensions: mime_type = "text/plain"
             elif ext in supported_image_extensions: mime_type = f"image/{ext[1:]}" if ext[1:] else "image/unknown"
+            elif source.mime_type: mime_type = source.mime_type
             else:
                 logging.warning(f"Could not determine MIME type for {file_path}. Skipping.")
                 return f"Error: Unsupported file type or unknown extension for {os.path.basename(file_path)}."
 
         logging.info(f"Processing as MIME type: {mime_type}")
-        print(f"DEBUG: Mime type: {mime_type}")
+        logging_config.debug("Mime type: %s", mime_type)
         request_contents_list = [] # Holds the file content parts (image, text, pdf pages)
 
         # --- File Content Processing (Image, Text, PDF) ---
         # ... (Your existing code for loading file content into request_contents_list) ...
         # --- Image Handling Block (Using manual PNG load, fallback to VertexImage for others) ---
         if mime_type.startswith("image/"):
-            if mime_type == "image/png":
-                print(f"DEBUG: Entering MANUAL PNG byte loading block for {os.path.basename(file_path)}")
+            telemetry.stage("image_load")
+            preprocessed = None
+            if getattr(config, 'IMAGE_PREPROCESS_ENABLED', False):
+                try:
+                    original_bytes = source.read()
+                    preprocessed = utils.preprocess_image_bytes(
+                        original_bytes,
+                        max_edge=config.IMAGE_MAX_EDGE,
+                        max_pixels=config.IMAGE_MAX_PIXELS,
+                        output_format=config.IMAGE_OUTPUT_FORMAT,
+                        quality=config.IMAGE_OUTPUT_QUALITY,
+                    )
+                except Exception as prep_err:
+                    logging.warning(f"Image preprocessing failed for {os.path.basename(file_path)}, sending original: {prep_err}")
+
+            if preprocessed:
+                image_bytes, image_mime_type, _ = preprocessed
+                request_contents_list.append(Part.from_data(data=image_bytes, mime_type=image_mime_type))
+                logging.info(f"Prepared preprocessed image part ({image_mime_type}) for {os.path.basename(file_path)}")
+            elif mime_type == "image/png":
+                logging_config.debug("Entering MANUAL PNG byte loading block for %s", os.path.basename(file_path))
                 try:
-                    with open(file_path, "rb") as f:
-                        image_bytes = f.read()
+                    image_bytes = source.read()
                     if not image_bytes: raise ValueError("Read 0 bytes from image file.")
                     image_part = Part.from_data(data=image_bytes, mime_type="image/png")
                     request_contents_list.append(image_part)
                     logging.info(f"Prepared image part manually from PNG bytes for {os.path.basename(file_path)}")
-                    print("DEBUG: Manual PNG byte loading successful.")
+                    logging_config.debug("Manual PNG byte loading successful.")
                 except FileNotFoundError:
                     logging.error(f"File not found error during manual PNG loading: {file_path}")
-                    print(f"DEBUG: FileNotFoundError caught manually loading PNG.")
                     return f"Error: File not found when trying to load PNG image {os.path.basename(file_path)}."
                 except Exception as png_err:
                     logging.error(f"Failed to manually load PNG bytes from {file_path}: {png_err}", exc_info=True)
-                    print(f"DEBUG: Exception caught manually loading PNG bytes: {type(png_err).__name__} - {png_err}")
                     return f"Error: Could not process PNG file {os.path.basename(file_path)} (Manual Load Error: {png_err})."
             else: # Fallback for JPEG and other image types
-                print(f"DEBUG: Entering VertexImage.load_from_file block for {os.path.basename(file_path)} ({mime_type})")
+                logging_config.debug("Entering VertexImage.load_from_file block for %s (%s)", os.path.basename(file_path), mime_type)
                 try:
-                    print(f"DEBUG: Attempting VertexImage.load_from_file('{file_path}')...")
-                    image_part = Part.from_image(VertexImage.load_from_file(file_path))
-                    print("DEBUG: VertexImage.load_from_file successful.")
+                    logging_config.debug("Attempting VertexImage.load_from_file('%s')...", file_path)
+                    if source.data is not None:
+                        image_part = Part.from_image(VertexImage.from_bytes(source.data))
+                    else:
+                        image_part = Part.from_image(VertexImage.load_from_file(source.path))
+                    logging_config.debug("VertexImage.load_from_file successful.")
                     request_contents_list.append(image_part)
                     logging.info(f"Prepared image part using VertexImage for {os.path.basename(file_path)}")
                 except FileNotFoundError:
                     logging.error(f"File not found error during VertexImage loading: {file_path}")
-                    print(f"DEBUG: FileNotFoundError caught loading image.")
                     return f"Error: File not found when trying to load image {os.path.basename(file_path)}."
                 except Exception as img_err:
                      logging.error(f"Failed to load image {file_path} using VertexImage: {img_err}", exc_info=True)
-                     print(f"DEBUG: General Exception caught loading image via VertexImage: {type(img_err).__name__} - {img_err}")
                      if isinstance(img_err, AttributeError) and "'NoneType' object has no attribute 'close'" in str(img_err):
                           return f"Error: Could not load or invalid image file {os.path.basename(file_path)} (Internal Library Error)."
                      else:
@@ -158,10 +1433,10 @@ def analyze_content(file_path: str, user_prompt: str, model_id_override: str = N
 
         # --- Text Handling Block ---
         elif mime_type.startswith("text/"):
-            print(f"DEBUG: Entering text processing block for {os.path.basename(file_path)}")
+            telemetry.stage("text_load")
+            logging_config.debug("Entering text processing block for %s", os.path.basename(file_path))
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text_content = f.read()
+                text_content = source.read_text()
                 if not text_content.strip():
                     logging.warning(f"Text file is empty: {file_path}")
                     return "Info: Input text file is empty."
@@ -173,33 +1448,36 @@ def analyze_content(file_path: str, user_prompt: str, model_id_override: str = N
 
         # --- PDF Handling Block ---
         elif mime_type == "application/pdf":
-            print(f"DEBUG: Entering PDF processing block for {os.path.basename(file_path)}")
+            telemetry.stage("pdf_render")
+            logging_config.debug("Entering PDF processing block for %s", os.path.basename(file_path))
             if not fitz_available:
                  logging.error("PyMuPDF (fitz) is not available in utils module.")
                  return "Error: PDF processing requires PyMuPDF. Please install it (`pip install PyMuPDF`)."
-            doc = None
             try:
-                MAX_PDF_PAGES_TO_SEND = 1 # Limit pages sent for analysis
-                doc = utils.fitz.open(file_path)
-                num_pages = len(doc)
-                logging.info(f"Processing PDF with {num_pages} pages. Sending first {min(num_pages, MAX_PDF_PAGES_TO_SEND)} pages.")
-                for page_num in range(min(num_pages, MAX_PDF_PAGES_TO_SEND)):
-                    img_bytes = utils.render_pdf_page_to_image_bytes(file_path, page_num)
-                    if img_bytes:
-                        pdf_image_part = Part.from_data(data=img_bytes, mime_type="image/png")
-                        request_contents_list.append(pdf_image_part)
-                        logging.info(f"Prepared image part for PDF page {page_num} of {os.path.basename(file_path)}")
+                MAX_PDF_PAGES_TO_SEND = getattr(config, 'PDF_MAX_PAGES_TO_SEND', 1) # Limit pages sent for analysis
+                # The document is opened once; pages with a usable text layer are sent as text
+                for page_num, part_kind, part_data, part_mime_type in utils.iter_pdf_page_parts(
+                    file_path,
+                    max_pages=MAX_PDF_PAGES_TO_SEND,
+                    text_mode=getattr(config, 'PDF_TEXT_LAYER_MODE', "off"),
+                    min_text_chars=getattr(config, 'PDF_TEXT_MIN_CHARS', 200),
+                    zoom=getattr(config, 'PDF_RENDER_ZOOM', 2),
+                    dpi=getattr(config, 'PDF_RENDER_DPI', None),
+                    image_format=getattr(config, 'PDF_IMAGE_FORMAT', "png"),
+                    quality=getattr(config, 'PDF_IMAGE_QUALITY', 85),
+                    processes=getattr(config, 'PDF_RENDER_PROCESSES', 0),
+                    pdf_data=source.data,
+                ):
+                    if part_kind == "text":
+                        request_contents_list.append(Part.from_text(part_data))
                     else:
-                        logging.warning(f"Could not render page {page_num} of PDF {file_path}.")
+                        request_contents_list.append(Part.from_data(data=part_data, mime_type=part_mime_type))
+                    logging.info(f"Prepared {part_kind} part for PDF page {page_num} of {os.path.basename(file_path)}")
                 if not request_contents_list:
                     return f"Error: Could not render any pages from PDF {os.path.basename(file_path)}."
             except Exception as pdf_err:
                  logging.error(f"Failed to process PDF file {file_path}: {pdf_err}", exc_info=True)
                  return f"Error: Could not process PDF file {os.path.basename(file_path)}."
-            finally:
-                if doc and hasattr(doc, 'is_closed') and not doc.is_closed:
-                     try: doc.close()
-                     except Exception: pass
         # --- End PDF Handling ---
 
         else:
@@ -210,211 +1488,70 @@ def analyze_content(file_path: str, user_prompt: str, model_id_override: str = N
              logging.error(f"No content parts could be prepared for file: {file_path}")
              return f"Info: No processable content found in file {os.path.basename(file_path)}."
 
-        # --- Model Selection Logic ---
-        # ... (Your existing model selection logic remains the same) ...
-        model = None
-        model_name_to_use = None
-        # Get IDs from config (ensure config.py is updated and loaded)
-        default_tuned_model = getattr(config, 'TUNED_MODEL_ID', None)
-        default_base_model = getattr(config, 'BASE_MODEL_ID', "gemini-2.0-flash-lite-001") # Ensure a default base model
-
-        if not default_tuned_model:
-            logging.warning("TUNED_MODEL_ID not found or is None in config.py. Defaulting to base model if no override.")
-            tuned_model_name = None
-        else:
-            tuned_model_name = default_tuned_model
-
-        base_model_name = default_base_model
-
-        if model_id_override:
-            model_name_to_use = model_id_override
-            logging.info(f"Using OVERRIDDEN model: {model_name_to_use}")
-            print(f"DEBUG: Using OVERRIDDEN model: {model_name_to_use}")
-            try:
-                print(f"DEBUG: Attempting GenerativeModel('{model_name_to_use}')...")
-                model = GenerativeModel(model_name_to_use) # Use direct instantiation
-                logging.info(f"Successfully loaded OVERRIDDEN model: {model_name_to_use}")
-                print(f"DEBUG: Loaded OVERRIDDEN model successfully.")
-            except Exception as load_err:
-                logging.error(f"Failed to load overridden model '{model_name_to_use}': {load_err}", exc_info=True)
-                print(f"DEBUG: Failed to load OVERRIDDEN model: {load_err}")
-                error_prefix = "endpoint" if "endpoints/" in model_name_to_use else "model"
-                if "not found" in str(load_err).lower() or "404" in str(load_err):
-                    return f"Error: Could not load {error_prefix} '{model_name_to_use}' (Not Found or No Access)."
-                else:
-                    return f"Error: Could not load {error_prefix} '{model_name_to_use}' (Load Error: {load_err})."
-
-        else: # Default model logic
-            if tuned_model_name and "endpoints/" in tuned_model_name:
-                model_name_to_use = tuned_model_name
-                logging.info(f"Using DEFAULT (tuned endpoint) model: {model_name_to_use}")
-                print(f"DEBUG: Using DEFAULT (tuned endpoint) model: {model_name_to_use}")
-                try:
-                    print(f"DEBUG: Attempting GenerativeModel('{model_name_to_use}')...")
-                    model = GenerativeModel(model_name_to_use) # Use direct instantiation
-                    logging.info(f"Successfully loaded DEFAULT (tuned endpoint) model: {model_name_to_use}")
-                    print(f"DEBUG: Loaded DEFAULT tuned endpoint model successfully.")
-                except Exception as load_err:
-                    logging.error(f"Failed to load default tuned endpoint model '{model_name_to_use}': {load_err}", exc_info=True)
-                    print(f"DEBUG: Failed to load DEFAULT tuned endpoint model: {load_err}")
-                    if "not found" in str(load_err).lower() or "404" in str(load_err):
-                        return f"Error: Could not load fine-tuned endpoint '{model_name_to_use}' (Not Found or No Access)."
-                    else:
-                        return f"Error: Could not load fine-tuned endpoint '{model_name_to_use}' (Load Error: {load_err})."
-            else: # Fallback to base model
-                 if not tuned_model_name:
-                      logging.info(f"Tuned model ID not configured, using DEFAULT (base) model: {base_model_name}")
-                 else: # Tuned model ID was set but wasn't an endpoint format
-                      logging.warning(f"Configured TUNED_MODEL_ID '{tuned_model_name}' is not an endpoint format. Using DEFAULT (base) model: {base_model_name}")
-
-                 model_name_to_use = base_model_name
-                 print(f"DEBUG: Using DEFAULT (base) model: {model_name_to_use}")
-                 try:
-                    print(f"DEBUG: Attempting GenerativeModel('{model_name_to_use}')...")
-                    model = GenerativeModel(model_name_to_use) # Use direct instantiation
-                    logging.info(f"Successfully loaded DEFAULT (base) model: {model_name_to_use}")
-                    print(f"DEBUG: Loaded DEFAULT base model successfully.")
-                 except Exception as load_err:
-                    logging.error(f"Failed to load default base model '{model_name_to_use}': {load_err}", exc_info=True)
-                    print(f"DEBUG: Failed to load DEFAULT base model: {load_err}")
-                    if "not found" in str(load_err).lower() or "404" in str(load_err):
-                         return f"Error: Could not load base model '{model_name_to_use}' (Not Found or No Access)."
-                    else:
-                         return f"Error: Could not load base model '{model_name_to_use}' (Load Error: {load_err})."
-
-        if not model:
-             logging.error("Model object could not be instantiated.")
-             print("DEBUG: Model object is None after selection block.")
-             return "Error: Model object could not be instantiated (check previous errors)."
-
-        # --- Define System Instructions/Structure Prompt ---
-        # This prompt tells the model HOW to structure its response.
-        system_instructions = """
-        Your task is to act as an expert document analyst. Analyze the provided document content meticulously based *only* on the user's request.
-
-        Follow these steps precisely and structure your output exactly as requested by the user, or if the user asks for specific information (like summary, key points, data extraction), structure your output clearly using Markdown headings based on their request.
-
-        If the user asks a general question or requests analysis without specifying format, structure your output using the following default Markdown headings:
-
-        **Document Type:**
-        [Identify the type: e.g., Handwritten Notes, Typed Essay, Scientific Paper, Form, Receipt, General Text, PDF Page Image, Bar Chart, Line Graph, Diagram. Note if handwriting is present.]
-
-        **Summary:**
-        [Provide a concise 1-2 sentence summary of the main topic or purpose. For charts/graphs, describe what it represents.]
-
-        **Key Information & Localization:**
-        [Identify and extract crucial pieces of information relevant to the user's query (main points, arguments, data points from charts/graphs, axis labels, legends, titles, definitions, form fields/values). For EACH piece of information, describe its precise location (Text files: line/paragraph; Images/PDF pages: visual location like 'top-left', 'bar corresponding to 'Category A'', 'X-axis label', 'legend entry for Series 1'). Use bullet points for clarity.]
-        * [Extracted Info 1]
-            * Location: [Precise location description]
-            * Confidence: [High, Medium, or Low]
-        * [Extracted Info 2]
-            * Location: [Precise location description]
-            * Confidence: [High, Medium, or Low]
-        * ... (continue for all key pieces relevant to the user's request)
-
-        **Category:**
-        [Assign ONE category based on the content from this list: Lecture Notes, Essay Draft, Research Paper, Assignment Submission, Admin Form, Data Visualization, Other. If unsure, state 'Other'.]
-
-        ---
-        Respond *only* based on the user's request applied to the provided document content. Do not add information not present in the document.
-        """
-
-        # --- Construct the final request content list ---
-        # Order: User Prompt -> File Content -> System Instructions
-        request_contents = [Part.from_text(user_prompt)] + request_contents_list + [Part.from_text(system_instructions)]
-        print(f"DEBUG: Final request_contents length: {len(request_contents)}")
-        print(f"DEBUG: First part type: {type(request_contents[0])}, Content snippet: {str(request_contents[0])[:100]}...") # Check user prompt part
-        print(f"DEBUG: Last part type: {type(request_contents[-1])}, Content snippet: {str(request_contents[-1])[:100]}...") # Check system instructions part
-
-        # --- Safety and Generation Config ---
-        safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        }
-
-        generation_config = {
-            "max_output_tokens": 2048,
-            "temperature": 0.3, # Lower temperature for more factual/structured output
-            "top_p": 0.95,
-            "top_k": 40,
-        }
-
-        # --- API Call ---
-        logging.info(f"Sending request to Vertex AI Gemini model ({model_name_to_use}) for file: {os.path.basename(file_path)}...")
-        print(f"DEBUG: Sending request with model: {model_name_to_use}")
-        # Ensure the model object is valid before calling generate_content
-        if not isinstance(model, GenerativeModel):
-             logging.error("Model object is not a valid GenerativeModel instance before API call.")
-             return "Error: Invalid model object before API call."
-
-        responses = model.generate_content(
-            request_contents,
-            generation_config=generation_config,
-            safety_settings=safety_settings,
-            stream=False, # Use stream=False for simpler response handling
-        )
-        logging.info(f"Received response from model for file: {os.path.basename(file_path)}.")
-        print(f"DEBUG: Received response for {os.path.basename(file_path)}")
-
-        # --- Response Processing ---
-        analysis_result = "Error: Failed to process model response." # Default error
-        try:
-            # Use the built-in .text property for convenience if available and valid
-            # It handles combining text parts and checks for blocked content.
-            analysis_result = responses.text
-            logging.info(f"Analysis complete for file: {os.path.basename(file_path)}.")
-            print(f"DEBUG: Analysis complete via responses.text. Result length: {len(analysis_result)}")
-
-        except ValueError as e:
-            # Handle cases where .text raises ValueError (e.g., blocked content, no text parts)
-            logging.warning(f"Could not directly access response.text: {e}. Checking finish reason and parts.")
-            print(f"DEBUG: ValueError accessing response.text: {e}")
-            # Check finish reason if available
-            finish_reason_name = "UNKNOWN"
-            if responses.candidates and responses.candidates[0].finish_reason != FinishReason.STOP:
-                try: finish_reason_name = FinishReason(responses.candidates[0].finish_reason).name
-                except ValueError: finish_reason_name = f"UNKNOWN_REASON_{responses.candidates[0].finish_reason}"
-                logging.error(f"Analysis stopped for {os.path.basename(file_path)} due to finish reason: {finish_reason_name}")
-                print(f"DEBUG: Analysis stopped. Finish Reason: {finish_reason_name}")
-                analysis_result = f"Error: Analysis stopped due to {finish_reason_name}."
-            # Check prompt feedback if available
-            elif hasattr(responses, 'prompt_feedback') and responses.prompt_feedback and responses.prompt_feedback.block_reason:
-                 feedback_reason = responses.prompt_feedback.block_reason
-                 logging.error(f"Analysis failed for {os.path.basename(file_path)}. Prompt blocked. Reason: {feedback_reason}.")
-                 print(f"DEBUG: Prompt blocked. Reason: {feedback_reason}")
-                 analysis_result = f"Error: Analysis failed. Prompt Blocked. Reason: {feedback_reason}"
-            # Check if there are any text parts manually as a fallback
-            elif responses.candidates and responses.candidates[0].content and responses.candidates[0].content.parts:
-                 text_parts = [part.text for part in responses.candidates[0].content.parts if hasattr(part, 'text')]
-                 if text_parts:
-                     analysis_result = " ".join(text_parts)
-                     if not analysis_result.strip(): analysis_result = "Error: Model response parts contained empty text."
-                 else: analysis_result = "Error: Could not parse text from model response parts (no text parts found)."
-            else:
-                analysis_result = f"Error: Analysis failed. Reason: {e}" # Use the ValueError message
-
-        except Exception as e_resp:
-             # Catch any other unexpected errors during response processing
-             logging.error(f"Unexpected error processing model response: {e_resp}", exc_info=True)
-             print(f"DEBUG: Exception processing response: {e_resp}")
-             analysis_result = f"Error: Unexpected error processing response: {e_resp}"
-
-        return analysis_result
+        return request_contents_list
 
     # --- Outer error handling ---
     except FileNotFoundError:
         logging.error(f"Outer FileNotFoundError: {file_path}")
-        print(f"DEBUG: Outer FileNotFoundError caught.")
         return "Error: File not found during processing."
     except ImportError as e:
         logging.error(f"ImportError: {e}")
-        print(f"DEBUG: Outer ImportError caught: {e}")
         return "Error: Required libraries not installed or import failed."
     except Exception as e:
         logging.error(f"Outer unexpected error for {os.path.basename(file_path)}: {e}", exc_info=True)
-        print(f"DEBUG: Outer Exception caught: {type(e).__name__} - {e}")
         return f"Error: An unexpected error occurred during analysis for {os.path.basename(file_path)}: {e}"
 
+def _response_to_text(responses, file_path: str) -> str:
+    """
+    Extracts the analysis text from a generate_content response.
+
+    Args:
+        responses: The GenerationResponse returned by the model.
+        file_path: Path of the analyzed file (used for logging).
+
+    Returns:
+        The analysis text, or an "Error: ..." string if the response was blocked or empty.
+    """
+    # --- Response Processing ---
+    analysis_result = "Error: Failed to process model response." # Default error
+    try:
+        # Use the built-in .text property for convenience if available and valid
+        # It handles combining text parts and checks for blocked content.
+        analysis_result = responses.text
+        logging.info(f"Analysis complete for file: {os.path.basename(file_path)}.")
+        logging_config.debug("Analysis complete via responses.text. Result length: %d", len(analysis_result))
+
+    except ValueError as e:
+        # Handle cases where .text raises ValueError (e.g., blocked content, no text parts)
+        logging.warning(f"Could not directly access response.text: {e}. Checking finish reason and parts.")
+        logging_config.debug("ValueError accessing response.text: %s", e)
+        # Check finish reason if available
+        finish_reason_name = "UNKNOWN"
+        if responses.candidates and responses.candidates[0].finish_reason != FinishReason.STOP:
+            try: finish_reason_name = FinishReason(responses.candidates[0].finish_reason).name
+            except ValueError: finish_reason_name = f"UNKNOWN_REASON_{responses.candidates[0].finish_reason}"
+            logging.error(f"Analysis stopped for {os.path.basename(file_path)} due to finish reason: {finish_reason_name}")
+            analysis_result = f"Error: Analysis stopped due to {finish_reason_name}."
+        # Check prompt feedback if available
+        elif hasattr(responses, 'prompt_feedback') and responses.prompt_feedback and responses.prompt_feedback.block_reason:
+             feedback_reason = responses.prompt_feedback.block_reason
+             logging.error(f"Analysis failed for {os.path.basename(file_path)}. Prompt blocked. Reason: {feedback_reason}.")
+             analysis_result = f"Error: Analysis failed. Prompt Blocked. Reason: {feedback_reason}"
+        # Check if there are any text parts manually as a fallback
+        elif responses.candidates and responses.candidates[0].content and responses.candidates[0].content.parts:
+             text_parts = [part.text for part in responses.candidates[0].content.parts if hasattr(part, 'text')]
+             if text_parts:
+                 analysis_result = " ".join(text_parts)
+                 if not analysis_result.strip(): analysis_result = "Error: Model response parts contained empty text."
+             else: analysis_result = "Error: Could not parse text from model response parts (no text parts found)."
+        else:
+            analysis_result = f"Error: Analysis failed. Reason: {e}" # Use the ValueError message
+
+    except Exception as e_resp:
+         # Catch any other unexpected errors during response processing
+         logging.error(f"Unexpected error processing model response: {e_resp}", exc_info=True)
+         analysis_result = f"Error: Unexpected error processing response: {e_resp}"
+
+    return analysis_result
+
 # --- End of analyze_content function ---
@@ -0,0 +1,242 @@
+# src/watch_daemon.py
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Import project modules
+try:
+    from . import batch_engine
+    from . import file_index
+except ImportError:
+    try:
+        import batch_engine
+        import file_index
+    except ImportError as e:
+        logging.error(f"Fallback import failed: {e}")
+        batch_engine = None
+        file_index = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Long-running ingestion: watches the input directory (file_index.watch_changes, inotify
+# or polling), waits until a new or changed file has stopped growing, and analyzes it on
+# a bounded worker pool. Each result is appended to the batch checkpoint as it completes
+# and the file is marked processed in the file index, so a restart (or a later one-shot
+# run) picks up exactly the files that were not finished.
+#
+# On stop() the watcher and the debouncer stop handing out files, queued files that have
+# not started are dropped (they are still pending in the index) and in-flight analyses
+# are waited for.
+
+
+class Debouncer:
+    """
+    Holds files until their size and mtime have not changed for quiet_s seconds, so
+    files that are still being copied or written are not analyzed half-way.
+
+    Args:
+        quiet_s: Time a file must stay unchanged before it is released.
+        clock: Monotonic clock (replaceable for testing).
+    """
+
+    def __init__(self, quiet_s: float = 2.0, clock: Callable[[], float] = time.monotonic):
+        self.quiet_s = quiet_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[Optional[Tuple[int, int]], float]] = {} # path -> (size, mtime_ns), since
+
+    def add(self, path: str):
+        """Starts (or restarts) the quiet period of path."""
+        with self._lock:
+            self._files[path] = (None, self._clock())
+
+    def ready(self) -> List[str]:
+        """Returns (and forgets) the files that have been stable for quiet_s. Vanished files are dropped."""
+        with self._lock:
+            items = list(self._files.items())
+        now = self._clock()
+        released = []
+        for path, (last_stat, since) in items:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._files.pop(path, None)
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            with self._lock:
+                if self._files.get(path) != (last_stat, since):
+                    continue # Re-added meanwhile
+                if current != last_stat:
+                    self._files[path] = (current, now)
+                elif now - since >= self.quiet_s:
+                    del self._files[path]
+                    released.append(path)
+        return released
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._files)
+
+
+class WatchDaemon:
+    """
+    Analyzes files as they arrive in input_dir until stop() is called.
+
+    Args:
+        input_dir: Directory to watch (recursively).
+        index: File index tracking which files still need to be analyzed.
+        analyze_fn: Callable taking a file path and returning the analysis string
+                    (or an "Error: ..." string).
+        checkpoint_path: JSONL checkpoint the results are appended to.
+        base_dir: Directory that result keys are made relative to.
+        max_workers: Files analyzed concurrently.
+        max_queued: Files waiting for a worker; the daemon stops releasing files while full.
+        debounce_s: Quiet period before a new or changed file is analyzed.
+        poll_interval_s: Rescan interval when inotify is unavailable.
+        on_success: Optional callback(relative_path, analysis) for successful analyses.
+        on_export: Optional callback run every export_interval_s and at shutdown, when
+                   files finished since the last call (e.g. to write the result files).
+        export_interval_s: Interval between on_export calls (0 = only at shutdown).
+        use_inotify: Force (True) or disable (False) inotify; None picks it if available.
+    """
+
+    def __init__(self, input_dir: str, index: Any, analyze_fn: Callable[[str], str], checkpoint_path: str,
+                 base_dir: str, max_workers: int = 8, max_queued: int = 16, debounce_s: float = 2.0,
+                 poll_interval_s: float = 30.0, on_success: Optional[Callable[[str, str], None]] = None,
+                 on_export: Optional[Callable[[], None]] = None, export_interval_s: float = 0,
+                 use_inotify: Optional[bool] = None):
+        self.input_dir = input_dir
+        self.index = index
+        self.analyze_fn = analyze_fn
+        self.checkpoint_path = checkpoint_path
+        self.base_dir = base_dir
+        self.max_workers = max(1, max_workers)
+        self.poll_interval_s = poll_interval_s
+        self.on_success = on_success
+        self.on_export = on_export
+        self.export_interval_s = export_interval_s
+        self.use_inotify = use_inotify
+        self.debouncer = Debouncer(debounce_s)
+        self._tick_s = min(0.5, max(0.05, debounce_s / 4))
+        self._slots = threading.BoundedSemaphore(self.max_workers + max(0, max_queued))
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._changed_in_flight = set() # Changed again while being analyzed
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0}
+        self._exported_count = 0
+        self._checkpoint = None
+
+    def stop(self):
+        """Asks run() to finish; safe to call from signal handlers and other threads."""
+        self._stop_event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._in_flight), debouncing=len(self.debouncer))
+
+    # --- Watching ---
+    def _watch(self):
+        try:
+            for indexed in file_index.watch_changes(self.index, self.input_dir, self.poll_interval_s,
+                                                    stop_event=self._stop_event, use_inotify=self.use_inotify):
+                with self._lock:
+                    if indexed.path in self._in_flight:
+                        self._changed_in_flight.add(indexed.path)
+                        continue
+                self.debouncer.add(indexed.path)
+        except Exception as e:
+            logging.error(f"Watch daemon: watcher failed, shutting down: {e}", exc_info=True)
+            self.stop()
+
+    # --- Processing ---
+    def _submit(self, executor: ThreadPoolExecutor, path: str) -> bool:
+        """Queues path for analysis once a slot is free. False if the daemon is stopping."""
+        while not self._slots.acquire(timeout=self._tick_s):
+            if self._stop_event.is_set():
+                return False
+        # Re-read the file: the hash reported by the watcher may predate the last write
+        indexed = self.index.check_file(path)
+        if indexed is None:
+            self._slots.release()
+            return True
+        with self._lock:
+            self._in_flight.add(path)
+            self.counters["submitted"] += 1
+        executor.submit(self._process, indexed)
+        return True
+
+    def _process(self, indexed: Any):
+        relative_file_path = os.path.relpath(indexed.path, self.base_dir)
+        try:
+            logging.info(f"--- Processing file: {relative_file_path} ---")
+            try:
+                analysis_result_str = self.analyze_fn(indexed.path)
+            except Exception as e:
+                logging.error(f"Unexpected error analyzing {relative_file_path}: {e}", exc_info=True)
+                analysis_result_str = f"Error: Unexpected error during analysis: {e}"
+            record = batch_engine.make_record(indexed.path, (indexed.path, indexed.size, indexed.mtime_ns),
+                                              analysis_result_str, self.base_dir, self.on_success)
+            self._checkpoint.write(record)
+            succeeded = record["result"]["status"] == "success"
+            if succeeded:
+                self.index.mark_processed([(indexed.path, indexed.content_hash)])
+            with self._lock:
+                self.counters["succeeded" if succeeded else "failed"] += 1
+        except Exception as e:
+            logging.error(f"Watch daemon: could not record result for {relative_file_path}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_flight.discard(indexed.path)
+                changed_again = indexed.path in self._changed_in_flight
+                self._changed_in_flight.discard(indexed.path)
+            if changed_again:
+                self.debouncer.add(indexed.path)
+            self._slots.release()
+
+    def _export(self):
+        """Runs on_export if files finished since the last export."""
+        with self._lock:
+            finished = self.counters["succeeded"] + self.counters["failed"]
+        if not self.on_export or finished == self._exported_count:
+            return
+        try:
+            self.on_export()
+            self._exported_count = finished
+        except Exception as e:
+            logging.error(f"Watch daemon: exporting results failed: {e}", exc_info=True)
+
+    def run(self):
+        """Watches and analyzes until stop() is called, then drains in-flight analyses."""
+        logging.info(f"Watch daemon: watching {self.input_dir} with {self.max_workers} workers "
+                     f"(debounce {self.debouncer.quiet_s:.1f}s).")
+        watcher = threading.Thread(target=self._watch, name="watch-daemon-watcher", daemon=True)
+        next_export = time.monotonic() + self.export_interval_s
+        with batch_engine.CheckpointWriter(self.checkpoint_path) as checkpoint:
+            self._checkpoint = checkpoint
+            executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="watch-daemon")
+            try:
+                watcher.start()
+                while not self._stop_event.is_set():
+                    for path in self.debouncer.ready():
+                        if not self._submit(executor, path):
+                            break
+                    if self.export_interval_s and time.monotonic() >= next_export:
+                        self._export()
+                        next_export = time.monotonic() + self.export_interval_s
+                    self._stop_event.wait(self._tick_s)
+            finally:
+                self._stop_event.set()
+                logging.info(f"Watch daemon: stopping, waiting for {len(self._in_flight)} in-flight "
+                             f"analyses (files not started yet stay pending for the next start).")
+                executor.shutdown(wait=True, cancel_futures=True)
+                watcher.join(timeout=5)
+                with self._lock:
+                    self._in_flight.clear() # Only cancelled files are left
+        self._export()
+        logging.info(f"Watch daemon: stopped. {self.stats()}")
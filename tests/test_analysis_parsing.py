@@ -0,0 +1,186 @@
+# tests/test_analysis_parsing.py
+import re
+
+import pytest
+
+from src import utils
+
+FIELDS = ("document_type", "summary", "key_info_localization", "category")
+_LEGACY_END = r"(?=\n\s*\**\w+(\s*&\s*\w+)?\s*:?\**\s*\n?|\Z)"
+_LEGACY_PATTERNS = {
+    "document_type": r"^\s*\**Document Type:?\**\s*(.*?)" + _LEGACY_END,
+    "summary": r"^\s*\**Summary:?\**\s*(.*?)" + _LEGACY_END,
+    "key_info_localization": r"^\s*\**Key Information(?: & Localization)?:?\**\s*\n?(.*?)" + _LEGACY_END,
+    "category": r"^\s*\**Category:?\**\s*(.*?)" + _LEGACY_END,
+}
+
+
+def legacy_parse(analysis_text):
+    """The four-regex parser that parse_gemini_analysis replaced, kept as the reference."""
+    parsed = {}
+    for field, pattern in _LEGACY_PATTERNS.items():
+        match = re.search(pattern, analysis_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
+        parsed[field] = match.group(1).strip() if match else "N/A"
+    return parsed
+
+
+def sections(parsed):
+    return {field: parsed[field] for field in FIELDS}
+
+
+# --- Golden Responses ---
+TYPICAL = """**Document Type:**
+Lecture Notes
+
+**Summary:**
+Backpropagation computes gradients layer by layer using the chain rule.
+
+**Key Information & Localization:**
+* Chain rule for composite functions
+    * Location: Page 2, top
+    * Confidence: High
+* Vanishing gradients in deep networks
+    * Location: Page 3
+    * Confidence: Medium
+
+**Category:**
+Lecture Notes"""
+
+INLINE = """**Document Type:** Essay
+**Summary:** An essay on the causes of the industrial revolution.
+**Key Information:**
+* Steam engine patents (1769)
+**Category:** Essay Draft"""
+
+REORDERED = """**Category:**
+Admin Form
+
+**Summary:**
+An enrolment form for the autumn term.
+
+**Document Type:**
+Form
+
+**Key Information & Localization:**
+* Student ID field
+    * Location: Top right
+    * Confidence: High"""
+
+MISSING_SECTIONS = """**Document Type:**
+Handwritten Notes
+
+**Summary:**
+Notes on linear regression."""
+
+OTHER_HEADINGS = """**Document Type:**
+Lecture Slides
+
+**Summary:**
+Slides introducing decision trees.
+
+**Notes:**
+The slides are partly illegible.
+
+**Key Information & Localization:**
+* Gini impurity
+    * Location: Slide 4
+    * Confidence: High
+
+**Category:**
+Lecture Notes
+
+**Additional Observations:**
+Handwriting in the margins."""
+
+LOWERCASE = """**document type:**
+Lab Report
+
+**summary:**
+A titration experiment.
+
+**key information & localization:**
+* Endpoint at 23.4 mL
+
+**category:**
+Lab Work"""
+
+GOLDEN = {
+    "typical": TYPICAL,
+    "inline": INLINE,
+    "reordered": REORDERED,
+    "missing_sections": MISSING_SECTIONS,
+    "other_headings": OTHER_HEADINGS,
+    "lowercase": LOWERCASE,
+}
+
+
+@pytest.mark.parametrize("name", GOLDEN)
+def test_single_pass_parser_matches_the_regex_parser(name):
+    assert sections(utils.parse_gemini_analysis(GOLDEN[name])) == legacy_parse(GOLDEN[name])
+
+
+def test_reordered_headings():
+    parsed = utils.parse_gemini_analysis(REORDERED)
+
+    assert (parsed["document_type"], parsed["category"]) == ("Form", "Admin Form")
+    assert parsed["summary"] == "An enrolment form for the autumn term."
+
+
+def test_missing_sections_default_to_na():
+    parsed = utils.parse_gemini_analysis(MISSING_SECTIONS)
+
+    assert parsed["key_info_localization"] == parsed["category"] == "N/A"
+    assert parsed["key_info_items"] == []
+
+
+def test_other_headings_close_the_section_before_them():
+    parsed = utils.parse_gemini_analysis(OTHER_HEADINGS)
+
+    assert parsed["summary"] == "Slides introducing decision trees."
+    assert parsed["category"] == "Lecture Notes"
+    assert "illegible" not in parsed["key_info_localization"] and "margins" not in parsed["category"]
+
+
+def test_repeated_heading_keeps_the_first_occurrence():
+    text = MISSING_SECTIONS + "\n\n**Summary:**\nA second summary."
+
+    assert utils.parse_gemini_analysis(text)["summary"] == legacy_parse(text)["summary"] == "Notes on linear regression."
+
+
+def test_multi_line_sections_are_kept_whole():
+    # The regex parser stopped at the first line break followed by a word
+    text = "**Summary:**\nGradient descent minimises the loss.\nEach step follows the negative gradient.\n\n**Category:**\nNotes"
+
+    assert utils.parse_gemini_analysis(text)["summary"] == \
+        "Gradient descent minimises the loss.\nEach step follows the negative gradient."
+    assert legacy_parse(text)["summary"] == "Gradient descent minimises the loss."
+
+
+# --- Key Information Items ---
+def test_key_info_items():
+    assert utils.parse_gemini_analysis(TYPICAL)["key_info_items"] == [
+        {"info": "Chain rule for composite functions", "location": "Page 2, top", "confidence": "High"},
+        {"info": "Vanishing gradients in deep networks", "location": "Page 3", "confidence": "Medium"},
+    ]
+
+
+def test_key_info_items_without_nested_fields():
+    assert utils.parse_gemini_analysis(INLINE)["key_info_items"] == [
+        {"info": "Steam engine patents (1769)", "location": None, "confidence": None},
+    ]
+
+
+def test_key_info_items_accept_bold_labels_and_dash_bullets():
+    text = "**Key Information:**\n- Ohm's law\n  - **Location:** Page 1\n  - **Confidence:** Low"
+
+    assert utils.parse_gemini_analysis(text)["key_info_items"] == [
+        {"info": "Ohm's law", "location": "Page 1", "confidence": "Low"},
+    ]
+
+
+@pytest.mark.parametrize("text", ["", "Error: Model call failed.", "Info: No content."])
+def test_errors_and_empty_text_return_the_default_structure(text):
+    parsed = utils.parse_gemini_analysis(text)
+
+    assert all(parsed[field] == "N/A" for field in FIELDS) and parsed["key_info_items"] == []
+    assert parsed["raw_text"] == text
@@ -0,0 +1,115 @@
+# tests/test_api_stream.py
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from src import api
+
+
+@pytest.fixture
+def upload_dirs(monkeypatch, tmp_path):
+    """Records the temporary upload directories the route creates; uploads always spill to disk."""
+    created = []
+
+    def mkdtemp():
+        path = tmp_path / f"upload-{len(created)}"
+        path.mkdir()
+        created.append(str(path))
+        return str(path)
+
+    monkeypatch.setattr(api, "tempfile", SimpleNamespace(mkdtemp=mkdtemp))
+    monkeypatch.setattr(api, "DocumentSource", None)
+    monkeypatch.setattr(api, "get_answering_model", lambda: None)
+    return created
+
+
+def post_stream(client, *names):
+    data = {"prompt": "Summarize", "files": [(io.BytesIO(b"lecture notes"), name) for name in names]}
+    return client.post("/api/analyze/stream", data=data, content_type="multipart/form-data", buffered=False)
+
+
+def events(body: bytes):
+    return [block.split("\n", 1)[0][len("event: "):] for block in body.decode().split("\n\n") if block]
+
+
+# --- Temporary Directory Cleanup ---
+def test_remove_when_done_waits_for_running_futures(tmp_path):
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        running = executor.submit(release.wait, 5)
+        api._remove_when_done([running], str(tmp_path))
+        assert tmp_path.exists()
+
+        release.set()
+        running.result()
+    assert not tmp_path.exists()
+
+
+def test_remove_when_done_removes_at_once_without_running_futures(tmp_path):
+    api._remove_when_done([], str(tmp_path))
+
+    assert not tmp_path.exists()
+
+
+# --- Streaming ---
+def test_stream_analyzes_uploads_and_removes_the_upload_dir(monkeypatch, upload_dirs):
+    def analyze(path, prompt):
+        with open(path, "rb") as f:
+            text = f.read().decode()
+        yield "chunk", text
+        yield "result", f"Analysis of {text}"
+
+    monkeypatch.setattr(api, "analyze_content_stream", analyze)
+    response = post_stream(api.app.test_client(), "a.txt", "b.txt")
+
+    names = events(response.get_data())
+    response.close()
+
+    assert names[0] == "start" and names[-1] == "done"
+    assert names.count("chunk") == names.count("file_complete") == 2
+    assert len(upload_dirs) == 1 and not os.path.exists(upload_dirs[0])
+
+
+def test_disconnect_does_not_wait_for_in_flight_analyses(monkeypatch, upload_dirs):
+    started, release = threading.Event(), threading.Event()
+    finished = []
+
+    def analyze(path, prompt):
+        yield "chunk", "Partial"
+        started.set()
+        release.wait(5)
+        with open(path, "rb") as f: # The upload is still readable after the disconnect
+            finished.append(f.read())
+        yield "result", "Analysis"
+
+    monkeypatch.setattr(api, "analyze_content_stream", analyze)
+    response = post_stream(api.app.test_client(), "a.txt")
+    body = iter(response.response)
+    assert next(body).startswith(b"event: start")
+    assert next(body).startswith(b"event: chunk")
+    assert started.wait(5)
+
+    closing = time.monotonic()
+    response.close() # Client disconnects while the analysis runs
+    assert time.monotonic() - closing < 1
+    assert os.path.exists(upload_dirs[0])
+
+    release.set()
+    for _ in range(100):
+        if not os.path.exists(upload_dirs[0]):
+            break
+        threading.Event().wait(0.05)
+    assert finished == [b"lecture notes"] and not os.path.exists(upload_dirs[0])
+
+
+def test_response_closed_before_streaming_removes_the_upload_dir(upload_dirs):
+    response = post_stream(api.app.test_client(), "a.txt")
+
+    response.close()
+
+    assert not os.path.exists(upload_dirs[0])
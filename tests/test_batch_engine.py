@@ -0,0 +1,183 @@
+# tests/test_batch_engine.py
+import json
+import os
+
+import pytest
+
+from src import batch_engine, config, main
+
+
+def write_files(directory, *names):
+    paths = []
+    for name in names:
+        path = directory / name
+        path.write_text(f"Notes in {name}")
+        paths.append(str(path))
+    return paths
+
+
+class Analyzer:
+    """analyze_fn that records the files it was called with."""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+
+    def __call__(self, file_path):
+        self.calls.append(os.path.basename(file_path))
+        if os.path.basename(file_path) in self.fail:
+            return "Error: Model call failed."
+        return f"Analysis of {os.path.basename(file_path)}"
+
+
+def record(file, status="success", path=None, size=1, mtime_ns=1):
+    result = {"status": "success", "analysis": f"Analysis of {file}"} if status == "success" else \
+        {"status": "error", "message": "Error: failed"}
+    return {"file": file, "path": path or f"/data/{file}", "size": size, "mtime_ns": mtime_ns, "result": result}
+
+
+def write_checkpoint(path, records, tail=""):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in records)
+        f.write(tail)
+
+
+# --- Fingerprints ---
+def test_completed_fingerprints_latest_record_decides():
+    records = [
+        record("a.pdf"),
+        record("b.pdf", status="error"), record("b.pdf"), # Retried successfully
+        record("c.pdf"), record("c.pdf", status="error"), # Failed after an earlier success
+        record("d.pdf"), record("d.pdf", mtime_ns=2), # Changed and re-analyzed
+    ]
+
+    assert batch_engine.completed_fingerprints(records) == {
+        ("/data/a.pdf", 1, 1), ("/data/b.pdf", 1, 1), ("/data/d.pdf", 1, 2),
+    }
+
+
+# --- Reading Checkpoints ---
+def test_iter_checkpoint_skips_a_truncated_last_line(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(checkpoint, [record("a.pdf"), record("b.pdf")], tail='{"file": "c.pdf", "res')
+
+    assert [r["file"] for r in batch_engine.iter_checkpoint(str(checkpoint))] == ["a.pdf", "b.pdf"]
+    assert list(batch_engine.iter_checkpoint(str(tmp_path / "missing.jsonl"))) == []
+
+
+def test_iter_latest_records_keeps_the_latest_record_in_the_given_order(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(checkpoint, [record("a.pdf", status="error"), record("b.pdf"), record("c.pdf"),
+                                  record("a.pdf")], tail="not json\n")
+
+    latest = list(batch_engine.iter_latest_records(str(checkpoint), order=["c.pdf", "a.pdf"]))
+
+    assert [r["file"] for r in latest] == ["c.pdf", "a.pdf", "b.pdf"] # Unlisted files follow
+    assert latest[1]["result"]["status"] == "success"
+
+
+def test_compact_checkpoint_matches_the_results_layout(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    write_checkpoint(checkpoint, [record("a.pdf"), record("b.pdf", status="error")])
+
+    assert batch_engine.compact_checkpoint(str(checkpoint)) == {
+        "a.pdf": {"status": "success", "analysis": "Analysis of a.pdf"},
+        "b.pdf": {"status": "error", "message": "Error: failed"},
+    }
+
+
+# --- Resume ---
+@pytest.fixture
+def batch(tmp_path):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    files = write_files(inputs, "a.txt", "b.txt", "c.txt")
+    checkpoint = str(tmp_path / "outputs" / "checkpoint.jsonl")
+
+    def run(analyzer, **kwargs):
+        return batch_engine.run_batch(files, analyzer, checkpoint, str(tmp_path), max_workers=2, **kwargs)
+
+    return files, checkpoint, run
+
+
+def test_run_batch_returns_counts(batch):
+    _, checkpoint, run = batch
+
+    assert run(Analyzer(fail={"b.txt"})) == {"found": 3, "skipped": 0, "succeeded": 2, "failed": 1}
+    assert len(batch_engine.read_checkpoint(checkpoint)) == 3
+
+
+def test_resume_after_a_crash_only_reanalyzes_unfinished_files(batch):
+    files, checkpoint, run = batch
+    run(Analyzer(fail={"c.txt"}))
+    with open(checkpoint, "r+", encoding="utf-8") as f: # Crash while writing b.txt's record
+        lines = f.readlines()
+        f.seek(0)
+        f.truncate()
+        f.writelines(line for line in lines if '"inputs/b.txt"' not in line)
+        f.write('{"file": "inputs/b.txt", "pa')
+
+    analyzer = Analyzer()
+    summary = run(analyzer)
+
+    assert sorted(analyzer.calls) == ["b.txt", "c.txt"] # Unrecorded and failed files
+    assert summary == {"found": 3, "skipped": 1, "succeeded": 2, "failed": 0}
+    results = batch_engine.compact_checkpoint(checkpoint)
+    assert all(result["status"] == "success" for result in results.values()) and len(results) == 3
+
+
+def test_resume_reanalyzes_changed_files(batch):
+    files, _, run = batch
+    run(Analyzer())
+    with open(files[0], "a") as f:
+        f.write(" and an appendix")
+
+    analyzer = Analyzer()
+    run(analyzer)
+
+    assert analyzer.calls == ["a.txt"]
+
+
+def test_no_resume_discards_the_checkpoint(batch):
+    _, checkpoint, run = batch
+    run(Analyzer())
+
+    analyzer = Analyzer()
+    run(analyzer, resume=False)
+
+    assert sorted(analyzer.calls) == ["a.txt", "b.txt", "c.txt"]
+    assert len(batch_engine.read_checkpoint(checkpoint)) == 3
+
+
+# --- Entry Points ---
+@pytest.fixture
+def project(monkeypatch, tmp_path):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    write_files(inputs, "a.txt", "b.txt")
+    monkeypatch.setattr(config, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "INPUT_DIR", str(inputs))
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(tmp_path / "outputs"))
+    monkeypatch.setattr(config, "RESULTS_FORMATS", ["json"])
+    monkeypatch.setattr(config, "FILE_INDEX_ENABLED", False)
+    monkeypatch.setattr(config, "PACKING_ENABLED", False)
+    monkeypatch.setattr(main, "process_edtech_analysis", lambda file, analysis: None)
+    monkeypatch.setattr(main, "_analyze_file", Analyzer(fail={"b.txt"}))
+    return tmp_path
+
+
+def test_run_analysis_returns_the_results_dict(project):
+    results = main.run_analysis(max_workers=1)
+
+    assert results == {
+        os.path.join("inputs", "a.txt"): {"status": "success", "analysis": "Analysis of a.txt"},
+        os.path.join("inputs", "b.txt"): {"status": "error", "message": "Error: Model call failed."},
+    }
+    assert main.run_analysis(max_workers=1) == results # Resumed files keep their checkpointed result
+
+
+def test_run_analysis_summary_returns_counts_and_outputs(project):
+    summary = main.run_analysis_summary(max_workers=1)
+
+    assert (summary["found"], summary["succeeded"], summary["failed"]) == (2, 1, 1)
+    assert os.path.exists(summary["outputs"]["json"])
@@ -0,0 +1,172 @@
+# tests/test_context_cache.py
+import pytest
+
+from src import config, context_cache, fake_backend, vllm_handler
+
+INSTRUCTIONS = "Analyze the document and answer in the usual layout. " * 20
+MODEL = "fake-model"
+
+
+class Clock:
+    """Manually advanced Unix clock shared by the manager and the stand-in service."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def service(clock):
+    return fake_backend.FakeCacheService(lambda name: fake_backend.FakeGenerativeModel(name, latency_ms=0, tokens_per_second=0),
+                                         clock=clock)
+
+
+@pytest.fixture
+def manager(service, clock):
+    return context_cache.ContextCacheManager(service, ttl_s=3600, renew_before_s=300,
+                                             retry_after_failure_s=600, clock=clock)
+
+
+def test_creates_cache_once_then_hits(manager, service):
+    first = manager.get_model(MODEL, INSTRUCTIONS)
+    second = manager.get_model(MODEL, INSTRUCTIONS)
+
+    assert first is not None and second is first
+    assert service.calls["create"] == 1
+    assert manager.stats()["created"] == 1 and manager.stats()["hits"] == 1
+
+
+def test_reuses_live_cache_created_by_another_process(manager, service, clock):
+    other = context_cache.ContextCacheManager(service, ttl_s=3600, renew_before_s=300, clock=clock)
+    other.get_model(MODEL, INSTRUCTIONS)
+
+    assert manager.get_model(MODEL, INSTRUCTIONS) is not None
+    assert service.calls["create"] == 1
+    assert manager.stats()["reused"] == 1
+
+
+def test_renews_cache_close_to_expiry(manager, service, clock):
+    model = manager.get_model(MODEL, INSTRUCTIONS)
+    clock.now += 3600 - 100 # Inside the renew window
+
+    renewed = manager.get_model(MODEL, INSTRUCTIONS)
+
+    assert renewed is not None and renewed.handle.name == model.handle.name
+    assert service.calls["renew"] == 1 and service.calls["create"] == 1
+    assert renewed.handle.expire_time == clock.now + 3600
+
+
+def test_creates_new_cache_after_expiry(manager, service, clock):
+    manager.get_model(MODEL, INSTRUCTIONS)
+    clock.now += 3600 + 1
+
+    assert manager.get_model(MODEL, INSTRUCTIONS) is not None
+    assert service.calls["create"] == 2 and service.calls["renew"] == 0
+
+
+def test_changed_instructions_get_a_new_cache(manager, service):
+    old = manager.get_model(MODEL, INSTRUCTIONS)
+    new = manager.get_model(MODEL, INSTRUCTIONS + " Also list the dates.")
+
+    assert new.handle.name != old.handle.name
+    assert new.handle.display_name != old.handle.display_name
+    assert service.calls["create"] == 2
+
+
+def test_invalidate_drops_only_the_given_instructions(manager, service):
+    manager.get_model(MODEL, INSTRUCTIONS)
+    manager.get_model(MODEL, INSTRUCTIONS + " Other.")
+
+    manager.invalidate(MODEL, INSTRUCTIONS)
+
+    assert manager.stats()["invalidated"] == 1 and manager.stats()["active"] == 1
+
+
+def test_creation_failure_backs_off_then_retries(service, clock):
+    service.min_tokens = 10_000 # The service rejects the instructions as too small
+    manager = context_cache.ContextCacheManager(service, ttl_s=3600, retry_after_failure_s=600, clock=clock)
+
+    assert manager.get_model(MODEL, INSTRUCTIONS) is None
+    assert manager.get_model(MODEL, INSTRUCTIONS) is None
+    assert service.calls["create"] == 1 # Not retried during the backoff
+    assert manager.stats()["failures"] == 1
+
+    clock.now += 601
+    service.min_tokens = 0
+    assert manager.get_model(MODEL, INSTRUCTIONS) is not None
+    assert service.calls["create"] == 2
+
+
+def test_instructions_below_min_tokens_are_never_sent_to_the_service(service, clock):
+    manager = context_cache.ContextCacheManager(service, min_tokens=10_000, clock=clock)
+
+    assert manager.get_model(MODEL, INSTRUCTIONS) is None
+    clock.now += 10_000
+    assert manager.get_model(MODEL, INSTRUCTIONS) is None
+    assert service.calls["create"] == 0
+    assert manager.stats()["too_small"] == 1
+
+
+# --- Inline resend through vllm_handler ---
+@pytest.fixture
+def handler_with_cache(monkeypatch, tmp_path, clock):
+    model = fake_backend.FakeGenerativeModel(MODEL, latency_ms=0, tokens_per_second=0)
+    sent = [] # Contents of every request the plain model received
+    generate = model.generate_content
+
+    def recording_generate(contents, **kwargs):
+        sent.append(contents)
+        return generate(contents, **kwargs)
+
+    monkeypatch.setattr(model, "generate_content", recording_generate)
+    monkeypatch.setattr(config, "GCP_PROJECT_ID", config.GCP_PROJECT_ID or "test-project")
+    monkeypatch.setattr(config, "GCP_REGION", config.GCP_REGION or "europe-west4")
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "MODEL_ROUTING_ENABLED", False)
+    vllm_handler.set_model_factory(lambda name: model)
+    service = fake_backend.FakeCacheService(vllm_handler.get_model, clock=clock)
+    manager = context_cache.ContextCacheManager(service, ttl_s=3600, renew_before_s=300, clock=clock)
+    vllm_handler.set_context_cache(manager)
+    document = tmp_path / "notes.txt"
+    document.write_text("Decision trees split on the feature with the highest information gain.")
+    yield str(document), service, manager, sent
+    vllm_handler.set_context_cache(None)
+    vllm_handler.set_model_factory(None)
+
+
+def _has_instructions(contents) -> bool:
+    return any(vllm_handler.SYSTEM_INSTRUCTIONS in text for text in fake_backend.request_text_parts(contents))
+
+
+def test_cached_requests_leave_instructions_out(handler_with_cache):
+    document, service, manager, sent = handler_with_cache
+
+    result = vllm_handler.analyze_content(document, "Summarize", model_id_override=MODEL)
+
+    assert not result.startswith("Error:")
+    assert service.calls["create"] == 1
+    assert len(sent) == 1 and not _has_instructions(sent[0])
+
+
+@pytest.mark.parametrize("code", [404, 400])
+def test_cache_dropped_server_side_is_resent_inline(handler_with_cache, monkeypatch, code):
+    document, service, manager, sent = handler_with_cache
+    vllm_handler.analyze_content(document, "Summarize", model_id_override=MODEL)
+    service.drop() # Gone server-side before the manager's expiry time
+    if code == 400:
+        def reject(self, contents, **kwargs):
+            raise fake_backend.FakeAPIError(400, "Cached content is invalid")
+        monkeypatch.setattr(fake_backend.FakeCachedModel, "generate_content", reject)
+
+    result = vllm_handler.analyze_content(document, "Summarize", model_id_override=MODEL)
+
+    assert not result.startswith("Error:")
+    assert _has_instructions(sent[-1]) # Resent with the instructions inline
+    assert manager.stats()["invalidated"] == 1
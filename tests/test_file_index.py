@@ -0,0 +1,171 @@
+# tests/test_file_index.py
+import os
+import threading
+
+import pytest
+
+from src import file_index, response_cache
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = file_index.FileIndex(str(tmp_path / "index.db"))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    inputs = tmp_path / "inputs"
+    (inputs / "week1").mkdir(parents=True)
+    (inputs / "week1" / "notes.txt").write_text("Decision trees")
+    (inputs / "slides.txt").write_text("Random forests")
+    (inputs / ".hidden.txt").write_text("Ignored")
+    (inputs / "data.csv").write_text("Unsupported")
+    return inputs
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Records the files the index hashes."""
+    paths = []
+    hash_file = response_cache.hash_file
+
+    def spy(path):
+        paths.append(os.path.basename(path))
+        return hash_file(path)
+
+    monkeypatch.setattr(file_index.response_cache, "hash_file", spy)
+    return paths
+
+
+def names(indexed_files):
+    return sorted(os.path.basename(indexed.path) for indexed in indexed_files)
+
+
+def bump_mtime(path, seconds=10):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 1_000_000_000))
+
+
+def process_all(index, root):
+    index.mark_processed((indexed.path, indexed.content_hash) for indexed in index.scan_changes(str(root)))
+
+
+# --- Scanning ---
+def test_first_scan_reports_supported_visible_files(index, inputs):
+    assert names(index.scan_changes(str(inputs))) == ["notes.txt", "slides.txt"]
+    assert index.stats() == {"files": 2, "pending": 2}
+
+
+def test_unprocessed_files_stay_pending_until_marked(index, inputs):
+    list(index.scan_changes(str(inputs)))
+    assert names(index.scan_changes(str(inputs))) == ["notes.txt", "slides.txt"]
+    assert list(index.scan_changes(str(inputs), include_pending=False)) == []
+
+    process_all(index, inputs)
+    assert list(index.scan_changes(str(inputs))) == []
+    assert index.stats() == {"files": 2, "pending": 0}
+
+
+def test_unchanged_files_are_not_hashed_again(index, inputs, hashed):
+    process_all(index, inputs)
+    hashed.clear()
+
+    list(index.scan_changes(str(inputs)))
+
+    assert hashed == []
+
+
+def test_deleted_files_and_directories_leave_the_index(index, inputs):
+    process_all(index, inputs)
+    (inputs / "slides.txt").unlink()
+    (inputs / "week1" / "notes.txt").unlink()
+    (inputs / "week1").rmdir()
+
+    list(index.scan_changes(str(inputs)))
+
+    assert index.stats()["files"] == 0
+
+
+# --- Change Detection ---
+def test_touched_file_is_rehashed_but_not_pending(index, inputs, hashed):
+    process_all(index, inputs)
+    notes = inputs / "week1" / "notes.txt"
+    bump_mtime(notes)
+    hashed.clear()
+
+    assert index.check_file(str(notes)) is None
+    assert hashed == ["notes.txt"]
+    assert list(index.scan_changes(str(inputs))) == [] # The new mtime was recorded
+
+
+def test_changed_content_is_pending(index, inputs):
+    process_all(index, inputs)
+    notes = inputs / "week1" / "notes.txt"
+    notes.write_text("Decision trees and pruning")
+    bump_mtime(notes)
+
+    indexed = index.check_file(str(notes))
+
+    assert indexed.content_hash == response_cache.hash_file(str(notes))
+    assert indexed.size == len("Decision trees and pruning")
+
+
+def test_same_size_edit_is_detected_by_mtime(index, inputs):
+    process_all(index, inputs)
+    notes = inputs / "week1" / "notes.txt"
+    notes.write_text("Decision TREES") # Same size
+    bump_mtime(notes)
+
+    assert names(index.scan_changes(str(inputs))) == ["notes.txt"]
+
+
+def test_renamed_file_is_reported_under_its_new_path(index, inputs):
+    process_all(index, inputs)
+    old, new = inputs / "slides.txt", inputs / "week1" / "forests.txt"
+    os.rename(old, new)
+
+    assert index.check_file(str(old)) is None # Gone: its row is dropped
+    indexed = index.check_file(str(new))
+
+    assert indexed.path == str(new)
+    assert index.stats() == {"files": 2, "pending": 1}
+
+
+def test_mark_processed_with_a_stale_hash_keeps_the_file_pending(index, inputs):
+    notes = inputs / "week1" / "notes.txt"
+    picked_up = index.check_file(str(notes))
+    notes.write_text("Edited while the analysis ran")
+    bump_mtime(notes)
+    changed = index.check_file(str(notes))
+
+    index.mark_processed([(picked_up.path, picked_up.content_hash)])
+
+    assert index.check_file(str(notes)) == changed
+    index.mark_processed([(changed.path, changed.content_hash)])
+    assert index.check_file(str(notes)) is None
+
+
+def test_remove_drops_a_directory_prefix_only(index, inputs):
+    (inputs / "week10").mkdir()
+    (inputs / "week10" / "quiz.txt").write_text("Quiz")
+    list(index.scan_changes(str(inputs)))
+
+    assert index.remove(str(inputs / "week1"))
+
+    assert index.stats()["files"] == 2 # slides.txt and week10/quiz.txt
+
+
+# --- Watch Mode ---
+def test_polling_watch_reports_changes_until_stopped(index, inputs):
+    stop = threading.Event()
+    watcher = file_index.watch_changes(index, str(inputs), poll_interval_s=0, stop_event=stop, use_inotify=False)
+
+    first = [next(watcher), next(watcher)] # Catch-up scan
+    (inputs / "new.txt").write_text("Gradient boosting")
+    changed = next(watcher)
+    stop.set()
+
+    assert names(first) == ["notes.txt", "slides.txt"] and names([changed]) == ["new.txt"]
+    assert list(watcher) == []
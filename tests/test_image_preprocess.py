@@ -0,0 +1,67 @@
+# tests/test_image_preprocess.py
+import io
+
+import pytest
+
+from src import utils
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def encode(image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def line_art(size=(400, 300)):
+    """Black strokes on white, like a scanned page of handwritten notes."""
+    image = Image.new("L", size, 255)
+    for y in range(20, size[1], 24):
+        image.paste(0, (10, y, size[0] - 10, y + 2))
+    return image
+
+
+def test_small_image_that_would_grow_is_sent_unchanged():
+    original = encode(Image.effect_noise((64, 64), 64).convert("RGB"), "JPEG", quality=30)
+
+    data, mime_type, metrics = utils.preprocess_image_bytes(original, output_format="webp", quality=95)
+
+    assert metrics["kept_original"] and data == original and mime_type == "image/jpeg"
+
+
+def test_png_input_is_reencoded_losslessly():
+    image = line_art((3000, 2000))
+
+    data, mime_type, metrics = utils.preprocess_image_bytes(encode(image, "PNG"), max_edge=1500, output_format="webp")
+
+    assert mime_type == "image/webp" and metrics["pixels_after"] == (1500, 1000)
+    expected = image.resize((1500, 1000), Image.LANCZOS)
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.convert("L").tobytes() == expected.tobytes() # No lossy artifacts
+
+
+def test_png_input_stays_png_when_jpeg_is_configured():
+    data, mime_type, _ = utils.preprocess_image_bytes(encode(line_art((3000, 2000)), "PNG"), output_format="jpeg")
+
+    assert mime_type == "image/png"
+
+
+def test_large_photo_is_downscaled_and_reencoded():
+    original = encode(Image.effect_noise((3000, 2000), 32).convert("RGB"), "JPEG", quality=95)
+
+    data, mime_type, metrics = utils.preprocess_image_bytes(original, max_edge=1024, output_format="webp")
+
+    assert mime_type == "image/webp" and not metrics["kept_original"]
+    assert metrics["pixels_after"] == (1024, 682) and len(data) < len(original)
+
+
+def test_exif_rotated_image_is_always_reencoded():
+    image = Image.new("RGB", (64, 32), "white")
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Rotate 90 degrees clockwise when displayed
+    original = encode(image, "JPEG", quality=30, exif=exif.tobytes())
+
+    data, _, metrics = utils.preprocess_image_bytes(original, output_format="webp", quality=100)
+
+    assert not metrics["kept_original"] and metrics["pixels_after"] == (32, 64)
@@ -0,0 +1,169 @@
+# tests/test_long_document.py
+import re
+
+import pytest
+
+from src import config, fake_backend, long_document, structured_output, vllm_handler
+
+Chunk = long_document.ChunkAnalysis
+Item = structured_output.KeyInfoItem
+
+
+def markdown(document_type="Lecture Notes", summary="Notes.", items=(), category="Lecture Notes"):
+    lines = ["**Document Type:**", document_type, "", "**Summary:**", summary, "",
+             "**Key Information & Localization:**"]
+    for info, location in items:
+        lines += [f"* {info}", f"    * Location: {location}", "    * Confidence: High"]
+    return "\n".join(lines + ["", "**Category:**", category])
+
+
+# --- Page References ---
+@pytest.mark.parametrize("location, expected", [
+    (None, "Pages 3-4"),
+    ("", "Pages 3-4"),
+    ("top-left", "Pages 3-4, top-left"),
+    ("Page 3, figure 2", "Page 3, figure 2"),
+    ("pages 3 and 4", "pages 3 and 4"),
+    ("p. 4, footnote", "p. 4, footnote"),
+    ("pp. 3", "pp. 3"),
+    ("Pageant scene", "Pages 3-4, Pageant scene"),
+])
+def test_with_page_reference(location, expected):
+    assert long_document.with_page_reference(location, 3, 4) == expected
+
+
+def test_single_page_chunks_use_a_singular_label():
+    assert long_document.with_page_reference("bottom", 5, 5) == "Page 5, bottom"
+
+
+# --- Voting ---
+def test_vote_prefers_a_specific_category_over_other():
+    assert long_document._vote(["Other", "Other", "Lecture Notes"], avoid=("Other",)) == "Lecture Notes"
+    assert long_document._vote(["Other", "N/A"], avoid=("Other",)) == "Other"
+
+
+def test_vote_takes_the_most_frequent_value_and_the_earliest_on_ties():
+    assert long_document._vote(["Essay", "Form", "Form"]) == "Form"
+    assert long_document._vote(["Essay", "Form"]) == "Essay"
+    assert long_document._vote(["", "n/a", "Parsing Error"]) == "N/A"
+
+
+# --- Merging ---
+def test_merge_keeps_repeated_items_once_with_every_location():
+    chunks = [
+        Chunk(1, 2, markdown(items=[("Gradient descent", "Page 1"), ("Learning rate", "top")])),
+        Chunk(3, 4, markdown(items=[("gradient  DESCENT", "Page 4, figure"), ("Momentum", "")])),
+    ]
+
+    merged = long_document.merge_chunk_analyses(chunks)
+
+    assert merged.key_info == [
+        Item("Gradient descent", "Page 1; Page 4, figure", "High"),
+        Item("Learning rate", "Pages 1-2, top", "High"),
+        Item("Momentum", "Pages 3-4", "High"),
+    ]
+
+
+def test_merge_votes_and_summarizes_per_chunk():
+    chunks = [
+        Chunk(1, 2, markdown(summary="Linear models.", category="Other")),
+        Chunk(3, 4, markdown(document_type="Lecture Slides", summary="Neural networks.", category="Lecture Notes")),
+        Chunk(5, 5, markdown(summary="N/A", category="Other")),
+    ]
+
+    merged = long_document.merge_chunk_analyses(chunks)
+
+    assert (merged.document_type, merged.category, merged.source) == ("Lecture Notes", "Lecture Notes", "merged")
+    assert merged.summary == "Pages 1-2: Linear models. Pages 3-4: Neural networks."
+
+
+def test_merge_names_the_failed_chunks_in_the_summary():
+    chunks = [
+        Chunk(1, 2, markdown(summary="Linear models.")),
+        Chunk(3, 4, "Error: Model call failed."),
+        Chunk(5, 5, "Info: The model returned no content."),
+    ]
+
+    merged = long_document.merge_chunk_analyses(chunks)
+
+    assert merged.summary == "Pages 1-2: Linear models. (Pages 3-4, Page 5 could not be analyzed.)"
+
+
+# --- Rendering ---
+MERGED = structured_output.StructuredAnalysis(
+    "Lecture Notes", "Pages 1-2: Linear models.",
+    [Item("Gradient descent", "Page 1; Page 4", "High"), Item("Momentum", "Pages 3-4", None)],
+    "Lecture Notes", "merged", "")
+
+
+def test_render_analysis_round_trips_through_the_markdown_parser():
+    parsed = structured_output.from_markdown(long_document.render_analysis(MERGED))
+
+    assert parsed._replace(source="merged", raw_text="") == MERGED
+
+
+def test_render_analysis_round_trips_through_the_json_parser():
+    parsed = structured_output.parse_json_analysis(long_document.render_analysis(MERGED, structured=True))
+
+    assert parsed.key_info[1].confidence == "Low" # Required by the schema
+    assert parsed._replace(source="merged", raw_text="", key_info=MERGED.key_info) == MERGED
+
+
+# --- Model Reduce ---
+@pytest.fixture
+def long_pdf(monkeypatch):
+    """A 5-page PDF analyzed in groups of 2 pages by a fake model; returns the requests it saw."""
+    fitz = pytest.importorskip("fitz")
+    doc = fitz.open()
+    for n in range(5):
+        doc.new_page().insert_text(fitz.Point(72, 72), f"Page {n + 1}")
+    pdf_data = doc.tobytes()
+    doc.close()
+
+    model = fake_backend.FakeGenerativeModel("fake-model", latency_ms=0, tokens_per_second=0)
+    requests = []
+
+    def generate(contents, generation_config=None, **kwargs):
+        text = "\n".join(fake_backend.request_text_parts(contents))
+        if "Combine them into a single analysis" in text:
+            requests.append("reduce")
+            if reduce_fails[0]:
+                raise fake_backend.FakeAPIError(400, "Request too large")
+            return fake_backend.FakeResponse(markdown(summary="The whole course."))
+        pages = re.search(r"is (pages? [\d-]+) of a", text).group(1)
+        requests.append(pages)
+        return fake_backend.FakeResponse(markdown(summary=f"Notes on {pages}.", items=[("Gradient descent", "top")]))
+
+    reduce_fails = [True]
+    monkeypatch.setattr(model, "generate_content", generate)
+    monkeypatch.setattr(config, "GCP_PROJECT_ID", config.GCP_PROJECT_ID or "test-project")
+    monkeypatch.setattr(config, "GCP_REGION", config.GCP_REGION or "europe-west4")
+    monkeypatch.setattr(config, "MODEL_ROUTING_ENABLED", False)
+    monkeypatch.setattr(config, "PDF_CHUNK_PAGES", 2)
+    monkeypatch.setattr(config, "PDF_CHUNK_CONCURRENCY", 1)
+    monkeypatch.setattr(config, "PDF_LONG_DOCUMENT_MAX_PAGES", 0)
+    monkeypatch.setattr(config, "PDF_REDUCE_MODE", "model")
+    vllm_handler.set_model_factory(lambda name: model)
+    source = vllm_handler.DocumentSource(name="course.pdf", data=pdf_data, mime_type="application/pdf")
+    yield source, requests, reduce_fails
+    vllm_handler.set_model_factory(None)
+
+
+def test_failed_model_reduce_falls_back_to_the_local_merge(long_pdf):
+    source, requests, _ = long_pdf
+
+    analysis = vllm_handler._analyze_long_pdf(source, "Summarize", 5, model_id_override="fake-model")
+
+    assert requests == ["pages 1-2", "pages 3-4", "page 5", "reduce"]
+    parsed = structured_output.from_markdown(analysis)
+    assert parsed.summary == "Pages 1-2: Notes on pages 1-2. Pages 3-4: Notes on pages 3-4. Page 5: Notes on page 5."
+    assert parsed.key_info == [Item("Gradient descent", "Pages 1-2, top; Pages 3-4, top; Page 5, top", "High")]
+
+
+def test_successful_model_reduce_is_returned(long_pdf):
+    source, requests, reduce_fails = long_pdf
+    reduce_fails[0] = False
+
+    analysis = vllm_handler._analyze_long_pdf(source, "Summarize", 5, model_id_override="fake-model")
+
+    assert structured_output.from_markdown(analysis).summary == "The whole course."
@@ -0,0 +1,184 @@
+# tests/test_model_router.py
+import pytest
+
+from src import config, fake_backend, jobs, model_router, response_cache, vllm_handler
+
+PRIMARY = "projects/p/locations/europe-west4/endpoints/tuned"
+FALLBACK = "gemini-2.0-flash-lite-001"
+
+
+class Clock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_router(clock=None, **kwargs):
+    router = model_router.ModelRouter(PRIMARY, FALLBACK, latency_slo_s=2.0, error_rate_threshold=0.2,
+                                      min_samples=5, window_s=60, seed=3, **kwargs)
+    if clock is not None:
+        router._targets[PRIMARY] = model_router.TargetStats(router.window_s, clock=clock)
+    return router
+
+
+def record(router, count, latency_s=0.5, ok=True):
+    for _ in range(count):
+        router.record(PRIMARY, latency_s, ok)
+
+
+def decision_counts(router):
+    return {(d["source"], d["reason"]): d["count"] for d in router.stats()["decisions"]}
+
+
+# --- Health ---
+def test_healthy_primary_gets_every_request():
+    router = make_router(probe_fraction=1.0)
+    record(router, 10)
+
+    assert router.choose() == model_router.RouteDecision(PRIMARY, "tuned", "primary")
+
+
+def test_too_few_samples_never_judge_the_primary():
+    router = make_router()
+    record(router, 4, ok=False)
+
+    assert router.primary_health() is None
+
+
+def test_error_rate_and_latency_slo_route_to_the_fallback():
+    errors, slow = make_router(probe_fraction=0), make_router(probe_fraction=0)
+    record(errors, 4)
+    record(errors, 2, ok=False) # 2/6 > 0.2
+    record(slow, 10, latency_s=3.0)
+
+    assert errors.choose() == model_router.RouteDecision(FALLBACK, "base", "error_rate")
+    assert slow.choose() == model_router.RouteDecision(FALLBACK, "base", "latency_slo")
+
+
+def test_open_circuit_routes_to_the_fallback_without_probing():
+    router = make_router(probe_fraction=1.0, circuit_state=lambda name: "open")
+
+    assert router.choose() == model_router.RouteDecision(FALLBACK, "base", "circuit_open")
+
+
+def test_no_fallback_keeps_the_primary():
+    router = model_router.ModelRouter(PRIMARY, None, min_samples=1)
+    record(router, 3, ok=False)
+
+    assert router.choose().model_name == PRIMARY
+
+
+# --- Probing ---
+@pytest.mark.parametrize("fraction, expected", [(0.0, 0), (1.0, 1000)])
+def test_probe_fraction_bounds(fraction, expected):
+    router = make_router(probe_fraction=fraction)
+    record(router, 10, ok=False)
+
+    probes = sum(router.choose().reason == "probe" for _ in range(1000))
+
+    assert probes == expected
+
+
+def test_probe_fraction_share():
+    router = make_router(probe_fraction=0.1)
+    record(router, 10, ok=False)
+
+    probes = sum(router.choose().reason == "probe" for _ in range(2000))
+
+    assert 150 <= probes <= 250
+    assert decision_counts(router) == {("base", "error_rate"): 2000 - probes, ("tuned", "probe"): probes}
+
+
+# --- Window ---
+def test_old_samples_leave_the_window():
+    clock = Clock()
+    router = make_router(clock=clock, probe_fraction=0)
+    record(router, 10, ok=False)
+    assert router.primary_health() == "error_rate"
+
+    clock.now += 61
+    assert router.primary_health() is None
+    assert router.stats()["targets"][PRIMARY]["samples"] == 0
+
+
+def test_recovery_after_failures_age_out():
+    clock = Clock()
+    router = make_router(clock=clock, probe_fraction=0)
+    record(router, 5, ok=False)
+    clock.now += 30
+    record(router, 20) # 5/25 = 0.2 is not over the threshold
+    assert router.primary_health() is None
+
+    record(router, 1, ok=False)
+    assert router.primary_health() == "error_rate"
+    clock.now += 31 # The first five failures age out
+    assert router.primary_health() is None
+
+
+def test_window_latency_p95_ignores_failures():
+    stats = model_router.TargetStats(window_s=60)
+    for latency in range(1, 21):
+        stats.record(latency / 10, ok=True)
+    stats.record(99.0, ok=False)
+
+    snapshot = stats.snapshot()
+    assert snapshot["p95_latency_s"] == 2.0 and snapshot["samples"] == 21
+
+
+# --- Counting ---
+def test_uncounted_choices_are_counted_on_demand():
+    router = make_router()
+    decision = router.choose(count=False)
+    assert decision_counts(router) == {}
+
+    router.count(decision)
+    assert decision_counts(router) == {("tuned", "primary"): 1}
+
+
+@pytest.fixture
+def routed_handler(monkeypatch, tmp_path):
+    model = fake_backend.FakeGenerativeModel("fake-model", latency_ms=0, tokens_per_second=0)
+    monkeypatch.setattr(config, "GCP_PROJECT_ID", config.GCP_PROJECT_ID or "test-project")
+    monkeypatch.setattr(config, "GCP_REGION", config.GCP_REGION or "europe-west4")
+    monkeypatch.setattr(config, "TUNED_MODEL_ID", PRIMARY)
+    monkeypatch.setattr(config, "BASE_MODEL_ID", FALLBACK)
+    monkeypatch.setattr(config, "MODEL_ROUTING_ENABLED", True)
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(vllm_handler, "_response_cache", response_cache.ResponseCache(str(tmp_path / "responses.db")))
+    monkeypatch.setattr(vllm_handler, "_model_router", None)
+    vllm_handler.set_model_factory(lambda name: model)
+    document = tmp_path / "notes.txt"
+    document.write_text("Decision trees split on the feature with the highest information gain.")
+    yield str(document)
+    vllm_handler.set_model_factory(None)
+
+
+def test_cache_hits_are_not_routing_decisions(routed_handler):
+    for _ in range(3):
+        assert not vllm_handler.analyze_content(routed_handler, "Summarize").startswith("Error:")
+
+    assert decision_counts(vllm_handler.get_model_router()) == {("tuned", "primary"): 1}
+    assert vllm_handler.get_answering_model() == {"model": PRIMARY, "source": "tuned"}
+
+
+def test_job_results_name_the_answering_model(routed_handler, tmp_path):
+    backend = jobs.create_backend("sqlite", str(tmp_path / "jobs.db"))
+    manager = jobs.JobManager(backend, analyze_fn=vllm_handler.analyze_content, upload_dir=str(tmp_path / "uploads"),
+                              workers=1, model_fn=vllm_handler.get_answering_model)
+    job_id, _ = manager.new_job_dir()
+    manager.submit(job_id, "Summarize", [("notes.txt", routed_handler)])
+    try:
+        for _ in range(100):
+            job = manager.get(job_id)
+            if job["status"] == "completed":
+                break
+            manager._stop.wait(0.05)
+    finally:
+        manager.stop(timeout=5)
+
+    assert job["files"][0]["status"] == "success"
+    assert job["files"][0]["model"] == {"model": PRIMARY, "source": "tuned"}
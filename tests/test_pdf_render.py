@@ -0,0 +1,63 @@
+# tests/test_pdf_render.py
+import pytest
+
+from src import utils
+
+fitz = pytest.importorskip("fitz")
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    doc = fitz.open()
+    for n in range(3):
+        doc.new_page().insert_text(fitz.Point(72, 72), f"Lecture page {n + 1}", fontsize=24)
+    path = tmp_path / "lecture.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def pages(rendered):
+    return [(page_num, data) for page_num, data, _ in rendered]
+
+
+# --- Rendering ---
+def test_renders_pages_in_order(pdf_path):
+    rendered = list(utils.iter_pdf_page_images(pdf_path, max_pages=2, zoom=1))
+
+    assert [page_num for page_num, _, _ in rendered] == [0, 1]
+    assert all(data.startswith(b"\x89PNG") and mime_type == "image/png" for _, data, mime_type in rendered)
+
+
+def test_renders_from_memory(pdf_path):
+    with open(pdf_path, "rb") as f:
+        pdf_data = f.read()
+
+    from_memory = pages(utils.iter_pdf_page_images("upload.pdf", zoom=1, pdf_data=pdf_data))
+
+    assert from_memory == pages(utils.iter_pdf_page_images(pdf_path, zoom=1))
+
+
+# --- Process Pool ---
+def test_pool_uses_spawned_workers(monkeypatch, pdf_path):
+    contexts = []
+    pool = utils.ProcessPoolExecutor
+
+    def spy(*args, **kwargs):
+        contexts.append(kwargs.get("mp_context"))
+        return pool(*args, **kwargs)
+
+    monkeypatch.setattr(utils, "ProcessPoolExecutor", spy)
+    rendered = pages(utils.iter_pdf_page_images(pdf_path, zoom=1, processes=2))
+
+    assert [context.get_start_method() for context in contexts] == ["spawn"]
+    assert rendered == pages(utils.iter_pdf_page_images(pdf_path, zoom=1))
+
+
+def test_pool_renders_from_memory(pdf_path):
+    with open(pdf_path, "rb") as f:
+        pdf_data = f.read()
+
+    rendered = pages(utils.iter_pdf_page_images("upload.pdf", zoom=1, processes=2, pdf_data=pdf_data))
+
+    assert rendered == pages(utils.iter_pdf_page_images(pdf_path, zoom=1))
@@ -0,0 +1,105 @@
+# tests/test_pdf_text_layer.py
+import pytest
+
+from src import utils
+
+fitz = pytest.importorskip("fitz")
+
+PARAGRAPH = "Gradient descent updates the weights against the gradient of the loss. " * 6 # ~430 characters
+
+
+def add_text_page(doc, text=PARAGRAPH):
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(40, 40, 560, 400), text, fontsize=9)
+    return page
+
+
+def add_image(page):
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 16, 16), False)
+    pixmap.clear_with(128)
+    page.insert_image(fitz.Rect(40, 450, 200, 610), pixmap=pixmap)
+
+
+def add_drawings(page, count):
+    for n in range(count):
+        page.draw_line(fitz.Point(40, 450 + 10 * n), fitz.Point(300, 450 + 10 * n))
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """Pages: 0 text-only, 1 text + image, 2 scanned (no text layer), 3 text + chart drawings."""
+    doc = fitz.open()
+    add_text_page(doc)
+    add_image(add_text_page(doc))
+    add_image(doc.new_page())
+    add_drawings(add_text_page(doc), 12)
+    path = tmp_path / "lecture.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+# --- Triage ---
+def test_classify_pdf_page_decisions(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        decisions = [utils.classify_pdf_page(doc.load_page(n))[0] for n in range(len(doc))]
+
+    assert decisions == ["text", "mixed", "image", "mixed"]
+
+
+def test_classify_pdf_page_text_threshold():
+    doc = fitz.open()
+    page = add_text_page(doc, "x" * 50)
+    text_length = len(page.get_text("text").strip())
+
+    assert utils.classify_pdf_page(page, min_text_chars=text_length)[0] == "text"
+    assert utils.classify_pdf_page(page, min_text_chars=text_length + 1) == ("image", "x" * 50)
+
+
+def test_classify_pdf_page_drawing_threshold():
+    doc = fitz.open()
+    page = add_text_page(doc)
+    add_drawings(page, 3)
+
+    assert utils.classify_pdf_page(page, min_drawings=4)[0] == "text"
+    assert utils.classify_pdf_page(page, min_drawings=3)[0] == "mixed"
+
+
+# --- Page Parts ---
+def kinds(parts):
+    return [(page_num, kind) for page_num, kind, _, _ in parts]
+
+
+def test_off_mode_renders_every_page_by_default(pdf_path):
+    parts = list(utils.iter_pdf_page_parts(pdf_path))
+
+    assert kinds(parts) == [(0, "image"), (1, "image"), (2, "image"), (3, "image")]
+    assert all(mime_type == "image/png" and data.startswith(b"\x89PNG") for _, _, data, mime_type in parts)
+
+
+def test_auto_mode_sends_text_only_for_text_pages(pdf_path):
+    parts = list(utils.iter_pdf_page_parts(pdf_path, text_mode="auto"))
+
+    assert kinds(parts) == [(0, "text"), (1, "image"), (2, "image"), (3, "image")]
+    assert parts[0][2].startswith("[PDF page 1 text layer]\nGradient descent")
+    assert parts[0][3] == "text/plain"
+
+
+def test_mixed_mode_sends_text_then_image_for_pages_with_figures(pdf_path):
+    parts = list(utils.iter_pdf_page_parts(pdf_path, text_mode="mixed", max_pages=3))
+
+    assert kinds(parts) == [(0, "text"), (1, "text"), (1, "image"), (2, "image")]
+
+
+def test_page_parts_from_memory(pdf_path):
+    with open(pdf_path, "rb") as f:
+        pdf_data = f.read()
+
+    parts = list(utils.iter_pdf_page_parts("upload.pdf", text_mode="auto", pdf_data=pdf_data))
+
+    assert kinds(parts) == [(0, "text"), (1, "image"), (2, "image"), (3, "image")]
+
+
+def test_unknown_text_mode_is_rejected(pdf_path):
+    with pytest.raises(ValueError):
+        list(utils.iter_pdf_page_parts(pdf_path, text_mode="ocr"))
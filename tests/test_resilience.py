@@ -0,0 +1,221 @@
+# tests/test_resilience.py
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src import fake_backend, resilience
+
+
+class Clock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff sleeps of resilience instead of waiting them out."""
+    recorded = []
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(sleep=recorded.append, perf_counter=time.perf_counter,
+                                                            monotonic=time.monotonic))
+    return recorded
+
+
+def fake_model(**kwargs):
+    return fake_backend.FakeGenerativeModel("fake-model", latency_ms=0, latency_distribution="fixed",
+                                            tokens_per_second=0, **kwargs)
+
+
+def model_call(model):
+    return lambda: model.generate_content(["Summarize"]).text
+
+
+# --- Backoff ---
+def test_retry_delays_are_jittered_below_the_exponential_cap():
+    policy = resilience.RetryPolicy(max_attempts=6, base_delay_s=0.5, max_delay_s=3.0)
+    rng = random.Random(7)
+
+    for attempt in range(1, 6):
+        cap = min(3.0, 0.5 * 2 ** (attempt - 1))
+        delays = [policy.delay(attempt, rng) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1 # Jittered, not a fixed schedule
+
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_retries_transient_errors_with_backoff(sleeps, code):
+    model = fake_model()
+    model.fail_next(2, code=code)
+    guard = resilience.ModelCallGuard("fake-model", policy=resilience.RetryPolicy(max_attempts=4), seed=1)
+
+    assert guard.call(model_call(model)).startswith("**Document Type:**")
+    assert model.calls == 3
+    assert len(sleeps) == 2 and sleeps[1] <= 1.0 # Second retry waits at most base * 2
+    assert guard.counters["retries"] == 2 and guard.counters["failures"] == 0
+
+
+def test_gives_up_after_max_attempts(sleeps):
+    model = fake_model()
+    model.set_outage(503)
+    guard = resilience.ModelCallGuard("fake-model", policy=resilience.RetryPolicy(max_attempts=3),
+                                      breaker=resilience.CircuitBreaker(failure_threshold=0))
+
+    with pytest.raises(fake_backend.FakeAPIError):
+        guard.call(model_call(model))
+    assert model.calls == 3 and len(sleeps) == 2
+    assert guard.counters["failures"] == 1
+
+
+def test_client_errors_are_not_retried(sleeps):
+    model = fake_model()
+    model.fail_next(1, code=400)
+    guard = resilience.ModelCallGuard("fake-model")
+
+    with pytest.raises(fake_backend.FakeAPIError):
+        guard.call(model_call(model))
+    assert model.calls == 1 and sleeps == []
+    assert guard.breaker.state == "closed"
+
+
+# --- Token Bucket ---
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    bucket = resilience.TokenBucket(rate_per_s=2, burst=3, clock=clock)
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5 # One token at 2/s
+    assert bucket.try_acquire() and not bucket.try_acquire()
+
+
+def test_token_bucket_acquire_waits_for_the_next_token():
+    bucket = resilience.TokenBucket(rate_per_s=20, burst=1)
+    assert bucket.acquire(timeout_s=1)
+
+    start = time.perf_counter()
+    assert bucket.acquire(timeout_s=1)
+    assert time.perf_counter() - start >= 0.04 # One token every 50 ms
+
+
+def test_token_bucket_acquire_times_out():
+    bucket = resilience.TokenBucket(rate_per_s=0.1, burst=1)
+    assert bucket.acquire(timeout_s=0)
+
+    start = time.perf_counter()
+    assert not bucket.acquire(timeout_s=0.05)
+    assert time.perf_counter() - start < 1
+
+
+def test_guard_raises_rate_limit_timeout_without_calling_the_model():
+    model = fake_model()
+    guard = resilience.ModelCallGuard("fake-model", rate_per_minute=1, burst=1, rate_limit_wait_s=0.01)
+    guard.call(model_call(model))
+
+    with pytest.raises(resilience.RateLimitTimeout):
+        guard.call(model_call(model))
+    assert model.calls == 1 and guard.counters["rate_limit_timeouts"] == 1
+
+
+# --- Hedging ---
+def test_hedges_a_call_slower_than_the_p95():
+    guard = resilience.ModelCallGuard("fake-model", hedge_enabled=True, hedge_percentile=95, hedge_min_delay_s=0.01)
+    assert guard.hedge_delay_s() is None # Too few samples yet
+    for _ in range(guard.latency.min_samples):
+        guard.latency.record(0.02)
+    assert guard.hedge_delay_s() == pytest.approx(0.02)
+
+    release = threading.Event()
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) == 1: # The primary stalls until the test ends
+            release.wait(5)
+            return "primary"
+        return "hedge"
+
+    try:
+        assert guard.call(call) == "hedge"
+    finally:
+        release.set()
+    assert guard.counters["hedges"] == 1 and guard.counters["hedge_wins"] == 1
+
+
+def test_fast_calls_and_streams_are_not_hedged():
+    guard = resilience.ModelCallGuard("fake-model", hedge_enabled=True, hedge_min_delay_s=0.01)
+    for _ in range(guard.latency.min_samples):
+        guard.latency.record(0.02)
+
+    assert guard.call(lambda: "fast") == "fast"
+    assert guard.call(lambda: time.sleep(0.1) or "stream", streaming=True) == "stream"
+    assert guard.counters["hedges"] == 0
+
+
+# --- Circuit Breaker ---
+def test_breaker_opens_then_half_opens_then_closes(clock):
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout_s=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow() # Only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout_s=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.times_opened == 2
+    assert not breaker.allow()
+
+
+def test_guard_fails_fast_while_open_and_recovers(clock, sleeps):
+    model = fake_model()
+    model.set_outage(503)
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout_s=30, clock=clock)
+    guard = resilience.ModelCallGuard("fake-model", policy=resilience.RetryPolicy(max_attempts=3), breaker=breaker)
+
+    with pytest.raises(resilience.CircuitOpenError):
+        guard.call(model_call(model))
+    assert model.calls == 2 and breaker.state == "open"
+
+    model.set_outage(None)
+    clock.now += 30
+    assert guard.call(model_call(model)).startswith("**Document Type:**")
+    assert breaker.state == "closed"
+
+
+def test_rate_limit_timeout_releases_the_half_open_probe(clock):
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout_s=30, clock=clock)
+    guard = resilience.ModelCallGuard("fake-model", rate_limit_wait_s=0, breaker=breaker)
+    guard.bucket = resilience.TokenBucket(rate_per_s=1, burst=1, clock=clock)
+    model = fake_model()
+    breaker.record_failure()
+    clock.now += 30
+    guard.bucket.try_acquire() # Quota used up when the probe is due
+
+    with pytest.raises(resilience.RateLimitTimeout):
+        guard.call(model_call(model))
+    assert breaker.state == "half_open" and model.calls == 0
+
+    clock.now += 1 # A token is back: the next call must be let through as the probe
+    assert guard.call(model_call(model)).startswith("**Document Type:**")
+    assert breaker.state == "closed"
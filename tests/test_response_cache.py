@@ -0,0 +1,139 @@
+# tests/test_response_cache.py
+from types import SimpleNamespace
+
+import pytest
+
+from src import response_cache
+
+KEY_PARTS = {
+    "content_hash": response_cache.hash_bytes(b"lecture notes"),
+    "user_prompt": "Summarize",
+    "model_name": "gemini-2.0-flash",
+    "system_instructions": "Analyze the document.",
+    "generation_config": {"temperature": 0.3, "max_output_tokens": 2048},
+}
+
+
+class Clock:
+    """Manually advanced Unix clock."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+def make_cache(tmp_path, **kwargs):
+    return response_cache.ResponseCache(str(tmp_path / "responses.db"), **kwargs)
+
+
+# --- Keys ---
+@pytest.mark.parametrize("field, value", [
+    ("content_hash", response_cache.hash_bytes(b"other notes")),
+    ("user_prompt", "List the dates"),
+    ("model_name", "projects/p/locations/l/endpoints/tuned"),
+    ("system_instructions", "Answer in JSON."),
+    ("generation_config", {"temperature": 0.3, "max_output_tokens": 1024}),
+])
+def test_every_request_field_changes_the_key(field, value):
+    assert response_cache.make_cache_key(**dict(KEY_PARTS, **{field: value})) != response_cache.make_cache_key(**KEY_PARTS)
+
+
+def test_key_ignores_generation_config_order():
+    reordered = {"max_output_tokens": 2048, "temperature": 0.3}
+
+    assert response_cache.make_cache_key(**dict(KEY_PARTS, generation_config=reordered)) == \
+        response_cache.make_cache_key(**KEY_PARTS)
+
+
+def test_hash_file_matches_hash_bytes(tmp_path):
+    document = tmp_path / "notes.txt"
+    document.write_bytes(b"lecture notes")
+
+    assert response_cache.hash_file(str(document)) == KEY_PARTS["content_hash"]
+
+
+# --- Entries ---
+def test_put_then_get(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put("key", "**Summary:** Notes.")
+
+    assert cache.get("key") == "**Summary:** Notes."
+    assert cache.get("other") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+@pytest.mark.parametrize("value", ["Error: Model call failed.", ""])
+def test_errors_and_empty_results_are_not_cached(tmp_path, clock, value):
+    cache = make_cache(tmp_path)
+    cache.put("key", value)
+
+    assert cache.get("key") is None and cache.stats()["entries"] == 0
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.put("key", "analysis")
+    clock.now += 60
+    assert cache.get("key") == "analysis"
+
+    clock.now += 1
+    assert cache.get("key") is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["bytes"] == 0
+
+
+def test_expired_entries_are_swept_on_put(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.put("old", "analysis")
+    clock.now += 61
+    cache.put("new", "analysis")
+
+    assert cache.stats()["entries"] == 1 and cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=35) # Evicts down to 31 bytes
+    for key in ("a", "b", "c"):
+        cache.put(key, "x" * 10)
+        clock.now += 1
+    cache.get("a") # "b" is now the least recently used
+    clock.now += 1
+
+    cache.put("d", "x" * 10)
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 30
+
+
+def test_running_total_follows_replacements_and_other_processes(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=100)
+    cache.put("a", "x" * 40)
+    cache.put("a", "x" * 20) # Replaces the first value
+    assert cache._total_bytes == 20
+
+    other = make_cache(tmp_path, max_bytes=100) # Another process sharing the file
+    clock.now += 1
+    other.put("b", "x" * 50)
+    clock.now += 1
+    cache.put("c", "x" * 85) # 105 bytes as counted here, 155 in the file
+
+    assert cache.get("a") is None and cache.get("b") is None # Evicted down to 90 bytes of the real total
+    assert cache.stats()["evictions"] == 2
+    assert cache._total_bytes == cache.stats()["bytes"] == 85
+
+
+def test_clear_resets_the_total(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put("a", "analysis")
+    cache.clear()
+
+    assert cache._total_bytes == 0 and cache.stats()["entries"] == 0
@@ -0,0 +1,122 @@
+# tests/test_results_sink.py
+import json
+import os
+
+import pytest
+
+from src import batch_engine, results_sink
+
+
+def record(file, status="success", mtime_ns=1):
+    result = {"status": "success", "analysis": f"**Summary:**\nNotes on {file} – ünïcode"} if status == "success" \
+        else {"status": "error", "message": "Error: Model call failed."}
+    return {"file": file, "path": f"/data/{file}", "size": 10, "mtime_ns": mtime_ns, "result": result}
+
+
+RECORDS = [record("notes/a.png"), record("notes/b.pdf", status="error"), record("essay.txt")]
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    superseded = record("notes/b.pdf", status="success", mtime_ns=0)
+    with open(path, "w", encoding="utf-8") as f:
+        for r in [RECORDS[0], superseded] + RECORDS[1:]: # Files keep the position of their first record
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if ".tmp-" in name]
+
+
+# --- JSON Layout ---
+@pytest.mark.parametrize("records", [RECORDS, []])
+def test_json_sink_writes_the_same_text_as_json_dump(tmp_path, records):
+    path = tmp_path / "results.json"
+    results_sink.write_records(records, {"json": str(path)})
+
+    expected = json.dumps({r["file"]: r["result"] for r in records}, indent=4, ensure_ascii=False)
+    assert path.read_text(encoding="utf-8") == expected
+
+
+# --- Round Trips ---
+@pytest.mark.parametrize("file_format", ["jsonl", "sqlite"])
+def test_export_round_trips_the_latest_records(tmp_path, checkpoint, file_format):
+    output_dir = tmp_path / "outputs"
+    paths = results_sink.export_results(checkpoint, [file_format], str(output_dir),
+                                        order=["essay.txt", "notes/a.png"])
+
+    assert list(results_sink.iter_records(paths[file_format])) == [RECORDS[2], RECORDS[0], RECORDS[1]]
+
+
+def test_export_writes_every_format_in_one_pass(tmp_path, checkpoint):
+    paths = results_sink.export_results(checkpoint, ["json", "jsonl", "sqlite", "json"], str(tmp_path))
+
+    assert sorted(paths) == ["json", "jsonl", "sqlite"]
+    assert list(results_sink.iter_records(paths["json"])) == \
+        [{"file": r["file"], "result": r["result"]} for r in RECORDS]
+    assert batch_engine.read_checkpoint(paths["jsonl"]) == RECORDS
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_columnar_round_trip(tmp_path, checkpoint, file_format):
+    pytest.importorskip("pyarrow")
+    paths = results_sink.export_results(checkpoint, [file_format], str(tmp_path))
+
+    assert list(results_sink.iter_records(paths[file_format])) == RECORDS
+
+
+# --- Atomic Writes ---
+def test_results_are_moved_into_place_with_os_replace(monkeypatch, tmp_path):
+    replaced = []
+    replace = os.replace
+
+    def spy(src, dst):
+        assert os.path.exists(src) and not os.path.exists(dst) # Readers see the old file until now
+        replaced.append((os.path.basename(src), os.path.basename(dst)))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", spy)
+    results_sink.write_records(RECORDS, {"jsonl": str(tmp_path / "results.jsonl"),
+                                         "sqlite": str(tmp_path / "results.sqlite3")})
+
+    assert replaced == [(f"results.jsonl.tmp-{os.getpid()}", "results.jsonl"),
+                        (f"results.sqlite3.tmp-{os.getpid()}", "results.sqlite3")]
+    assert leftovers(tmp_path) == []
+
+
+def test_failed_export_keeps_the_previous_files(tmp_path):
+    paths = {"json": str(tmp_path / "results.json"), "sqlite": str(tmp_path / "results.sqlite3")}
+    results_sink.write_records(RECORDS[:1], paths)
+    previous = (tmp_path / "results.json").read_bytes()
+
+    def failing_records():
+        yield RECORDS[1]
+        raise OSError("checkpoint unreadable")
+
+    with pytest.raises(OSError):
+        results_sink.write_records(failing_records(), paths)
+
+    assert (tmp_path / "results.json").read_bytes() == previous
+    assert list(results_sink.iter_records(paths["sqlite"])) == RECORDS[:1]
+    assert leftovers(tmp_path) == []
+
+
+def test_stale_temporary_file_is_replaced(tmp_path):
+    path = tmp_path / "results.jsonl"
+    (tmp_path / f"results.jsonl.tmp-{os.getpid()}").write_text("half-written by a crashed run")
+
+    results_sink.write_records(RECORDS, {"jsonl": str(path)})
+
+    assert batch_engine.read_checkpoint(str(path)) == RECORDS
+
+
+# --- Formats ---
+def test_format_for_path():
+    assert results_sink.format_for_path("out/Results.FEATHER") == "arrow"
+    assert results_sink.format_for_path("results.db") == "sqlite"
+    with pytest.raises(ValueError):
+        results_sink.format_for_path("results.csv")
+    with pytest.raises(ValueError):
+        results_sink.open_sink("csv", "results.csv")
@@ -0,0 +1,129 @@
+# tests/test_results_store.py
+import json
+import logging
+
+import pytest
+
+from src import results_store, structured_output
+
+Item = structured_output.KeyInfoItem
+
+
+def analysis(summary, category="Lecture Notes", document_type="Handwritten Notes", key_info=()):
+    return structured_output.StructuredAnalysis(document_type, summary, list(key_info), category, "json", "")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = results_store.ResultsStore(str(tmp_path / "results.db"))
+    store.upsert_many([
+        ("notes/trees.png", analysis("Decision trees split nodes by information gain.",
+                                     key_info=[Item("Gini impurity", "Page 1", "High")])),
+        ("notes/forest.pdf", analysis("Random forests average many decision trees. Trees trees trees.")),
+        ("essays/history.docx", analysis("An essay on the industrial revolution.", category="Essay Draft",
+                                         document_type="Essay")),
+        ("forms/enrolment.pdf", analysis("Enrolment form with a tree diagram.", category="Admin Form",
+                                         document_type="Form")),
+    ])
+    yield store
+    store.close()
+
+
+def files(found):
+    return [hit["file"] for hit in found["results"]]
+
+
+# --- Full-text Search ---
+def test_fts_query_quotes_words_and_keeps_prefixes():
+    assert results_store.fts_query('decision "trees" OR*') == '"decision" "trees" "OR"*'
+    assert results_store.fts_query("?!") is None
+
+
+def test_search_stems_words_and_ranks_by_bm25(store):
+    found = store.search("tree")
+
+    assert found["order"] == "relevance"
+    assert set(files(found)) == {"notes/trees.png", "notes/forest.pdf", "forms/enrolment.pdf"}
+    assert files(found)[0] == "notes/forest.pdf" # Most occurrences
+    scores = [hit["score"] for hit in found["results"]]
+    assert scores == sorted(scores) # bm25: lower is better
+
+
+def test_search_requires_every_word_and_covers_key_information(store):
+    assert files(store.search("gini decision")) == ["notes/trees.png"]
+    assert files(store.search("gini revolution")) == []
+
+
+def test_search_returns_snippets_for_matches(store):
+    hit = store.search("information gain")["results"][0]
+
+    assert "[information]" in hit["snippet"] and "[gain]" in hit["snippet"]
+    assert hit["key_info"] == [{"info": "Gini impurity", "location": "Page 1", "confidence": "High"}]
+
+
+def test_prefix_search(store):
+    assert files(store.search("indust*")) == ["essays/history.docx"]
+
+
+def test_broad_queries_fall_back_to_newest_first(tmp_path):
+    store = results_store.ResultsStore(str(tmp_path / "results.db"), rank_max_matches=2)
+    store.upsert_many((f"notes/{n}.png", analysis(f"Decision tree notes, part {n}.")) for n in range(4))
+
+    found = store.search("tree", limit=2, offset=1)
+
+    assert found["order"] == "newest" and files(found) == ["notes/2.png", "notes/1.png"]
+
+
+# --- Filters ---
+def test_category_filter_is_case_insensitive(store):
+    found = store.search(category="lecture notes")
+
+    assert found["order"] == "newest" and files(found) == ["notes/forest.pdf", "notes/trees.png"]
+
+
+def test_text_and_category_filters_combine(store):
+    assert files(store.search("tree", category="Admin Form")) == ["forms/enrolment.pdf"]
+    assert files(store.search("tree", document_type="essay")) == []
+
+
+def test_upsert_replaces_the_indexed_text(store):
+    store.upsert("notes/trees.png", analysis("Notes on linear regression."))
+
+    assert "notes/trees.png" not in files(store.search("gini"))
+    assert files(store.search("regression")) == ["notes/trees.png"]
+    assert store.stats()["documents"] == 4
+
+
+# --- Indexing Records ---
+MARKDOWN = """**Document Type:**
+Lecture Notes
+
+**Summary:**
+Backpropagation computes gradients layer by layer.
+
+**Key Information & Localization:**
+* Chain rule
+    * Location: Page 2
+    * Confidence: High
+
+**Category:**
+Lecture Notes"""
+
+
+def test_index_records_parses_each_mode_without_fallback_warnings(tmp_path, caplog):
+    store = results_store.ResultsStore(str(tmp_path / "results.db"))
+    json_analysis = json.dumps({"document_type": "Essay", "summary": "An essay on steam engines.",
+                                "key_info": [], "category": "Essay Draft"})
+    records = [
+        {"file": "notes/backprop.png", "result": {"status": "success", "analysis": MARKDOWN}},
+        {"file": "essays/steam.docx", "result": {"status": "success", "analysis": f"```json\n{json_analysis}\n```"}},
+        {"file": "broken.pdf", "result": {"status": "error", "message": "Error: failed"}},
+    ]
+
+    with caplog.at_level(logging.INFO):
+        assert results_store.index_records(store, records) == 2
+
+    assert "Parsing it as Markdown" not in caplog.text
+    assert files(store.search("gradient", category="Lecture Notes")) == ["notes/backprop.png"]
+    assert files(store.search("steam", category="Essay Draft")) == ["essays/steam.docx"]
+    store.close()
@@ -0,0 +1,120 @@
+# tests/test_structured_output.py
+import json
+
+import pytest
+
+from src import config, fake_backend, response_cache, structured_output, vllm_handler
+
+VALID = {
+    "document_type": "Lecture Notes",
+    "summary": "Notes on decision trees.",
+    "key_info": [{"info": "Gini impurity", "location": "Page 1, top", "confidence": "high"}],
+    "category": "lecture notes",
+}
+
+MARKDOWN = """**Document Type:**
+Lecture Notes
+
+**Summary:**
+Notes on decision trees.
+
+**Key Information & Localization:**
+* Gini impurity
+    * Location: Page 1, top
+    * Confidence: High
+
+**Category:**
+Lecture Notes"""
+
+
+# --- Validation ---
+def test_validate_analysis_normalizes_enum_case():
+    analysis = structured_output.validate_analysis(VALID)
+
+    assert analysis.category == "Lecture Notes" and analysis.source == "json"
+    assert analysis.key_info == [structured_output.KeyInfoItem("Gini impurity", "Page 1, top", "High")]
+
+
+@pytest.mark.parametrize("change", [
+    {"category": "Poetry"},
+    {"summary": None},
+    {"key_info": "Gini impurity"},
+    {"key_info": [{"info": "Gini impurity", "location": "Page 1", "confidence": "Certain"}]},
+    {"key_info": [{"info": "Gini impurity", "confidence": "High"}]},
+])
+def test_validate_analysis_rejects_schema_mismatches(change):
+    with pytest.raises(structured_output.SchemaValidationError):
+        structured_output.validate_analysis(dict(VALID, **change))
+
+
+def test_validate_analysis_rejects_non_objects():
+    with pytest.raises(structured_output.SchemaValidationError):
+        structured_output.validate_analysis([VALID])
+
+
+# --- Parsing ---
+def test_from_markdown_reads_every_section():
+    analysis = structured_output.from_markdown(MARKDOWN)
+
+    assert (analysis.document_type, analysis.category, analysis.source) == ("Lecture Notes", "Lecture Notes", "markdown")
+    assert analysis.summary == "Notes on decision trees."
+    assert analysis.key_info == [structured_output.KeyInfoItem("Gini impurity", "Page 1, top", "High")]
+
+
+def test_parse_json_analysis_accepts_fenced_json():
+    analysis = structured_output.parse_json_analysis(f"```json\n{json.dumps(VALID)}\n```")
+
+    assert analysis.source == "json" and analysis.document_type == "Lecture Notes"
+
+
+@pytest.mark.parametrize("text", ["{not json", json.dumps(dict(VALID, category="Poetry"))])
+def test_parse_json_analysis_raises_on_invalid_responses(text):
+    with pytest.raises(structured_output.SchemaValidationError):
+        structured_output.parse_json_analysis(text)
+
+
+def test_parse_structured_analysis_parses_markdown_results_as_markdown():
+    analysis = structured_output.parse_structured_analysis(MARKDOWN)
+
+    assert analysis.source == "markdown" and analysis.category == "Lecture Notes"
+
+
+# --- Markdown resend through vllm_handler ---
+@pytest.fixture
+def handler(monkeypatch, tmp_path):
+    model = fake_backend.FakeGenerativeModel("fake-model", latency_ms=0, tokens_per_second=0)
+    generate = model.generate_content
+    modes = [] # "json" or "markdown" per request
+
+    def invalid_json_generate(contents, generation_config=None, **kwargs):
+        structured = bool(generation_config and generation_config.get("response_schema"))
+        modes.append("json" if structured else "markdown")
+        if structured:
+            return fake_backend.FakeResponse(json.dumps(dict(VALID, category="Poetry")))
+        return generate(contents, generation_config=generation_config, **kwargs)
+
+    monkeypatch.setattr(model, "generate_content", invalid_json_generate)
+    monkeypatch.setattr(config, "GCP_PROJECT_ID", config.GCP_PROJECT_ID or "test-project")
+    monkeypatch.setattr(config, "GCP_REGION", config.GCP_REGION or "europe-west4")
+    monkeypatch.setattr(config, "MODEL_ROUTING_ENABLED", False)
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", True)
+    cache = response_cache.ResponseCache(str(tmp_path / "responses.db"))
+    monkeypatch.setattr(vllm_handler, "_response_cache", cache)
+    vllm_handler.set_model_factory(lambda name: model)
+    document = tmp_path / "notes.txt"
+    document.write_text("Decision trees split on the feature with the highest information gain.")
+    yield str(document), modes, cache
+    vllm_handler.set_model_factory(None)
+
+
+def test_invalid_json_is_resent_in_markdown_mode_and_not_cached(handler):
+    document, modes, cache = handler
+
+    analysis = vllm_handler.analyze_content_structured(document, "Summarize", model_id_override="fake-model")
+
+    assert modes == ["json", "markdown"]
+    assert analysis.source == "markdown" and analysis.document_type == "General Text"
+    assert cache.stats()["entries"] == 1 # Only the Markdown result
+
+    vllm_handler.analyze_content_structured(document, "Summarize", model_id_override="fake-model")
+    assert modes == ["json", "markdown", "json"] # The invalid JSON was not replayed; Markdown came from the cache
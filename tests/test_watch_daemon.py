@@ -0,0 +1,161 @@
+# tests/test_watch_daemon.py
+import os
+import threading
+import time
+
+import pytest
+
+from src import batch_engine, file_index, watch_daemon
+
+
+class Clock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the daemon")
+        time.sleep(0.01)
+
+
+# --- Debouncer ---
+@pytest.fixture
+def debouncer():
+    clock = Clock()
+    return watch_daemon.Debouncer(quiet_s=2.0, clock=clock), clock
+
+
+def test_file_is_released_once_it_stays_unchanged(debouncer, tmp_path):
+    debouncer, clock = debouncer
+    notes = tmp_path / "notes.txt"
+    notes.write_text("Decision trees")
+    debouncer.add(str(notes))
+
+    assert debouncer.ready() == [] # First look: records size and mtime
+    clock.now += 1.9
+    assert debouncer.ready() == []
+    clock.now += 0.1
+    assert debouncer.ready() == [str(notes)]
+    assert len(debouncer) == 0 and debouncer.ready() == []
+
+
+def test_repeated_events_are_coalesced(debouncer, tmp_path):
+    debouncer, clock = debouncer
+    notes = tmp_path / "notes.txt"
+    notes.write_text("Decision trees")
+    for _ in range(5):
+        debouncer.add(str(notes))
+    debouncer.ready()
+    clock.now += 2
+
+    assert debouncer.ready() == [str(notes)]
+
+
+def test_a_new_event_restarts_the_quiet_period(debouncer, tmp_path):
+    debouncer, clock = debouncer
+    notes = tmp_path / "notes.txt"
+    notes.write_text("Decision trees")
+    debouncer.add(str(notes))
+    debouncer.ready()
+    clock.now += 1.5
+
+    debouncer.add(str(notes))
+    debouncer.ready()
+    clock.now += 1.5
+    assert debouncer.ready() == []
+    clock.now += 0.5
+    assert debouncer.ready() == [str(notes)]
+
+
+def test_growing_file_is_held_until_it_stops_changing(debouncer, tmp_path):
+    debouncer, clock = debouncer
+    upload = tmp_path / "upload.pdf"
+    upload.write_bytes(b"%PDF")
+    debouncer.add(str(upload))
+    debouncer.ready()
+
+    for _ in range(3):
+        clock.now += 1.5
+        with open(upload, "ab") as f:
+            f.write(b"more pages")
+        assert debouncer.ready() == []
+    clock.now += 2
+
+    assert debouncer.ready() == [str(upload)]
+
+
+def test_vanished_files_are_dropped(debouncer, tmp_path):
+    debouncer, clock = debouncer
+    temp = tmp_path / "notes.txt.tmp"
+    temp.write_text("partial")
+    debouncer.add(str(temp))
+    temp.unlink()
+
+    assert debouncer.ready() == [] and len(debouncer) == 0
+
+
+# --- Daemon ---
+@pytest.fixture
+def daemon_setup(tmp_path):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    for name in ("a.txt", "b.txt"):
+        (inputs / name).write_text(f"Notes in {name}")
+    index = file_index.FileIndex(str(tmp_path / "index.db"))
+    yield inputs, index, str(tmp_path / "checkpoint.jsonl")
+    index.close()
+
+
+def test_stop_drains_in_flight_analyses_and_leaves_queued_files_pending(daemon_setup, tmp_path):
+    inputs, index, checkpoint = daemon_setup
+    started, release = threading.Event(), threading.Event()
+    analyzed, exports = [], []
+
+    def analyze(path):
+        analyzed.append(os.path.basename(path))
+        started.set()
+        release.wait(5)
+        return "Analysis"
+
+    daemon = watch_daemon.WatchDaemon(str(inputs), index, analyze, checkpoint, str(tmp_path), max_workers=1,
+                                      debounce_s=0.05, poll_interval_s=60, use_inotify=False,
+                                      on_export=lambda: exports.append(True))
+    runner = threading.Thread(target=daemon.run)
+    runner.start()
+    wait_until(lambda: started.is_set() and daemon.stats()["submitted"] == 2)
+
+    daemon.stop()
+    time.sleep(0.1)
+    assert runner.is_alive() # Waits for the analysis that is running
+
+    release.set()
+    runner.join(timeout=5)
+
+    assert not runner.is_alive() and len(analyzed) == 1
+    assert [record["file"] for record in batch_engine.read_checkpoint(checkpoint)] == \
+        [os.path.join("inputs", analyzed[0])]
+    assert index.stats() == {"files": 2, "pending": 1} # The queued file is picked up next time
+    assert daemon.stats()["in_flight"] == 0 and exports == [True]
+
+
+def test_failed_analyses_stay_pending(daemon_setup, tmp_path):
+    inputs, index, checkpoint = daemon_setup
+    daemon = watch_daemon.WatchDaemon(str(inputs), index, lambda path: "Error: Model call failed.", checkpoint,
+                                      str(tmp_path), max_workers=2, debounce_s=0.05, poll_interval_s=60,
+                                      use_inotify=False)
+    runner = threading.Thread(target=daemon.run)
+    runner.start()
+    wait_until(lambda: daemon.stats()["failed"] == 2)
+    daemon.stop()
+    runner.join(timeout=5)
+
+    assert index.stats() == {"files": 2, "pending": 2}
+    assert all(record["result"]["status"] == "error" for record in batch_engine.read_checkpoint(checkpoint))